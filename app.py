@@ -1,57 +1,211 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request
 from pythonosc import dispatcher, osc_server
-from threading import Thread
+from threading import Condition, Thread, active_count
+import argparse
+import signal
+import sys
 import time
-from collections import deque
+
+from capture import CaptureWriter
+from channel_store import ChannelStore, numeric_values
+from coalescer import DEFAULT_RATE_HZ, MODE_AGGREGATE, MODE_OFF, Coalescer
+from chunking import (ChunkedServerMixin, add_chunk_arguments, reassembler_from_args,
+                      register_chunk_metrics)
+from dispatch_pool import PooledServerMixin, add_pool_arguments, pool_from_args
+from history_store import HistoryStore
+from log_sink import DEFAULT_EVERY, DEFAULT_FIRST, LogSink, level_from_args
+from metrics import MetricsRegistry, register_udp_socket
+from osc_api import (build_osc_response, get_channel, get_channel_stats, list_channels,
+                     long_poll_timeout)
+from osc_router import RouterDispatcherMixin
+from osc_scheduler import ScheduledDispatcherMixin
+from relay import RelayServerMixin, add_relay_arguments, relay_from_args
+from udp_socket import (RcvbufAutosizer, SocketOptions, TunedServerMixin, add_socket_arguments,
+                        print_socket_report, request_time, socket_options_from_args)
 
 app = Flask(__name__)
 
+# Cronologia in memoria condivisa: leggibile anche da altri processi
+# (es. python history_store.py streamtorasp_osc -f)
+HISTORY_NAME = 'streamtorasp_osc'
+HISTORY_CAPACITY = 10000
+HISTORY_SLAB = 128
+OSC_PORT = 10000
+
+# Canali numerici (NumPy): campioni per indirizzo e numero massimo di indirizzi;
+# la memoria massima è riportata da /api/channels
+CHANNEL_CAPACITY = 4096
+CHANNEL_MAX_CHANNELS = 256
+
+# Coalescenza per indirizzo: 'latest' o 'aggregate' riducono i flussi
+# a 60-120 Hz al ritmo del tick; i pattern in passthrough non vengono mai ridotti
+COALESCE_MODE = MODE_OFF
+COALESCE_RATE_HZ = DEFAULT_RATE_HZ
+COALESCE_PASSTHROUGH = ('/trigger*',)
+
 # Variabile globale per memorizzare gli ultimi dati OSC ricevuti
 osc_data = {
     'last_message': None,
     'last_address': None,
     'last_timestamp': None,
-    'message_history': deque(maxlen=100)  # Mantiene gli ultimi 100 messaggi
+    'message_history': None  # HistoryStore, creata all'avvio
 }
 
-# Funzione per gestire i messaggi OSC
-def handle_osc_message(address, *args):
-    """Gestisce i messaggi OSC in arrivo e aggiorna i dati globali."""
-    current_time = time.time()
+# Risveglia le richieste long-poll quando arrivano nuovi messaggi
+new_data = Condition()
+
+# Ring buffer NumPy per ogni indirizzo con argomenti numerici
+channels = ChannelStore(CHANNEL_CAPACITY, CHANNEL_MAX_CHANNELS)
+
+# Log per messaggio: campionato per indirizzo e scritto in background
+osc_log = LogSink()
+
+# Registrazione su disco dei datagrammi OSC (--capture), None se disattivata
+capture_writer = None
+
+# Metriche esportate su /metrics in formato Prometheus
+registry = MetricsRegistry()
+packets_received = registry.counter('packets_received_total', 'Datagrammi OSC ricevuti')
+bytes_received = registry.counter('bytes_received_total', 'Byte OSC ricevuti')
+decode_errors = registry.counter('decode_errors_total', 'Datagrammi che non sono messaggi o bundle OSC')
+osc_messages = registry.counter('osc_messages_total', 'Messaggi OSC smistati')
+handler_histogram = registry.histogram('osc_handler_seconds',
+                                       'Tempo di gestione di un messaggio OSC, attesa del lock compresa')
+
+def record_osc_message(key, item, window):
+    """Registra un messaggio (eventualmente coalescato) e risveglia i long-poll."""
+    current_time, client_address, address, args = item
+    if window is not None:
+        # Finestra aggregata: in cronologia va la media
+        args = tuple(window.mean)
     
     osc_data['last_message'] = args
     osc_data['last_address'] = address
     osc_data['last_timestamp'] = current_time
     
-    # Aggiunge il messaggio alla cronologia
-    message_info = {
-        'address': address,
-        'args': args,
-        'timestamp': current_time,
-        'time_str': time.strftime('%H:%M:%S', time.localtime(current_time))
-    }
-    osc_data['message_history'].append(message_info)
+    # Aggiunge il messaggio alla cronologia (O(1), nessuna copia)
+    osc_data['message_history'].append_values(current_time, client_address, address, args)
+    values = numeric_values(args)
+    if values is not None:
+        channels.append(address, current_time, values)
+    new_data.notify_all()
+    
+    if window is not None:
+        osc_log.log(address, "OSC Message received: %s -> %r (%d campioni, min %r, max %r)",
+                    address, args, window.count, window.min, window.max)
+    else:
+        osc_log.log(address, "OSC Message received: %s -> %r", address, args)
+
+# Eseguita con il lock di new_data: i thread del server OSC e le richieste
+# HTTP la fanno avanzare con poll(), senza un thread dedicato al tick
+coalescer = Coalescer(record_osc_message, COALESCE_MODE, COALESCE_RATE_HZ, COALESCE_PASSTHROUGH)
+
+# Funzione per gestire i messaggi OSC
+def handle_osc_message(client_address, address, *args):
+    """Gestisce i messaggi OSC in arrivo e aggiorna i dati globali."""
+    start_ns = time.perf_counter_ns()
+    # Istante di ricezione del kernel (SO_TIMESTAMPNS), non quello del thread
+    current_time = request_time()
+    values = None
+    if coalescer.mode == MODE_AGGREGATE and args and all(
+            type(arg) is float or type(arg) is int for arg in args):
+        values = args
+    
+    # Stato condiviso (osc_data, canali, coalescenza, contatori) solo con il
+    # lock: i worker del pool gestiscono indirizzi diversi in parallelo
+    with new_data:
+        osc_messages.inc()
+        coalescer.offer(address, address, (current_time, client_address, address, args), values)
+        coalescer.poll()
+        handler_histogram.record_since(start_ns)
+
+class InstrumentedOSCUDPServer(TunedServerMixin, RelayServerMixin, ChunkedServerMixin,
+                               PooledServerMixin, osc_server.OSCUDPServer):
+    """Server OSC che conta (ed eventualmente registra) ogni datagramma prima di smistarlo.
+    
+    I datagrammi vanno a un pool di thread fisso (per indirizzo, in ordine)
+    invece che a un nuovo thread ciascuno; con --relay vengono anche
+    ritrasmessi ad altri host dal thread di ricezione, con --chunks i
+    frammenti vengono ricomposti prima di arrivare al pool.
+    """
+    
+    def verify_request(self, request, client_address):
+        # Gira nel thread di serve_forever: un solo produttore per contatori e cattura
+        data = request[0]
+        packets_received.inc()
+        bytes_received.inc(len(data))
+        if capture_writer is not None:
+            capture_writer.record(data, client_address)
+        if super().verify_request(request, client_address):
+            return True
+        decode_errors.inc()
+        return False
+
+class RoutedDispatcher(ScheduledDispatcherMixin, RouterDispatcherMixin, dispatcher.Dispatcher):
+    """Dispatcher con il router dei pattern (in cache) e i bundle programmati per timetag."""
     
-    print(f"OSC Message received: {address} -> {args}")
+    def dispatch_messages(self, client_address, messages):
+        # Tutto il gruppo del bundle con un solo lock: i long-poll si
+        # risvegliano una volta, con tutti i messaggi già in cronologia
+        with new_data:
+            super().dispatch_messages(client_address, messages)
+
+def register_metrics(pool, relay=None, chunks=None):
+    """Registra le metriche lette solo quando viene chiamato /metrics."""
+    register_udp_socket(registry, OSC_PORT)
+    registry.gauge('threads', 'Thread attivi del processo', active_count)
+    pool.register_metrics(registry)
+    if relay is not None:
+        relay.register_metrics(registry)
+    if chunks is not None:
+        register_chunk_metrics(registry, {OSC_PORT: chunks})
+    registry.gauge('coalescer_pending', 'Indirizzi in attesa del tick di coalescenza',
+                   lambda: len(coalescer.pending))
+    registry.gauge('history_last_seq', 'Messaggi scritti nella cronologia',
+                   lambda: osc_data['message_history'].last_seq, kind='counter')
+    registry.gauge('channels', 'Canali numerici in memoria', lambda: len(channels.channels))
+    registry.gauge('channels_memory_bytes', 'Memoria dei canali numerici',
+                   lambda: channels.memory_size)
+    registry.gauge('channels_rejected_total', 'Campioni scartati per limite di canali',
+                   lambda: channels.rejected, kind='counter')
+    registry.gauge('log_pending', 'Righe di log in coda',
+                   lambda: osc_log.get_stats()['pending'])
+    registry.gauge('log_dropped_total', 'Righe di log perse',
+                   lambda: osc_log.dropped, kind='counter')
+    if capture_writer is not None:
+        registry.gauge('capture_pending_bytes', 'Byte in coda per la cattura su disco',
+                       lambda: capture_writer.get_stats()['pending_bytes'])
+        registry.gauge('capture_dropped_total', 'Datagrammi persi dalla cattura',
+                       lambda: capture_writer.dropped, kind='counter')
 
 # Configurazione del server OSC
-def start_osc_server():
+def start_osc_server(socket_options=None, pool=None, relay=None, chunks=None):
     """Avvia il server OSC in un thread separato."""
-    osc_dispatcher = dispatcher.Dispatcher()
+    osc_dispatcher = RoutedDispatcher()
+    osc_dispatcher.scheduler.register_metrics(registry)
+    registry.gauge('bundles_malformed_total', 'Bundle OSC scartati perché malformati',
+                   lambda: osc_dispatcher.malformed, kind='counter')
     
-    # Mappa tutti gli indirizzi OSC alla funzione di gestione
-    osc_dispatcher.map("/*", handle_osc_message)
+    # Mappa tutti gli indirizzi OSC ("//" = qualsiasi numero di livelli)
+    osc_dispatcher.map("//*", handle_osc_message, needs_reply_address=True)
     
     # Configura il server OSC per ricevere dalla rete locale (porta 10000)
     ip = "0.0.0.0"  # Ascolta su tutte le interfacce di rete
-    port = 10000
-    server = osc_server.ThreadingOSCUDPServer((ip, port), osc_dispatcher)
+    port = OSC_PORT
+    socket_options = socket_options or SocketOptions()
+    server = InstrumentedOSCUDPServer((ip, port), osc_dispatcher, socket_options=socket_options,
+                                      pool=pool, relay=relay, reassembler=chunks)
+    RcvbufAutosizer(server.socket, socket_options.rcvbuf_max).start()
     
     print(f"OSC Server started on {ip}:{port}")
+    print_socket_report(server.socket_report)
+    print(f"Gestione dei messaggi: {server.pool.format_stats()}")
+    if relay is not None:
+        print("Ritrasmissione verso " + ", ".join(target.label for target in relay.targets))
     print("Ready to receive OSC messages from TouchDesigner...")
     
-    # Avvia il server
-    server.serve_forever()
+    # Avvia il server (il poll_interval scandisce anche la coalescenza della ritrasmissione)
+    server.serve_forever(poll_interval=relay.poll_interval if relay is not None else 0.5)
 
 # Route principale - Interfaccia web
 @app.route('/')
@@ -59,24 +213,129 @@ def index():
     """Pagina principale dell'interfaccia web."""
     return render_template('index.html')
 
+def api_response(status, body):
+    """Risposta Flask per il risultato (stato, corpo) di osc_api."""
+    if isinstance(body, bytes):
+        return app.response_class(body, status=status, mimetype='application/octet-stream')
+    return jsonify(body), status
+
+def conditional_osc_response(since):
+    """Risponde 304 se il client ha già l'ultima sequenza (ETag)."""
+    # Un tick scaduto senza nuovi messaggi OSC si chiude qui; l'ultimo
+    # messaggio si copia con il lock, per non mescolare due aggiornamenti
+    with new_data:
+        coalescer.poll()
+        snapshot = dict(osc_data)
+    # L'ETag è l'ultima sequenza: chi l'ha già vista non ha nulla di nuovo
+    etag = str(osc_data['message_history'].last_seq)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    data = build_osc_response(snapshot, coalescer, since)
+    response = jsonify(data)
+    response.set_etag(str(data['last_seq']))
+    return response
+
 # API endpoint per ottenere i dati OSC
 @app.route('/api/osc-data')
 def get_osc_data():
-    """Restituisce i dati OSC più recenti in formato JSON."""
-    return jsonify({
-        'last_message': osc_data['last_message'],
-        'last_address': osc_data['last_address'],
-        'last_timestamp': osc_data['last_timestamp'],
-        'message_count': len(osc_data['message_history']),
-        'history': list(osc_data['message_history'])
-    })
+    """Restituisce i dati OSC più recenti in formato JSON.
+    
+    Con ?since=<seq> restituisce solo i messaggi successivi a quella sequenza.
+    """
+    since = request.args.get('since', type=int)
+    return conditional_osc_response(since)
+
+@app.route('/api/osc-data/wait')
+def wait_osc_data():
+    """Long-poll: attende messaggi successivi a ?since=<seq> fino a ?timeout=<s>."""
+    since = request.args.get('since', default=0, type=int)
+    timeout = long_poll_timeout(request.args)
+    history_store = osc_data['message_history']
+    deadline = time.monotonic() + timeout
+    
+    with new_data:
+        while history_store.last_seq <= since and not coalescer.poll():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Con valori in attesa di coalescenza ci si risveglia al tick
+            if coalescer.pending:
+                remaining = min(remaining, coalescer.interval)
+            new_data.wait(remaining)
+    return conditional_osc_response(since)
+
+@app.route('/api/channels')
+def channels_index():
+    """Elenco dei canali numerici e memoria usata (attuale e massima)."""
+    return api_response(*list_channels(channels))
+
+@app.route('/api/channels/<path:address>')
+def channel_samples(address):
+    """Campioni di un canale (parametri in osc_api.get_channel)."""
+    return api_response(*get_channel(channels, '/' + address, request.args))
+
+@app.route('/api/channel-stats/<path:address>')
+def channel_stats(address):
+    """Statistiche su finestre di un canale (parametri in osc_api.get_channel_stats)."""
+    return api_response(*get_channel_stats(channels, '/' + address, request.args))
+
+@app.route('/metrics')
+def metrics():
+    """Metriche del processo nel formato testuale di Prometheus."""
+    return app.response_class(registry.render_prometheus(),
+                              mimetype='text/plain; version=0.0.4')
 
 # Avvia l'applicazione
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Server OSC + interfaccia web')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Nessun log per messaggio OSC')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Log di tutti i messaggi, senza campionamento')
+    parser.add_argument('--log-first', type=int, default=DEFAULT_FIRST,
+                        help=f'Messaggi mostrati per indirizzo prima del campionamento '
+                             f'(default: {DEFAULT_FIRST})')
+    parser.add_argument('--log-every', type=int, default=DEFAULT_EVERY,
+                        help=f'Poi uno ogni N messaggi (default: {DEFAULT_EVERY})')
+    parser.add_argument('--capture', metavar='CARTELLA', default=None,
+                        help='Registra ogni datagramma OSC su disco (rileggibile con capture.py)')
+    add_socket_arguments(parser)
+    add_pool_arguments(parser)
+    add_relay_arguments(parser)
+    add_chunk_arguments(parser)
+    args = parser.parse_args()
+    pool = pool_from_args(args, parser)
+    relay = relay_from_args(args, parser)
+    chunks = reassembler_from_args(args, parser)
+    osc_log.configure(level_from_args(args.quiet, args.verbose),
+                      args.log_first, args.log_every)
+    try:
+        osc_data['message_history'] = HistoryStore.create(
+            HISTORY_NAME, HISTORY_CAPACITY, HISTORY_SLAB
+        )
+    except FileExistsError as e:
+        # Cronologia di un altro server ancora attivo
+        raise SystemExit(f"Avvio non riuscito: {e}")
+    # SIGTERM chiude come Ctrl+C: la cronologia condivisa va rimossa
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.capture:
+        capture_writer = CaptureWriter(args.capture)
+        print(f"Registrazione dei datagrammi OSC in '{args.capture}'")
+    register_metrics(pool, relay, chunks)
+    
     # Avvia il server OSC in un thread separato
-    osc_thread = Thread(target=start_osc_server, daemon=True)
+    osc_thread = Thread(target=start_osc_server,
+                        args=(socket_options_from_args(args), pool, relay, chunks),
+                        daemon=True)
     osc_thread.start()
     
     # Avvia il server web Flask
     print("Starting web server...")
-    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
\ No newline at end of file
+    try:
+        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+    finally:
+        if capture_writer is not None:
+            capture_writer.close()
+        osc_data['message_history'].close()
\ No newline at end of file
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark del polling di /api/osc-data
+Confronta la risposta completa con la modalità ?since=<seq> + ETag per
+10 e 100 dashboard che interrogano l'API mentre arrivano messaggi OSC
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as osc_app
+from history_store import HistoryStore
+from osc_api import HISTORY_API_COUNT
+
+
+def simulate(client, mode, dashboards, seconds, poll_hz, message_rate):
+    """Simula `seconds` secondi di traffico: restituisce byte e CPU al secondo"""
+    ticks = int(seconds * poll_hz)
+    messages_per_tick = message_rate / poll_hz
+    pending = 0.0
+    cursors = [0] * dashboards
+    etags = [None] * dashboards
+    total_bytes = 0
+    not_modified = 0
+
+    cpu_start = time.process_time()
+    for tick in range(ticks):
+        pending += messages_per_tick
+        while pending >= 1.0:
+            osc_app.handle_osc_message(('127.0.0.1', 9000), f'/fader{tick % 8}', 0.5, 0.25)
+            pending -= 1.0
+
+        for index in range(dashboards):
+            if mode == 'full':
+                response = client.get('/api/osc-data')
+            else:
+                headers = {'If-None-Match': etags[index]} if etags[index] else {}
+                response = client.get(f'/api/osc-data?since={cursors[index]}', headers=headers)
+                etags[index] = response.headers.get('ETag')
+                if response.status_code == 304:
+                    not_modified += 1
+                else:
+                    cursors[index] = response.get_json()['last_seq']
+            # Corpo + intestazioni, come sul filo
+            total_bytes += len(response.data) + sum(
+                len(k) + len(v) + 4 for k, v in response.headers.items())
+    cpu = time.process_time() - cpu_start
+
+    return {
+        'mode': mode,
+        'dashboards': dashboards,
+        'bytes_per_s': total_bytes / seconds,
+        'cpu_per_s': cpu / seconds,
+        'not_modified': not_modified,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark polling /api/osc-data')
+    parser.add_argument('--dashboards', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--seconds', type=float, default=5.0,
+                        help='Secondi di traffico simulato (default: 5)')
+    parser.add_argument('--poll-hz', type=float, default=2.0,
+                        help='Interrogazioni al secondo per dashboard (default: 2)')
+    parser.add_argument('--message-rate', type=float, default=1.0,
+                        help='Messaggi OSC al secondo (default: 1, controlli lenti)')
+    args = parser.parse_args()
+
+    print(f"{'modo':<8}{'dashboard':>10}{'KB/s':>12}{'CPU s/s':>10}{'304':>8}")
+    for dashboards in args.dashboards:
+        for mode in ('full', 'since'):
+            store = HistoryStore.create('bench_api_poll', osc_app.HISTORY_CAPACITY,
+                                        osc_app.HISTORY_SLAB)
+            osc_app.osc_data['message_history'] = store
+            # Cronologia già piena, come dopo qualche minuto di spettacolo
+            for i in range(HISTORY_API_COUNT):
+                store.append_values(time.time(), ('127.0.0.1', 9000), f'/fader{i % 8}', (0.5, 0.25))
+            client = osc_app.app.test_client()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = simulate(client, mode, dashboards, args.seconds,
+                                  args.poll_hz, args.message_rate)
+            store.close()
+            print(f"{result['mode']:<8}{result['dashboards']:>10}"
+                  f"{result['bytes_per_s'] / 1024:>12.1f}{result['cpu_per_s']:>10.3f}"
+                  f"{result['not_modified']:>8}")
+
+
+if __name__ == "__main__":
+    main()
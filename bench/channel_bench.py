@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark dei canali numerici
+Estrarre la serie di un indirizzo per un grafico: ciclo Python sulla
+cronologia (come farebbe una dashboard su /api/osc-data) contro le query
+vettoriali di ChannelStore (ultimi N, ricampionamento, finestre mobili)
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from channel_store import ChannelStore
+from history_store import HistoryStore
+
+
+def timed(function, repeat):
+    """Miglior tempo di esecuzione in ms"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark canali numerici NumPy')
+    parser.add_argument('--addresses', type=int, default=8,
+                        help='Indirizzi interlacciati nel traffico (default: 8)')
+    parser.add_argument('--samples', type=int, default=4096,
+                        help='Campioni per indirizzo (default: 4096)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    total = args.addresses * args.samples
+    history = HistoryStore.create(None, total, 128)
+    channels = ChannelStore(capacity=args.samples)
+    addresses = [f'/sensor/{index}' for index in range(args.addresses)]
+    start = time.time()
+    for step in range(args.samples):
+        timestamp = start + step / 120.0
+        for address in addresses:
+            values = (step * 0.001, -step * 0.001)
+            history.append_values(timestamp, ('127.0.0.1', 9000), address, values)
+            channels.append(address, timestamp, values)
+
+    target = addresses[0]
+
+    def from_history():
+        times = []
+        values = []
+        for record in history.last(total):
+            if record.address == target:
+                times.append(record.timestamp)
+                values.append(record.value)
+        return times, values
+
+    cases = [
+        ('cronologia, ciclo Python', from_history),
+        ('canale, ultimi N', lambda: channels.last(target, args.samples)),
+        ('canale, ricampiona 60 Hz', lambda: channels.resample(target, 60, 30)),
+        ('canale, finestra 1 s', lambda: channels.window_stats(target, 1.0)),
+        ('canale, mobile 1 s @30 Hz', lambda: channels.rolling(target, 1.0, 30, 30)),
+    ]
+    print(f"{args.samples} campioni per indirizzo, {args.addresses} indirizzi "
+          f"({total} messaggi in cronologia)")
+    print(f"{'query':<28}{'ms':>10}")
+    for name, function in cases:
+        print(f"{name:<28}{timed(function, args.repeat):>10.2f}")
+    stats = channels.get_stats()
+    print(f"Memoria canali: {stats['memory_bytes'] // 1024} KB "
+          f"(massimo {stats['memory_limit_bytes'] // 1024} KB)")
+    history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark dei payload a frammenti (chunking.py)
+1. Riassemblaggio in memoria: payload da 64 KB a 1 MB spezzati in
+   frammenti e ricomposti a lotti di 64, MB/s e payload/s.
+2. Perdite: una parte dei frammenti scartata, duplicata o fuori ordine;
+   payload completi, scaduti e frammenti persi contati dal Reassembler.
+3. Ricezione su loopback: recvfrom() con un bytes nuovo da 64 KB per
+   datagramma (come socketserver) contro BatchReceiver con l'arena
+   riusata, fino al payload ricomposto; CPU del thread ricevente per MB.
+"""
+
+import argparse
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import CHUNK_HEADER, CHUNK_MAGIC, Reassembler, split_payload
+from udp_engine import BatchReceiver
+from udp_socket import MAX_UDP_PAYLOAD
+
+SIZES = (64 * 1024, 256 * 1024, 1024 * 1024)
+BATCH = 64
+ADDR = ('127.0.0.1', 9000)
+PORT = 18991
+
+
+def batches_of(fragments):
+    """Frammenti in lotti come quelli di BatchReceiver"""
+    return [[(fragment, ADDR) for fragment in fragments[i:i + BATCH]]
+            for i in range(0, len(fragments), BATCH)]
+
+
+def bench_memory(size, seconds):
+    """Payload/s ricomposti in memoria, senza socket"""
+    data = os.urandom(size)
+    fragments = [bytearray(fragment) for fragment in split_payload(data, 0)]
+    batches = batches_of(fragments)
+    reassembler = Reassembler(max_size=max(SIZES))
+    done = 0
+    elapsed = 0.0
+    while elapsed < seconds:
+        # Id nuovo per ogni payload (fuori dalla misura): un id già
+        # completato sarebbe scartato come duplicato
+        for fragment in fragments:
+            CHUNK_HEADER.pack_into(fragment, 0, CHUNK_MAGIC, done,
+                                   *CHUNK_HEADER.unpack_from(fragment)[2:])
+        start = time.perf_counter()
+        for batch in batches:
+            reassembler.reassemble(batch)
+        elapsed += time.perf_counter() - start
+        done += 1
+    assert reassembler.completed == done
+    return done / elapsed, done * size / elapsed / 1e6
+
+
+def bench_loss(size, payloads, drop, duplicate, seed=1):
+    """Frammenti scartati/duplicati/mescolati: statistiche del Reassembler"""
+    rng = random.Random(seed)
+    data = os.urandom(size)
+    reassembler = Reassembler(max_size=size, timeout=0.05)
+    now = 0.0
+    for message_id in range(payloads):
+        fragments = []
+        for fragment in split_payload(data, message_id):
+            if rng.random() < drop:
+                continue
+            fragments.append(fragment)
+            if rng.random() < duplicate:
+                fragments.append(fragment)
+        # Fuori ordine dentro una finestra di 8 frammenti
+        for i in range(0, len(fragments), 8):
+            window = fragments[i:i + 8]
+            rng.shuffle(window)
+            fragments[i:i + 8] = window
+        for batch in batches_of(fragments):
+            for payload, _ in reassembler.reassemble(batch, now):
+                assert payload == data
+        now += 0.01
+    reassembler.expire(now + 1.0)
+    return reassembler.get_stats()
+
+
+def send_payloads(fragments, pace):
+    """Thread mittente: i payload a frammenti, con una pausa tra l'uno e l'altro"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for payload in fragments:
+        for fragment in payload:
+            sock.sendto(fragment, ('127.0.0.1', PORT))
+        time.sleep(pace)
+    sock.close()
+
+
+def receive_socket(size, count, pace, batched):
+    """Ricezione e riassemblaggio su loopback: (payload completi, CPU s)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # Oltre net.core.rmem_max solo con CAP_NET_ADMIN
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUFFORCE, 8 * 1024 * 1024)
+    except (AttributeError, OSError):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    sock.bind(('127.0.0.1', PORT))
+    sock.settimeout(1.0)
+    reassembler = Reassembler(max_size=size)
+    receiver = BatchReceiver(sock) if batched else None
+    fragments = [split_payload(os.urandom(size), message_id) for message_id in range(count)]
+    sender = threading.Thread(target=send_payloads, args=(fragments, pace))
+    cpu = time.thread_time()
+    sender.start()
+    completed = 0
+    try:
+        while completed < count:
+            if batched:
+                if not receiver.wait(1.0):
+                    break
+                batch = receiver.drain()
+            else:
+                try:
+                    # socketserver: recvfrom() con un bytes nuovo per ogni datagramma
+                    data, addr = sock.recvfrom(MAX_UDP_PAYLOAD)
+                except socket.timeout:
+                    break
+                batch = [(data, addr)]
+            completed += len(reassembler.reassemble(batch))
+    finally:
+        cpu = time.thread_time() - cpu
+        sender.join()
+        sock.close()
+    return completed, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dei payload a frammenti')
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help='Durata di ogni misura in memoria (default: 1)')
+    parser.add_argument('--payloads', type=int, default=200,
+                        help='Payload per le prove di perdita e su loopback (default: 200)')
+    args = parser.parse_args()
+
+    print("Riassemblaggio in memoria (lotti da 64 frammenti)")
+    print(f"{'payload':>10}{'frammenti':>11}{'payload/s':>11}{'MB/s':>9}")
+    for size in SIZES:
+        rate, mbps = bench_memory(size, args.seconds)
+        print(f"{size // 1024:>7} KB{len(split_payload(b'x' * size, 0)):>11}"
+              f"{rate:>11.0f}{mbps:>9.0f}")
+
+    print(f"\nPerdite: {args.payloads} payload da 256 KB, fuori ordine a gruppi di 8")
+    print(f"{'scartati':>9}{'duplicati':>10}{'completi':>10}{'scaduti':>9}{'sostituiti':>11}"
+          f"{'fr. persi':>10}{'fr. duplicati':>14}")
+    for drop, duplicate in ((0.0, 0.0), (0.0, 0.05), (0.001, 0.0), (0.01, 0.01)):
+        stats = bench_loss(256 * 1024, args.payloads, drop, duplicate)
+        print(f"{drop:>9.1%}{duplicate:>10.0%}{stats['completed']:>10}{stats['expired']:>9}"
+              f"{stats['evicted']:>11}{stats['lost_fragments']:>10}{stats['duplicates']:>14}")
+
+    print(f"\nLoopback: {args.payloads} payload da 256 KB, ricezione e riassemblaggio")
+    print(f"{'ricezione':<24}{'completi':>10}{'CPU ms/MB':>11}")
+    for name, batched in (('recvfrom() 64 KB', False), ('BatchReceiver (arena)', True)):
+        completed, cpu = receive_socket(256 * 1024, args.payloads, 0.005, batched)
+        megabytes = completed * 256 / 1024
+        per_mb = cpu * 1000 / megabytes if megabytes else float('nan')
+        print(f"{name:<24}{completed:>10}{per_mb:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark della classificazione dei payload UDP
+Costo per datagramma del vecchio percorso (decodifica UTF-8 tentata con
+le eccezioni, esadecimale e JSON per ogni pacchetto, estrazione numerica
+che decodifica di nuovo) contro il classificatore con formato per
+mittente, con il JSON costruito solo se un client lo chiede
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from payload_classifier import PayloadClassifier, parse_schema, udp_message
+from wire_format import AddressTable, extract_numeric, prepare_message
+
+SOURCE = ('192.168.1.50', 10001)
+TIMESTAMP = '00:00:00.000'
+
+
+def osc_floats(address, count):
+    """Datagramma OSC con `count` float"""
+    builder = OscMessageBuilder(address)
+    for i in range(count):
+        builder.add_arg(i / count, 'f')
+    return builder.build().dgram
+
+
+def old_message(data, addr, timestamp):
+    """Percorso precedente: UTF-8 tentato, altrimenti esadecimale"""
+    try:
+        data_type = 'text'
+        content = str(data, 'utf-8')
+    except UnicodeDecodeError:
+        data_type = 'binary'
+        hex_data = data.hex()
+        content = hex_data[:100] + "..." if len(hex_data) > 100 else hex_data
+    return {'timestamp': timestamp, 'source_ip': addr[0], 'source_port': addr[1],
+            'data_type': data_type, 'content': content, 'size': len(data)}
+
+
+def old_path(data, addresses):
+    text = json.dumps({'type': 'udp_message', 'message': old_message(data, SOURCE, TIMESTAMP)})
+    return prepare_message(text, addresses, SOURCE, extract_numeric(data), 0.0)
+
+
+def new_path(classifier, data, addresses, json_client):
+    payload = classifier.decode(data, SOURCE)
+
+    def render():
+        return ('{"type": "udp_message", "message": '
+                + json.dumps(udp_message(payload, SOURCE, TIMESTAMP)) + '}')
+
+    message = prepare_message(None, addresses, SOURCE, payload.numeric(), 0.0, render)
+    if json_client or not message.is_numeric:
+        message.text
+    else:
+        message.binary()
+    return message
+
+
+def per_packet_us(function, data, count, repeat=3):
+    """Miglior tempo medio per datagramma su `repeat` passate, in µs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(count):
+            function(data)
+        best = min(best, time.perf_counter() - start)
+    return best / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark classificazione payload UDP')
+    parser.add_argument('-n', '--count', type=int, default=50000,
+                        help='Datagrammi per caso (default: 50000)')
+    args = parser.parse_args()
+
+    cases = [
+        ('float32 (4 B)', struct.pack('>f', 0.5), None),
+        ('16xfloat32le dichiarato', struct.pack('<16f', *range(16)), '16xfloat32le'),
+        ('OSC 4 float', osc_floats('/sensor/xyzw', 4), None),
+        ('testo "0.25 0.5"', b'0.25 0.5', None),
+        ('binario 200 B', bytes(range(200)), None),
+    ]
+    print(f"{'payload':<26}{'prima us':>10}{'JSON us':>10}{'binario us':>12}")
+    for name, data, schema in cases:
+        schemas = [parse_schema(f':{SOURCE[1]}={schema}')] if schema else []
+        classifier = PayloadClassifier(schemas)
+        addresses = AddressTable()
+        old = per_packet_us(lambda d: old_path(d, addresses), data, args.count)
+        lazy_json = per_packet_us(lambda d: new_path(classifier, d, addresses, True),
+                                  data, args.count)
+        lazy_binary = per_packet_us(lambda d: new_path(classifier, d, addresses, False),
+                                    data, args.count)
+        print(f"{name:<26}{old:>10.2f}{lazy_json:>10.2f}{lazy_binary:>12.2f}")
+    print("JSON: un client JSON connesso; binario: solo client binari "
+          "(il testo non viene mai costruito per i payload numerici)")
+
+
+if __name__ == "__main__":
+    main()
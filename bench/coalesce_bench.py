@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark della coalescenza per indirizzo
+N fader a 60-120 Hz più un trigger sul loop asyncio: messaggi inoltrati,
+rapporto di riduzione e CPU per modalità (off, latest, aggregate)
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coalescer import MODE_AGGREGATE, MODES, Coalescer
+
+
+async def run(mode, faders, fader_hz, tick_hz, seconds):
+    loop = asyncio.get_running_loop()
+    emitted = []
+    coalescer = Coalescer(lambda key, item, window: emitted.append(key),
+                          mode, tick_hz, passthrough=('/trigger*',))
+    coalescer.attach(loop)
+    period = 1.0 / fader_hz
+    ticks = int(seconds * fader_hz)
+    triggers = 0
+
+    cpu_start = time.process_time()
+    start = loop.time()
+    for tick in range(ticks):
+        for index in range(faders):
+            address = f'/fader{index}'
+            values = (tick / ticks, index) if mode == MODE_AGGREGATE else None
+            coalescer.offer(address, address, (tick, index), values)
+        if tick % fader_hz == 0:
+            coalescer.offer('/trigger1', '/trigger1', (tick, -1))
+            triggers += 1
+        # Ritmo reale: il tick della coalescenza gira sul loop nel frattempo
+        await asyncio.sleep(max(0.0, start + (tick + 1) * period - loop.time()))
+    coalescer.detach()
+    cpu = time.process_time() - cpu_start
+
+    stats = coalescer.get_stats()
+    stats['triggers_delivered'] = sum(1 for key in emitted if key == '/trigger1')
+    stats['triggers_sent'] = triggers
+    stats['cpu_per_s'] = cpu / seconds
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark coalescenza per indirizzo')
+    parser.add_argument('--faders', type=int, default=16)
+    parser.add_argument('--fader-hz', type=int, default=120,
+                        help='Frequenza di ogni fader (default: 120)')
+    parser.add_argument('--tick-hz', type=float, default=30.0,
+                        help='Frequenza del tick (default: 30)')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{'modo':<11}{'ricevuti':>10}{'inviati':>10}{'riduzione':>11}"
+          f"{'trigger':>10}{'CPU s/s':>10}")
+    for mode in MODES:
+        stats = asyncio.run(run(mode, args.faders, args.fader_hz, args.tick_hz, args.seconds))
+        print(f"{mode:<11}{stats['received']:>10}{stats['emitted']:>10}"
+              f"{stats['reduction_ratio']:>10.1f}x"
+              f"{stats['triggers_delivered']:>6}/{stats['triggers_sent']:<3}"
+              f"{stats['cpu_per_s']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
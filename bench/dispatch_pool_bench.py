@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Benchmark della gestione dei datagrammi OSC
+ThreadingOSCUDPServer (un thread per datagramma) contro il pool fisso di
+dispatch_pool.py (N worker, e inline nel thread di ricezione). Un
+processo mittente invia messaggi numerati su più indirizzi; l'handler
+aggiorna uno stato condiviso con un lock, come app.py. Per ogni modalità:
+messaggi gestiti e persi, CPU e cambi di contesto del processo server,
+picco dei thread e messaggi fuori ordine per indirizzo.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pythonosc import dispatcher, osc_server
+
+from dispatch_pool import POLICY_BLOCK, DispatchPool, PooledServerMixin
+from udp_socket import SocketOptions, TunedServerMixin
+
+PORT = 10200
+
+
+class ThreadingServer(TunedServerMixin, osc_server.ThreadingOSCUDPServer):
+    """Server originale: un thread per datagramma"""
+
+
+class PooledServer(TunedServerMixin, PooledServerMixin, osc_server.OSCUDPServer):
+    """Server con il pool fisso"""
+
+
+def _osc_string(text):
+    data = text.encode('utf-8') + b'\0'
+    return data + b'\0' * (-len(data) % 4)
+
+
+def sender_main(count, rate, addresses):
+    """Messaggi ",if": numero progressivo e un valore"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    names = [_osc_string(f'/bench/{index}') for index in range(addresses)]
+    interval = 1.0 / rate if rate else 0.0
+    next_send = time.perf_counter()
+    for seq in range(count):
+        if interval:
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sock.sendto(names[seq % addresses] + b',if\0' + struct.pack('>if', seq, 0.5),
+                    ('127.0.0.1', PORT))
+    sock.close()
+
+
+class State:
+    """Stato condiviso dall'handler, protetto da un lock come in app.py"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_seq = {}
+        self.handled = 0
+        self.out_of_order = 0
+        self.last_handled = time.monotonic()
+
+    def handle(self, address, seq, value):
+        with self.lock:
+            if self.last_seq.get(address, -1) > seq:
+                self.out_of_order += 1
+            self.last_seq[address] = seq
+            self.handled += 1
+            self.last_handled = time.monotonic()
+
+
+def usage():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime, ru.ru_nvcsw + ru.ru_nivcsw
+
+
+def run_mode(name, server_class, pool, args):
+    state = State()
+    osc_dispatcher = dispatcher.Dispatcher()
+    osc_dispatcher.map('/bench/*', state.handle)
+    kwargs = {'socket_options': SocketOptions(rcvbuf=4 * 1024 * 1024)}
+    if pool is not None:
+        kwargs['pool'] = pool
+    server = server_class(('127.0.0.1', PORT), osc_dispatcher, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05},
+                              daemon=True)
+    thread.start()
+
+    cpu_before, switches_before = usage()
+    peak_threads = threading.active_count()
+    sender = multiprocessing.Process(target=sender_main,
+                                     args=(args.count, args.rate, args.addresses))
+    sender.start()
+    # Picco dei thread vivi, campionato mentre il mittente invia
+    while sender.is_alive() or time.monotonic() - state.last_handled < args.settle:
+        peak_threads = max(peak_threads, threading.active_count())
+        time.sleep(0.01)
+    sender.join()
+    cpu_after, switches_after = usage()
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    return {
+        'mode': name,
+        'handled': state.handled,
+        'lost': args.count - state.handled,
+        'out_of_order': state.out_of_order,
+        'cpu_s': cpu_after - cpu_before,
+        'switches': switches_after - switches_before,
+        'peak_threads': peak_threads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark thread per datagramma contro pool')
+    parser.add_argument('-n', '--count', type=int, default=20000,
+                        help='Messaggi per modalità (default: 20000)')
+    parser.add_argument('--rate', type=float, default=5000.0,
+                        help='Messaggi/s del mittente, 0 = massima velocità (default: 5000)')
+    parser.add_argument('--addresses', type=int, default=16,
+                        help='Indirizzi distinti (default: 16)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Worker del pool (default: 4)')
+    parser.add_argument('--settle', type=float, default=0.5,
+                        help='Secondi senza messaggi per considerare finito (default: 0.5)')
+    args = parser.parse_args()
+
+    modes = [
+        ('thread per datagramma', ThreadingServer, None),
+        (f'pool {args.workers} worker', PooledServer, DispatchPool(args.workers, 1024, POLICY_BLOCK)),
+        ('inline', PooledServer, DispatchPool(0)),
+    ]
+    print(f"{args.count} messaggi a {args.rate:g}/s su {args.addresses} indirizzi")
+    print(f"{'modalità':<24}{'gestiti':>9}{'persi':>7}{'fuori ordine':>14}"
+          f"{'CPU s':>8}{'ctx sw':>9}{'thread':>8}")
+    for name, server_class, pool in modes:
+        result = run_mode(name, server_class, pool, args)
+        print(f"{name:<24}{result['handled']:>9}{result['lost']:>7}{result['out_of_order']:>14}"
+              f"{result['cpu_s']:>8.2f}{result['switches']:>9}{result['peak_threads']:>8}")
+    print("CPU e cambi di contesto del solo processo server (il mittente è un altro processo)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Benchmark end-to-end di tutti i punti di ingresso
+Avvia localmente app.py, osc_receiver.py, udp_receiver.py,
+udp_websocket_server.py e raspberry_osc_client.py, invia traffico OSC e
+UDP sintetico da N processi e misura messaggi consegnati, perdite e
+latenza p50/p99/p999. Ogni messaggio porta il proprio istante di invio
+(token "T<ns>"); la consegna si osserva dove ogni programma la rende
+visibile: client WebSocket headless per i bridge, cronologia condivisa
+per app.py, output su console per gli altri. Il risultato è un JSON
+confrontabile tra commit. Tutto gira su loopback.
+
+    python bench/e2e_bench.py --rate 2000 --senders 4 --output risultati.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import re
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import websockets
+
+from history_store import HistoryStore
+from metrics import LatencyHistogram
+
+KINDS = ('osc', 'text', 'binary')
+TOKEN = re.compile(r'T(\d{19})')
+WEBSOCKET_URL = 'ws://127.0.0.1:8765/'
+BRIDGE_PORT = 10100
+
+# Come ogni programma rende visibile un messaggio consegnato:
+# websocket (client headless), history (memoria condivisa), stdout (console)
+TARGETS = {
+    'app': {
+        'command': ['app.py', '-q'],
+        'port': 10000,
+        'kinds': ('osc',),
+        'sink': 'history',
+        'history': 'streamtorasp_osc',
+        'ready': 'Starting web server',
+    },
+    'osc_receiver': {
+        'command': ['osc_receiver.py'],
+        'port': 5005,
+        'kinds': ('osc',),
+        'sink': 'stdout',
+        'ready': 'Listening for OSC messages',
+    },
+    'udp_receiver': {
+        'command': ['udp_receiver.py', '-p', str(BRIDGE_PORT), '-q'],
+        'port': BRIDGE_PORT,
+        'kinds': KINDS,
+        'sink': 'websocket',
+        'ready': 'Server WebSocket avviato',
+    },
+    'udp_websocket_server': {
+        'command': ['udp_websocket_server.py', '-p', str(BRIDGE_PORT), '-q'],
+        'port': BRIDGE_PORT,
+        'kinds': KINDS,
+        'sink': 'websocket',
+        'ready': 'Server WebSocket avviato',
+    },
+    'raspberry_osc_client': {
+        'command': ['raspberry_osc_client.py', '127.0.0.1', '-p', str(BRIDGE_PORT)],
+        'port': BRIDGE_PORT,
+        'kinds': ('osc',),
+        'sink': 'stdout',
+        'ready': 'In ascolto',
+    },
+}
+
+
+def _osc_string(text):
+    data = text.encode('utf-8') + b'\0'
+    return data + b'\0' * (-len(data) % 4)
+
+
+def build_osc(address, value, token):
+    """Messaggio OSC ",fs": un float e il token di invio"""
+    return _osc_string(address) + b',fs\0' + struct.pack('>f', value) + _osc_string(token)
+
+
+def build_payload(kind, index, cardinality, size):
+    """Payload sintetico con l'istante di invio (wall clock, ns)"""
+    token = f"T{time.time_ns()}"
+    if kind == 'osc':
+        address = f"/bench/{index % cardinality}"
+        return build_osc(address, (index % 1000) / 1000.0, token.ljust(max(len(token), size - 24)))
+    if kind == 'text':
+        return f"{token} {index % cardinality}".ljust(size).encode('ascii')
+    # Binario non UTF-8: conta nella consegna, non nella latenza
+    return b'\xff\xfe' + os.urandom(max(0, size - 2))
+
+
+def sender_main(port, rate, duration, kinds, cardinality, size, sent):
+    """Processo mittente: `rate` messaggi/s per `duration` secondi"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = ('127.0.0.1', port)
+    interval = 1.0 / rate if rate else 0.0
+    start = time.perf_counter()
+    deadline = start + duration
+    count = 0
+    next_send = start
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        if interval:
+            next_send += interval
+            delay = next_send - now
+            if delay > 0:
+                time.sleep(delay)
+        payload = build_payload(kinds[count % len(kinds)], count, cardinality, size)
+        try:
+            sock.sendto(payload, target)
+            count += 1
+        except OSError:
+            pass
+    sock.close()
+    sent.value = count
+
+
+def expand_mix(mix, allowed):
+    """'osc=6,text=3,binary=1' -> ciclo di tipi rispettando le proporzioni"""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name in allowed:
+            weights[name] = int(weight or 1)
+    if not weights:
+        weights = {allowed[0]: 1}
+    cycle = []
+    for name, weight in weights.items():
+        cycle.extend([name] * weight)
+    return tuple(cycle)
+
+
+class Collector:
+    """Conta le consegne e registra la latenza dai token"""
+
+    def __init__(self):
+        self.histogram = LatencyHistogram('e2e')
+        self.delivered = 0
+        self.last_delivery = time.monotonic()
+        self.lock = threading.Lock()
+
+    def delivery(self, text, received_ns):
+        match = TOKEN.search(text)
+        with self.lock:
+            self.delivered += 1
+            self.last_delivery = time.monotonic()
+            if match:
+                self.histogram.record(max(0, received_ns - int(match.group(1))))
+
+
+class Target:
+    """Processo sotto test con lettura continua della sua console"""
+
+    def __init__(self, name, spec, collector):
+        self.name = name
+        self.spec = spec
+        self.collector = collector
+        self.ready = threading.Event()
+        env = dict(os.environ, PYTHONUNBUFFERED='1')
+        self.process = subprocess.Popen(
+            [sys.executable] + spec['command'], cwd=ROOT, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace')
+        self.output_tail = []
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+
+    def _read_output(self):
+        count_lines = self.spec['sink'] == 'stdout'
+        for line in self.process.stdout:
+            if not self.ready.is_set() and self.spec['ready'] in line:
+                self.ready.set()
+            if count_lines and TOKEN.search(line):
+                self.collector.delivery(line, time.time_ns())
+            elif len(self.output_tail) < 50:
+                self.output_tail.append(line.rstrip())
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class WebSocketClient:
+    """Client WebSocket headless in un thread con il suo loop"""
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.connected = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.websocket = None
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.future = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+
+    async def _run(self):
+        for _ in range(50):
+            try:
+                websocket = await websockets.connect(WEBSOCKET_URL, max_queue=None)
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        else:
+            return
+        self.websocket = websocket
+        self.connected.set()
+        try:
+            async for frame in websocket:
+                if frame.startswith('{"type": "udp_message"'):
+                    self.collector.delivery(frame, time.time_ns())
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def stop(self):
+        if self.websocket is not None:
+            asyncio.run_coroutine_threadsafe(self.websocket.close(), self.loop)
+        try:
+            self.future.result(timeout=5)
+        except Exception:
+            self.future.cancel()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
+        self.loop.close()
+
+
+class HistoryPoller:
+    """Legge la cronologia condivisa di app.py mentre arrivano i messaggi"""
+
+    def __init__(self, name, collector):
+        self.name = name
+        self.collector = collector
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        store = None
+        while store is None and not self.stopping.is_set():
+            try:
+                store = HistoryStore.attach(self.name)
+            except FileNotFoundError:
+                time.sleep(0.1)
+        if store is None:
+            return
+        last_seq = store.last_seq
+        try:
+            # Il timestamp dei record è l'istante di ricezione del kernel:
+            # la consegna è il momento in cui il record diventa visibile
+            while not self.stopping.wait(0.001):
+                seen_ns = time.time_ns()
+                for record in store.since(last_seq):
+                    last_seq = record.seq
+                    args = record.value if isinstance(record.value, (list, tuple)) else ()
+                    token = next((arg for arg in args if isinstance(arg, str)), '')
+                    self.collector.delivery(token, seen_ns)
+        finally:
+            store.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join(timeout=2)
+
+
+def run_target(name, args):
+    spec = TARGETS[name]
+    collector = Collector()
+    target = Target(name, spec, collector)
+    observer = None
+    result = {'target': name}
+    try:
+        if not target.ready.wait(15):
+            raise RuntimeError('avvio non riuscito: ' + ' | '.join(target.output_tail[-5:]))
+        if spec['sink'] == 'websocket':
+            observer = WebSocketClient(collector)
+            if not observer.connected.wait(5):
+                raise RuntimeError('connessione WebSocket non riuscita')
+        elif spec['sink'] == 'history':
+            observer = HistoryPoller(spec['history'], collector)
+        time.sleep(0.5)
+
+        kinds = expand_mix(args.mix, spec['kinds'])
+        counters = [multiprocessing.Value('q', 0) for _ in range(args.senders)]
+        senders = [
+            multiprocessing.Process(target=sender_main, args=(
+                spec['port'], args.rate, args.duration, kinds,
+                args.cardinality, args.size, counter))
+            for counter in counters
+        ]
+        start = time.perf_counter()
+        for process in senders:
+            process.start()
+        for process in senders:
+            process.join()
+        send_elapsed = time.perf_counter() - start
+
+        # Attende che le consegne si fermino (code e buffer svuotati)
+        while time.monotonic() - collector.last_delivery < args.settle:
+            time.sleep(0.1)
+        sent = sum(counter.value for counter in counters)
+        delivered = collector.delivered
+        result.update({
+            'sent': sent,
+            'delivered': delivered,
+            'drop_rate': max(0.0, 1.0 - delivered / sent) if sent else 0.0,
+            'sent_per_s': sent / send_elapsed if send_elapsed else 0.0,
+            'delivered_per_s': delivered / send_elapsed if send_elapsed else 0.0,
+            'latency': collector.histogram.summary(),
+            'mix': ','.join(sorted(set(kinds))),
+        })
+    except RuntimeError as e:
+        result['error'] = str(e)
+    finally:
+        if observer is not None:
+            observer.stop()
+        target.stop()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark end-to-end dei punti di ingresso')
+    parser.add_argument('--targets', nargs='+', choices=sorted(TARGETS), default=sorted(TARGETS))
+    parser.add_argument('--senders', type=int, default=2,
+                        help='Processi mittenti (default: 2)')
+    parser.add_argument('--rate', type=float, default=500.0,
+                        help='Messaggi/s per mittente, 0 = massima velocità (default: 500)')
+    parser.add_argument('--duration', type=float, default=3.0,
+                        help='Secondi di invio (default: 3)')
+    parser.add_argument('--mix', default='osc=6,text=3,binary=1',
+                        help='Proporzioni dei payload (default: osc=6,text=3,binary=1)')
+    parser.add_argument('--cardinality', type=int, default=16,
+                        help='Indirizzi distinti (default: 16)')
+    parser.add_argument('--size', type=int, default=64,
+                        help='Dimensione indicativa dei payload in byte (default: 64)')
+    parser.add_argument('--settle', type=float, default=1.0,
+                        help='Secondi senza consegne per considerare finito (default: 1)')
+    parser.add_argument('--output', default=None,
+                        help='File JSON dei risultati (default: solo a video)')
+    args = parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'python': platform.python_version(), 'machine': platform.machine(),
+                 'cpus': os.cpu_count()},
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': [],
+    }
+    print(f"{'target':<22}{'inviati':>9}{'consegnati':>11}{'perdite':>9}"
+          f"{'msg/s':>9}{'p50 us':>10}{'p99 us':>10}{'p999 us':>10}")
+    for name in args.targets:
+        result = run_target(name, args)
+        report['results'].append(result)
+        if 'error' in result:
+            print(f"{name:<22} errore: {result['error']}")
+            continue
+        latency = result['latency']
+        print(f"{name:<22}{result['sent']:>9}{result['delivered']:>11}"
+              f"{result['drop_rate'] * 100:>8.1f}%{result['delivered_per_s']:>9.0f}"
+              f"{latency.get('p50_us', 0):>10.0f}{latency.get('p99_us', 0):>10.0f}"
+              f"{latency.get('p999_us', 0):>10.0f}")
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"Risultati scritti in {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
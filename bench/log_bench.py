@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark del log per pacchetto
+Pacchetti/s di encode_udp_batch con la vecchia print() sincrona e con il
+LogSink (quiet, campionato, verbose) su una console lenta simulata
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import udp_websocket_server as bridge
+from log_sink import LEVEL_NORMAL, LEVEL_QUIET, LEVEL_VERBOSE, LogSink
+
+
+class SlowConsole:
+    """Console simulata: costo fisso per write più un costo per byte"""
+
+    def __init__(self, write_us, baud):
+        self.write_s = write_us / 1e6
+        # 10 bit per byte su seriale (start + 8 + stop)
+        self.byte_s = 10.0 / baud if baud else 0.0
+        self.writes = 0
+        self.bytes = 0
+
+    def _spin(self, seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    def write(self, text):
+        self.writes += 1
+        self.bytes += len(text)
+        self._spin(self.write_s + self.byte_s * len(text))
+
+    def flush(self):
+        pass
+
+
+class PrintLog:
+    """Comportamento precedente: strftime e print() per ogni pacchetto"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def log(self, key, fmt, *args):
+        timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
+        print(f"[{timestamp}] " + fmt % args, file=self.stream, flush=True)
+
+    def close(self):
+        pass
+
+
+def run(packet_log, batch, seconds):
+    """Pacchetti/s di encode_udp_batch per `seconds` secondi"""
+    bridge.packet_log = packet_log
+    packets = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        bridge.encode_udp_batch(batch, 0)
+        packets += len(batch)
+    elapsed = time.perf_counter() - start
+    packet_log.close()
+    return packets / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark log per pacchetto')
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--sources', type=int, default=8,
+                        help='Mittenti distinti nel lotto (default: 8)')
+    parser.add_argument('--write-us', type=float, default=20.0,
+                        help='Costo di ogni write sulla console in µs (default: 20, SSH)')
+    parser.add_argument('--baud', type=int, default=0,
+                        help='Simula una console seriale (es. 115200); 0 = nessun limite')
+    args = parser.parse_args()
+
+    batch = [(b'/fader1\0,f\0\0?\0\0\0', ('192.168.1.%d' % (10 + i % args.sources), 9000))
+             for i in range(64)]
+
+    cases = [
+        ('print()', lambda console: PrintLog(console)),
+        ('sink quiet', lambda console: LogSink(console, LEVEL_QUIET)),
+        ('sink campionato', lambda console: LogSink(console, LEVEL_NORMAL)),
+        ('sink verbose', lambda console: LogSink(console, LEVEL_VERBOSE)),
+    ]
+    print(f"{'log':<18}{'pacchetti/s':>14}{'write':>10}{'righe perse':>13}")
+    for name, factory in cases:
+        console = SlowConsole(args.write_us, args.baud)
+        packet_log = factory(console)
+        rate = run(packet_log, batch, args.seconds)
+        dropped = getattr(packet_log, 'dropped', 0)
+        print(f"{name:<18}{rate:>14.0f}{console.writes:>10}{dropped:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark del costo delle metriche
+ns per evento di Counter.inc(), LatencyHistogram.record() e del fan-out
+con e senza istogramma; costo di un'esportazione Prometheus completa
+"""
+
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcaster import Broadcaster
+from metrics import LatencyHistogram, MetricsRegistry, register_udp_socket
+
+
+class FakeSession:
+    """Sessione minima: offer() senza coda né loop"""
+
+    queue = ()
+    sent = dropped = 0
+    lag_ms = 0.0
+
+    def __init__(self, index):
+        self.websocket = type('WebSocket', (), {'remote_address': ('127.0.0.1', index)})
+
+    def offer(self, frame, key=None, received_ns=None):
+        return True
+
+
+def per_event_ns(statement, number, namespace):
+    """Miglior tempo per esecuzione su 5 ripetizioni, in ns"""
+    timer = timeit.Timer(statement, globals=namespace)
+    return min(timer.repeat(5, number)) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark costo delle metriche')
+    parser.add_argument('--number', type=int, default=200000,
+                        help='Eventi per misura (default: 200000)')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='Sessioni nel fan-out (default: 4)')
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    counter = registry.counter('events_total', 'Eventi')
+    histogram = registry.histogram('latency_seconds', 'Latenza')
+    register_udp_socket(registry, 10000)
+    plain = Broadcaster()
+    timed = Broadcaster(fanout_histogram=LatencyHistogram('fan-out'))
+    for broadcaster in (plain, timed):
+        for index in range(args.clients):
+            broadcaster.sessions[index] = FakeSession(index)
+    timed.register_metrics(registry)
+    namespace = {'counter': counter, 'histogram': histogram, 'plain': plain,
+                 'timed': timed, 'time': time}
+
+    cases = [
+        ('Counter.inc()', 'counter.inc()'),
+        ('record()', 'histogram.record(123456)'),
+        ('record_since()', 'histogram.record_since(0)'),
+        (f'fan-out {args.clients} client', "plain.publish('x')"),
+        (f'fan-out {args.clients} client + ist.', "timed.publish('x')"),
+    ]
+    print(f"{'evento':<28}{'ns':>8}")
+    for name, statement in cases:
+        print(f"{name:<28}{per_event_ns(statement, args.number, namespace):>8.0f}")
+
+    start = time.perf_counter()
+    text = registry.render_prometheus()
+    elapsed = time.perf_counter() - start
+    print(f"Esportazione Prometheus: {len(text)} byte in {elapsed * 1e6:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
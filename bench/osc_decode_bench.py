@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del decoder OSC
+Confronta osc_decoder con OscMessage di python-osc (il parser usato in
+origine da raspberry_osc_client.py) su payload tipici di TouchDesigner
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pythonosc.osc_message import OscMessage
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from osc_decoder import decode_message
+
+
+def build(address, *args):
+    builder = OscMessageBuilder(address)
+    for arg in args:
+        builder.add_arg(arg)
+    return builder.build().dgram
+
+
+PAYLOADS = {
+    'fader ,f': build('/fader1', 0.5),
+    'xyz ,fff': build('/sensor/accel', 0.1, -0.2, 9.81),
+    'chop ,f x16': build('/td/chop1/chan', *[i / 16.0 for i in range(16)]),
+    'chop ,f x64': build('/td/chop1/chan', *[i / 64.0 for i in range(64)]),
+    'misto ,sif': build('/cue/go', 'scene_3', 42, 1.5),
+}
+
+
+def decode_python_osc(data):
+    msg = OscMessage(data)
+    return msg.address, msg.params
+
+
+def decode_fast(data):
+    return decode_message(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark decoder OSC')
+    parser.add_argument('-n', '--number', type=int, default=50000)
+    args = parser.parse_args()
+
+    print(f"{'payload':<14}{'python-osc':>14}{'osc_decoder':>14}"
+          f"{'memoryview':>14}{'speedup':>10}")
+    for name, data in PAYLOADS.items():
+        view = memoryview(bytearray(data))
+        t_ref = timeit.timeit(lambda: decode_python_osc(data), number=args.number)
+        t_fast = timeit.timeit(lambda: decode_fast(data), number=args.number)
+        t_view = timeit.timeit(lambda: decode_fast(view), number=args.number)
+        to_us = 1e6 / args.number
+        print(f"{name:<14}{t_ref * to_us:>12.2f}us{t_fast * to_us:>12.2f}us"
+              f"{t_view * to_us:>12.2f}us{t_ref / t_fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
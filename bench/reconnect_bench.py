@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmark delle riconnessioni in massa (snapshot.py)
+Un Broadcaster con un vero server WebSocket su loopback, K indirizzi già
+pubblicati e traffico dal vivo; N client si collegano tutti insieme (come
+le pagine web dopo una caduta del Wi-Fi) e aspettano il loro stato
+iniziale. Tre varianti:
+1. cronologia: gli ultimi 20 messaggi, costruiti per ogni client (il
+   comportamento precedente di udp_websocket_server.py);
+2. per client: l'ultimo valore di ogni indirizzo, ricostruito a ogni client;
+3. in cache: gli stessi frame, ricostruiti solo quando la tabella cambia.
+Per ogni variante: tempo dalla raffica di connessioni allo stato ricevuto
+(p50, max), indirizzi ricevuti, costruzioni e tempo speso nei join.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import sys
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcaster import Broadcaster
+from metrics import LatencyHistogram
+from snapshot import SnapshotTable
+from wire_format import (BATCH_HEADER, FORMAT_BINARY, FRAME_BATCH, batch_from_path,
+                         pack_numeric, prepare_message, wire_format_from_request)
+
+PORT = 18766
+HISTORY_REPLAY = 20
+SOURCE = ('127.0.0.1', 9000)
+
+
+class UncachedSnapshot(SnapshotTable):
+    """Stessa tabella, frame ricostruiti per ogni client"""
+
+    def frames(self, addresses, wire_format):
+        self._cache.clear()
+        return super().frames(addresses, wire_format)
+
+
+def make_message(broadcaster, index, value):
+    """PreparedMessage numerico per /bench/<index>, come quelli del bridge"""
+    address = f'/bench/{index}'
+    text = json.dumps({'type': 'udp_message', 'message': {
+        'timestamp': '12:00:00.000', 'source_ip': SOURCE[0], 'source_port': SOURCE[1],
+        'data_type': 'osc', 'content': f'{address} {value}', 'size': 32}})
+    return prepare_message(text, broadcaster.addresses, SOURCE,
+                           pack_numeric(32, address, [value]), time.time())
+
+
+def state_size(frame):
+    """Indirizzi contenuti in un frame di stato, None per gli altri frame"""
+    if isinstance(frame, bytes):
+        if frame[0] == FRAME_BATCH:
+            return BATCH_HEADER.unpack_from(frame)[1]
+        return None
+    data = json.loads(frame)
+    if data['type'] in ('snapshot', 'history'):
+        return len(data['messages'])
+    return None
+
+
+async def client(url, storm_start, histogram, received):
+    """Client che si ferma al primo frame di stato"""
+    async with websockets.connect(url, max_queue=None) as websocket:
+        async for frame in websocket:
+            size = state_size(frame)
+            if size is not None:
+                histogram.record(time.perf_counter_ns() - storm_start)
+                received.append(size)
+                return
+
+
+async def live_traffic(broadcaster, history, args, stop):
+    """Messaggi dal vivo su indirizzi a caso durante la raffica"""
+    rng = random.Random(1)
+    while not stop.is_set():
+        message = make_message(broadcaster, rng.randrange(args.addresses), rng.random())
+        history.append(message.text)
+        broadcaster.publish(message, SOURCE)
+        await asyncio.sleep(1.0 / args.rate)
+
+
+async def run(variant, args):
+    snapshot = {'cronologia': None, 'per client': UncachedSnapshot(),
+                'in cache': SnapshotTable()}[variant]
+    broadcaster = Broadcaster(max_queue=4096, snapshot=snapshot)
+    history = collections.deque(maxlen=HISTORY_REPLAY)
+    join_ns = 0
+
+    async def handler(websocket, path):
+        nonlocal join_ns
+        start = time.perf_counter_ns()
+        session = broadcaster.add(websocket, wire_format=wire_format_from_request(
+            path, websocket.subprotocol), batch=batch_from_path(path))
+        if snapshot is None:
+            recent = list(history)
+            session.offer('{"type": "history", "messages": [' + ', '.join(recent) + ']}')
+        join_ns += time.perf_counter_ns() - start
+        try:
+            await websocket.wait_closed()
+        finally:
+            await broadcaster.remove(websocket)
+
+    # Stato iniziale: tutti gli indirizzi pubblicati una volta
+    for index in range(args.addresses):
+        message = make_message(broadcaster, index, float(index))
+        history.append(message.text)
+        broadcaster.publish(message, SOURCE)
+
+    histogram = LatencyHistogram('stato')
+    received = []
+    url = f'ws://127.0.0.1:{PORT}/'
+    if args.format == FORMAT_BINARY:
+        url += '?format=binary'
+    stop = asyncio.Event()
+    async with websockets.serve(handler, '127.0.0.1', PORT, max_queue=None,
+                                backlog=args.clients):
+        traffic = asyncio.ensure_future(live_traffic(broadcaster, history, args, stop))
+        cpu = time.process_time()
+        for _ in range(args.rounds):
+            storm_start = time.perf_counter_ns()
+            await asyncio.gather(*(client(url, storm_start, histogram, received)
+                                   for _ in range(args.clients)))
+            while len(broadcaster):
+                await asyncio.sleep(0.01)
+        cpu = time.process_time() - cpu
+        stop.set()
+        await traffic
+    builds = snapshot.builds if snapshot is not None else len(received)
+    return histogram, received, builds, join_ns, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark delle riconnessioni in massa')
+    parser.add_argument('--clients', type=int, default=200,
+                        help='Client che si ricollegano insieme (default: 200)')
+    parser.add_argument('--addresses', type=int, default=2000,
+                        help='Indirizzi già pubblicati (default: 2000)')
+    parser.add_argument('--rate', type=float, default=200.0,
+                        help='Messaggi al secondo dal vivo durante la raffica (default: 200)')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='Raffiche di connessioni per variante (default: 3)')
+    parser.add_argument('--format', choices=('json', 'binary'), default='binary',
+                        help='Formato dei client (default: binary, come la pagina web)')
+    args = parser.parse_args()
+
+    print(f"{args.rounds} raffiche da {args.clients} client {args.format}, "
+          f"{args.addresses} indirizzi, {args.rate:g} messaggi/s dal vivo")
+    print(f"{'variante':<12}{'p50 ms':>9}{'max ms':>9}{'indirizzi':>11}"
+          f"{'costruzioni':>13}{'join ms':>9}{'CPU s':>8}")
+    for variant in ('cronologia', 'per client', 'in cache'):
+        histogram, received, builds, join_ns, cpu = asyncio.run(run(variant, args))
+        print(f"{variant:<12}{histogram.percentile(50) / 1e6:>9.1f}{histogram.max / 1e6:>9.1f}"
+              f"{min(received):>11}{builds:>13}{join_ns / 1e6:>9.1f}{cpu:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
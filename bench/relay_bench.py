@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark della ritrasmissione (relay.py)
+Lotti di datagrammi OSC, come li restituisce BatchReceiver (memoryview su
+buffer riusati), inoltrati a N destinazioni su loopback più un gruppo
+multicast. Confronta l'inoltro ingenuo (copia in bytes e sendto() con il
+nome dell'host) con Relay, anche con filtro e limite per destinazione.
+Per ogni variante: ns per datagramma e destinazione (solo l'invio) e
+datagrammi consegnati a ogni ricevitore.
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from relay import Relay, RelayTarget
+from udp_socket import SocketOptions, create_udp_socket
+
+BASE_PORT = 10400
+GROUP = '239.1.2.3'
+
+
+def osc_packet(address, value):
+    data = address.encode('utf-8') + b'\0'
+    data += b'\0' * (-len(data) % 4)
+    return data + b',f\0\0' + struct.pack('>f', value)
+
+
+def make_batch(size, addresses):
+    """Lotto di memoryview su buffer preallocati, come BatchReceiver"""
+    batch = []
+    for index in range(size):
+        buffer = bytearray(4096)
+        packet = osc_packet(f'/bench/{index % addresses}', float(index))
+        buffer[:len(packet)] = packet
+        batch.append((memoryview(buffer)[:len(packet)], ('127.0.0.1', 9999)))
+    return batch
+
+
+def drain(sinks):
+    counts = []
+    for sink in sinks:
+        count = 0
+        while True:
+            try:
+                sink.recv(4096, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            count += 1
+        counts.append(count)
+    return counts
+
+
+class NaiveRelay:
+    """Inoltro senza il modulo: copia del datagramma e sendto() con il nome"""
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+    def send_batch(self, batch):
+        for data, _ in batch:
+            payload = bytes(data)
+            for host, port in self.targets:
+                self.sock.sendto(payload, (host, port))
+
+    def close(self):
+        self.sock.close()
+
+
+def run(name, relay, sinks, batch, batches):
+    drain(sinks)
+    delivered = [0] * len(sinks)
+    elapsed = 0
+    for _ in range(batches):
+        start = time.perf_counter_ns()
+        relay.send_batch(batch)
+        elapsed += time.perf_counter_ns() - start
+        # I ricevitori si svuotano fuori dalla misura, senza perdite nel kernel
+        for index, count in enumerate(drain(sinks)):
+            delivered[index] += count
+    relay.close()
+    return name, elapsed, delivered
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark della ritrasmissione')
+    parser.add_argument('--targets', type=int, default=4,
+                        help='Destinazioni unicast su loopback (default: 4)')
+    parser.add_argument('--batch', type=int, default=64,
+                        help='Datagrammi per lotto (default: 64)')
+    parser.add_argument('--batches', type=int, default=500,
+                        help='Lotti per variante (default: 500)')
+    parser.add_argument('--addresses', type=int, default=16,
+                        help='Indirizzi OSC distinti (default: 16)')
+    args = parser.parse_args()
+
+    ports = [BASE_PORT + index for index in range(args.targets)]
+    sinks = [create_udp_socket(port, '127.0.0.1', SocketOptions(rcvbuf=4 * 1024 * 1024))[0]
+             for port in ports]
+    group_port = BASE_PORT + args.targets
+    sinks.append(create_udp_socket(group_port, '0.0.0.0',
+                                   SocketOptions(rcvbuf=4 * 1024 * 1024, multicast=GROUP))[0])
+    labels = [f'localhost:{port}' for port in ports] + [f'{GROUP}:{group_port}']
+    batch = make_batch(args.batch, args.addresses)
+    sent = args.batch * args.batches
+
+    def targets(rate=0.0):
+        return ([RelayTarget('localhost', port, rate) for port in ports]
+                + [RelayTarget(GROUP, group_port)])
+
+    variants = [
+        ('ingenuo (copia + nome)', lambda: NaiveRelay(
+            [('localhost', port) for port in ports] + [(GROUP, group_port)])),
+        ('Relay', lambda: Relay(targets())),
+        ('Relay + filtro metà', lambda: Relay(
+            targets(), patterns=[f'/bench/{index}' for index in range(0, args.addresses, 2)])),
+        ('Relay + limite 1000/s', lambda: Relay(targets(rate=1000.0))),
+    ]
+    print(f"{sent} datagrammi in lotti da {args.batch}, {args.targets} destinazioni unicast "
+          f"+ il gruppo {GROUP}")
+    print(f"{'variante':<24}{'ns/dgr/dest':>12}  consegnati per destinazione")
+    for variant, factory in variants:
+        name, elapsed, delivered = run(variant, factory(), sinks, batch, args.batches)
+        per_send = elapsed / (sent * len(sinks))
+        print(f"{name:<24}{per_send:>12.0f}  " + ', '.join(str(count) for count in delivered))
+    print("Destinazioni: " + ", ".join(labels))
+    for sink in sinks:
+        sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark di scalabilità della ricezione multi-processo (SO_REUSEPORT)
+Più mittenti su loopback, 1..N worker che decodificano e pubblicano
+i frame JSON verso un unico processo broadcaster
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from udp_loadgen import sender
+from udp_websocket_server import build_udp_message
+from workers import WorkerPool
+
+
+def encode_quiet(batch, received_ns):
+    """Stesso lavoro di encode_udp_batch, senza stampa su console"""
+    return [(addr, json.dumps(build_udp_message(data, addr, '00:00:00.000')), b'')
+            for data, addr in batch]
+
+
+async def run_pool(workers, port, senders, count, size, rate):
+    loop = asyncio.get_running_loop()
+    pool = WorkerPool(workers, port, '127.0.0.1', encode_quiet)
+    pool.start()
+    received = 0
+
+    def on_frames(frames):
+        nonlocal received
+        received += len(frames)
+
+    pool.attach(loop, on_frames)
+    await asyncio.sleep(0.3)
+
+    # Ogni mittente ha la sua porta sorgente: il kernel lo assegna a un worker
+    procs = [
+        multiprocessing.Process(target=sender, args=(port, count, size, rate))
+        for _ in range(senders)
+    ]
+    start = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    while any(proc.is_alive() for proc in procs):
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    last = -1
+    while last != received:
+        last = received
+        await asyncio.sleep(0.3)
+    pool.stop()
+
+    sent = senders * count
+    return {
+        'workers': workers,
+        'sent': sent,
+        'received': received,
+        'drop_rate': 1.0 - received / sent if sent else 0.0,
+        'messages_per_s': received / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SO_REUSEPORT multi-worker')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('-p', '--port', type=int, default=10910)
+    parser.add_argument('--senders', type=int, default=4)
+    parser.add_argument('--count', type=int, default=20000,
+                        help='Pacchetti per mittente (default: 20000)')
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Pacchetti/s per mittente (0 = massima velocità)')
+    args = parser.parse_args()
+
+    print(f"CPU disponibili: {os.cpu_count()}")
+    for workers in args.workers:
+        result = asyncio.run(run_pool(workers, args.port, args.senders,
+                                      args.count, args.size, args.rate))
+        print(f"{result['workers']} worker: {result['received']}/{result['sent']} "
+              f"messaggi, {result['messages_per_s']:.0f} msg/s, "
+              f"drop {result['drop_rate'] * 100:.2f}%")
+
+
+if __name__ == "__main__":
+    main()
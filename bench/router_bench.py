@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Benchmark del router degli indirizzi OSC
+10k indirizzi e 1k sottoscrizioni con pattern misti: costo per messaggio
+della scansione di tutti i pattern, del trie senza cache e della ricerca
+in cache; dispatcher di python-osc contro quello con il router; costo di
+una sottoscrizione a cache piena e del fan-out verso client filtrati
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pythonosc import dispatcher
+
+from broadcaster import Broadcaster
+from osc_router import AddressRouter, RouterDispatcherMixin, compile_pattern
+from wire_format import PreparedMessage
+
+GROUPS = ('mix', 'eq', 'fx', 'sensor', 'fader', 'knob', 'meter', 'send', 'pan', 'aux')
+PARAMS = ('x', 'y', 'z', 'rms', 'peak', 'gain', 'freq', 'q', 'level', 'mute')
+
+
+class RoutedDispatcher(RouterDispatcherMixin, dispatcher.Dispatcher):
+    """Dispatcher di python-osc con il router"""
+
+
+class FakeSession:
+    """Sessione minima: conta i messaggi accodati"""
+
+    def __init__(self, index):
+        self.websocket = index
+        self.subscriptions = set()
+        self.offered = 0
+
+    def offer(self, frame, key=None, received_ns=None):
+        self.offered += 1
+        return True
+
+
+def make_addresses(count):
+    """Indirizzi /deviceN/gruppo/parametro"""
+    per_device = len(GROUPS) * len(PARAMS)
+    return [f'/device{device}/{group}/{param}'
+            for device in range((count + per_device - 1) // per_device)
+            for group in GROUPS for param in PARAMS][:count]
+
+
+def make_patterns(count, addresses, rng):
+    """Sottoscrizioni miste: letterali, *, ?, [..], {..} e //"""
+    devices = len(addresses) // (len(GROUPS) * len(PARAMS)) or 1
+    patterns = set()
+    while len(patterns) < count:
+        device = rng.randrange(devices)
+        group = rng.choice(GROUPS)
+        param = rng.choice(PARAMS)
+        kind = rng.randrange(6)
+        if kind == 0:
+            patterns.add(rng.choice(addresses))
+        elif kind == 1:
+            patterns.add(f'/device{device}/{group}/*')
+        elif kind == 2:
+            patterns.add(f'/device{device}/*/{param}')
+        elif kind == 3:
+            other = rng.choice(PARAMS)
+            patterns.add(f'/device{device}/{group}/{{{param},{other}}}')
+        elif kind == 4:
+            patterns.add(f'/device{device // 10}[0-4]/{group}/{param[:-1]}?')
+        else:
+            patterns.add(f'/device{device}//{param}')
+    return sorted(patterns)
+
+
+def per_message_us(function, addresses, repeat=3):
+    """Miglior tempo medio per indirizzo su `repeat` passate, in µs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for address in addresses:
+            function(address)
+        best = min(best, time.perf_counter() - start)
+    return best / len(addresses) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark router indirizzi OSC')
+    parser.add_argument('--addresses', type=int, default=10000,
+                        help='Indirizzi distinti (default: 10000)')
+    parser.add_argument('--subscriptions', type=int, default=1000,
+                        help='Pattern sottoscritti (default: 1000)')
+    parser.add_argument('--messages', type=int, default=20000,
+                        help='Messaggi per misura (default: 20000)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    addresses = make_addresses(args.addresses)
+    patterns = make_patterns(args.subscriptions, addresses, rng)
+    stream = [rng.choice(addresses) for _ in range(args.messages)]
+    print(f"{len(addresses)} indirizzi, {len(patterns)} pattern, {len(stream)} messaggi")
+
+    # Un destinatario per pattern, come 1k client con un filtro ciascuno
+    router = AddressRouter()
+    start = time.perf_counter()
+    for index, pattern in enumerate(patterns):
+        router.add(pattern, index)
+    print(f"Compilazione dei pattern: {(time.perf_counter() - start) * 1e3:.1f} ms")
+    regexes = [compile_pattern(pattern).fullmatch for pattern in patterns]
+
+    def scan(address):
+        return [index for index, fullmatch in enumerate(regexes) if fullmatch(address)]
+
+    # Correttezza: il trie trova gli stessi pattern della scansione completa
+    for address in stream[:500]:
+        assert sorted(router.match(address)) == scan(address), address
+    matched = sum(len(router.match(address)) for address in stream) / len(stream)
+
+    results = [
+        ('scansione di tutti i pattern', per_message_us(scan, stream, 1)),
+        ('trie senza cache', per_message_us(router.matching_patterns, stream)),
+        ('router con cache', per_message_us(router.match, stream)),
+    ]
+
+    classic = dispatcher.Dispatcher()
+    routed = RoutedDispatcher()
+    for pattern in patterns:
+        classic.map(pattern, print)
+        routed.map(pattern, print)
+    sample = stream[:max(1, len(stream) // 10)]
+    results.append(('python-osc Dispatcher',
+                    per_message_us(lambda a: list(classic.handlers_for_address(a)), sample, 1)))
+    results.append(('RoutedDispatcher',
+                    per_message_us(routed.handlers_for_address, stream)))
+
+    print(f"Destinatari medi per messaggio: {matched:.2f}")
+    print(f"{'smistamento':<32}{'µs/messaggio':>14}")
+    for name, value in results:
+        print(f"{name:<32}{value:>14.2f}")
+
+    # Sottoscrizione con tutti gli indirizzi in cache: aggiorna solo le sue voci
+    for address in addresses:
+        router.match(address)
+    timings = []
+    for index in range(100):
+        pattern = f'/device{index}/*/rms'
+        start = time.perf_counter()
+        router.add(pattern, 'nuovo')
+        router.remove(pattern, 'nuovo')
+        timings.append(time.perf_counter() - start)
+    print(f"subscribe + unsubscribe con {router.cached} indirizzi in cache: "
+          f"{sorted(timings)[len(timings) // 2] * 1e3:.2f} ms")
+
+    # Fan-out: 1k client filtrati, uno per pattern
+    broadcaster = Broadcaster()
+    sessions = []
+    for index, pattern in enumerate(patterns):
+        session = FakeSession(index)
+        broadcaster.sessions[index] = session
+        broadcaster.subscribe(session, [pattern])
+        sessions.append(session)
+    messages = [PreparedMessage('{}', address) for address in stream]
+    for message in messages:
+        broadcaster.publish(message)
+    start = time.perf_counter()
+    for message in messages:
+        broadcaster.publish(message)
+    elapsed = time.perf_counter() - start
+    offered = sum(session.offered for session in sessions) / 2
+    print(f"publish verso {len(sessions)} client filtrati: "
+          f"{elapsed / len(messages) * 1e6:.2f} µs/messaggio, "
+          f"{offered / len(messages):.2f} client per messaggio")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark di un client WebSocket lento
+Un client con invio rallentato e altri normali: confronta la latenza dei
+client normali tra il vecchio broadcast con asyncio.gather e le code
+per client del Broadcaster
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcaster import POLICIES, Broadcaster
+from metrics import LatencyHistogram
+
+
+class FakeWebSocket:
+    """WebSocket finto: send() impiega `delay` secondi e misura la latenza"""
+
+    def __init__(self, name, delay, histogram):
+        self.remote_address = (name, 0)
+        self.delay = delay
+        self.histogram = histogram
+        self.received = 0
+
+    async def send(self, frame):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            await asyncio.sleep(0)
+        self.received += 1
+        if self.histogram is not None:
+            self.histogram.record_since(frame[1])
+
+    async def close(self, code=1000, reason=''):
+        pass
+
+
+async def run_legacy(clients, count, interval):
+    """Vecchio schema: coda unica, ogni messaggio attende tutti i client"""
+    queue = asyncio.Queue()
+
+    async def producer():
+        for i in range(count):
+            await queue.put((i, time.perf_counter_ns()))
+            await asyncio.sleep(interval)
+        await queue.put(None)
+
+    async def consumer():
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                return
+            await asyncio.gather(*[client.send(frame) for client in clients],
+                                 return_exceptions=True)
+
+    await asyncio.gather(producer(), consumer())
+
+
+async def run_broadcaster(clients, count, interval, policy):
+    """Nuovo schema: ogni client ha la sua coda e il suo task"""
+    broadcaster = Broadcaster(policy, max_queue=64)
+    for client in clients:
+        broadcaster.add(client)
+    for i in range(count):
+        broadcaster.publish((i, time.perf_counter_ns()), key=i % 8)
+        await asyncio.sleep(interval)
+    # Tempo ai client normali per svuotare la coda
+    await asyncio.sleep(0.05)
+    stats = broadcaster.get_stats()
+    for client in clients:
+        await broadcaster.remove(client)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark client WebSocket lento')
+    parser.add_argument('-n', '--count', type=int, default=2000,
+                        help='Messaggi pubblicati (default: 2000)')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='Messaggi al secondo (default: 1000)')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='Client normali (default: 4)')
+    parser.add_argument('--slow-delay', type=float, default=0.01,
+                        help='Secondi per invio del client lento (default: 0.01)')
+    args = parser.parse_args()
+    interval = 1.0 / args.rate
+
+    def make_clients(histogram):
+        clients = [FakeWebSocket(f'normale{i}', 0, histogram) for i in range(args.clients)]
+        clients.append(FakeWebSocket('lento', args.slow_delay, None))
+        return clients
+
+    histogram = LatencyHistogram('gather')
+    clients = make_clients(histogram)
+    start = time.perf_counter()
+    asyncio.run(run_legacy(clients, args.count, interval))
+    elapsed = time.perf_counter() - start
+    print(f"{histogram.format_summary()}  durata={elapsed:.2f}s")
+
+    for policy in POLICIES:
+        histogram = LatencyHistogram(policy)
+        clients = make_clients(histogram)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = asyncio.run(run_broadcaster(clients, args.count, interval, policy))
+        elapsed = time.perf_counter() - start
+        slow = stats[-1]
+        print(f"{histogram.format_summary()}  durata={elapsed:.2f}s  "
+              f"lento: inviati={clients[-1].received} scartati={slow['dropped']} "
+              f"fusi={slow['conflated']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Generatore di carico UDP su loopback
+Confronta la ricezione classica (un recvfrom per pacchetto) con il motore a lotti
+
+Il costo a buffer pieno si misura su più ripetizioni (mediana), fino alla
+consegna al loop asyncio: recvfrom() in un thread con call_soon_threadsafe
+per pacchetto (il percorso precedente) contro BatchReceiver sul loop. Come
+riferimento anche un ciclo recvfrom() nudo, senza consegna. Con --cpu
+processo e mittenti restano su un core, per risultati ripetibili.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from udp_engine import BatchReceiver
+
+
+def sender(port, count, size, rate):
+    """Invia count datagrammi di size byte (rate=0: alla massima velocità)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = os.urandom(size)
+    target = ('127.0.0.1', port)
+    interval = 1.0 / rate if rate else 0.0
+    next_send = time.perf_counter()
+    for _ in range(count):
+        if interval:
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            sock.sendto(payload, target)
+        except OSError:
+            pass
+    sock.close()
+
+
+def make_socket(port, rcvbuf):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.bind(('127.0.0.1', port))
+    return sock
+
+
+def receive_legacy(sock, stats, stop):
+    """Percorso precedente: thread con recvfrom(4096) bloccante per pacchetto,
+    consegna al loop asyncio con call_soon_threadsafe"""
+    loop = asyncio.new_event_loop()
+
+    def on_message(data):
+        stats['packets'] += 1
+        stats['bytes'] += len(data)
+
+    def reader():
+        sock.settimeout(0.2)
+        while not stop.is_set():
+            try:
+                data, addr = sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            loop.call_soon_threadsafe(on_message, data)
+
+    async def wait_stop():
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        thread.join()
+
+    loop.run_until_complete(wait_stop())
+    loop.close()
+
+
+def receive_batch(sock, stats, stop):
+    """Motore a lotti registrato direttamente sul loop asyncio"""
+    loop = asyncio.new_event_loop()
+    receiver = BatchReceiver(sock)
+
+    def on_batch(batch):
+        for data, addr in batch:
+            stats['packets'] += 1
+            stats['bytes'] += len(data)
+
+    async def wait_stop():
+        receiver.attach(loop, on_batch)
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        receiver.detach(loop)
+
+    loop.run_until_complete(wait_stop())
+    loop.close()
+    stats['avg_batch'] = receiver.get_stats()['avg_batch']
+
+
+def run(mode, port, senders, count, size, rate, rcvbuf):
+    sock = make_socket(port, rcvbuf)
+    stats = {'packets': 0, 'bytes': 0}
+    stop = threading.Event()
+    target = receive_batch if mode == 'batch' else receive_legacy
+    thread = threading.Thread(target=target, args=(sock, stats, stop), daemon=True)
+    thread.start()
+
+    procs = [
+        multiprocessing.Process(target=sender, args=(port, count, size, rate))
+        for _ in range(senders)
+    ]
+    start = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    send_elapsed = time.perf_counter() - start
+
+    # Lascia al ricevitore il tempo di svuotare il buffer del kernel
+    last = -1
+    while last != stats['packets']:
+        last = stats['packets']
+        time.sleep(0.3)
+    stop.set()
+    thread.join()
+    sock.close()
+
+    sent = senders * count
+    received = stats['packets']
+    return {
+        'mode': mode,
+        'sent': sent,
+        'received': received,
+        'drop_rate': 1.0 - received / sent if sent else 0.0,
+        'packets_per_s': received / send_elapsed if send_elapsed else 0.0,
+        'avg_batch': stats.get('avg_batch', 1.0),
+    }
+
+
+def fill_socket(port, count, size):
+    """Socket con il buffer del kernel già pieno di datagrammi"""
+    sock = make_socket(port, 8 << 20)
+    sender(port, count, size, 0)
+    return sock
+
+
+def drain_cost(mode, port, count, size):
+    """Costo per pacchetto (ns) fino alla consegna, con il buffer del kernel già pieno
+
+    Isola il lavoro del ricevitore dalla contesa CPU con i mittenti
+    (rilevante su macchine con pochi core). mode 'recvfrom': solo le
+    letture, senza consegna al loop.
+    """
+    sock = fill_socket(port, count, size)
+    received = 0
+    loop = asyncio.new_event_loop()
+    done = loop.create_future()
+    start = time.perf_counter()
+    end = None
+    if mode == 'recvfrom':
+        sock.setblocking(False)
+        while True:
+            try:
+                sock.recvfrom(4096)
+            except BlockingIOError:
+                break
+            received += 1
+    elif mode == 'batch':
+        receiver = BatchReceiver(sock)
+
+        def on_batch(batch):
+            nonlocal received, end
+            received += len(batch)
+            end = time.perf_counter()
+            # Lotto incompleto: il buffer del kernel è vuoto
+            if len(batch) < receiver.batch_size and not done.done():
+                done.set_result(None)
+
+        receiver.attach(loop, on_batch)
+        # Se l'ultimo lotto è completo nessun risveglio lo segnala: conta `end`
+        loop.call_later(2.0, lambda: done.done() or done.set_result(None))
+        loop.run_until_complete(done)
+        receiver.detach(loop)
+    else:
+        def on_message(data):
+            nonlocal received
+            received += 1
+
+        def reader():
+            sock.setblocking(False)
+            while True:
+                try:
+                    data, addr = sock.recvfrom(4096)
+                except BlockingIOError:
+                    break
+                loop.call_soon_threadsafe(on_message, data)
+            loop.call_soon_threadsafe(done.set_result, None)
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        loop.run_until_complete(done)
+        thread.join()
+    elapsed = (end or time.perf_counter()) - start
+    loop.close()
+    sock.close()
+    return received, elapsed / received * 1e9 if received else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generatore di carico UDP su loopback')
+    parser.add_argument('--mode', choices=['legacy', 'batch', 'both'], default='both')
+    parser.add_argument('-p', '--port', type=int, default=10900)
+    parser.add_argument('--senders', type=int, default=2)
+    parser.add_argument('--count', type=int, default=100000,
+                        help='Pacchetti per mittente (default: 100000)')
+    parser.add_argument('--size', type=int, default=64, help='Byte per pacchetto')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Pacchetti/s per mittente (0 = massima velocità)')
+    parser.add_argument('--rcvbuf', type=int, default=0,
+                        help='SO_RCVBUF da impostare (0 = default del kernel)')
+    parser.add_argument('--repeat', type=int, default=7,
+                        help='Ripetizioni della misura a buffer pieno (default: 7, mediana)')
+    parser.add_argument('--cpu', type=int, default=None, metavar='N',
+                        help='Blocca processo e mittenti sul core N')
+    args = parser.parse_args()
+    if args.cpu is not None:
+        # Ereditato dai processi mittenti
+        os.sched_setaffinity(0, {args.cpu})
+
+    modes = ['legacy', 'batch'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        result = run(mode, args.port, args.senders, args.count, args.size,
+                     args.rate, args.rcvbuf)
+        print(f"{result['mode']:>6}: {result['received']}/{result['sent']} ricevuti, "
+              f"{result['packets_per_s']:.0f} pacchetti/s, "
+              f"drop {result['drop_rate'] * 100:.2f}%, "
+              f"lotto medio {result['avg_batch']:.1f}")
+
+    # Buffer pieno: modalità alternate a ogni ripetizione, poi la mediana
+    drain_modes = ['recvfrom'] + modes
+    costs = {mode: [] for mode in drain_modes}
+    received = {}
+    for _ in range(args.repeat):
+        for mode in drain_modes:
+            received[mode], ns_per_packet = drain_cost(mode, args.port, 20000, args.size)
+            costs[mode].append(ns_per_packet)
+    print(f"\nA buffer pieno, fino alla consegna al loop ({args.repeat} ripetizioni)")
+    print(f"{'ricezione':<31}{'mediana ns':>11}{'min':>7}{'max':>7}{'pacchetti':>11}")
+    labels = {'recvfrom': 'recvfrom() nudo (rif.)', 'legacy': 'thread + call_soon_threadsafe',
+              'batch': 'BatchReceiver sul loop'}
+    for mode in drain_modes:
+        values = costs[mode]
+        print(f"{labels[mode]:<31}{statistics.median(values):>11.0f}{min(values):>7.0f}"
+              f"{max(values):>7.0f}{received[mode]:>11}")
+
+
+if __name__ == "__main__":
+    main()
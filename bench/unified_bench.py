@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Benchmark: server separati contro server unificato
+Stesso traffico verso le due architetture: app.py (OSC con un thread per
+datagramma + Flask) insieme a udp_websocket_server.py, oppure il solo
+unified_server.py. Metà dei mittenti invia OSC, l'altra metà testo UDP
+grezzo, mentre alcune dashboard interrogano /api/osc-data?since con
+ETag. Per ogni architettura: consegne e latenza, CPU, cambi di contesto
+(getrusage dei processi figli, thread compresi), picco di memoria
+residente e di thread sommati su tutti i processi del server.
+
+    python bench/unified_bench.py --rate 1000 --duration 5 --dashboards 10
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from e2e_bench import Collector, HistoryPoller, Target, WebSocketClient, sender_main
+
+OSC_PORT = 10000
+UDP_PORT = 10100
+
+UNIFIED_CONFIG = f"""
+[http]
+port = 8765
+[osc]
+port = {OSC_PORT}
+[udp]
+port = {UDP_PORT}
+[log]
+level = quiet
+stats_interval = 0
+"""
+
+
+def architectures(config_path):
+    """Processi di ogni architettura, porta dell'API HTTP e chi osserva l'OSC"""
+    return {
+        'separati': {
+            'targets': [
+                ('app', {'command': ['app.py', '-q'], 'sink': 'history',
+                         'ready': 'Starting web server'}),
+                ('bridge', {'command': ['udp_websocket_server.py', '-p', str(UDP_PORT), '-q'],
+                            'sink': 'websocket', 'ready': 'Server WebSocket avviato'}),
+            ],
+            # app.py non inoltra l'OSC al WebSocket: si legge dalla cronologia
+            'osc_sink': 'history',
+            'http': 'http://127.0.0.1:5000',
+        },
+        'unificato': {
+            'targets': [
+                ('unified', {'command': ['unified_server.py', '-c', config_path, '-q'],
+                             'sink': 'websocket', 'ready': 'Server WebSocket su'}),
+            ],
+            'osc_sink': 'websocket',
+            'http': 'http://127.0.0.1:8765',
+        },
+    }
+
+
+class ProcessSampler:
+    """Somma RSS e thread dei processi del server, tenendo il picco"""
+
+    def __init__(self, pids, interval=0.05):
+        self.pids = pids
+        self.interval = interval
+        self.peak_rss_kb = 0
+        self.peak_threads = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _read(self, pid):
+        rss = threads = 0
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss = int(line.split()[1])
+                    elif line.startswith('Threads:'):
+                        threads = int(line.split()[1])
+        except OSError:
+            pass
+        return rss, threads
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            samples = [self._read(pid) for pid in self.pids]
+            self.peak_rss_kb = max(self.peak_rss_kb, sum(rss for rss, _ in samples))
+            self.peak_threads = max(self.peak_threads, sum(threads for _, threads in samples))
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join(timeout=2)
+
+
+class Dashboards:
+    """Dashboard che interrogano /api/osc-data?since=<seq> con If-None-Match"""
+
+    def __init__(self, base_url, count, poll_hz):
+        self.base_url = base_url
+        self.count = count
+        self.interval = 1.0 / poll_hz
+        self.responses = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(count)]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self):
+        since = 0
+        etag = None
+        while not self.stopping.wait(self.interval):
+            request = urllib.request.Request(f'{self.base_url}/api/osc-data?since={since}',
+                                             headers={'If-None-Match': etag} if etag else {})
+            try:
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    etag = response.headers.get('ETag')
+                    since = json.loads(response.read())['last_seq']
+                    status = 200
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except (OSError, ValueError):
+                status = None
+            with self.lock:
+                if status == 304:
+                    self.not_modified += 1
+                    self.responses += 1
+                elif status == 200:
+                    self.responses += 1
+                else:
+                    self.errors += 1
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join(timeout=6)
+
+
+def children_usage():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_nvcsw + usage.ru_nivcsw
+
+
+def run_architecture(name, spec, args):
+    collector = Collector()
+    result = {'architecture': name}
+    start_cpu, start_switches = children_usage()
+    targets = [Target(target_name, target_spec, collector)
+               for target_name, target_spec in spec['targets']]
+    observers = []
+    sampler = dashboards = None
+    try:
+        for target in targets:
+            if not target.ready.wait(15):
+                raise RuntimeError(f'avvio di {target.name} non riuscito: '
+                                   + ' | '.join(target.output_tail[-5:]))
+        observers.append(WebSocketClient(collector))
+        if not observers[0].connected.wait(5):
+            raise RuntimeError('connessione WebSocket non riuscita')
+        if spec['osc_sink'] == 'history':
+            observers.append(HistoryPoller('streamtorasp_osc', collector))
+        sampler = ProcessSampler([target.process.pid for target in targets])
+        time.sleep(0.5)
+
+        dashboards = Dashboards(spec['http'], args.dashboards, args.poll_hz)
+        # I mittenti sono figli anche loro: il loro consumo va escluso
+        before_cpu, before_switches = children_usage()
+        counters = [multiprocessing.Value('q', 0) for _ in range(args.senders * 2)]
+        senders = [
+            multiprocessing.Process(target=sender_main, args=(
+                OSC_PORT if index % 2 == 0 else UDP_PORT, args.rate, args.duration,
+                ('osc',) if index % 2 == 0 else ('text',), args.cardinality, args.size,
+                counter))
+            for index, counter in enumerate(counters)
+        ]
+        started = time.perf_counter()
+        for process in senders:
+            process.start()
+        for process in senders:
+            process.join()
+        elapsed = time.perf_counter() - started
+        after_cpu, after_switches = children_usage()
+        sender_cpu = after_cpu - before_cpu
+        sender_switches = after_switches - before_switches
+
+        while time.monotonic() - collector.last_delivery < args.settle:
+            time.sleep(0.1)
+        dashboards.stop()
+        sent = sum(counter.value for counter in counters)
+        result.update({
+            'sent': sent,
+            'delivered': collector.delivered,
+            'drop_rate': max(0.0, 1.0 - collector.delivered / sent) if sent else 0.0,
+            'sent_per_s': sent / elapsed if elapsed else 0.0,
+            'latency': collector.histogram.summary(),
+            'http_responses': dashboards.responses,
+            'http_not_modified': dashboards.not_modified,
+            'http_errors': dashboards.errors,
+        })
+    except RuntimeError as e:
+        result['error'] = str(e)
+        sender_cpu = sender_switches = 0
+    finally:
+        if dashboards is not None:
+            dashboards.stop()
+        for observer in observers:
+            observer.stop()
+        if sampler is not None:
+            sampler.stop()
+        # Dopo wait() i contatori dei processi terminati (e dei loro
+        # thread) sono in RUSAGE_CHILDREN
+        for target in targets:
+            target.stop()
+    end_cpu, end_switches = children_usage()
+    result.update({
+        'cpu_s': end_cpu - start_cpu - sender_cpu,
+        'context_switches': end_switches - start_switches - sender_switches,
+        'peak_rss_mb': sampler.peak_rss_kb / 1024 if sampler else 0.0,
+        'peak_threads': sampler.peak_threads if sampler else 0,
+        'processes': len(targets),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark server separati contro unificato')
+    parser.add_argument('--senders', type=int, default=1,
+                        help='Mittenti per tipo, OSC e testo UDP (default: 1)')
+    parser.add_argument('--rate', type=float, default=500.0,
+                        help='Messaggi/s per mittente (default: 500)')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='Secondi di invio (default: 5)')
+    parser.add_argument('--dashboards', type=int, default=10,
+                        help='Client HTTP che interrogano /api/osc-data (default: 10)')
+    parser.add_argument('--poll-hz', type=float, default=2.0,
+                        help='Interrogazioni al secondo per dashboard (default: 2)')
+    parser.add_argument('--cardinality', type=int, default=16,
+                        help='Indirizzi distinti (default: 16)')
+    parser.add_argument('--size', type=int, default=64,
+                        help='Dimensione indicativa dei payload in byte (default: 64)')
+    parser.add_argument('--settle', type=float, default=1.0,
+                        help='Secondi senza consegne per considerare finito (default: 1)')
+    parser.add_argument('--output', default=None, help='File JSON dei risultati')
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.ini', delete=False) as f:
+        f.write(UNIFIED_CONFIG)
+        config_path = f.name
+    results = []
+    try:
+        print(f"{'architettura':<13}{'proc':>5}{'inviati':>9}{'consegnati':>11}{'p50 us':>9}"
+              f"{'p99 us':>9}{'CPU s':>8}{'ctx sw':>9}{'RSS MB':>8}{'thread':>8}{'HTTP':>7}")
+        for name, spec in architectures(config_path).items():
+            result = run_architecture(name, spec, args)
+            results.append(result)
+            if 'error' in result:
+                print(f"{name:<13} errore: {result['error']}")
+                continue
+            latency = result['latency']
+            print(f"{name:<13}{result['processes']:>5}{result['sent']:>9}"
+                  f"{result['delivered']:>11}{latency.get('p50_us', 0):>9.0f}"
+                  f"{latency.get('p99_us', 0):>9.0f}{result['cpu_s']:>8.2f}"
+                  f"{result['context_switches']:>9}{result['peak_rss_mb']:>8.1f}"
+                  f"{result['peak_threads']:>8}{result['http_responses']:>7}")
+    finally:
+        os.unlink(config_path)
+    print("OSC letto dalla cronologia condivisa con i server separati (app.py non lo "
+          "inoltra al WebSocket), dal WebSocket con il server unificato")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+        print(f"Risultati scritti in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark del formato dei frame WebSocket
+Byte per messaggio e CPU di codifica: JSON testuale contro frame binari
+float32, e serializzazione per ogni client contro una sola per messaggio
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from udp_websocket_server import build_udp_message
+from wire_format import AddressTable, extract_numeric, prepare_message
+
+SOURCE = ('192.168.1.50', 9000)
+TIMESTAMP = '00:00:00.000'
+
+
+def osc_floats(address, count):
+    """Datagramma OSC con `count` float"""
+    builder = OscMessageBuilder(address)
+    for i in range(count):
+        builder.add_arg(i / count, 'f')
+    return builder.build().dgram
+
+
+def encode_json(data):
+    """Codifica attuale: dizionario annidato serializzato in JSON"""
+    return json.dumps({'type': 'udp_message',
+                       'message': build_udp_message(data, SOURCE, TIMESTAMP)})
+
+
+def encode_binary(data, addresses):
+    """Codifica binaria: estrazione dei float e frame pronto"""
+    text = encode_json(data)
+    message = prepare_message(text, addresses, SOURCE, extract_numeric(data), 0.0)
+    return message.binary() if message.is_numeric else text
+
+
+def measure(encode, payloads, clients, once):
+    """Secondi di CPU per messaggio, codificando una volta o per ogni client"""
+    start = time.process_time()
+    for data in payloads:
+        if once:
+            encode(data)
+        else:
+            for _ in range(clients):
+                encode(data)
+    return (time.process_time() - start) / len(payloads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark formato frame WebSocket')
+    parser.add_argument('-n', '--count', type=int, default=20000,
+                        help='Messaggi per caso (default: 20000)')
+    parser.add_argument('--clients', type=int, default=10,
+                        help='Client connessi (default: 10)')
+    args = parser.parse_args()
+
+    cases = [
+        ('OSC 1 float', osc_floats('/fader1', 1)),
+        ('OSC 4 float', osc_floats('/sensor/xyzw', 4)),
+        ('OSC 32 float', osc_floats('/spectrum', 32)),
+        ('testo "0.25 0.5"', b'0.25 0.5'),
+    ]
+    print(f"{'payload':<20}{'JSON B':>8}{'bin B':>8}"
+          f"{'JSON/cl us':>12}{'JSON 1x us':>12}{'bin 1x us':>11}")
+    for name, data in cases:
+        addresses = AddressTable()
+        payloads = [data] * args.count
+        json_bytes = len(encode_json(data).encode('utf-8'))
+        binary_bytes = len(encode_binary(data, addresses))
+        per_client = measure(encode_json, payloads, args.clients, once=False)
+        json_once = measure(encode_json, payloads, args.clients, once=True)
+        binary_once = measure(lambda d: encode_binary(d, addresses),
+                              payloads, args.clients, once=True)
+        print(f"{name:<20}{json_bytes:>8}{binary_bytes:>8}"
+              f"{per_client * 1e6:>12.2f}{json_once * 1e6:>12.2f}{binary_once * 1e6:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark dei lotti WebSocket (frame_batcher.py)
+Un Broadcaster con un vero server WebSocket su loopback e N client che
+decodificano ogni frame come la pagina web (JSON, lotti compresi). Lo
+stesso flusso di messaggi (raffiche a frequenza fissa, più una fase a
+traffico rado) viene inviato senza lotti e con i lotti: per ogni variante
+frame WebSocket ricevuti, messaggi per frame, CPU del processo (server e
+client) e latenza dalla pubblicazione alla ricezione nel client.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcaster import Broadcaster
+from frame_batcher import FrameBatcher
+from metrics import LatencyHistogram
+from wire_format import batch_from_path
+
+PORT = 18765
+
+
+def message_json(index):
+    """Frame come quelli del bridge, con l'istante di pubblicazione"""
+    return json.dumps({'type': 'udp_message', 'message': {
+        'timestamp': '12:00:00.000', 'source_ip': '127.0.0.1', 'source_port': 9000,
+        'data_type': 'osc', 'content': f'/bench/{index % 16} {index}',
+        'size': 32, 'published_ns': time.perf_counter_ns()}})
+
+
+async def client(url, count, histogram, stats):
+    """Client che decodifica come index2.html finché non ha `count` messaggi"""
+    received = 0
+    async with websockets.connect(url, max_queue=None) as websocket:
+        stats['ready'] += 1
+        async for frame in websocket:
+            stats['frames'] += 1
+            data = json.loads(frame)
+            messages = data['messages'] if data['type'] == 'batch' else [data]
+            now = time.perf_counter_ns()
+            for message in messages:
+                histogram.record(now - message['message']['published_ns'])
+            received += len(messages)
+            if received >= count:
+                return
+
+
+async def run(batcher, args):
+    broadcaster = Broadcaster(max_queue=4096, batcher=batcher)
+
+    async def handler(websocket, path):
+        broadcaster.add(websocket, batch=batch_from_path(path))
+        try:
+            await websocket.wait_closed()
+        finally:
+            await broadcaster.remove(websocket)
+
+    dense = args.bursts * args.burst
+    count = dense + args.sparse
+    histogram = LatencyHistogram('latenza')
+    stats = {'frames': 0, 'ready': 0}
+    async with websockets.serve(handler, '127.0.0.1', PORT, max_queue=None):
+        url = f'ws://127.0.0.1:{PORT}/?batch=1'
+        clients = [asyncio.ensure_future(client(url, count, histogram, stats))
+                   for _ in range(args.clients)]
+        while stats['ready'] < args.clients or len(broadcaster) < args.clients:
+            await asyncio.sleep(0.01)
+
+        cpu = time.process_time()
+        start = time.perf_counter()
+        index = 0
+        # Traffico fitto: raffiche di messaggi a frequenza fissa
+        for _ in range(args.bursts):
+            for _ in range(args.burst):
+                broadcaster.publish(message_json(index))
+                index += 1
+            await asyncio.sleep(1.0 / args.rate)
+        # Traffico rado: un messaggio ogni 50 ms, deve partire subito
+        for _ in range(args.sparse):
+            broadcaster.publish(message_json(index))
+            index += 1
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*clients)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+    return stats['frames'], count * args.clients, cpu, elapsed, histogram
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dei lotti WebSocket')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='Client WebSocket (default: 4)')
+    parser.add_argument('--bursts', type=int, default=500,
+                        help='Raffiche di traffico fitto (default: 500)')
+    parser.add_argument('--burst', type=int, default=8,
+                        help='Messaggi per raffica (default: 8)')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='Raffiche al secondo (default: 1000)')
+    parser.add_argument('--sparse', type=int, default=20,
+                        help='Messaggi della fase a traffico rado (default: 20)')
+    args = parser.parse_args()
+
+    print(f"{args.clients} client, {args.bursts} raffiche da {args.burst} messaggi "
+          f"a {args.rate:g}/s, poi {args.sparse} messaggi radi")
+    print(f"{'variante':<14}{'frame':>9}{'msg/frame':>11}{'CPU s':>8}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, batcher in (('senza lotti', None), ('lotti 2-16 ms', FrameBatcher())):
+        frames, messages, cpu, elapsed, histogram = asyncio.run(run(batcher, args))
+        print(f"{name:<14}{frames:>9}{messages / frames:>11.1f}{cpu:>8.2f}"
+              f"{histogram.percentile(50) / 1e6:>9.2f}{histogram.percentile(99) / 1e6:>9.2f}"
+              f"{histogram.max / 1e6:>9.2f}")
+        if batcher is not None:
+            print(f"  {batcher.format_stats()}")
+
+
+if __name__ == "__main__":
+    main()
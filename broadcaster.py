@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Broadcast WebSocket con coda di invio per ogni client
+Ogni connessione ha la sua coda limitata e il suo task di scrittura:
+un client lento non rallenta gli altri e un errore di invio non ferma
+il broadcast. I client possono sottoscrivere pattern di indirizzi OSC
+e ricevere solo i messaggi corrispondenti, e chiedere i messaggi a lotti
+(frame_batcher.py). Con una SnapshotTable (snapshot.py) ogni client appena
+collegato riceve per primo l'ultimo valore di ogni indirizzo.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs, urlsplit
+
+from frame_batcher import FLUSH_BYTES, FLUSH_COUNT, FLUSH_IDLE, FLUSH_WINDOW
+from osc_router import AddressRouter, compile_pattern
+from wire_format import FORMAT_BINARY, FORMAT_JSON, AddressTable, PreparedMessage
+
+# Politiche per i client che non tengono il passo
+POLICY_DROP_OLDEST = 'drop-oldest'   # scarta i messaggi più vecchi
+POLICY_CONFLATE = 'conflate'         # tiene solo l'ultimo per indirizzo
+POLICY_DISCONNECT = 'disconnect'     # chiude se il ritardo supera max_lag_ms
+POLICIES = (POLICY_DROP_OLDEST, POLICY_CONFLATE, POLICY_DISCONNECT)
+
+DEFAULT_MAX_QUEUE = 256
+DEFAULT_MAX_LAG_MS = 2000
+# Il fan-out si cronometra un publish ogni N: due letture dell'orologio
+# costano quanto l'accodamento stesso
+FANOUT_SAMPLE = 16
+# Pattern sottoscrivibili da un singolo client
+MAX_SUBSCRIPTIONS = 1024
+
+
+class ClientSession:
+    """Coda di invio e contatori di un singolo client WebSocket"""
+
+    def __init__(self, websocket, policy=POLICY_DROP_OLDEST,
+                 max_queue=DEFAULT_MAX_QUEUE, max_lag_ms=DEFAULT_MAX_LAG_MS,
+                 latency_histogram=None, wire_format=FORMAT_JSON, addresses=None,
+                 batcher=None):
+        if policy not in POLICIES:
+            raise ValueError(f"politica sconosciuta: {policy}")
+        self.websocket = websocket
+        self.policy = policy
+        self.wire_format = wire_format
+        # Tabella degli id condivisa; `announced` = id già noti al client
+        self.addresses = addresses
+        self.announced = 0
+        # Pattern OSC sottoscritti (vuoto: il client riceve tutto)
+        self.subscriptions = set()
+        self.max_queue = max_queue
+        self.max_lag_ns = int(max_lag_ms * 1e6)
+        self.latency_histogram = latency_histogram
+        # Lotti (None: un frame per messaggio); finestra corrente e ultimo invio
+        self.batcher = batcher
+        self.window_ns = batcher.min_window_ns if batcher is not None else 0
+        self.last_flush_ns = 0
+        # Messaggi in coda che svegliano il task di scrittura (di più mentre
+        # raccoglie un lotto: lo sveglia la scadenza della finestra)
+        self._wake_at = 1
+
+        # Elementi: (frame, received_ns, enqueued_ns)
+        if policy == POLICY_CONFLATE:
+            self.queue = OrderedDict()
+        else:
+            self.queue = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.closed = False
+
+        # Contatori
+        self.sent = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def offer(self, frame, key=None, received_ns=None):
+        """Accoda un frame senza mai bloccare; False se il client è chiuso"""
+        if self.closed:
+            return False
+        now = time.perf_counter_ns()
+        item = (frame, received_ns or now, now)
+
+        if self.policy == POLICY_CONFLATE and key is not None:
+            if key in self.queue:
+                # Il valore precedente non è ancora partito: si sostituisce
+                del self.queue[key]
+                self.conflated += 1
+            self.queue[key] = item
+            if len(self.queue) > self.max_queue:
+                self.queue.popitem(last=False)
+                self.dropped += 1
+        elif self.policy == POLICY_CONFLATE:
+            # Messaggi senza chiave: ognuno la sua voce
+            self.queue[object()] = item
+            if len(self.queue) > self.max_queue:
+                self.queue.popitem(last=False)
+                self.dropped += 1
+        else:
+            self.queue.append(item)
+            if len(self.queue) > self.max_queue:
+                if self.policy == POLICY_DISCONNECT:
+                    self.disconnect('coda piena')
+                    return False
+                self.queue.popleft()
+                self.dropped += 1
+
+        if self.policy == POLICY_DISCONNECT and self.queue:
+            oldest_enqueued = self.queue[0][2]
+            if now - oldest_enqueued > self.max_lag_ns:
+                self.disconnect('ritardo eccessivo')
+                return False
+
+        if len(self.queue) >= self._wake_at:
+            self._wakeup.set()
+        return True
+
+    def _pop(self):
+        if self.policy == POLICY_CONFLATE:
+            return self.queue.popitem(last=False)[1]
+        return self.queue.popleft()
+
+    async def run(self):
+        """Task di scrittura: invia i frame in coda uno alla volta"""
+        websocket = self.websocket
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                if self.batcher is not None:
+                    await self._send_batch()
+                    continue
+                frame, received_ns, enqueued_ns = self._pop()
+                if type(frame) is PreparedMessage:
+                    frame = await self._select_frame(frame)
+                await websocket.send(frame)
+                now = time.perf_counter_ns()
+                self.sent += 1
+                self.lag_ms = (now - enqueued_ns) / 1e6
+                if self.lag_ms > self.max_lag_ms:
+                    self.max_lag_ms = self.lag_ms
+                if self.latency_histogram is not None:
+                    self.latency_histogram.record(now - received_ns)
+        except Exception:
+            # Connessione chiusa o errore di invio: riguarda solo questo client
+            self.closed = True
+
+    async def _send_batch(self):
+        """Raccoglie i messaggi per la finestra corrente e li invia a lotti"""
+        batcher = self.batcher
+        reason = FLUSH_IDLE
+        now = time.perf_counter_ns()
+        deadline = self.last_flush_ns + self.window_ns
+        if len(self.queue) >= batcher.max_messages:
+            reason = FLUSH_COUNT
+        elif now < deadline:
+            # Traffico fitto: si attende la fine della finestra o N messaggi
+            self._wake_at = batcher.max_messages
+            self._wakeup.clear()
+            timer = asyncio.get_running_loop().call_later((deadline - now) / 1e9,
+                                                         self._wakeup.set)
+            try:
+                await self._wakeup.wait()
+            finally:
+                timer.cancel()
+                self._wake_at = 1
+            if self.closed or not self.queue:
+                return
+            reason = FLUSH_COUNT if len(self.queue) >= batcher.max_messages else FLUSH_WINDOW
+
+        items = [self._pop() for _ in range(min(len(self.queue), batcher.max_messages))]
+        frames = []
+        for frame, _, _ in items:
+            if type(frame) is PreparedMessage:
+                # Gli annunci degli indirizzi partono prima del lotto
+                frame = await self._select_frame(frame)
+            frames.append(frame)
+        packed, split = batcher.pack(frames)
+        for frame in packed:
+            await self.websocket.send(frame)
+
+        now = time.perf_counter_ns()
+        if split:
+            reason = FLUSH_BYTES
+        batcher.flushes[reason] += 1
+        self.window_ns = batcher.adapt(self.window_ns, reason, len(items))
+        self.last_flush_ns = now
+        self.sent += len(items)
+        self.lag_ms = (now - items[0][2]) / 1e6
+        if self.lag_ms > self.max_lag_ms:
+            self.max_lag_ms = self.lag_ms
+        if self.latency_histogram is not None:
+            for _, received_ns, _ in items:
+                self.latency_histogram.record(now - received_ns)
+
+    async def _select_frame(self, message):
+        """Sceglie la codifica già pronta adatta al formato del client"""
+        if self.wire_format != FORMAT_BINARY or not message.has_binary:
+            return message.text
+        if message.address_id >= self.announced:
+            # Indirizzi nuovi per questo client: la tabella parte una volta sola
+            await self.websocket.send(self.addresses.announce(self.announced))
+            self.announced = len(self.addresses)
+        return message.binary()
+
+    def start(self):
+        """Avvia il task di scrittura sul loop corrente"""
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    def disconnect(self, reason):
+        """Chiude la connessione di un client che non tiene il passo"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._wakeup.set()
+        print(f"Client WebSocket {self.websocket.remote_address} disconnesso: {reason}")
+        asyncio.ensure_future(self.websocket.close(1013, reason))
+
+    async def stop(self):
+        """Ferma il task di scrittura"""
+        self.closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def get_stats(self):
+        """Contatori del client"""
+        return {
+            'remote_address': str(self.websocket.remote_address),
+            'policy': self.policy,
+            'format': self.wire_format,
+            'batch_window_ms': self.window_ns / 1e6 if self.batcher is not None else None,
+            'queued': len(self.queue),
+            'subscriptions': len(self.subscriptions),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'conflated': self.conflated,
+            'lag_ms': self.lag_ms,
+            'max_lag_ms': self.max_lag_ms,
+        }
+
+
+class Broadcaster:
+    """Distribuisce i frame a tutte le sessioni senza attendere gli invii"""
+
+    def __init__(self, policy=POLICY_DROP_OLDEST, max_queue=DEFAULT_MAX_QUEUE,
+                 max_lag_ms=DEFAULT_MAX_LAG_MS, latency_histogram=None,
+                 fanout_histogram=None, batcher=None, snapshot=None):
+        self.policy = policy
+        self.max_queue = max_queue
+        self.max_lag_ms = max_lag_ms
+        self.latency_histogram = latency_histogram
+        # Tempo di publish(): accodamento su tutte le sessioni (campionato)
+        self.fanout_histogram = fanout_histogram
+        # Lotti per i client che li chiedono (None: disattivati)
+        self.batcher = batcher
+        # Ultimo valore per indirizzo per i nuovi client (None: nessuno)
+        self.snapshot = snapshot
+        self.published = 0
+        self.addresses = AddressTable()
+        self.sessions = {}
+        # Sessioni senza sottoscrizioni (ricevono tutto) e router per le altre
+        self.unfiltered = {}
+        self.router = AddressRouter()
+        # Contatori dei client già scollegati (le metriche restano monotone)
+        self.closed_sent = 0
+        self.closed_dropped = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self, websocket, policy=None, wire_format=FORMAT_JSON, batch=False):
+        """Registra un client e avvia il suo task di scrittura
+
+        Con batch=True il client riceve i messaggi a lotti, se il server
+        li ha attivati. Lo stato degli indirizzi parte prima di ogni
+        messaggio dal vivo.
+        """
+        session = ClientSession(
+            websocket,
+            policy=policy or self.policy,
+            max_queue=self.max_queue,
+            max_lag_ms=self.max_lag_ms,
+            latency_histogram=self.latency_histogram,
+            wire_format=wire_format,
+            addresses=self.addresses,
+            batcher=self.batcher if batch else None
+        )
+        if self.snapshot is not None:
+            # Frame già pronti, gli stessi per tutti i client che si collegano
+            frames, announced = self.snapshot.frames(self.addresses, wire_format)
+            for frame in frames:
+                session.offer(frame)
+            session.announced = announced
+        self.sessions[websocket] = session
+        self.unfiltered[websocket] = session
+        session.start()
+        return session
+
+    async def remove(self, websocket):
+        """Rimuove un client e ferma il suo task"""
+        session = self.sessions.pop(websocket, None)
+        self.unfiltered.pop(websocket, None)
+        if session is not None:
+            for pattern in session.subscriptions:
+                self.router.remove(pattern, session)
+            self.closed_sent += session.sent
+            self.closed_dropped += session.dropped
+            await session.stop()
+
+    def publish(self, frame, key=None, received_ns=None):
+        """Accoda un frame (testo o PreparedMessage) per i client interessati (non blocca mai)
+
+        key è il mittente: con conflate i client tengono l'ultimo messaggio
+        per (mittente, indirizzo OSC); i bundle non vengono mai sostituiti.
+        """
+        self.published += 1
+        if type(frame) is PreparedMessage:
+            if self.snapshot is not None:
+                self.snapshot.update(key, frame)
+            if type(frame.address) is tuple:
+                key = None
+            elif key is not None:
+                key = (key, frame.address)
+        if self.fanout_histogram is None or self.published % FANOUT_SAMPLE:
+            self._fanout(frame, key, received_ns)
+            return
+        start = time.perf_counter_ns()
+        self._fanout(frame, key, received_ns)
+        self.fanout_histogram.record(time.perf_counter_ns() - start)
+
+    def _fanout(self, frame, key, received_ns):
+        for session in self.unfiltered.values():
+            session.offer(frame, key, received_ns)
+        if not self.router.patterns or type(frame) is not PreparedMessage:
+            return
+        # Client con sottoscrizioni: solo i messaggi OSC con indirizzo corrispondente
+        address = frame.address
+        if not address:
+            return
+        if type(address) is tuple:
+            # Bundle: un solo frame se almeno un indirizzo corrisponde
+            sessions = {}
+            for bundled in address:
+                sessions.update(self.router.match(bundled))
+        else:
+            sessions = self.router.match(address)
+        for session in sessions:
+            session.offer(frame, key, received_ns)
+
+    def subscribe(self, session, patterns):
+        """Aggiunge pattern OSC alle sottoscrizioni del client
+
+        Dal primo pattern il client riceve solo i messaggi corrispondenti.
+        ValueError se un pattern non è valido (nessuno viene applicato).
+        """
+        if not patterns:
+            raise ValueError("nessun pattern da sottoscrivere")
+        for pattern in patterns:
+            compile_pattern(pattern)
+        if len(session.subscriptions | set(patterns)) > MAX_SUBSCRIPTIONS:
+            raise ValueError(f"al massimo {MAX_SUBSCRIPTIONS} pattern per client")
+        self.unfiltered.pop(session.websocket, None)
+        for pattern in patterns:
+            if pattern not in session.subscriptions:
+                session.subscriptions.add(pattern)
+                self.router.add(pattern, session)
+
+    def unsubscribe(self, session, patterns=None):
+        """Rimuove pattern dalle sottoscrizioni (None: tutti)
+
+        Il client resta filtrato: senza pattern non riceve più messaggi
+        finché non ne sottoscrive di nuovi.
+        """
+        if patterns is None:
+            # Anche un client che riceveva tutto smette di ricevere
+            self.unfiltered.pop(session.websocket, None)
+            patterns = list(session.subscriptions)
+        elif not patterns:
+            raise ValueError("nessun pattern da annullare")
+        for pattern in patterns:
+            if pattern in session.subscriptions:
+                session.subscriptions.discard(pattern)
+                self.router.remove(pattern, session)
+
+    def handle_subscription(self, session, message):
+        """Applica un comando subscribe/unsubscribe del client
+
+        Restituisce il frame di risposta (pattern attivi o errore), None se
+        il messaggio non è un comando di sottoscrizione.
+        """
+        request = subscription_request(message)
+        if request is None:
+            return None
+        kind, patterns = request
+        try:
+            if kind == 'subscribe':
+                self.subscribe(session, patterns)
+            else:
+                self.unsubscribe(session, patterns)
+        except ValueError as e:
+            return json.dumps({'type': 'error', 'request': kind, 'message': str(e)})
+        return json.dumps({'type': 'subscriptions',
+                           'patterns': sorted(session.subscriptions)})
+
+    def get_stats(self):
+        """Contatori di tutti i client"""
+        return [session.get_stats() for session in self.sessions.values()]
+
+    def register_metrics(self, registry):
+        """Esporta client, code, scarti e ritardo di invio nel registro delle metriche"""
+        sessions = self.sessions
+        registry.gauge('websocket_clients', 'Client WebSocket collegati',
+                       lambda: len(sessions))
+        registry.gauge('websocket_queued', 'Messaggi in coda verso i client',
+                       lambda: sum(len(session.queue) for session in sessions.values()))
+        registry.gauge('websocket_published_total', 'Messaggi distribuiti ai client',
+                       lambda: self.published, kind='counter')
+        registry.gauge('websocket_sent_total', 'Messaggi inviati ai client',
+                       lambda: self.closed_sent + sum(s.sent for s in sessions.values()),
+                       kind='counter')
+        registry.gauge('websocket_dropped_total', 'Messaggi scartati per client lenti',
+                       lambda: self.closed_dropped + sum(s.dropped for s in sessions.values()),
+                       kind='counter')
+        registry.gauge('websocket_subscriptions', 'Pattern OSC sottoscritti dai client',
+                       lambda: len(self.router))
+        registry.gauge('router_cached_addresses', 'Indirizzi OSC risolti in cache',
+                       lambda: self.router.cached)
+        registry.gauge('router_misses_total', 'Indirizzi risolti percorrendo il trie dei pattern',
+                       lambda: self.router.misses, kind='counter')
+        registry.gauge('websocket_client_lag_ms',
+                       'Ritardo tra accodamento e invio dell\'ultimo messaggio, per client',
+                       lambda: [({'client': _client_label(session.websocket)}, session.lag_ms)
+                                for session in sessions.values()])
+        registry.gauge('websocket_client_queued', 'Messaggi in coda, per client',
+                       lambda: [({'client': _client_label(session.websocket)}, len(session.queue))
+                                for session in sessions.values()])
+        if self.latency_histogram is not None:
+            registry.histogram('delivery_latency_seconds',
+                               'Tempo dalla ricezione UDP all\'invio WebSocket',
+                               self.latency_histogram)
+        if self.fanout_histogram is not None:
+            registry.histogram('broadcast_fanout_seconds',
+                               'Tempo di accodamento di un messaggio su tutti i client '
+                               f'(uno ogni {FANOUT_SAMPLE})',
+                               self.fanout_histogram)
+        if self.batcher is not None:
+            self.batcher.register_metrics(registry)
+        if self.snapshot is not None:
+            self.snapshot.register_metrics(registry)
+
+    def format_stats(self):
+        """Riepilogo leggibile su una riga"""
+        if not self.sessions:
+            return "nessun client"
+        stats = self.get_stats()
+        return (f"{len(stats)} client, "
+                f"in coda {sum(s['queued'] for s in stats)}, "
+                f"scartati {sum(s['dropped'] for s in stats)}, "
+                f"ritardo max {max(s['max_lag_ms'] for s in stats):.0f} ms")
+
+
+def _client_label(websocket):
+    address = websocket.remote_address
+    return f"{address[0]}:{address[1]}" if address else 'sconosciuto'
+
+
+def policy_from_path(path, default=None):
+    """Legge la politica da ?policy=... nell'URL della connessione WebSocket"""
+    query = parse_qs(urlsplit(path or '').query)
+    policy = query.get('policy', [default])[0]
+    return policy if policy in POLICIES else default
+
+
+def subscription_request(message):
+    """(tipo, pattern) per {"type": "subscribe" | "unsubscribe", "patterns": [...]}
+
+    Accetta anche "pattern" con una stringa sola; per unsubscribe senza
+    pattern restituisce None al posto della lista (tutti). None se il
+    messaggio non è un comando di sottoscrizione.
+    """
+    if not isinstance(message, str) or 'subscribe"' not in message:
+        return None
+    try:
+        request = json.loads(message)
+        kind = request.get('type')
+    except (ValueError, AttributeError):
+        return None
+    if kind not in ('subscribe', 'unsubscribe'):
+        return None
+    patterns = request.get('patterns', request.get('pattern'))
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    elif isinstance(patterns, list):
+        patterns = [pattern for pattern in patterns if isinstance(pattern, str)]
+    elif kind == 'subscribe' or patterns is not None:
+        patterns = []
+    return kind, patterns
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+Registrazione su disco dei datagrammi ricevuti e replay
+Ogni datagramma finisce in file di segmento append-only (lunghezza,
+istante monotono in ns, sorgente, payload grezzo) con un indice temporale
+sparso accanto. La scrittura avviene a lotti in un thread in background;
+la lettura usa mmap e raggiunge un istante con una ricerca binaria
+sull'indice.
+
+    python capture.py info CARTELLA
+    python capture.py dump CARTELLA -n 20 --start 12.5
+    python capture.py replay CARTELLA -p 10000 --speed 2
+"""
+
+import argparse
+import bisect
+import mmap
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+MAGIC = b'STRC'
+VERSION = 1
+
+# Intestazione del segmento: magic, versione, numero del segmento, istante
+# di riferimento (time_ns) e il corrispondente perf_counter_ns, per
+# convertire gli istanti monotoni in ora del giorno
+_SEGMENT_HEADER = struct.Struct('<4sIIqQ4x')
+# Record: lunghezza del payload, istante monotono (ns), ip, porta
+_RECORD = struct.Struct('<IQ4sH2x')
+# Voce dell'indice sparso: istante monotono (ns), posizione nel segmento
+_INDEX_ENTRY = struct.Struct('<QQ')
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+DEFAULT_INDEX_INTERVAL_MS = 100
+DEFAULT_MAX_PENDING = 32 * 1024 * 1024
+DEFAULT_FLUSH_INTERVAL = 0.05
+
+CaptureRecord = namedtuple('CaptureRecord', 'timestamp_ns source_ip source_port payload')
+
+
+def _segment_name(number):
+    return f"{number:06d}"
+
+
+def _list_segments(directory):
+    """Numeri dei segmenti presenti nella cartella, in ordine"""
+    numbers = []
+    for name in os.listdir(directory):
+        stem, suffix = os.path.splitext(name)
+        if suffix == SEGMENT_SUFFIX and stem.isdigit():
+            numbers.append(int(stem))
+    return sorted(numbers)
+
+
+class CaptureWriter:
+    """Scrive i datagrammi ricevuti in segmenti append-only
+
+    record() copia il payload e lo accoda senza toccare il disco; il thread
+    di scrittura svuota la coda ogni flush_interval con una write per lotto.
+    Se il disco non tiene il passo la coda è limitata a max_pending byte e
+    i datagrammi in eccesso vengono contati come persi.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE,
+                 index_interval_ms=DEFAULT_INDEX_INTERVAL_MS,
+                 max_pending=DEFAULT_MAX_PENDING, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.index_interval_ns = int(index_interval_ms * 1e6)
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+
+        # Stesso riferimento per tutti i segmenti di questa sessione
+        self.wall_anchor_ns = time.time_ns()
+        self.mono_anchor_ns = time.perf_counter_ns()
+
+        existing = _list_segments(directory)
+        self.segment_number = existing[-1] + 1 if existing else 0
+        self._segment = None
+        self._index = None
+        self._offset = 0
+        self._last_index_ns = None
+
+        self._queue = deque()
+        # Un contatore per thread: accodati (ricezione) e scritti (writer)
+        self._queued_bytes = 0
+        self._flushed_bytes = 0
+        self._ip_cache = {}
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._run, name='capture', daemon=True)
+        self._writer.start()
+
+        # Statistiche
+        self.records = 0
+        self.bytes = 0
+        self.segments = 0
+        self.dropped = 0
+
+    def _pack_ip(self, ip):
+        packed = self._ip_cache.get(ip)
+        if packed is None:
+            packed = socket.inet_aton(ip)
+            if len(self._ip_cache) < 65536:
+                self._ip_cache[ip] = packed
+        return packed
+
+    def record(self, data, source, received_ns=None):
+        """Accoda un datagramma (copiato: il buffer può essere riusato)"""
+        if self._queued_bytes - self._flushed_bytes > self.max_pending:
+            self.dropped += 1
+            return
+        if received_ns is None:
+            received_ns = time.perf_counter_ns()
+        chunk = _RECORD.pack(len(data), received_ns, self._pack_ip(source[0]), source[1]) + data
+        self._queued_bytes += len(chunk)
+        self._queue.append((received_ns, chunk))
+
+    def record_batch(self, batch, received_ns):
+        """Accoda un lotto di (data, addr) ricevuto nello stesso risveglio"""
+        for data, addr in batch:
+            self.record(data, addr, received_ns)
+
+    def _open_segment(self):
+        self._close_segment()
+        base = os.path.join(self.directory, _segment_name(self.segment_number))
+        self._segment = open(base + SEGMENT_SUFFIX, 'wb')
+        self._index = open(base + INDEX_SUFFIX, 'wb')
+        self._segment.write(_SEGMENT_HEADER.pack(MAGIC, VERSION, self.segment_number,
+                                                 self.wall_anchor_ns, self.mono_anchor_ns))
+        self._offset = _SEGMENT_HEADER.size
+        self._last_index_ns = None
+        self.segment_number += 1
+        self.segments += 1
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = None
+            self._index = None
+
+    def flush(self):
+        """Scrive su disco i record in coda (chiamata dal thread di scrittura)"""
+        popleft = self._queue.popleft
+        chunks = []
+        index_entries = []
+        written = 0
+        while True:
+            try:
+                received_ns, chunk = popleft()
+            except IndexError:
+                break
+            self._flushed_bytes += len(chunk)
+            if self._segment is None or (self._offset + len(chunk) > self.segment_size
+                                         and self._offset > _SEGMENT_HEADER.size):
+                self._write(chunks, index_entries)
+                chunks, index_entries = [], []
+                self._open_segment()
+            if (self._last_index_ns is None
+                    or received_ns - self._last_index_ns >= self.index_interval_ns):
+                index_entries.append(_INDEX_ENTRY.pack(received_ns, self._offset))
+                self._last_index_ns = received_ns
+            chunks.append(chunk)
+            self._offset += len(chunk)
+            written += 1
+        self._write(chunks, index_entries)
+        self.records += written
+
+    def _write(self, chunks, index_entries):
+        if not chunks:
+            return
+        data = b''.join(chunks)
+        self._segment.write(data)
+        self._segment.flush()
+        if index_entries:
+            # L'indice segue i dati: una voce punta sempre a byte già scritti
+            self._index.write(b''.join(index_entries))
+            self._index.flush()
+        self.bytes += len(data)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def get_stats(self):
+        """Contatori della registrazione"""
+        return {
+            'records': self.records,
+            'bytes': self.bytes,
+            'segments': self.segments,
+            'pending_bytes': self._queued_bytes - self._flushed_bytes,
+            'dropped': self.dropped,
+        }
+
+    def format_stats(self):
+        """Riepilogo leggibile su una riga"""
+        return (f"{self.records} datagrammi, {self.bytes // 1024} KB in "
+                f"{self.segments} segmenti, persi {self.dropped}")
+
+    def close(self):
+        """Ferma il thread di scrittura, scrive ciò che resta e chiude i file"""
+        self._stop.set()
+        self._writer.join(timeout=5.0)
+        self.flush()
+        self._close_segment()
+
+
+class _Segment:
+    """Segmento aperto in lettura con mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size < _SEGMENT_HEADER.size:
+                raise ValueError(f"segmento troppo corto: {path}")
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.number, wall_anchor, mono_anchor = \
+            _SEGMENT_HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError(f"non è un segmento di cattura: {path}")
+        # Istante monotono + offset = ora del giorno in ns
+        self.offset_ns = wall_anchor - mono_anchor
+        self.view = memoryview(self.mm)
+
+    def load_index(self, index_path, interval_ns):
+        """Voci (istante, posizione) dall'indice, o ricostruite scandendo i dati"""
+        entries = []
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            usable = len(data) - len(data) % _INDEX_ENTRY.size
+            entries = [entry for entry in _INDEX_ENTRY.iter_unpack(data[:usable])
+                       if entry[1] < self.size]
+        if not entries:
+            last_ns = None
+            for offset, received_ns, _, _, _ in self.scan(_SEGMENT_HEADER.size):
+                if last_ns is None or received_ns - last_ns >= interval_ns:
+                    entries.append((received_ns, offset))
+                    last_ns = received_ns
+        return entries
+
+    def scan(self, offset):
+        """Record dal byte offset: (offset, istante monotono, ip, porta, payload)"""
+        view = self.view
+        size = self.size
+        unpack = _RECORD.unpack_from
+        header_size = _RECORD.size
+        while offset + header_size <= size:
+            length, received_ns, ip, port = unpack(view, offset)
+            start = offset + header_size
+            if start + length > size:
+                # Ultimo record incompleto (registrazione interrotta)
+                break
+            yield offset, received_ns, ip, port, view[start:start + length]
+            offset = start + length
+
+    def close(self):
+        try:
+            self.view.release()
+            self.mm.close()
+        except BufferError:
+            # Qualche payload è ancora in uso: la mappatura resta al GC
+            pass
+
+
+class CaptureReader:
+    """Legge una cartella di cattura senza caricarla in memoria
+
+    Gli istanti restituiti sono in ns dell'ora del giorno (come time.time_ns);
+    i payload sono memoryview sui segmenti mappati, validi fino a close().
+    """
+
+    def __init__(self, directory, index_interval_ms=DEFAULT_INDEX_INTERVAL_MS):
+        self.directory = directory
+        self.segments = []
+        # Indice globale: istanti (ora del giorno) e (segmento, posizione)
+        self._index_ns = []
+        self._index_pos = []
+        interval_ns = int(index_interval_ms * 1e6)
+        for number in _list_segments(directory):
+            base = os.path.join(directory, _segment_name(number))
+            try:
+                segment = _Segment(base + SEGMENT_SUFFIX)
+            except ValueError:
+                continue
+            position = len(self.segments)
+            self.segments.append(segment)
+            for received_ns, offset in segment.load_index(base + INDEX_SUFFIX, interval_ns):
+                self._index_ns.append(received_ns + segment.offset_ns)
+                self._index_pos.append((position, offset))
+
+    @property
+    def first_ns(self):
+        return self._index_ns[0] if self._index_ns else None
+
+    @property
+    def last_ns(self):
+        """Istante dell'ultimo record (scandisce solo dall'ultima voce d'indice)"""
+        if not self._index_pos:
+            return None
+        position, offset = self._index_pos[-1]
+        segment = self.segments[position]
+        last = None
+        for _, received_ns, _, _, _ in segment.scan(offset):
+            last = received_ns
+        return last + segment.offset_ns
+
+    def seek(self, timestamp_ns):
+        """(segmento, posizione) dell'ultima voce d'indice non successiva all'istante"""
+        i = bisect.bisect_right(self._index_ns, timestamp_ns) - 1
+        return self._index_pos[max(i, 0)]
+
+    def records(self, start_ns=None, end_ns=None):
+        """Itera i record (CaptureRecord) nell'intervallo [start_ns, end_ns)"""
+        for timestamp_ns, ip, port, payload in self.iter_raw(start_ns, end_ns):
+            yield CaptureRecord(timestamp_ns, socket.inet_ntoa(ip), port, payload)
+
+    def iter_raw(self, start_ns=None, end_ns=None):
+        """Come records() ma con ip grezzo (4 byte): per il replay veloce"""
+        if not self._index_pos:
+            return
+        position, offset = (0, _SEGMENT_HEADER.size) if start_ns is None else self.seek(start_ns)
+        for segment in self.segments[position:]:
+            offset_ns = segment.offset_ns
+            for _, received_ns, ip, port, payload in segment.scan(offset):
+                timestamp_ns = received_ns + offset_ns
+                if start_ns is not None and timestamp_ns < start_ns:
+                    continue
+                if end_ns is not None and timestamp_ns >= end_ns:
+                    return
+                yield timestamp_ns, ip, port, payload
+            offset = _SEGMENT_HEADER.size
+
+    def get_stats(self):
+        """Segmenti, byte su disco e intervallo di tempo coperto"""
+        first_ns = self.first_ns
+        last_ns = self.last_ns
+        return {
+            'segments': len(self.segments),
+            'bytes': sum(segment.size for segment in self.segments),
+            'index_entries': len(self._index_ns),
+            'first_ns': first_ns,
+            'last_ns': last_ns,
+            'duration_s': (last_ns - first_ns) / 1e9 if first_ns is not None else 0.0,
+        }
+
+    def close(self):
+        """Rilascia le mappature (le memoryview dei payload non sono più valide)"""
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+
+def replay(reader, host, port, speed=1.0, start_ns=None, end_ns=None):
+    """Reinvia i datagrammi a host:port
+
+    speed 1.0 = tempo reale, 2.0 = doppia velocità, 0 = più veloce possibile.
+    Restituisce (inviati, errori, ritardo massimo in secondi).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = (host, port)
+    sendto = sock.sendto
+    sent = 0
+    errors = 0
+    max_late = 0.0
+    first_ns = None
+    start = 0.0
+    try:
+        for timestamp_ns, _, _, payload in reader.iter_raw(start_ns, end_ns):
+            if speed > 0:
+                if first_ns is None:
+                    first_ns = timestamp_ns
+                    start = time.perf_counter()
+                due = start + (timestamp_ns - first_ns) / 1e9 / speed
+                delay = due - time.perf_counter()
+                if delay > 0.0005:
+                    time.sleep(delay)
+                elif -delay > max_late:
+                    max_late = -delay
+            try:
+                sendto(payload, target)
+                sent += 1
+            except OSError:
+                # Buffer di invio pieno (modalità veloce): si conta e si prosegue
+                errors += 1
+    finally:
+        sock.close()
+    return sent, errors, max_late
+
+
+def _format_ns(timestamp_ns):
+    seconds = timestamp_ns / 1e9
+    return time.strftime('%H:%M:%S', time.localtime(seconds)) + f".{timestamp_ns // 1000000 % 1000:03d}"
+
+
+def _relative_ns(reader, seconds):
+    """Istante assoluto da secondi relativi all'inizio della cattura"""
+    if seconds is None or reader.first_ns is None:
+        return None
+    return reader.first_ns + int(seconds * 1e9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Catture dei datagrammi ricevuti')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    info = commands.add_parser('info', help='Riepilogo della cattura')
+    info.add_argument('directory')
+
+    dump = commands.add_parser('dump', help='Mostra i record da un istante')
+    dump.add_argument('directory')
+    dump.add_argument('-n', '--count', type=int, default=20,
+                      help='Record da mostrare (default: 20)')
+    dump.add_argument('--start', type=float, default=None,
+                      help='Secondi dall\'inizio della cattura')
+
+    play = commands.add_parser('replay', help='Reinvia la cattura via UDP')
+    play.add_argument('directory')
+    play.add_argument('--host', default='127.0.0.1',
+                      help='Destinazione (default: 127.0.0.1)')
+    play.add_argument('-p', '--port', type=int, default=10000,
+                      help='Porta UDP di destinazione (default: 10000)')
+    play.add_argument('--speed', type=float, default=1.0,
+                      help='Multiplo del tempo reale (default: 1.0)')
+    play.add_argument('--fast', action='store_true',
+                      help='Più veloce possibile (generatore di carico)')
+    play.add_argument('--start', type=float, default=None,
+                      help='Secondi dall\'inizio della cattura')
+    play.add_argument('--duration', type=float, default=None,
+                      help='Secondi da reinviare')
+    play.add_argument('--repeat', type=int, default=1,
+                      help='Ripetizioni (default: 1)')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"Cattura '{args.directory}' non trovata")
+        sys.exit(1)
+    reader = CaptureReader(args.directory)
+    try:
+        if args.command == 'info':
+            stats = reader.get_stats()
+            print(f"Segmenti: {stats['segments']}, {stats['bytes'] // 1024} KB, "
+                  f"{stats['index_entries']} voci d'indice")
+            if stats['first_ns'] is not None:
+                print(f"Dalle {_format_ns(stats['first_ns'])} alle "
+                      f"{_format_ns(stats['last_ns'])} ({stats['duration_s']:.1f} s)")
+        elif args.command == 'dump':
+            start_ns = _relative_ns(reader, args.start)
+            for i, record in enumerate(reader.records(start_ns)):
+                if i >= args.count:
+                    break
+                payload = bytes(record.payload)
+                try:
+                    content = payload.decode('utf-8')
+                except UnicodeDecodeError:
+                    content = payload.hex()
+                print(f"[{_format_ns(record.timestamp_ns)}] {record.source_ip}:"
+                      f"{record.source_port} - {len(payload)} bytes | {content[:80]!r}")
+        else:
+            start_ns = _relative_ns(reader, args.start)
+            end_ns = None
+            if args.duration is not None:
+                end_ns = (start_ns or reader.first_ns or 0) + int(args.duration * 1e9)
+            speed = 0 if args.fast else args.speed
+            for _ in range(args.repeat):
+                began = time.perf_counter()
+                sent, errors, max_late = replay(reader, args.host, args.port,
+                                                speed, start_ns, end_ns)
+                elapsed = time.perf_counter() - began
+                print(f"Inviati {sent} datagrammi a {args.host}:{args.port} in "
+                      f"{elapsed:.2f} s ({sent / elapsed if elapsed else 0:.0f}/s), "
+                      f"errori {errors}, ritardo max {max_late * 1000:.1f} ms")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
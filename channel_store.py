@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Archivio NumPy dei canali numerici OSC
+Ogni indirizzo con argomenti numerici (/sensor/x, /audio/rms...) ha un
+ring buffer preallocato di (timestamp, valori): ultimi N campioni,
+ricampionamento a frequenza fissa e statistiche min/max/media/RMS su
+finestre sono operazioni vettoriali, senza cicli Python sui campioni.
+La memoria è limitata da capacità e numero massimo di canali.
+"""
+
+import struct
+import threading
+import warnings
+
+import numpy as np
+
+DEFAULT_CAPACITY = 4096      # campioni per canale
+DEFAULT_MAX_CHANNELS = 256
+DEFAULT_MAX_WIDTH = 8        # valori per campione (argomenti oltre vengono ignorati)
+
+RESAMPLE_PREVIOUS = 'previous'  # ultimo valore noto (sample and hold)
+RESAMPLE_LINEAR = 'linear'      # interpolazione lineare
+RESAMPLE_METHODS = (RESAMPLE_PREVIOUS, RESAMPLE_LINEAR)
+
+# Formato binario: campioni e larghezza (uint32), poi i timestamp
+# float64 e i valori float32 riga per riga, tutto little-endian
+BINARY_HEADER = struct.Struct('<II')
+
+
+def numeric_values(args):
+    """Argomenti come tupla di numeri, o None se non sono tutti int/float"""
+    if not args:
+        return None
+    for arg in args:
+        kind = type(arg)
+        if kind is not float and kind is not int:
+            return None
+    return args
+
+
+def encode_binary(timestamps, values):
+    """Serializza (timestamp, valori) nel formato binario degli endpoint"""
+    rows, width = values.shape
+    return (BINARY_HEADER.pack(rows, width)
+            + timestamps.astype('<f8', copy=False).tobytes()
+            + values.astype('<f4', copy=False).tobytes())
+
+
+def json_values(array):
+    """Lista per JSON con None al posto di NaN (NaN non è JSON valido)"""
+    missing = np.isnan(array)
+    if not missing.any():
+        return array.tolist()
+    result = array.astype(object)
+    result[missing] = None
+    return result.tolist()
+
+
+def _statistics(values, axis):
+    # Colonne senza valori (solo NaN): risultato NaN, senza avvisi
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return {
+            'min': np.nanmin(values, axis=axis),
+            'max': np.nanmax(values, axis=axis),
+            'mean': np.nanmean(values, axis=axis),
+            'rms': np.sqrt(np.nanmean(np.square(values, dtype=np.float64), axis=axis)),
+        }
+
+
+def window_stats(values):
+    """min, max, media e RMS per colonna (NaN ignorati), pronti per JSON"""
+    if not len(values):
+        return None
+    stats = {name: json_values(result) for name, result in _statistics(values, 0).items()}
+    stats['count'] = int(len(values))
+    return stats
+
+
+class Channel:
+    """Ring buffer di un indirizzo: timestamp float64, valori float32"""
+
+    __slots__ = ('address', 'width', 'capacity', 'times', 'values', 'written')
+
+    def __init__(self, address, width, capacity):
+        self.address = address
+        self.width = width
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        # Argomenti mancanti rispetto alla larghezza del canale: NaN
+        self.values = np.full((capacity, width), np.nan, dtype=np.float32)
+        self.written = 0
+
+    @property
+    def count(self):
+        """Campioni disponibili (al massimo la capacità)"""
+        return min(self.written, self.capacity)
+
+    @property
+    def memory_size(self):
+        """Byte occupati dai buffer"""
+        return self.times.nbytes + self.values.nbytes
+
+    def append(self, timestamp, values):
+        """Scrive un campione sovrascrivendo il più vecchio"""
+        index = self.written % self.capacity
+        self.times[index] = timestamp
+        row = self.values[index]
+        width = self.width
+        if len(values) >= width:
+            row[:] = values[:width]
+        else:
+            row[:len(values)] = values
+            row[len(values):] = np.nan
+        self.written += 1
+
+    def last(self, n):
+        """Copie ordinate degli ultimi n campioni: (timestamp, valori)"""
+        n = max(0, min(n, self.count))
+        # Indici nel ring, dal più vecchio al più recente
+        indices = np.arange(self.written - n, self.written) % self.capacity
+        times = self.times[indices]
+        values = self.values[indices]
+        # I thread del server OSC possono scrivere fuori ordine di qualche µs:
+        # ricampionamento e ricerche richiedono timestamp crescenti
+        if n > 1 and (np.diff(times) < 0).any():
+            order = np.argsort(times, kind='stable')
+            times = times[order]
+            values = values[order]
+        return times, values
+
+    def since(self, start):
+        """Copie dei campioni con timestamp >= start"""
+        times, values = self.last(self.count)
+        first = np.searchsorted(times, start, side='left')
+        return times[first:], values[first:]
+
+    def info(self):
+        """Descrizione del canale per l'elenco"""
+        count = self.count
+        newest = (self.written - 1) % self.capacity
+        oldest = (self.written - count) % self.capacity
+        return {
+            'address': self.address,
+            'width': self.width,
+            'samples': count,
+            'written': self.written,
+            'first_timestamp': float(self.times[oldest]) if count else None,
+            'last_timestamp': float(self.times[newest]) if count else None,
+            'memory_bytes': self.memory_size,
+        }
+
+
+class ChannelStore:
+    """Canali numerici per indirizzo con memoria limitata
+
+    append() arriva dai thread del server OSC, le query dai thread di
+    Flask: un lock protegge la scrittura e la copia dei campioni, i
+    calcoli avvengono sulle copie fuori dal lock.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, max_channels=DEFAULT_MAX_CHANNELS,
+                 max_width=DEFAULT_MAX_WIDTH):
+        self.capacity = capacity
+        self.max_channels = max_channels
+        self.max_width = max_width
+        self.channels = {}
+        self._lock = threading.Lock()
+        # Campioni di indirizzi nuovi rifiutati perché i canali sono esauriti
+        self.rejected = 0
+
+    @property
+    def memory_size(self):
+        """Byte allocati finora"""
+        return sum(channel.memory_size for channel in list(self.channels.values()))
+
+    @property
+    def memory_limit(self):
+        """Byte occupati con tutti i canali alla larghezza massima"""
+        return self.max_channels * self.capacity * (8 + 4 * self.max_width)
+
+    def append(self, address, timestamp, values):
+        """Aggiunge un campione numerico; False se l'indirizzo non trova posto"""
+        with self._lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                if len(self.channels) >= self.max_channels:
+                    self.rejected += 1
+                    return False
+                # La larghezza la decide il primo campione
+                width = max(1, min(len(values), self.max_width))
+                channel = Channel(address, width, self.capacity)
+                self.channels[address] = channel
+            channel.append(timestamp, values)
+        return True
+
+    def last(self, address, n):
+        """Ultimi n campioni di un indirizzo, o None se sconosciuto"""
+        with self._lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                return None
+            return channel.last(n)
+
+    def since(self, address, start):
+        """Campioni con timestamp >= start, o None se l'indirizzo è sconosciuto"""
+        with self._lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                return None
+            return channel.since(start)
+
+    def resample(self, address, rate_hz, seconds, end=None, method=RESAMPLE_PREVIOUS):
+        """Valori su una griglia regolare a rate_hz negli ultimi `seconds` secondi
+
+        Con end=None la griglia finisce all'ultimo campione. Prima del
+        primo campione disponibile i valori sono NaN.
+        """
+        if method not in RESAMPLE_METHODS:
+            raise ValueError(f"metodo sconosciuto: {method}")
+        with self._lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                return None
+            times, values = channel.last(channel.count)
+        if not len(times):
+            return times, values
+        if end is None:
+            end = times[-1]
+        steps = max(1, int(seconds * rate_hz))
+        grid = end - np.arange(steps - 1, -1, -1) / rate_hz
+        if method == RESAMPLE_LINEAR:
+            result = np.empty((steps, values.shape[1]), dtype=np.float32)
+            for column in range(values.shape[1]):
+                result[:, column] = np.interp(grid, times, values[:, column],
+                                              left=np.nan, right=values[-1, column])
+            return grid, result
+        # Indice dell'ultimo campione con timestamp <= istante della griglia
+        indices = np.searchsorted(times, grid, side='right') - 1
+        result = values[np.maximum(indices, 0)]
+        result[indices < 0] = np.nan
+        return grid, result
+
+    def window_stats(self, address, seconds):
+        """min/max/media/RMS degli ultimi `seconds` secondi (per colonna)"""
+        with self._lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                return None
+            newest = channel.times[(channel.written - 1) % channel.capacity]
+            _, values = channel.since(newest - seconds)
+        return window_stats(values)
+
+    def rolling(self, address, window, rate_hz, seconds, end=None):
+        """Serie di min/max/media/RMS su finestre mobili di `window` secondi
+
+        I campioni vengono prima ricampionati a rate_hz (sample and hold),
+        poi ogni punto della griglia negli ultimi `seconds` secondi riceve
+        le statistiche della finestra che termina in quel punto.
+        """
+        span = max(1, int(round(window * rate_hz)))
+        resampled = self.resample(address, rate_hz, seconds + window, end)
+        if resampled is None:
+            return None
+        grid, values = resampled
+        if len(grid) < span:
+            return grid[:0], {}
+        # Viste sovrapposte sullo stesso array, nessuna copia delle finestre
+        windows = np.lib.stride_tricks.sliding_window_view(values, span, axis=0)
+        return grid[span - 1:], _statistics(windows, -1)
+
+    def list_channels(self):
+        """Descrizione di tutti i canali"""
+        with self._lock:
+            return [channel.info() for channel in self.channels.values()]
+
+    def get_stats(self):
+        """Canali, campioni e memoria (allocata e massima)"""
+        with self._lock:
+            channels = list(self.channels.values())
+        return {
+            'channels': len(channels),
+            'max_channels': self.max_channels,
+            'capacity': self.capacity,
+            'samples': sum(channel.count for channel in channels),
+            'rejected': self.rejected,
+            'memory_bytes': sum(channel.memory_size for channel in channels),
+            'memory_limit_bytes': self.memory_limit,
+        }
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Payload più grandi di un datagramma: frammentazione e riassemblaggio
+Un payload (blob OSC, nuvola di punti, immagine) viene spezzato in
+frammenti che stanno in un datagramma senza frammentazione IP. Ogni
+frammento porta un'intestazione in stile OSC:
+
+    "#chunk\\0\\0"  id del payload (uint32), indice e numero di frammenti
+    (uint16), dimensione totale e posizione del frammento (uint32), tutti
+    big-endian come OSC; seguono i byte del frammento
+
+Il ricevitore copia ogni frammento al suo posto in un buffer preallocato
+e riusato; a payload completo il lotto riceve una memoryview sul buffer,
+al posto dei frammenti. Un payload incompleto viene scartato dopo un
+timeout, o se serve il suo buffer per un payload nuovo; i contatori
+riportano frammenti duplicati, non validi e persi.
+"""
+
+import argparse
+import socket
+import struct
+import time
+
+CHUNK_MAGIC = b'#chunk\0\0'
+CHUNK_HEADER = struct.Struct('>8sIHHII')
+# Frammento in un datagramma da 1472 byte (MTU Ethernet meno IP e UDP)
+DEFAULT_FRAGMENT = 1472 - CHUNK_HEADER.size
+MAX_FRAGMENTS = 0xFFFF
+
+DEFAULT_MAX_SIZE = 1024 * 1024
+DEFAULT_SLOTS = 4
+DEFAULT_TIMEOUT = 1.0
+# Payload completati ricordati per riconoscere i frammenti duplicati in ritardo
+RECENT_PAYLOADS = 256
+
+_HASH = ord('#')
+
+
+def is_chunk(data):
+    """True se il datagramma è un frammento"""
+    return data[:1] == b'#' and data[:8] == CHUNK_MAGIC
+
+
+def split_payload(data, message_id, fragment_size=DEFAULT_FRAGMENT):
+    """Frammenti (bytes) di un payload; un payload piccolo resta com'è"""
+    total = len(data)
+    if total <= fragment_size:
+        return [bytes(data)]
+    count = -(-total // fragment_size)
+    if count > MAX_FRAGMENTS:
+        raise ValueError(f"payload troppo grande: {total} byte in più di {MAX_FRAGMENTS} frammenti")
+    view = memoryview(data)
+    message_id &= 0xFFFFFFFF
+    return [CHUNK_HEADER.pack(CHUNK_MAGIC, message_id, index, count, total, offset)
+            + view[offset:offset + fragment_size]
+            for index, offset in enumerate(range(0, total, fragment_size))]
+
+
+def send_chunked(sock, data, address, message_id, fragment_size=DEFAULT_FRAGMENT):
+    """Invia un payload a frammenti (uno solo se sta in un datagramma)"""
+    fragments = split_payload(data, message_id, fragment_size)
+    for fragment in fragments:
+        sock.sendto(fragment, address)
+    return len(fragments)
+
+
+class _Slot:
+    """Buffer di un payload in riassemblaggio"""
+
+    __slots__ = ('buffer', 'view', 'key', 'count', 'total', 'fragment_size', 'received',
+                 'missing', 'bytes', 'started')
+
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.key = None
+
+
+class Reassembler:
+    """Ricompone i payload a frammenti in `slots` buffer da `max_size` byte
+
+    reassemble() restituisce il lotto con i frammenti sostituiti dai payload
+    completati: memoryview sui buffer interni, valide fino alla chiamata
+    successiva (come quelle di BatchReceiver). I buffer si allocano al primo
+    uso e poi si riusano.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, slots=DEFAULT_SLOTS, timeout=DEFAULT_TIMEOUT):
+        if max_size < 1 or slots < 1 or timeout <= 0:
+            raise ValueError("servono max_size >= 1, slots >= 1 e timeout > 0")
+        self.max_size = max_size
+        self.slots = slots
+        self.timeout = timeout
+        self._free = []
+        self._allocated = 0
+        # (mittente, id) -> _Slot, in ordine di arrivo del primo frammento
+        self.pending = {}
+        # Slot consegnati: tornano liberi alla chiamata successiva
+        self._delivered = []
+        # (mittente, id) degli ultimi payload completati, in ordine
+        self._recent = {}
+
+        # Contatori
+        self.fragments = 0
+        self.completed = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.oversized = 0
+        self.expired = 0
+        self.evicted = 0
+        self.lost_fragments = 0
+
+    def reassemble(self, batch, now=None):
+        """Lotto [(data, addr)] con i frammenti ricomposti"""
+        if self._delivered:
+            self._free.extend(self._delivered)
+            self._delivered.clear()
+        if self.pending:
+            if now is None:
+                now = time.monotonic()
+            self.expire(now)
+        result = None
+        for index, (data, addr) in enumerate(batch):
+            if not data or data[0] != _HASH or data[:8] != CHUNK_MAGIC:
+                if result is not None:
+                    result.append((data, addr))
+                continue
+            if result is None:
+                result = batch[:index]
+                if now is None:
+                    now = time.monotonic()
+            payload = self.feed(data, addr, now)
+            if payload is not None:
+                result.append((payload, addr))
+        return batch if result is None else result
+
+    def feed(self, data, addr, now):
+        """Aggiunge un frammento; memoryview del payload se è l'ultimo mancante"""
+        self.fragments += 1
+        if len(data) < CHUNK_HEADER.size:
+            self.invalid += 1
+            return None
+        _, message_id, index, count, total, offset = CHUNK_HEADER.unpack_from(data)
+        size = len(data) - CHUNK_HEADER.size
+        if index >= count or offset + size > total or not size:
+            self.invalid += 1
+            return None
+        # Frammenti tutti della stessa dimensione tranne l'ultimo, che chiude
+        # il payload: posizione = indice * dimensione, nessuna lacuna o sovrapposizione
+        if index < count - 1:
+            fragment_size = size
+            valid = offset == index * size
+        elif index:
+            fragment_size = offset // index
+            valid = (offset + size == total and offset == index * fragment_size
+                     and size <= fragment_size)
+        else:
+            fragment_size = size
+            valid = size == total
+        if not valid:
+            self.invalid += 1
+            return None
+        if total > self.max_size:
+            self.oversized += 1
+            return None
+        key = (addr, message_id)
+        slot = self.pending.get(key)
+        if slot is None:
+            if key in self._recent:
+                self.duplicates += 1
+                return None
+            slot = self._claim(now)
+            if slot is None:
+                self.lost_fragments += 1
+                return None
+            slot.key = key
+            slot.count = count
+            slot.total = total
+            slot.fragment_size = fragment_size
+            slot.received = bytearray(count)
+            slot.missing = count
+            slot.bytes = 0
+            slot.started = now
+            self.pending[key] = slot
+        elif (slot.count != count or slot.total != total
+              or slot.fragment_size != fragment_size):
+            self.invalid += 1
+            return None
+        if slot.received[index]:
+            self.duplicates += 1
+            return None
+        slot.received[index] = 1
+        slot.missing -= 1
+        slot.bytes += size
+        slot.view[offset:offset + size] = data[CHUNK_HEADER.size:]
+        # Completo solo se i byte ricevuti coprono tutto il payload
+        if slot.missing or slot.bytes != slot.total:
+            return None
+        del self.pending[key]
+        self._delivered.append(slot)
+        recent = self._recent
+        recent[key] = None
+        if len(recent) > RECENT_PAYLOADS:
+            del recent[next(iter(recent))]
+        self.completed += 1
+        return slot.view[:total]
+
+    def _claim(self, now):
+        """Buffer libero: nuovo, riusato o tolto al payload incompleto più vecchio"""
+        if self._free:
+            return self._free.pop()
+        if self._allocated < self.slots:
+            self._allocated += 1
+            return _Slot(self.max_size)
+        if not self.pending:
+            # Tutti i buffer contengono payload appena consegnati
+            return None
+        oldest = next(iter(self.pending.values()))
+        self._drop(oldest)
+        self.evicted += 1
+        return self._free.pop()
+
+    def _drop(self, slot):
+        del self.pending[slot.key]
+        self.lost_fragments += slot.missing
+        slot.key = None
+        self._free.append(slot)
+
+    def expire(self, now=None):
+        """Scarta i payload incompleti più vecchi del timeout"""
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self.timeout
+        for slot in list(self.pending.values()):
+            if slot.started > deadline:
+                # In ordine di arrivo: i successivi sono più recenti
+                break
+            self._drop(slot)
+            self.expired += 1
+
+    def get_stats(self):
+        """Contatori del riassemblaggio"""
+        return {
+            'fragments': self.fragments,
+            'completed': self.completed,
+            'pending': len(self.pending),
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'oversized': self.oversized,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'lost_fragments': self.lost_fragments,
+        }
+
+    def format_stats(self):
+        """Riepilogo leggibile su una riga"""
+        return (f"{self.completed} payload da {self.fragments} frammenti, "
+                f"in corso {len(self.pending)}, scaduti {self.expired}, "
+                f"sostituiti {self.evicted}, frammenti persi {self.lost_fragments}, "
+                f"duplicati {self.duplicates}, non validi {self.invalid + self.oversized}")
+
+
+# Contatori esportati: (metrica, descrizione, tipo, campi di get_stats sommati)
+_METRICS = (
+    ('chunk_fragments_total', 'Frammenti ricevuti', 'counter', ('fragments',)),
+    ('chunk_payloads_total', 'Payload ricomposti dai frammenti', 'counter', ('completed',)),
+    ('chunk_pending', 'Payload in attesa di frammenti', 'gauge', ('pending',)),
+    ('chunk_expired_total', 'Payload incompleti scaduti', 'counter', ('expired',)),
+    ('chunk_evicted_total', 'Payload incompleti scartati per fare posto', 'counter',
+     ('evicted',)),
+    ('chunk_lost_fragments_total', 'Frammenti mancanti dei payload scartati', 'counter',
+     ('lost_fragments',)),
+    ('chunk_duplicates_total', 'Frammenti duplicati', 'counter', ('duplicates',)),
+    ('chunk_invalid_total', 'Frammenti non validi o oltre la dimensione massima', 'counter',
+     ('invalid', 'oversized')),
+)
+
+
+def register_chunk_metrics(registry, reassemblers):
+    """Esporta i contatori di riassemblaggio {porta: Reassembler}
+
+    Con più porte (server unificato) ogni metrica ha l'etichetta port.
+    """
+    def read(fields):
+        values = [(port, reassembler.get_stats())
+                  for port, reassembler in reassemblers.items()]
+        if len(values) == 1:
+            return sum(values[0][1][field] for field in fields)
+        return [({'port': port}, sum(stats[field] for field in fields))
+                for port, stats in values]
+
+    for name, help_text, kind, fields in _METRICS:
+        registry.gauge(name, help_text, lambda fields=fields: read(fields), kind=kind)
+
+
+class ChunkedServerMixin:
+    """Per i server UDP di socketserver (python-osc): ricompone i frammenti
+
+    Va dopo RelayServerMixin (che inoltra i frammenti così come arrivano)
+    e prima del pool: al gestore arriva solo il payload completo, copiato.
+    """
+
+    def __init__(self, *args, reassembler=None, **kwargs):
+        self.reassembler = reassembler
+        super().__init__(*args, **kwargs)
+
+    def verify_request(self, request, client_address):
+        # python-osc accetta solo messaggi e bundle: i frammenti passano qui
+        if self.reassembler is not None and is_chunk(request[0]):
+            return True
+        return super().verify_request(request, client_address)
+
+    def process_request(self, request, client_address):
+        reassembler = self.reassembler
+        data = request[0]
+        if reassembler is None or not is_chunk(data):
+            super().process_request(request, client_address)
+            return
+        # Gira nel thread di serve_forever(): nessun lock
+        payload = reassembler.reassemble([(data, client_address)])
+        if payload:
+            super().process_request((bytes(payload[0][0]),) + tuple(request[1:]),
+                                    client_address)
+
+
+def add_chunk_arguments(parser):
+    """Opzioni --chunks* comuni ai ricevitori"""
+    group = parser.add_argument_group('payload a frammenti (chunking.py)')
+    group.add_argument('--chunks', action='store_true',
+                       help='Ricomponi i payload inviati a frammenti (intestazione #chunk)')
+    group.add_argument('--chunk-max-size', type=int, default=DEFAULT_MAX_SIZE, metavar='BYTE',
+                       help=f'Dimensione massima di un payload ricomposto '
+                            f'(default: {DEFAULT_MAX_SIZE})')
+    group.add_argument('--chunk-slots', type=int, default=DEFAULT_SLOTS,
+                       help=f'Payload ricomposti in parallelo (default: {DEFAULT_SLOTS})')
+    group.add_argument('--chunk-timeout', type=float, default=DEFAULT_TIMEOUT, metavar='S',
+                       help=f'Secondi prima di scartare un payload incompleto '
+                            f'(default: {DEFAULT_TIMEOUT:g})')
+
+
+def reassembler_from_args(args, parser):
+    """Reassembler dalle opzioni --chunks*, None senza --chunks"""
+    if not args.chunks:
+        return None
+    try:
+        return Reassembler(args.chunk_max_size, args.chunk_slots, args.chunk_timeout)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Invia un file a frammenti via UDP')
+    parser.add_argument('file', help='File da inviare (es. una nuvola di punti)')
+    parser.add_argument('--host', default='127.0.0.1', help='Destinazione (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=10000,
+                        help='Porta UDP di destinazione (default: 10000)')
+    parser.add_argument('--fragment', type=int, default=DEFAULT_FRAGMENT, metavar='BYTE',
+                        help=f'Byte per frammento (default: {DEFAULT_FRAGMENT})')
+    parser.add_argument('--id', type=int, default=None,
+                        help='Id del payload (default: dall\'orologio)')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    message_id = args.id if args.id is not None else time.monotonic_ns() // 1000
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        fragments = send_chunked(sock, data, (args.host, args.port), message_id, args.fragment)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        sock.close()
+    print(f"{len(data)} byte inviati a {args.host}:{args.port} in {fragments} datagrammi")
+
+
+if __name__ == "__main__":
+    main()
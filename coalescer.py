@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Coalescenza per indirizzo tra ricezione e invio
+Gli indirizzi ad alta frequenza (es. /fader1 a 60-120 Hz) vengono ridotti
+al ritmo dei display: ultimo valore per indirizzo a ogni tick, oppure
+min/max/media della finestra. Gli indirizzi in allowlist (trigger) passano
+sempre subito. Il tick è un timer del loop asyncio, armato solo quando c'è
+qualcosa in attesa; senza loop si usa poll().
+"""
+
+import time
+from collections import namedtuple
+from fnmatch import fnmatchcase
+
+MODE_OFF = 'off'              # nessuna coalescenza
+MODE_LATEST = 'latest'        # ultimo valore per indirizzo a ogni tick
+MODE_AGGREGATE = 'aggregate'  # min/max/media per indirizzo a ogni tick
+MODES = (MODE_OFF, MODE_LATEST, MODE_AGGREGATE)
+
+DEFAULT_RATE_HZ = 30.0
+
+# Statistiche della finestra: numero di campioni e liste min/max/media
+Window = namedtuple('Window', 'count min max mean')
+
+
+class Coalescer:
+    """Riduce i messaggi per indirizzo prima del fan-out
+
+    emit(key, item, window) riceve l'ultimo item di ogni chiave; window è
+    una Window in modalità aggregate (None per gli altri casi).
+    """
+
+    def __init__(self, emit, mode=MODE_LATEST, rate_hz=DEFAULT_RATE_HZ, passthrough=()):
+        if mode not in MODES:
+            raise ValueError(f"modalità sconosciuta: {mode}")
+        self.emit = emit
+        self.mode = mode
+        self.interval = 1.0 / rate_hz
+        self.passthrough = tuple(passthrough)
+        self._passthrough_cache = {}
+
+        # Chiave -> item (latest) o [item, count, min, max, sum] (aggregate)
+        self.pending = {}
+        self.deadline = None
+        self.last_flush = 0.0
+        self._loop = None
+        self._timer = None
+
+        # Statistiche
+        self.received = 0
+        self.passed = 0
+        self.emitted = 0
+
+    @property
+    def enabled(self):
+        return self.mode != MODE_OFF
+
+    def is_passthrough(self, address):
+        """True se l'indirizzo è in allowlist (pattern in stile glob)"""
+        result = self._passthrough_cache.get(address)
+        if result is None:
+            result = any(fnmatchcase(address, pattern) for pattern in self.passthrough)
+            if len(self._passthrough_cache) < 65536:
+                self._passthrough_cache[address] = result
+        return result
+
+    def offer(self, key, address, item, values=None):
+        """Accoda un messaggio; i valori servono solo in modalità aggregate"""
+        self.received += 1
+        if self.mode == MODE_OFF or self.is_passthrough(address):
+            self.passed += 1
+            self.emitted += 1
+            self.emit(key, item, None)
+            return
+
+        if self.mode == MODE_LATEST or values is None:
+            # Anche in aggregate, senza valori numerici resta solo l'ultimo
+            self.pending[key] = item
+        else:
+            entry = self.pending.get(key)
+            if type(entry) is list and len(entry[2]) == len(values):
+                entry[0] = item
+                entry[1] += 1
+                mins, maxs, sums = entry[2], entry[3], entry[4]
+                for i, value in enumerate(values):
+                    if value < mins[i]:
+                        mins[i] = value
+                    elif value > maxs[i]:
+                        maxs[i] = value
+                    sums[i] += value
+            else:
+                self.pending[key] = [item, 1, list(values), list(values), list(values)]
+
+        if self.deadline is None:
+            # Dopo una pausa il primo campione parte al prossimo tick utile,
+            # senza attendere un intervallo intero
+            self.deadline = max(self.last_flush + self.interval, time.monotonic())
+            if self._loop is not None:
+                self._timer = self._loop.call_at(self.deadline, self._tick)
+
+    def forward(self, key, item):
+        """Inoltra subito un messaggio che non va coalescato (es. testo)"""
+        self.received += 1
+        self.passed += 1
+        self.emitted += 1
+        self.emit(key, item, None)
+
+    def flush(self):
+        """Invia subito tutto ciò che è in attesa"""
+        pending = self.pending
+        self.pending = {}
+        self.deadline = None
+        self.last_flush = time.monotonic()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for key, entry in pending.items():
+            self.emitted += 1
+            if type(entry) is list:
+                item, count, mins, maxs, sums = entry
+                self.emit(key, item, Window(count, mins, maxs, [s / count for s in sums]))
+            else:
+                self.emit(key, entry, None)
+
+    def poll(self, now=None):
+        """Senza loop asyncio: invia se il tick è scaduto; True se ha inviato"""
+        if self.deadline is None:
+            return False
+        if (time.monotonic() if now is None else now) < self.deadline:
+            return False
+        self.flush()
+        return True
+
+    def attach(self, loop):
+        """Il tick diventa un timer del loop (loop.time() è time.monotonic())"""
+        self._loop = loop
+        if self.deadline is not None and self._timer is None:
+            self._timer = loop.call_at(self.deadline, self._tick)
+
+    def detach(self):
+        """Annulla il timer e invia ciò che resta"""
+        self.flush()
+        self._loop = None
+
+    def _tick(self):
+        self._timer = None
+        self.flush()
+
+    def get_stats(self):
+        """Contatori e rapporto di riduzione (ricevuti / inviati)"""
+        return {
+            'mode': self.mode,
+            'received': self.received,
+            'passthrough': self.passed,
+            'emitted': self.emitted,
+            'pending': len(self.pending),
+            'reduction_ratio': self.received / self.emitted if self.emitted else 0.0,
+        }
+
+    def format_stats(self):
+        """Riepilogo leggibile su una riga"""
+        stats = self.get_stats()
+        return (f"{stats['mode']}: ricevuti {stats['received']}, "
+                f"inviati {stats['emitted']} (passthrough {stats['passthrough']}), "
+                f"riduzione {stats['reduction_ratio']:.1f}x")
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Pool di thread a dimensione fissa per i server OSC di socketserver
+ThreadingOSCUDPServer avvia un thread per ogni datagramma: a qualche
+migliaio di messaggi al secondo la creazione dei thread domina la CPU e
+gli handler girano senza ordine né limite. Qui N thread fissi, ognuno
+con la sua coda limitata: i datagrammi sono assegnati per indirizzo OSC,
+così quelli dello stesso indirizzo restano in ordine. Con una coda piena
+il thread di ricezione attende (block: il buffer del socket fa da
+riserva, poi scarta il kernel) oppure il datagramma viene scartato e
+contato (drop). Con 0 worker ogni datagramma è gestito nel thread di
+ricezione, per gli handler che costano poco.
+"""
+
+import threading
+import traceback
+from collections import deque
+
+from osc_decoder import BUNDLE_PREFIX
+
+POLICY_BLOCK = 'block'  # il thread di ricezione attende (backpressure)
+POLICY_DROP = 'drop'    # il datagramma viene scartato e contato
+POLICIES = (POLICY_BLOCK, POLICY_DROP)
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE = 1024    # datagrammi in coda per worker
+
+# Intestazione di un bundle: "#bundle\0", timetag, dimensione del primo elemento
+_BUNDLE_FIRST_ELEMENT = 20
+
+
+def packet_key(data):
+    """Indirizzo OSC grezzo del datagramma (del primo messaggio, per un bundle)"""
+    start = _BUNDLE_FIRST_ELEMENT if data[:8] == BUNDLE_PREFIX else 0
+    end = data.find(b'\0', start)
+    return data[start:end] if end >= 0 else data[start:]
+
+
+class DispatchPool:
+    """Thread fissi con una coda limitata ciascuno, scelta per chiave
+
+    submit(key, function, *args) esegue function(*args) nel worker della
+    chiave: stessa chiave, stesso worker, stesso ordine di arrivo.
+    submit() va chiamata da un solo thread (quello di ricezione).
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=DEFAULT_QUEUE,
+                 policy=POLICY_BLOCK, name='osc-dispatch'):
+        if policy not in POLICIES:
+            raise ValueError(f"politica sconosciuta: {policy}")
+        if workers < 0 or max_queue < 1:
+            raise ValueError("servono workers >= 0 e max_queue >= 1")
+        self.workers = workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self.name = name
+        self._queues = [deque() for _ in range(workers)]
+        # Un solo lock per coda: il worker attende dati, la ricezione spazio
+        self._conditions = [threading.Condition() for _ in range(workers)]
+        self._threads = []
+        self._running = False
+
+        # Statistiche: submitted, dropped e blocked le scrive solo la
+        # ricezione, ogni worker la sua voce di processed
+        self.submitted = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.errors = 0
+        self.processed = [0] * max(workers, 1)
+
+    @property
+    def inline(self):
+        """True senza worker: tutto nel thread di ricezione"""
+        return self.workers == 0
+
+    def __len__(self):
+        """Elementi in coda su tutti i worker"""
+        return sum(len(queue) for queue in self._queues)
+
+    def start(self):
+        """Avvia i worker (nessuno in modalità inline)"""
+        if self._running:
+            return
+        self._running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(index,),
+                                      name=f'{self.name}-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Ferma i worker dopo aver eseguito ciò che è già in coda"""
+        if not self._running:
+            return
+        self._running = False
+        for condition in self._conditions:
+            with condition:
+                condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, key, function, *args):
+        """Accoda (o esegue, in modalità inline); False se scartato"""
+        self.submitted += 1
+        if not self.workers:
+            self._call(function, args)
+            self.processed[0] += 1
+            return True
+        index = hash(key) % self.workers
+        queue = self._queues[index]
+        condition = self._conditions[index]
+        with condition:
+            if len(queue) >= self.max_queue:
+                if self.policy == POLICY_DROP or not self._running:
+                    self.dropped += 1
+                    return False
+                self.blocked += 1
+                while len(queue) >= self.max_queue and self._running:
+                    condition.wait()
+            queue.append((function, args))
+            # Con un produttore e un consumatore per coda un solo risveglio basta
+            condition.notify()
+        return True
+
+    def _call(self, function, args):
+        try:
+            function(*args)
+        except Exception:
+            # Un handler che fallisce non deve fermare il worker
+            self.errors += 1
+            traceback.print_exc()
+
+    def _run(self, index):
+        queue = self._queues[index]
+        condition = self._conditions[index]
+        processed = self.processed
+        while True:
+            with condition:
+                while not queue:
+                    if not self._running:
+                        return
+                    condition.wait()
+                # Tutto ciò che è in coda in un colpo: un lock per lotto
+                items = list(queue)
+                queue.clear()
+                condition.notify()
+            for function, args in items:
+                self._call(function, args)
+            processed[index] += len(items)
+
+    def register_metrics(self, registry):
+        """Esporta code, scarti e attese del pool"""
+        registry.gauge('dispatch_workers', 'Thread del pool di gestione OSC (0 = inline)',
+                       lambda: self.workers)
+        registry.gauge('dispatch_queued', 'Datagrammi OSC in coda verso i worker',
+                       lambda: len(self))
+        registry.gauge('dispatch_processed_total', 'Datagrammi OSC gestiti dal pool',
+                       lambda: sum(self.processed), kind='counter')
+        registry.gauge('dispatch_dropped_total', 'Datagrammi OSC scartati con la coda piena',
+                       lambda: self.dropped, kind='counter')
+        registry.gauge('dispatch_blocked_total',
+                       'Attese della ricezione per una coda piena (backpressure)',
+                       lambda: self.blocked, kind='counter')
+        registry.gauge('dispatch_errors_total', 'Eccezioni degli handler OSC',
+                       lambda: self.errors, kind='counter')
+
+    def get_stats(self):
+        """Contatori del pool"""
+        return {
+            'workers': self.workers,
+            'policy': self.policy,
+            'queued': len(self),
+            'submitted': self.submitted,
+            'processed': sum(self.processed),
+            'dropped': self.dropped,
+            'blocked': self.blocked,
+            'errors': self.errors,
+        }
+
+    def format_stats(self):
+        """Riepilogo leggibile su una riga"""
+        stats = self.get_stats()
+        mode = 'inline' if not stats['workers'] else f"{stats['workers']} worker"
+        return (f"{mode}, gestiti {stats['processed']}, in coda {stats['queued']}, "
+                f"scartati {stats['dropped']}, attese {stats['blocked']}, "
+                f"errori {stats['errors']}")
+
+
+class PooledServerMixin:
+    """Per i server UDP di socketserver (python-osc): pool al posto di un thread per datagramma
+
+    Da usare con OSCUDPServer (non ThreadingOSCUDPServer), prima della
+    classe del server tra le basi. serve_forever riceve e accoda; gli
+    handler girano nei worker del pool, o subito se il pool è inline.
+    """
+
+    def __init__(self, *args, pool=None, **kwargs):
+        self.pool = pool if pool is not None else DispatchPool()
+        super().__init__(*args, **kwargs)
+        self.pool.start()
+
+    def process_request(self, request, client_address):
+        self.pool.submit(packet_key(request[0]), self._handle_request, request, client_address)
+
+    def _handle_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.stop()
+
+
+def add_pool_arguments(parser, default_workers=DEFAULT_WORKERS):
+    """Opzioni della riga di comando per il pool di gestione"""
+    parser.add_argument('--workers', type=int, default=default_workers,
+                        help=f'Thread di gestione dei messaggi OSC, 0 = nel thread di '
+                             f'ricezione (default: {default_workers})')
+    parser.add_argument('--queue', type=int, default=DEFAULT_QUEUE,
+                        help=f'Datagrammi in coda per thread (default: {DEFAULT_QUEUE})')
+    parser.add_argument('--overflow', choices=POLICIES, default=POLICY_BLOCK,
+                        help='Con la coda piena: block attende (il kernel fa da buffer), '
+                             'drop scarta (default: block)')
+
+
+def pool_from_args(args, parser=None):
+    """DispatchPool dalle opzioni aggiunte con add_pool_arguments()"""
+    try:
+        return DispatchPool(args.workers, args.queue, args.overflow)
+    except ValueError as e:
+        if parser is None:
+            raise
+        parser.error(str(e))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Lotti di frame WebSocket con finestra adattiva
+Con traffico fitto il task di scrittura di un client raccoglie i messaggi
+per una finestra di pochi millisecondi (o fino a N messaggi) e li invia in
+un solo frame: meno frame, meno chiamate di invio e meno lavoro per il
+browser. Un messaggio che arriva dopo una pausa più lunga della finestra
+parte subito, senza attese. La finestra si allarga quando le attese
+raccolgono molti messaggi e si restringe quando ne raccolgono uno solo.
+"""
+
+from metrics import CountHistogram
+from wire_format import MAX_BATCH_FRAMES, batch_binary, batch_text
+
+DEFAULT_MIN_WINDOW_MS = 2.0
+DEFAULT_MAX_WINDOW_MS = 16.0
+DEFAULT_MAX_MESSAGES = 256
+DEFAULT_MAX_BYTES = 64 * 1024
+
+# Motivi dell'invio di un lotto
+FLUSH_IDLE = 'idle'        # primo messaggio dopo una pausa: nessuna attesa
+FLUSH_WINDOW = 'window'    # finestra scaduta
+FLUSH_COUNT = 'count'      # raggiunti N messaggi
+FLUSH_BYTES = 'bytes'      # raggiunti K byte in un frame
+FLUSH_REASONS = (FLUSH_IDLE, FLUSH_WINDOW, FLUSH_COUNT, FLUSH_BYTES)
+
+# Messaggi raccolti da una finestra oltre i quali la finestra raddoppia
+GROW_AT = 4
+
+
+class FrameBatcher:
+    """Parametri e contatori dei lotti, condivisi da tutte le sessioni
+
+    La finestra corrente è di ogni sessione (ClientSession.window_ns):
+    qui ci sono i limiti, il confezionamento dei frame e le statistiche.
+    """
+
+    def __init__(self, min_window_ms=DEFAULT_MIN_WINDOW_MS,
+                 max_window_ms=DEFAULT_MAX_WINDOW_MS,
+                 max_messages=DEFAULT_MAX_MESSAGES, max_bytes=DEFAULT_MAX_BYTES):
+        if not 0 < min_window_ms <= max_window_ms:
+            raise ValueError("serve 0 < finestra minima <= finestra massima")
+        if max_messages < 2 or max_bytes < 1:
+            raise ValueError("servono almeno 2 messaggi e 1 byte per lotto")
+        self.min_window_ns = int(min_window_ms * 1e6)
+        self.max_window_ns = int(max_window_ms * 1e6)
+        self.max_messages = min(max_messages, MAX_BATCH_FRAMES)
+        self.max_bytes = max_bytes
+        self.messages_histogram = CountHistogram('messaggi/frame')
+        self.bytes_histogram = CountHistogram('byte/frame')
+        self.flushes = dict.fromkeys(FLUSH_REASONS, 0)
+
+    def adapt(self, window_ns, reason, messages):
+        """Nuova finestra di una sessione dopo un invio"""
+        if reason == FLUSH_WINDOW and messages >= GROW_AT:
+            return min(window_ns * 2, self.max_window_ns)
+        if messages <= 1:
+            return max(window_ns // 2, self.min_window_ns)
+        return window_ns
+
+    def pack(self, frames):
+        """Frame WebSocket per una sequenza di frame testo/binari già pronti
+
+        I frame consecutivi dello stesso tipo diventano un lotto (al massimo
+        max_bytes, salvo un frame singolo più grande); un lotto di un solo
+        frame parte così com'è. Restituisce (frame, spezzato per i byte).
+        """
+        result = []
+        split = False
+        run = []
+        run_bytes = 0
+        for frame in frames:
+            if run and (type(frame) is not type(run[0])
+                        or run_bytes + len(frame) > self.max_bytes):
+                split = split or type(frame) is type(run[0])
+                result.append(self._close_run(run, run_bytes))
+                run = []
+                run_bytes = 0
+            run.append(frame)
+            run_bytes += len(frame)
+        if run:
+            result.append(self._close_run(run, run_bytes))
+        return result, split
+
+    def _close_run(self, run, run_bytes):
+        self.messages_histogram.record(len(run))
+        self.bytes_histogram.record(run_bytes)
+        if len(run) == 1:
+            return run[0]
+        if type(run[0]) is str:
+            return batch_text(run)
+        return batch_binary(run)
+
+    def format_stats(self):
+        """Riepilogo leggibile su una riga"""
+        flushes = ', '.join(f"{reason} {count}" for reason, count in self.flushes.items())
+        return f"{self.messages_histogram.format_summary()}; invii: {flushes}"
+
+    def register_metrics(self, registry):
+        """Esporta dimensione dei lotti e motivi di invio"""
+        registry.histogram('websocket_batch_messages', 'Messaggi per frame WebSocket inviato',
+                           self.messages_histogram)
+        registry.histogram('websocket_batch_bytes', 'Byte di messaggi per frame WebSocket inviato',
+                           self.bytes_histogram)
+        registry.gauge('websocket_batch_flushes_total', 'Lotti inviati, per motivo',
+                       lambda: [({'reason': reason}, count)
+                                for reason, count in self.flushes.items()],
+                       kind='counter')
+
+
+def add_batch_arguments(parser):
+    """Opzioni --batch-* comuni ai server WebSocket"""
+    group = parser.add_argument_group('lotti WebSocket (client con ?batch=1 nell\'URL)')
+    group.add_argument('--batch-min-ms', type=float, default=DEFAULT_MIN_WINDOW_MS,
+                       help=f'Finestra minima di raccolta in ms (default: {DEFAULT_MIN_WINDOW_MS:g})')
+    group.add_argument('--batch-max-ms', type=float, default=DEFAULT_MAX_WINDOW_MS,
+                       help=f'Finestra massima in ms, 0 disattiva i lotti '
+                            f'(default: {DEFAULT_MAX_WINDOW_MS:g})')
+    group.add_argument('--batch-messages', type=int, default=DEFAULT_MAX_MESSAGES,
+                       help=f'Messaggi per lotto (default: {DEFAULT_MAX_MESSAGES})')
+    group.add_argument('--batch-bytes', type=int, default=DEFAULT_MAX_BYTES,
+                       help=f'Byte per frame di lotto (default: {DEFAULT_MAX_BYTES})')
+
+
+def batcher_from_args(args, parser):
+    """FrameBatcher dalle opzioni --batch-*, None se disattivato"""
+    if args.batch_max_ms <= 0:
+        return None
+    try:
+        return FrameBatcher(min(args.batch_min_ms, args.batch_max_ms), args.batch_max_ms,
+                            args.batch_messages, args.batch_bytes)
+    except ValueError as e:
+        parser.error(str(e))
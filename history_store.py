@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Cronologia messaggi in memoria condivisa
+Ring buffer a capacità fissa di record compatti (timestamp, sorgente,
+id indirizzo, valore tipizzato) leggibile da più processi senza copie
+"""
+
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+MAGIC = b'STRH'
+VERSION = 1
+
+# Intestazione: magic, versione, capacità, dimensione slab, max indirizzi,
+# numero indirizzi registrati, ultima sequenza scritta
+_HEADER = struct.Struct('<4sIIIIIQ')
+_HEADER_SIZE = 64
+_ADDRESS_COUNT_OFFSET = 20
+_LAST_SEQ_OFFSET = 24
+# PID del processo che scrive (0 nei segmenti creati prima di questo campo)
+_OWNER_PID_OFFSET = 32
+
+# Tabella indirizzi: lunghezza (uint8) + testo UTF-8
+ADDRESS_SLOT_SIZE = 64
+
+# Record: sequenza, timestamp, ip, porta, tipo, flag, id indirizzo,
+# dimensione originale, byte usati nello slab
+_RECORD = struct.Struct('<Qd4sHBBIIH6x')
+
+KIND_RAW = 0      # byte del payload
+KIND_FLOATS = 1   # valori numerici float64
+KIND_JSON = 2     # argomenti in JSON UTF-8 (decodificati in lettura)
+KIND_TEXT = 3     # testo UTF-8 restituito così com'è
+
+FLAG_TRUNCATED = 1
+
+NO_ADDRESS = 0xFFFFFFFF
+
+# Segmenti creati da questo processo (il resource tracker li conosce già)
+_created_here = set()
+
+Record = namedtuple('Record', 'seq timestamp source_ip source_port address kind size truncated value')
+
+
+def _in_use(shm):
+    """Perché un segmento esistente non va ricreato ('' se è rimasto orfano)"""
+    if shm.size < _HEADER_SIZE or bytes(shm.buf[:4]) != MAGIC:
+        return "esiste e non è una cronologia streamtorasp"
+    pid = struct.unpack_from('<I', shm.buf, _OWNER_PID_OFFSET)[0]
+    if not pid:
+        return ''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return ''
+    except PermissionError:
+        pass
+    return f"in uso dal processo {pid}"
+
+
+def _shm_size(capacity, slab_size, max_addresses):
+    return (_HEADER_SIZE + max_addresses * ADDRESS_SLOT_SIZE
+            + capacity * (_RECORD.size + slab_size))
+
+
+class HistoryView:
+    """Vista pigra su un intervallo di sequenze: i record si decodificano
+    solo durante l'iterazione, direttamente dalla memoria condivisa"""
+
+    def __init__(self, store, first_seq, last_seq):
+        self.store = store
+        self.first_seq = first_seq
+        self.last_seq = last_seq
+
+    def __len__(self):
+        return max(0, self.last_seq - self.first_seq + 1)
+
+    def __iter__(self):
+        read = self.store.read
+        for seq in range(self.first_seq, self.last_seq + 1):
+            record = read(seq)
+            if record is not None:
+                yield record
+
+    def raw_segments(self):
+        """Memoryview dei record grezzi (al massimo due tratti, per il giro del ring)"""
+        return self.store.raw_segments(self.first_seq, self.last_seq)
+
+
+class HistoryStore:
+    """Ring buffer di record in multiprocessing.shared_memory
+
+    Un solo processo scrive (append); qualunque processo può aprire la
+    stessa memoria con attach() e leggere. Ogni record porta la propria
+    sequenza, così un lettore riconosce i record sovrascritti nel frattempo.
+    """
+
+    def __init__(self, shm, capacity, slab_size, max_addresses, owner):
+        self.shm = shm
+        self.buf = shm.buf
+        self.capacity = capacity
+        self.slab_size = slab_size
+        self.max_addresses = max_addresses
+        self.record_size = _RECORD.size + slab_size
+        self.records_offset = _HEADER_SIZE + max_addresses * ADDRESS_SLOT_SIZE
+        self.owner = owner
+
+        # Cache locale della tabella indirizzi
+        self._address_ids = {}
+        self._addresses = []
+
+    @classmethod
+    def create(cls, name=None, capacity=10000, slab_size=64, max_addresses=4096,
+               replace=False):
+        """Crea la memoria condivisa con capacità fissa
+
+        Un segmento con lo stesso nome rimasto da un'esecuzione terminata
+        viene ricreato; se il processo che lo scrive è ancora attivo (o il
+        segmento non è una cronologia) solleva FileExistsError, a meno di
+        replace=True.
+        """
+        size = _shm_size(capacity, slab_size, max_addresses)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            existing = shared_memory.SharedMemory(name=name)
+            if not replace:
+                reason = _in_use(existing)
+                if reason:
+                    # Il segmento non è nostro: il resource tracker non deve rimuoverlo
+                    resource_tracker.unregister(existing._name, 'shared_memory')
+                    existing.close()
+                    raise FileExistsError(f"cronologia '{name}' {reason}") from None
+            existing.close()
+            existing.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _created_here.add(shm.name)
+
+        shm.buf[:_HEADER_SIZE] = bytes(_HEADER_SIZE)
+        _HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, capacity, slab_size,
+                          max_addresses, 0, 0)
+        struct.pack_into('<I', shm.buf, _OWNER_PID_OFFSET, os.getpid())
+        return cls(shm, capacity, slab_size, max_addresses, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Apre in lettura una cronologia creata da un altro processo"""
+        shm = shared_memory.SharedMemory(name=name)
+        # Chi si collega non deve distruggere il segmento all'uscita
+        if shm.name not in _created_here:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        magic, version, capacity, slab_size, max_addresses, _, _ = \
+            _HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            shm.close()
+            raise ValueError(f"'{name}' non è una cronologia streamtorasp")
+        return cls(shm, capacity, slab_size, max_addresses, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def last_seq(self):
+        """Sequenza dell'ultimo record scritto (0 se vuota)"""
+        return struct.unpack_from('<Q', self.buf, _LAST_SEQ_OFFSET)[0]
+
+    @property
+    def memory_size(self):
+        """Occupazione fissa in byte"""
+        return self.shm.size
+
+    # --- Tabella indirizzi ---
+
+    def address_id(self, address):
+        """Id dell'indirizzo, registrandolo se nuovo (solo chi scrive)"""
+        address_id = self._address_ids.get(address)
+        if address_id is not None:
+            return address_id
+
+        count = struct.unpack_from('<I', self.buf, _ADDRESS_COUNT_OFFSET)[0]
+        if count >= self.max_addresses:
+            return NO_ADDRESS
+        encoded = address.encode('utf-8')[:ADDRESS_SLOT_SIZE - 1]
+        offset = _HEADER_SIZE + count * ADDRESS_SLOT_SIZE
+        self.buf[offset] = len(encoded)
+        self.buf[offset + 1:offset + 1 + len(encoded)] = encoded
+        struct.pack_into('<I', self.buf, _ADDRESS_COUNT_OFFSET, count + 1)
+
+        self._address_ids[address] = count
+        return count
+
+    def address_for(self, address_id):
+        """Testo dell'indirizzo dato il suo id"""
+        if address_id == NO_ADDRESS:
+            return None
+        if address_id >= len(self._addresses):
+            count = struct.unpack_from('<I', self.buf, _ADDRESS_COUNT_OFFSET)[0]
+            for index in range(len(self._addresses), count):
+                offset = _HEADER_SIZE + index * ADDRESS_SLOT_SIZE
+                length = self.buf[offset]
+                self._addresses.append(
+                    str(self.buf[offset + 1:offset + 1 + length], 'utf-8'))
+            if address_id >= len(self._addresses):
+                return None
+        return self._addresses[address_id]
+
+    # --- Scrittura ---
+
+    def append(self, timestamp, source, address, kind, payload, size=None):
+        """Aggiunge un record in O(1) e restituisce la sua sequenza"""
+        seq = self.last_seq + 1
+        offset = self.records_offset + (seq % self.capacity) * self.record_size
+
+        # Invalida subito lo slot: un lettore non deve mescolare vecchio e nuovo
+        struct.pack_into('<Q', self.buf, offset, 0)
+
+        length = len(payload)
+        flags = 0
+        if length > self.slab_size:
+            length = self.slab_size
+            flags |= FLAG_TRUNCATED
+        slab = offset + _RECORD.size
+        self.buf[slab:slab + length] = payload[:length]
+
+        if source:
+            ip = socket.inet_aton(source[0])
+            port = source[1]
+        else:
+            ip = b'\0\0\0\0'
+            port = 0
+        address_id = NO_ADDRESS if address is None else self.address_id(address)
+        if size is None:
+            size = len(payload)
+
+        # La sequenza va scritta per ultima: rende il record visibile
+        _RECORD.pack_into(self.buf, offset, 0, timestamp, ip, port, kind, flags,
+                          address_id, size, length)
+        struct.pack_into('<Q', self.buf, offset, seq)
+        struct.pack_into('<Q', self.buf, _LAST_SEQ_OFFSET, seq)
+        return seq
+
+    def append_values(self, timestamp, source, address, values):
+        """Aggiunge argomenti OSC: float64 se sono tutti float, altrimenti JSON"""
+        if values and all(type(v) is float for v in values):
+            payload = struct.pack(f'<{len(values)}d', *values)
+            return self.append(timestamp, source, address, KIND_FLOATS, payload)
+        payload = json.dumps(list(values), default=str).encode('utf-8')
+        return self.append(timestamp, source, address, KIND_JSON, payload)
+
+    # --- Lettura ---
+
+    def read(self, seq):
+        """Legge il record di sequenza seq (None se sovrascritto o non scritto)"""
+        offset = self.records_offset + (seq % self.capacity) * self.record_size
+        (record_seq, timestamp, ip, port, kind, flags, address_id, size,
+         length) = _RECORD.unpack_from(self.buf, offset)
+        if record_seq != seq:
+            return None
+
+        slab = offset + _RECORD.size
+        if kind == KIND_FLOATS:
+            value = struct.unpack_from(f'<{length // 8}d', self.buf, slab)
+        else:
+            value = bytes(self.buf[slab:slab + length])
+            if kind == KIND_JSON and not flags & FLAG_TRUNCATED:
+                value = json.loads(value)
+            elif kind == KIND_TEXT:
+                value = value.decode('utf-8', 'replace')
+
+        # Se nel frattempo lo scrittore ha riusato lo slot, il record non vale
+        if struct.unpack_from('<Q', self.buf, offset)[0] != seq:
+            return None
+        return Record(seq, timestamp, socket.inet_ntoa(ip), port,
+                      self.address_for(address_id), kind, size,
+                      bool(flags & FLAG_TRUNCATED), value)
+
+    def _clamp(self, first_seq, last_seq):
+        return max(first_seq, last_seq - self.capacity + 1, 1)
+
+    def last(self, count):
+        """Vista sugli ultimi count record"""
+        last_seq = self.last_seq
+        return HistoryView(self, self._clamp(last_seq - count + 1, last_seq), last_seq)
+
+    def since(self, seq, limit=None):
+        """Vista sui record con sequenza maggiore di seq"""
+        last_seq = self.last_seq
+        first_seq = self._clamp(seq + 1, last_seq)
+        if limit is not None:
+            last_seq = min(last_seq, first_seq + limit - 1)
+        return HistoryView(self, first_seq, last_seq)
+
+    def raw_segments(self, first_seq, last_seq):
+        """Memoryview sui record grezzi tra due sequenze (senza copie)"""
+        if last_seq < first_seq:
+            return []
+        start = first_seq % self.capacity
+        end = last_seq % self.capacity
+        base = self.records_offset
+        size = self.record_size
+        if start <= end:
+            return [self.buf[base + start * size:base + (end + 1) * size]]
+        return [self.buf[base + start * size:base + self.capacity * size],
+                self.buf[base:base + (end + 1) * size]]
+
+    def get_stats(self):
+        """Restituisce le statistiche della cronologia"""
+        last_seq = self.last_seq
+        return {
+            'name': self.name,
+            'capacity': self.capacity,
+            'stored': min(last_seq, self.capacity),
+            'last_seq': last_seq,
+            'slab_size': self.slab_size,
+            'memory_bytes': self.memory_size,
+        }
+
+    def close(self):
+        """Chiude la memoria condivisa (e la rimuove se è di chi l'ha creata)"""
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def format_record(record):
+    """Riga leggibile per un record"""
+    time_str = time.strftime('%H:%M:%S', time.localtime(record.timestamp))
+    value = record.value
+    if isinstance(value, bytes):
+        try:
+            value = value.decode('utf-8')
+        except UnicodeDecodeError:
+            value = value.hex()
+    source = f"{record.source_ip}:{record.source_port}"
+    return f"#{record.seq} [{time_str}] {source} {record.address or '-'} -> {value}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Legge una cronologia in memoria condivisa')
+    parser.add_argument('name', help='Nome della memoria condivisa (es. streamtorasp_osc)')
+    parser.add_argument('-n', '--count', type=int, default=20,
+                        help='Numero di record da mostrare (default: 20)')
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='Continua a mostrare i nuovi record')
+    parser.add_argument('--stats', action='store_true', help='Mostra solo le statistiche')
+    args = parser.parse_args()
+
+    try:
+        store = HistoryStore.attach(args.name)
+    except FileNotFoundError:
+        print(f"Cronologia '{args.name}' non trovata")
+        sys.exit(1)
+
+    try:
+        if args.stats:
+            print(json.dumps(store.get_stats(), indent=2))
+            return
+        last_seq = 0
+        for record in store.last(args.count):
+            print(format_record(record))
+            last_seq = record.seq
+        while args.follow:
+            time.sleep(0.2)
+            for record in store.since(last_seq):
+                print(format_record(record))
+                last_seq = record.seq
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Log asincrono per i messaggi ad alta frequenza
+Chi riceve i pacchetti si limita ad accodare (deque, append atomico senza
+lock); un thread in background formatta i record, timestamp compreso, e li
+scrive a lotti. Per ogni indirizzo si mostrano i primi N messaggi, poi uno
+ogni M.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+LEVEL_QUIET = 0     # nessun log per pacchetto
+LEVEL_NORMAL = 1    # log campionato per indirizzo
+LEVEL_VERBOSE = 2   # tutti i pacchetti
+
+DEFAULT_FIRST = 20
+DEFAULT_EVERY = 100
+DEFAULT_MAX_PENDING = 10000
+DEFAULT_INTERVAL = 0.05
+_MAX_KEYS = 65536
+
+# Cache dell'ultimo secondo formattato: strftime una volta al secondo
+_clock_cache = (None, '')
+
+
+def format_clock(timestamp):
+    """HH:MM:SS.mmm di un istante time.time()"""
+    global _clock_cache
+    second = int(timestamp)
+    cached_second, prefix = _clock_cache
+    if second != cached_second:
+        prefix = time.strftime('%H:%M:%S', time.localtime(second))
+        _clock_cache = (second, prefix)
+    return f"{prefix}.{int((timestamp - second) * 1000):03d}"
+
+
+def level_from_args(quiet=False, verbose=False):
+    """Livello di log dalle opzioni -q/-v della riga di comando"""
+    if quiet:
+        return LEVEL_QUIET
+    if verbose:
+        return LEVEL_VERBOSE
+    return LEVEL_NORMAL
+
+
+class LogSink:
+    """Coda di record scritta a lotti da un thread in background
+
+    Gli argomenti dei record vengono formattati più tardi nel thread di
+    scrittura: devono essere valori immutabili (niente memoryview sui
+    buffer di ricezione).
+    """
+
+    def __init__(self, stream=None, level=LEVEL_NORMAL, first=DEFAULT_FIRST,
+                 every=DEFAULT_EVERY, max_pending=DEFAULT_MAX_PENDING,
+                 interval=DEFAULT_INTERVAL):
+        # stream None: sys.stdout al momento della scrittura
+        self.stream = stream
+        self.level = level
+        self.first = first
+        self.every = every
+        self.max_pending = max_pending
+        self.interval = interval
+
+        self._queue = deque()
+        self._counts = {}
+        self._writer = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+        # Statistiche
+        self.written = 0
+        self.suppressed = 0
+        self.dropped = 0
+
+        # Nei processi worker (fork) il thread di scrittura non esiste:
+        # si riparte da zero e lo si avvia al primo record
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def configure(self, level=None, first=None, every=None):
+        """Cambia livello e campionamento (es. dalle opzioni della CLI)"""
+        if level is not None:
+            self.level = level
+        if first is not None:
+            self.first = first
+        if every is not None:
+            self.every = max(1, every)
+
+    def sample(self, key):
+        """Numero del messaggio per questa chiave se va mostrato, altrimenti 0"""
+        if self.level == LEVEL_QUIET:
+            return 0
+        counts = self._counts
+        count = counts.get(key, 0) + 1
+        if count == 1 and len(counts) >= _MAX_KEYS:
+            counts.clear()
+        counts[key] = count
+        if self.level == LEVEL_NORMAL and count > self.first and (count - self.first) % self.every:
+            self.suppressed += 1
+            return 0
+        return count
+
+    def write(self, fmt, *args, sample=0):
+        """Accoda un record senza campionamento (ignorato solo in quiet)"""
+        if self.level == LEVEL_QUIET:
+            return
+        if len(self._queue) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._queue.append((time.time(), fmt, args, sample))
+        if self._writer is None:
+            self._start()
+
+    def log(self, key, fmt, *args):
+        """Accoda un record con campionamento per chiave (es. indirizzo)"""
+        sample = self.sample(key)
+        if sample:
+            self.write(fmt, *args, sample=sample)
+
+    def _start(self):
+        # Il lock serve solo al primo record, non sul percorso normale
+        with self._start_lock:
+            if self._writer is not None:
+                return
+            self._stop.clear()
+            self._writer = threading.Thread(target=self._run, name='log-sink', daemon=True)
+            self._writer.start()
+
+    def _after_fork(self):
+        self._queue = deque()
+        self._counts = {}
+        self._writer = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Formatta e scrive in un'unica write i record in coda"""
+        popleft = self._queue.popleft
+        first = self.first
+        lines = []
+        while True:
+            try:
+                timestamp, fmt, args, sample = popleft()
+            except IndexError:
+                break
+            text = fmt % args if args else fmt
+            if sample > first:
+                text = f"{text} (#{sample})"
+            lines.append(f"[{format_clock(timestamp)}] {text}\n")
+        if not lines:
+            return
+        stream = self.stream or sys.stdout
+        try:
+            stream.write(''.join(lines))
+            stream.flush()
+        except (OSError, ValueError):
+            # Console chiusa: il log non deve fermare la ricezione
+            self.dropped += len(lines)
+            return
+        self.written += len(lines)
+
+    def get_stats(self):
+        """Contatori del log"""
+        return {
+            'written': self.written,
+            'suppressed': self.suppressed,
+            'dropped': self.dropped,
+            'pending': len(self._queue),
+        }
+
+    def close(self):
+        """Ferma il thread di scrittura e scrive ciò che resta"""
+        writer = self._writer
+        if writer is not None:
+            self._stop.set()
+            writer.join(timeout=1.0)
+            self._writer = None
+        self.flush()
+        if self.suppressed or self.dropped:
+            print(f"Log: {self.written} righe scritte, {self.suppressed} campionate via, "
+                  f"{self.dropped} perse")
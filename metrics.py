@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Strumenti di misura per i bridge UDP/OSC
+Istogramma di latenza log-lineare (stile HDR), contatori e registro delle
+metriche esportabile in formato Prometheus o come dizionario (messaggio
+"stats" sul WebSocket). Registrare un evento costa un incremento di
+attributo: niente lock, niente allocazioni sul percorso caldo.
+"""
+
+import json
+import os
+import time
+
+# Sotto-bucket per ogni potenza di 2: 2**(SUB_BITS-1) bucket per ottava,
+# precisione relativa ~12% con SUB_BITS = 4
+SUB_BITS = 4
+_SUB_HALF = 1 << (SUB_BITS - 1)
+_BUCKETS = (1 << SUB_BITS) + _SUB_HALF * 64
+# Minimo di un istogramma vuoto: qualsiasi campione è più piccolo
+_NO_MIN = 1 << 64
+
+# Quantili esportati per ogni istogramma
+QUANTILES = (0.5, 0.99, 0.999)
+
+
+def _bucket_index(value):
+    """Indice del bucket per un valore intero non negativo"""
+    bits = value.bit_length()
+    if bits <= SUB_BITS:
+        return value
+    shift = bits - SUB_BITS
+    return shift * _SUB_HALF + (value >> shift)
+
+
+def _bucket_lower(index):
+    """Limite inferiore del bucket di indice dato"""
+    if index < (1 << SUB_BITS):
+        return index
+    shift = index // _SUB_HALF - 1
+    return (index - shift * _SUB_HALF) << shift
+
+
+def _bucket_upper(index):
+    """Limite superiore (escluso) del bucket di indice dato"""
+    if index < (1 << SUB_BITS):
+        return index + 1
+    shift = index // _SUB_HALF - 1
+    return (index - shift * _SUB_HALF + 1) << shift
+
+
+class LatencyHistogram:
+    """Istogramma di latenze in nanosecondi con percentili approssimati"""
+
+    # Divisore per l'esportazione Prometheus (nanosecondi -> secondi)
+    scale = 1e9
+
+    def __init__(self, name='latency'):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        """Azzera tutti i conteggi"""
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = _NO_MIN
+        self.max = 0
+
+    def record(self, value_ns):
+        """Registra una latenza in nanosecondi"""
+        if value_ns < 0:
+            value_ns = 0
+        # _bucket_index() in linea: è il percorso caldo
+        bits = value_ns.bit_length()
+        if bits <= SUB_BITS:
+            self.counts[value_ns] += 1
+        else:
+            shift = bits - SUB_BITS
+            self.counts[shift * _SUB_HALF + (value_ns >> shift)] += 1
+        self.count += 1
+        self.total += value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+        if value_ns < self.min:
+            self.min = value_ns
+
+    def record_since(self, start_ns):
+        """Registra il tempo trascorso da start_ns (perf_counter_ns)"""
+        self.record(time.perf_counter_ns() - start_ns)
+
+    def percentile(self, p):
+        """Valore approssimato al percentile p (0-100), in nanosecondi"""
+        if not self.count:
+            return 0
+        target = max(1, int(self.count * p / 100.0 + 0.5))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if not bucket_count:
+                continue
+            seen += bucket_count
+            if seen >= target:
+                # Punto medio del bucket, limitato da min/max osservati
+                mid = (_bucket_lower(index) + _bucket_upper(index) - 1) // 2
+                return min(max(mid, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """Riepilogo in microsecondi"""
+        if not self.count:
+            return {'name': self.name, 'count': 0}
+        return {
+            'name': self.name,
+            'count': self.count,
+            'min_us': self.min / 1000.0,
+            'mean_us': self.total / self.count / 1000.0,
+            'p50_us': self.percentile(50) / 1000.0,
+            'p99_us': self.percentile(99) / 1000.0,
+            'p999_us': self.percentile(99.9) / 1000.0,
+            'max_us': self.max / 1000.0,
+        }
+
+    def format_summary(self):
+        """Riepilogo leggibile su una riga"""
+        s = self.summary()
+        if not s['count']:
+            return f"{self.name}: nessun campione"
+        return (f"{self.name}: n={s['count']} "
+                f"p50={s['p50_us']:.0f}us p99={s['p99_us']:.0f}us "
+                f"p999={s['p999_us']:.0f}us max={s['max_us']:.0f}us")
+
+
+class CountHistogram(LatencyHistogram):
+    """Istogramma di quantità intere (messaggi, byte), esportato senza unità"""
+
+    scale = 1
+
+    def summary(self):
+        """Riepilogo nelle unità registrate"""
+        if not self.count:
+            return {'name': self.name, 'count': 0}
+        return {
+            'name': self.name,
+            'count': self.count,
+            'min': self.min,
+            'mean': self.total / self.count,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+    def format_summary(self):
+        """Riepilogo leggibile su una riga"""
+        s = self.summary()
+        if not s['count']:
+            return f"{self.name}: nessun campione"
+        return (f"{self.name}: n={s['count']} media={s['mean']:.1f} "
+                f"p50={s['p50']} p99={s['p99']} max={s['max']}")
+
+
+class Counter:
+    """Contatore monotono: inc() è un solo incremento di attributo"""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Aggiunge amount al contatore"""
+        self.value += amount
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+class MetricsRegistry:
+    """Elenco delle metriche di un processo
+
+    Contatori e istogrammi vengono aggiornati direttamente da chi li
+    possiede; i valori già tenuti altrove (statistiche del ricevitore,
+    code dei client, contatori del kernel) si leggono solo al momento
+    dell'esportazione, con una funzione registrata qui.
+    """
+
+    def __init__(self, prefix='streamtorasp'):
+        self.prefix = prefix
+        # nome -> (tipo, descrizione, sorgente)
+        self._metrics = {}
+
+    def counter(self, name, help_text):
+        """Crea (o restituisce) un contatore"""
+        entry = self._metrics.get(name)
+        if entry is None:
+            entry = ('counter', help_text, Counter())
+            self._metrics[name] = entry
+        return entry[2]
+
+    def histogram(self, name, help_text, histogram=None):
+        """Registra un istogramma di latenze (in nanosecondi) o un CountHistogram"""
+        if histogram is None:
+            histogram = LatencyHistogram(name)
+        self._metrics[name] = ('summary', help_text, histogram)
+        return histogram
+
+    def gauge(self, name, help_text, read, kind='gauge'):
+        """Registra un valore letto all'esportazione
+
+        read() restituisce un numero, None (metrica assente) oppure una
+        lista di (etichette, valore) per le metriche con etichette. Con
+        kind='counter' il valore è un contatore tenuto altrove.
+        """
+        self._metrics[name] = (kind, help_text, read)
+
+    def _samples(self, kind, source):
+        """Lista di (etichette, valore) di una metrica non istogramma"""
+        if kind == 'counter' and type(source) is Counter:
+            return [({}, source.value)]
+        value = source()
+        if value is None:
+            return []
+        if isinstance(value, list):
+            return value
+        return [({}, value)]
+
+    def snapshot(self):
+        """Tutti i valori correnti in un dizionario serializzabile in JSON"""
+        result = {}
+        for name, (kind, help_text, source) in self._metrics.items():
+            if kind == 'summary':
+                result[name] = source.summary()
+                continue
+            samples = self._samples(kind, source)
+            if len(samples) == 1 and not samples[0][0]:
+                result[name] = samples[0][1]
+            elif samples:
+                result[name] = [dict(labels, value=value) for labels, value in samples]
+        return result
+
+    def render_prometheus(self):
+        """Testo nel formato di esposizione di Prometheus (versione 0.0.4)"""
+        lines = []
+        for name, (kind, help_text, source) in self._metrics.items():
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            if kind == 'summary':
+                # Istogrammi esportati come summary (latenze in secondi)
+                scale = source.scale
+                for quantile in QUANTILES:
+                    value = source.percentile(quantile * 100) / scale
+                    lines.append(f'{full_name}{{quantile="{quantile}"}} {value!r}')
+                lines.append(f"{full_name}_sum {source.total / scale!r}")
+                lines.append(f"{full_name}_count {source.count}")
+                continue
+            for labels, value in self._samples(kind, source):
+                lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def is_stats_request(message):
+    """True per il comando {"type": "stats"} inviato da un client WebSocket"""
+    if not isinstance(message, str) or '"stats"' not in message:
+        return False
+    try:
+        return json.loads(message).get('type') == 'stats'
+    except (ValueError, AttributeError):
+        return False
+
+
+def stats_message(registry):
+    """Frame JSON del messaggio "stats" con tutte le metriche correnti"""
+    return json.dumps({'type': 'stats', 'timestamp': time.time(),
+                       'metrics': registry.snapshot()})
+
+
+def _proc_udp_rows():
+    """Campi delle righe di /proc/net/udp e udp6; None se non esistono (non Linux)"""
+    rows = []
+    found = False
+    for path in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(path) as f:
+                next(f)
+                rows.extend(line.split() for line in f)
+        except OSError:
+            continue
+        found = True
+    return rows if found else None
+
+
+def read_udp_drops(port):
+    """Contatori del kernel per i socket UDP in ascolto su port
+
+    Restituisce {'rx_queue': byte in attesa, 'drops': datagrammi scartati
+    per buffer pieno, 'sockets': socket trovati} oppure None dove
+    /proc/net/udp non esiste (non Linux).
+    """
+    rows = _proc_udp_rows()
+    if rows is None:
+        return None
+    rx_queue = drops = sockets = 0
+    for fields in rows:
+        # local_address è IP:PORTA in esadecimale; drops è l'ultima colonna
+        if int(fields[1].rsplit(':', 1)[1], 16) != port:
+            continue
+        rx_queue += int(fields[4].split(':')[1], 16)
+        drops += int(fields[-1])
+        sockets += 1
+    return {'rx_queue': rx_queue, 'drops': drops, 'sockets': sockets}
+
+
+def read_socket_drops(sock):
+    """Datagrammi scartati dal kernel per un solo socket (cercato per inode)"""
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+    except OSError:
+        return None
+    for fields in _proc_udp_rows() or ():
+        if fields[9] == inode:
+            return int(fields[-1])
+    return None
+
+
+def register_udp_socket(registry, *ports):
+    """Esporta coda di ricezione e drop del kernel per le porte UDP
+
+    Con più porte (server unificato) ogni metrica ha l'etichetta port.
+    """
+    # Una lettura di /proc per porta ed esportazione, condivisa dalle due metriche
+    cache = {'at': 0.0, 'values': {}}
+
+    def read(field):
+        now = time.monotonic()
+        if now - cache['at'] > 0.5:
+            cache['values'] = {port: read_udp_drops(port) for port in ports}
+            cache['at'] = now
+        values = cache['values']
+        if len(ports) == 1:
+            value = values[ports[0]]
+            return None if value is None else value[field]
+        return [({'port': port}, value[field]) for port, value in values.items()
+                if value is not None]
+
+    where = f"sulla porta {ports[0]}" if len(ports) == 1 else "per porta"
+    registry.gauge('kernel_udp_drops_total', f'Datagrammi scartati dal kernel {where}',
+                   lambda: read('drops'), kind='counter')
+    registry.gauge('kernel_udp_rx_queue_bytes', f'Byte in attesa nel buffer del socket {where}',
+                   lambda: read('rx_queue'))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+API HTTP dei dati OSC, indipendente dal server web
+Le stesse risposte (cronologia, canali numerici, statistiche sulle
+finestre) servono all'app Flask e al server unificato asyncio: ogni
+funzione restituisce (stato HTTP, corpo), con il corpo come dizionario
+da serializzare in JSON oppure come bytes (formato binario dei canali).
+"""
+
+import math
+import time
+from urllib.parse import parse_qsl
+
+from channel_store import RESAMPLE_METHODS, RESAMPLE_PREVIOUS, encode_binary, json_values
+
+HISTORY_API_COUNT = 100  # Messaggi restituiti da /api/osc-data
+LONG_POLL_MAX_TIMEOUT = 30.0  # Secondi massimi di attesa per /api/osc-data/wait
+LONG_POLL_DEFAULT_TIMEOUT = 20.0
+CHANNEL_MAX_POINTS = 100000  # Punti massimi per risposta (ricampionamento)
+
+
+class QueryArgs:
+    """Parametri della query string con get(nome, default, type) come in Flask
+
+    Un valore non convertibile con type restituisce il default, come
+    request.args di werkzeug: le funzioni qui sotto accettano l'uno o l'altro.
+    """
+
+    def __init__(self, query=''):
+        self.values = {}
+        for name, value in parse_qsl(query, keep_blank_values=True):
+            # Conta il primo valore, come in werkzeug
+            self.values.setdefault(name, value)
+
+    def get(self, name, default=None, type=None):
+        value = self.values.get(name)
+        if value is None:
+            return default
+        if type is not None:
+            try:
+                return type(value)
+            except ValueError:
+                return default
+        return value
+
+
+def etag_matches(if_none_match, etag):
+    """True se l'intestazione If-None-Match contiene l'ETag (o '*')"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == '*' or candidate.strip('"') == etag:
+            return True
+    return False
+
+
+def format_history_record(record):
+    """Converte un record della cronologia nel formato dell'API."""
+    # Un JSON troncato non è decodificabile: si restituiscono gli argomenti vuoti
+    args = [] if isinstance(record.value, bytes) else list(record.value)
+    return {
+        'seq': record.seq,
+        'address': record.address,
+        'args': args,
+        'timestamp': record.timestamp,
+        'time_str': time.strftime('%H:%M:%S', time.localtime(record.timestamp))
+    }
+
+
+def build_osc_response(osc_data, coalescer=None, since=None):
+    """Costruisce la risposta JSON: completa, oppure solo i messaggi dopo since."""
+    history_store = osc_data['message_history']
+    last_seq = history_store.last_seq
+    if since is None:
+        view = history_store.last(HISTORY_API_COUNT)
+    else:
+        view = history_store.since(since, limit=HISTORY_API_COUNT)
+    history = [format_history_record(record) for record in view]
+
+    response = {
+        'last_message': osc_data['last_message'],
+        'last_address': osc_data['last_address'],
+        'last_timestamp': osc_data['last_timestamp'],
+        'last_seq': last_seq,
+        'message_count': len(history),
+        'history': history
+    }
+    if since is not None:
+        # Il client ha perso dei messaggi (troppo vecchi o oltre il limite)
+        response['gap'] = view.first_seq > since + 1 or view.last_seq < last_seq
+    if coalescer is not None and coalescer.enabled:
+        response['coalescing'] = coalescer.get_stats()
+    return response
+
+
+def long_poll_timeout(args):
+    """Attesa richiesta con ?timeout=<s>, limitata a LONG_POLL_MAX_TIMEOUT"""
+    return min(args.get('timeout', default=LONG_POLL_DEFAULT_TIMEOUT, type=float),
+               LONG_POLL_MAX_TIMEOUT)
+
+
+def _positive(*values):
+    """True se tutti i valori sono numeri finiti maggiori di zero (niente nan/inf)"""
+    return all(math.isfinite(value) and value > 0 for value in values)
+
+
+def channel_response(address, timestamps, values, args):
+    """Campioni in JSON oppure, con ?format=binary, nel formato binario di channel_store."""
+    if args.get('format') == 'binary':
+        return 200, encode_binary(timestamps, values)
+    return 200, {
+        'address': address,
+        'count': len(timestamps),
+        'timestamps': timestamps.tolist(),
+        'values': json_values(values)
+    }
+
+
+def list_channels(channels):
+    """Elenco dei canali numerici e memoria usata (attuale e massima)."""
+    return 200, {'channels': channels.list_channels(), 'stats': channels.get_stats()}
+
+
+def get_channel(channels, address, args):
+    """Campioni di un canale: ?last=N, oppure ?rate=<Hz>&seconds=<s> ricampionati.
+
+    ?method=linear interpola invece di tenere l'ultimo valore; ?format=binary
+    restituisce i campioni in binario invece che in JSON.
+    """
+    rate = args.get('rate', type=float)
+    if rate:
+        seconds = args.get('seconds', default=10.0, type=float)
+        method = args.get('method', default=RESAMPLE_PREVIOUS)
+        if (method not in RESAMPLE_METHODS or not _positive(rate, seconds)
+                or rate * seconds > CHANNEL_MAX_POINTS):
+            return 400, {'error': 'parametri di ricampionamento non validi'}
+        result = channels.resample(address, rate, seconds, method=method)
+    else:
+        result = channels.last(address, args.get('last', default=500, type=int))
+    if result is None:
+        return 404, {'error': f'canale sconosciuto: {address}'}
+    return channel_response(address, *result, args)
+
+
+def get_channel_stats(channels, address, args):
+    """min/max/media/RMS sugli ultimi ?window=<s> secondi.
+
+    Con ?rate=<Hz>&seconds=<s> restituisce la serie delle statistiche su
+    finestre mobili, ricampionata a rate.
+    """
+    window = args.get('window', default=1.0, type=float)
+    rate = args.get('rate', type=float)
+    if not _positive(window):
+        return 400, {'error': 'finestra non valida'}
+    if not rate:
+        stats = channels.window_stats(address, window)
+        if stats is None and address not in channels.channels:
+            return 404, {'error': f'canale sconosciuto: {address}'}
+        return 200, {'address': address, 'window': window, 'stats': stats}
+
+    seconds = args.get('seconds', default=10.0, type=float)
+    if not _positive(rate, seconds) or rate * (seconds + window) > CHANNEL_MAX_POINTS:
+        return 400, {'error': 'parametri di ricampionamento non validi'}
+    result = channels.rolling(address, window, rate, seconds)
+    if result is None:
+        return 404, {'error': f'canale sconosciuto: {address}'}
+    grid, series = result
+    return 200, {
+        'address': address,
+        'window': window,
+        'rate': rate,
+        'timestamps': grid.tolist(),
+        **{name: json_values(values) for name, values in series.items()}
+    }
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Decoder OSC 1.0/1.1 senza copie
+Lavora su bytes, bytearray o memoryview e compila una struct.Struct
+per ogni firma di type tag (",ffff" -> una sola unpack_from)
+"""
+
+import struct
+from collections import namedtuple
+
+OSCMessage = namedtuple('OSCMessage', 'address typetags args')
+OSCBundle = namedtuple('OSCBundle', 'timetag elements')
+
+BUNDLE_PREFIX = b'#bundle\0'
+# Timetag speciale: "esegui subito"
+IMMEDIATELY = 1
+# Secondi tra l'epoca NTP (1900) e l'epoca Unix (1970)
+NTP_EPOCH_OFFSET = 2208988800
+# Livelli di bundle annidati accettati (oltre: OSCDecodeError, non RecursionError)
+MAX_BUNDLE_DEPTH = 32
+
+# Tipi a dimensione fissa -> codice struct (big-endian)
+_FIXED_CODES = {
+    'i': 'i',   # int32
+    'f': 'f',   # float32
+    'h': 'q',   # int64
+    'd': 'd',   # float64
+    't': 'Q',   # timetag NTP 64 bit
+    'r': 'I',   # colore RGBA32
+    'c': 'I',   # carattere ASCII su 32 bit
+    'm': '4s',  # messaggio MIDI
+}
+# Tipi senza dati nel payload
+_CONSTANTS = {
+    'T': True,
+    'F': False,
+    'N': None,
+    'I': float('inf'),  # Infinitum (OSC 1.0) / Impulse (OSC 1.1)
+}
+
+
+class OSCDecodeError(ValueError):
+    """Pacchetto OSC malformato"""
+
+
+def _char(code):
+    """Carattere di un argomento 'c' (OSCDecodeError fuori dall'intervallo Unicode)"""
+    if code > 0x10FFFF:
+        raise OSCDecodeError(f"carattere OSC non valido: {code:#x}")
+    return chr(code)
+
+
+# Tipi che richiedono una conversione dopo l'unpack
+_CONVERTERS = {
+    'c': _char,
+    'm': tuple,
+}
+
+_INT32 = struct.Struct('>i')
+_BUNDLE_HEADER = struct.Struct('>8sQ')
+
+_plans = {}
+_MAX_PLANS = 1024
+# Costruzione diretta della tupla, più rapida di OSCMessage(...)
+_new_message = tuple.__new__
+
+
+def _find_nul(data, pos, end):
+    """Posizione del primo byte nullo a partire da pos (stringa OSC allineata)"""
+    if type(data) is not memoryview:
+        return data.find(b'\0', pos, end)
+    # memoryview non ha find(): le stringhe OSC sono riempite fino a un
+    # multiplo di 4 byte, quindi basta controllare l'ultimo byte di ogni parola
+    i = pos + 3
+    while i < end:
+        if data[i] == 0:
+            while i > pos and data[i - 1] == 0:
+                i -= 1
+            return i
+        i += 4
+    return -1
+
+
+def _read_string(data, pos, end):
+    """Legge una stringa OSC: (testo, posizione successiva)"""
+    nul = _find_nul(data, pos, end)
+    if nul < 0:
+        raise OSCDecodeError('stringa OSC non terminata')
+    next_pos = pos + ((nul - pos + 4) & ~3)
+    if next_pos > end:
+        raise OSCDecodeError('stringa OSC troncata')
+    try:
+        return str(data[pos:nul], 'utf-8'), next_pos
+    except UnicodeDecodeError:
+        raise OSCDecodeError('stringa OSC non UTF-8') from None
+
+
+def _compile(typetags):
+    """Compila il piano di decodifica per una firma di type tag"""
+    # Caso veloce: solo tipi numerici a dimensione fissa senza conversioni
+    if all(tag in _FIXED_CODES and tag not in _CONVERTERS for tag in typetags):
+        plan = struct.Struct('>' + ''.join(_FIXED_CODES[tag] for tag in typetags))
+        return plan
+
+    ops = []
+    run = []
+
+    def flush_run():
+        if run:
+            converters = tuple(_CONVERTERS.get(tag) for tag in run)
+            if not any(converters):
+                converters = None
+            ops.append(('fixed', struct.Struct(
+                '>' + ''.join(_FIXED_CODES[tag] for tag in run)), converters))
+            del run[:]
+
+    for tag in typetags:
+        if tag in _FIXED_CODES:
+            run.append(tag)
+            continue
+        flush_run()
+        if tag in ('s', 'S'):
+            ops.append(('string', None, None))
+        elif tag == 'b':
+            ops.append(('blob', None, None))
+        elif tag in _CONSTANTS:
+            ops.append(('const', _CONSTANTS[tag], None))
+        elif tag == '[':
+            ops.append(('open', None, None))
+        elif tag == ']':
+            ops.append(('close', None, None))
+        else:
+            raise OSCDecodeError(f"type tag non supportato: {tag!r}")
+    flush_run()
+    return tuple(ops)
+
+
+def _get_plan(raw_typetags):
+    """Piano in cache per la firma grezza (bytes, virgola inclusa)"""
+    entry = _plans.get(raw_typetags)
+    if entry is None:
+        try:
+            typetag_string = str(raw_typetags, 'utf-8')
+        except UnicodeDecodeError:
+            raise OSCDecodeError('type tag non UTF-8') from None
+        if not typetag_string.startswith(','):
+            raise OSCDecodeError('stringa di type tag mancante')
+        typetags = typetag_string[1:]
+        entry = (typetags, _compile(typetags))
+        if len(_plans) >= _MAX_PLANS:
+            _plans.clear()
+        _plans[raw_typetags] = entry
+    return entry
+
+
+def _run_plan(plan, data, pos, end):
+    """Esegue un piano generico (stringhe, blob, costanti, array)"""
+    args = []
+    stack = []
+    for kind, value, converters in plan:
+        if kind == 'fixed':
+            if pos + value.size > end:
+                raise OSCDecodeError('argomenti OSC troncati')
+            values = value.unpack_from(data, pos)
+            pos += value.size
+            if converters is None:
+                args.extend(values)
+            else:
+                args.extend(conv(v) if conv else v
+                            for conv, v in zip(converters, values))
+        elif kind == 'string':
+            text, pos = _read_string(data, pos, end)
+            args.append(text)
+        elif kind == 'blob':
+            if pos + 4 > end:
+                raise OSCDecodeError('blob OSC troncato')
+            size = _INT32.unpack_from(data, pos)[0]
+            start = pos + 4
+            if size < 0 or start + size > end:
+                raise OSCDecodeError('blob OSC troncato')
+            # Nessuna copia: il blob punta al buffer originale
+            args.append(memoryview(data)[start:start + size])
+            pos = start + ((size + 3) & ~3)
+        elif kind == 'const':
+            args.append(value)
+        elif kind == 'open':
+            stack.append(args)
+            args = []
+        elif kind == 'close':
+            if not stack:
+                raise OSCDecodeError("']' senza '['")
+            inner = args
+            args = stack.pop()
+            args.append(inner)
+    if stack:
+        raise OSCDecodeError("'[' senza ']'")
+    return args, pos
+
+
+def decode_message(data, start=0, end=None):
+    """Decodifica un messaggio OSC in OSCMessage(address, typetags, args)
+
+    I blob sono restituiti come memoryview sul buffer d'ingresso, che quindi
+    deve restare valido (e non essere riusato) finché servono.
+    """
+    if end is None:
+        end = len(data)
+    address, pos = _read_string(data, start, end)
+    if not address.startswith('/'):
+        raise OSCDecodeError(f"indirizzo OSC non valido: {address!r}")
+
+    # Messaggi OSC 1.0 senza type tag: nessun argomento
+    if pos >= end:
+        return _new_message(OSCMessage, (address, '', []))
+
+    # La firma grezza fa da chiave: niente decodifica del testo se già vista
+    nul = _find_nul(data, pos, end)
+    if nul < 0:
+        raise OSCDecodeError('type tag OSC non terminati')
+    raw_typetags = data[pos:nul]
+    if type(raw_typetags) is not bytes:
+        raw_typetags = bytes(raw_typetags)
+    typetags, plan = _get_plan(raw_typetags)
+    pos += (nul - pos + 4) & ~3
+
+    if type(plan) is struct.Struct:
+        if pos + plan.size > end:
+            raise OSCDecodeError('argomenti OSC troncati')
+        return _new_message(OSCMessage, (address, typetags, list(plan.unpack_from(data, pos))))
+    args, pos = _run_plan(plan, data, pos, end)
+    return _new_message(OSCMessage, (address, typetags, args))
+
+
+def is_bundle(data, start=0):
+    """True se il pacchetto inizia con l'intestazione #bundle"""
+    return data[start:start + 8] == BUNDLE_PREFIX
+
+
+def decode_bundle(data, start=0, end=None, depth=0):
+    """Decodifica un bundle OSC (anche annidato) in OSCBundle(timetag, elements)
+
+    Al più MAX_BUNDLE_DEPTH livelli di annidamento.
+    """
+    if depth >= MAX_BUNDLE_DEPTH:
+        raise OSCDecodeError('bundle OSC annidati troppo in profondità')
+    if end is None:
+        end = len(data)
+    if end - start < 16:
+        raise OSCDecodeError('bundle OSC troncato')
+    prefix, timetag = _BUNDLE_HEADER.unpack_from(data, start)
+    if prefix != BUNDLE_PREFIX:
+        raise OSCDecodeError('intestazione #bundle mancante')
+
+    elements = []
+    pos = start + 16
+    while pos < end:
+        if pos + 4 > end:
+            raise OSCDecodeError('elemento del bundle troncato')
+        size = _INT32.unpack_from(data, pos)[0]
+        pos += 4
+        if size <= 0 or pos + size > end or size % 4:
+            raise OSCDecodeError('dimensione elemento del bundle non valida')
+        elements.append(decode_packet(data, pos, pos + size, depth + 1))
+        pos += size
+    return OSCBundle(timetag, elements)
+
+
+def packet_address(data, start=0, end=None):
+    """Indirizzo di un pacchetto (del primo messaggio, per un bundle) senza decodificarlo
+
+    None se il datagramma non è OSC o è malformato.
+    """
+    if end is None:
+        end = len(data)
+    # Bundle annidati: si scende nel primo elemento finché serve
+    while is_bundle(data, start):
+        if end - start < 24:
+            return None
+        start += 20
+        end = min(end, start + _INT32.unpack_from(data, start - 4)[0])
+    if start >= end or data[start] != 0x2f:  # '/'
+        return None
+    try:
+        return _read_string(data, start, end)[0]
+    except OSCDecodeError:
+        return None
+
+
+def decode_packet(data, start=0, end=None, depth=0):
+    """Decodifica un messaggio o un bundle OSC"""
+    if is_bundle(data, start):
+        return decode_bundle(data, start, end, depth)
+    return decode_message(data, start, end)
+
+
+def iter_messages(packet, timetag=IMMEDIATELY):
+    """Percorre un pacchetto decodificato: (timetag, OSCMessage) in ordine"""
+    if isinstance(packet, OSCBundle):
+        for element in packet.elements:
+            yield from iter_messages(element, packet.timetag)
+    else:
+        yield timetag, packet
+
+
+def group_by_timetag(packet):
+    """Messaggi del pacchetto raggruppati per timetag: [(timetag, [OSCMessage])]
+
+    I gruppi sono nell'ordine del primo messaggio; bundle annidati con lo
+    stesso timetag finiscono nello stesso gruppo.
+    """
+    groups = {}
+    for timetag, message in iter_messages(packet):
+        messages = groups.get(timetag)
+        if messages is None:
+            groups[timetag] = [message]
+        else:
+            messages.append(message)
+    return list(groups.items())
+
+
+def timetag_to_time(timetag):
+    """Converte un timetag NTP a 64 bit in secondi Unix (float)"""
+    return (timetag >> 32) - NTP_EPOCH_OFFSET + (timetag & 0xFFFFFFFF) / 4294967296.0
+
+
+def time_to_timetag(seconds):
+    """Converte secondi Unix (float) in un timetag NTP a 64 bit"""
+    ntp = seconds + NTP_EPOCH_OFFSET
+    whole = int(ntp)
+    return (whole << 32) | int((ntp - whole) * 4294967296.0)
@@ -1,7 +1,36 @@
+import argparse
+
 # Import necessary libraries from python-osc
 from pythonosc import dispatcher
 from pythonosc import osc_server
 
+from chunking import ChunkedServerMixin, add_chunk_arguments, reassembler_from_args
+from dispatch_pool import PooledServerMixin, add_pool_arguments, pool_from_args
+from osc_router import RouterDispatcherMixin
+from osc_scheduler import ScheduledDispatcherMixin
+from relay import RelayServerMixin, add_relay_arguments, relay_from_args
+from udp_socket import (RcvbufAutosizer, TunedServerMixin, add_socket_arguments,
+                        print_socket_report, socket_options_from_args)
+
+
+class TunedOSCUDPServer(TunedServerMixin, RelayServerMixin, ChunkedServerMixin,
+                        PooledServerMixin, osc_server.OSCUDPServer):
+    """OSC server with the shared receive-socket options.
+
+    Datagrams are handled by a fixed pool of threads (messages for the same
+    address stay in order) instead of a new thread per datagram. With
+    --relay they are also forwarded, unchanged, to other hosts; with
+    --chunks fragmented payloads are reassembled before dispatch.
+    """
+
+
+class RoutedDispatcher(ScheduledDispatcherMixin, RouterDispatcherMixin, dispatcher.Dispatcher):
+    """Dispatcher resolving addresses through the compiled pattern router.
+
+    Bundles with a future timetag wait in a scheduler thread instead of
+    sleeping in the request thread.
+    """
+
 # Define a function to handle incoming OSC messages
 def print_message(address, *args):
     """Prints the received OSC message to the console."""
@@ -12,26 +41,68 @@ if __name__ == "__main__":
     # -- Configuration --
     # Set the IP address and port for the OSC server.
     # Use "0.0.0.0" to listen on all available network interfaces.
-    # You can change the port number if needed.
+    # You can change the port number with -p.
+    parser = argparse.ArgumentParser(description='Simple OSC receiver')
+    parser.add_argument('-p', '--port', type=int, default=5005,
+                        help='UDP port to listen on (default: 5005)')
+    parser.add_argument('--filter', action='append', default=[], metavar='PATTERN',
+                        help='Only print addresses matching this OSC pattern, '
+                             'e.g. /sensor/*, /audio/{rms,peak} or //x (repeatable)')
+    add_socket_arguments(parser)
+    add_pool_arguments(parser)
+    add_relay_arguments(parser)
+    add_chunk_arguments(parser)
+    args = parser.parse_args()
     ip = "0.0.0.0"
-    port = 5005
+    port = args.port
 
     # -- OSC Server Setup --
     # Create a dispatcher to map OSC addresses to functions.
-    osc_dispatcher = dispatcher.Dispatcher()
+    # Patterns are compiled once and each address is resolved from a cache.
+    osc_dispatcher = RoutedDispatcher()
 
-    # Map all incoming OSC addresses to the print_message function.
+    # Map all incoming OSC addresses ("//" = any number of levels), or only
+    # the --filter patterns, to the print_message function.
     # You can also map specific addresses to different functions, for example:
     # osc_dispatcher.map("/filter", print_filter_message)
-    osc_dispatcher.map("/*", print_message)
+    for pattern in args.filter or ["//*"]:
+        try:
+            osc_dispatcher.map(pattern, print_message)
+        except ValueError as e:
+            parser.error(str(e))
 
-    # Create the OSC server.
-    server = osc_server.ThreadingOSCUDPServer((ip, port), osc_dispatcher)
+    # Create the OSC server (receive buffer, kernel timestamps, ...).
+    socket_options = socket_options_from_args(args)
+    # --workers 0 handles every message in the receiving thread
+    server = TunedOSCUDPServer((ip, port), osc_dispatcher, socket_options=socket_options,
+                               pool=pool_from_args(args, parser),
+                               relay=relay_from_args(args, parser),
+                               reassembler=reassembler_from_args(args, parser))
+    # Grow the receive buffer if the kernel starts dropping datagrams
+    RcvbufAutosizer(server.socket, socket_options.rcvbuf_max).start()
 
     # -- Start Server --
     print(f"Serving on {server.server_address}")
+    print_socket_report(server.socket_report)
+    print(f"Dispatch: {server.pool.format_stats()}")
+    if server.relay is not None:
+        print("Relaying to " + ", ".join(target.label for target in server.relay.targets))
     print("Listening for OSC messages...")
     print("Press Ctrl+C to exit.")
 
     # Start the server and keep it running until interrupted.
-    server.serve_forever()
\ No newline at end of file
+    # The poll interval also paces the relay's coalescing tick
+    poll_interval = server.relay.poll_interval if server.relay is not None else 0.5
+    try:
+        server.serve_forever(poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Messages already queued are handled before exiting
+        server.server_close()
+        if server.relay is not None:
+            print(f"Relay: {server.relay.format_stats()}")
+        if server.reassembler is not None:
+            print(f"Chunks: {server.reassembler.format_stats()}")
+        if osc_dispatcher.malformed:
+            print(f"Malformed bundles: {osc_dispatcher.malformed}")
\ No newline at end of file
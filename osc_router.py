@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Router degli indirizzi OSC
+I pattern OSC (*, ?, [a-z], [!0-9], {foo,bar} e // per un numero qualsiasi
+di livelli) vengono compilati in un trie per livello di indirizzo: un
+indirizzo nuovo si risolve percorrendo il trie, non provando ogni pattern.
+Il risultato resta in cache per indirizzo, e ogni pattern ricorda gli
+indirizzi in cache che gli corrispondono: sottoscrivere o annullare
+aggiorna solo quelle voci, così lo smistamento resta una ricerca in un
+dizionario anche con migliaia di sottoscrizioni.
+"""
+
+import re
+
+DEFAULT_CACHE_SIZE = 65536  # indirizzi risolti tenuti in cache
+
+# Caratteri che rendono un livello un pattern invece di un nome letterale
+_SPECIAL = frozenset('*?[]{}')
+# Un livello vuoto ("//" nel pattern) corrisponde a zero o più livelli
+_DESCENDANT = ''
+
+
+def has_wildcards(address):
+    """True se l'indirizzo contiene caratteri dei pattern OSC"""
+    return not _SPECIAL.isdisjoint(address) or '//' in address
+
+
+def _part_regex(part, pattern):
+    """Espressione regolare di un singolo livello del pattern"""
+    out = []
+    index = 0
+    while index < len(part):
+        char = part[index]
+        # Mai oltre il '/': la stessa regex serve anche per l'indirizzo intero
+        if char == '*':
+            out.append('[^/]*')
+        elif char == '?':
+            out.append('[^/]')
+        elif char == '[':
+            end = part.find(']', index + 1)
+            if end < 0:
+                raise ValueError(f"'[' senza ']' nel pattern {pattern!r}")
+            body = part[index + 1:end]
+            negate = body.startswith('!')
+            if negate:
+                body = body[1:]
+            if not body:
+                raise ValueError(f"classe di caratteri vuota nel pattern {pattern!r}")
+            body = body.replace('\\', '\\\\').replace('^', '\\^').replace('[', '\\[')
+            out.append('[^/' + body + ']' if negate else '[' + body + ']')
+            index = end
+        elif char == '{':
+            end = part.find('}', index + 1)
+            if end < 0:
+                raise ValueError(f"'{{' senza '}}' nel pattern {pattern!r}")
+            choices = part[index + 1:end].split(',')
+            out.append('(?:' + '|'.join(re.escape(choice) for choice in choices) + ')')
+            index = end
+        elif char in ']}':
+            raise ValueError(f"'{char}' inatteso nel pattern {pattern!r}")
+        else:
+            out.append(re.escape(char))
+        index += 1
+    return ''.join(out)
+
+
+def split_pattern(pattern):
+    """Livelli del pattern; '' al posto di ogni '//'"""
+    if not isinstance(pattern, str) or not pattern.startswith('/'):
+        raise ValueError(f"il pattern deve iniziare con '/': {pattern!r}")
+    if pattern.endswith('/'):
+        raise ValueError(f"il pattern non può terminare con '/': {pattern!r}")
+    return pattern[1:].split('/')
+
+
+def compile_pattern(pattern):
+    """Espressione regolare compilata per l'intero indirizzo (fullmatch)"""
+    out = []
+    for part in split_pattern(pattern):
+        if part == _DESCENDANT:
+            out.append('(?:/[^/]+)*')
+        else:
+            out.append('/' + _part_regex(part, pattern))
+    return re.compile(''.join(out))
+
+
+class _Node:
+    """Nodo del trie: figli letterali, figli con pattern e discendenti (//)"""
+
+    __slots__ = ('literal', 'wild', 'descendant', 'pattern')
+
+    def __init__(self):
+        self.literal = {}
+        # Livello del pattern -> (fullmatch compilato, nodo)
+        self.wild = {}
+        self.descendant = None
+        # Pattern che termina in questo nodo
+        self.pattern = None
+
+    def is_empty(self):
+        return (self.pattern is None and self.descendant is None
+                and not self.literal and not self.wild)
+
+
+def _walk(node, parts, index, found):
+    """Raccoglie in `found` i pattern del trie che corrispondono a parts[index:]"""
+    descendant = node.descendant
+    if descendant is not None:
+        # "//" salta da zero a tutti i livelli rimanenti
+        for skip in range(index, len(parts) + 1):
+            _walk(descendant, parts, skip, found)
+    if index == len(parts):
+        if node.pattern is not None:
+            found.add(node.pattern)
+        return
+    part = parts[index]
+    child = node.literal.get(part)
+    if child is not None:
+        _walk(child, parts, index + 1, found)
+    for fullmatch, child in node.wild.values():
+        if fullmatch(part) is not None:
+            _walk(child, parts, index + 1, found)
+
+
+class AddressRouter:
+    """Sottoscrizioni (pattern OSC -> destinatari) con smistamento in cache
+
+    I destinatari sono oggetti hashable qualsiasi (sessioni, nomi...).
+    match() restituisce il dizionario in cache {destinatario: numero di
+    pattern corrispondenti}: va solo iterato, e copiato se nel frattempo
+    le sottoscrizioni possono cambiare.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        # Pattern -> destinatari (dizionario usato come insieme ordinato)
+        self.patterns = {}
+        self._regexes = {}
+        self._root = _Node()
+        # Indirizzo -> {destinatario: conteggio}
+        self._cache = {}
+        # Pattern -> indirizzi in cache che gli corrispondono
+        self._matched = {}
+        # Indirizzi risolti percorrendo il trie (non trovati in cache)
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.patterns)
+
+    @property
+    def cached(self):
+        """Indirizzi in cache"""
+        return len(self._cache)
+
+    def add(self, pattern, target):
+        """Sottoscrive target al pattern; False se lo era già
+
+        Solleva ValueError se il pattern non è valido.
+        """
+        targets = self.patterns.get(pattern)
+        if targets is None:
+            regex = compile_pattern(pattern)
+            self._insert(pattern)
+            targets = self.patterns[pattern] = {}
+            self._regexes[pattern] = regex
+            fullmatch = regex.fullmatch
+            self._matched[pattern] = {address for address in self._cache
+                                      if fullmatch(address) is not None}
+        elif target in targets:
+            return False
+        targets[target] = None
+        cache = self._cache
+        for address in self._matched[pattern]:
+            entry = cache[address]
+            entry[target] = entry.get(target, 0) + 1
+        return True
+
+    def remove(self, pattern, target):
+        """Annulla la sottoscrizione; False se non esisteva"""
+        targets = self.patterns.get(pattern)
+        if targets is None or target not in targets:
+            return False
+        del targets[target]
+        cache = self._cache
+        for address in self._matched[pattern]:
+            entry = cache[address]
+            count = entry[target] - 1
+            if count:
+                entry[target] = count
+            else:
+                del entry[target]
+        if not targets:
+            del self.patterns[pattern]
+            del self._regexes[pattern]
+            del self._matched[pattern]
+            self._delete(pattern)
+        return True
+
+    def match(self, address):
+        """Destinatari dell'indirizzo (dizionario in cache, da non modificare)"""
+        entry = self._cache.get(address)
+        if entry is None:
+            entry = self._resolve(address)
+        return entry
+
+    def matching_patterns(self, address):
+        """Pattern che corrispondono all'indirizzo (senza cache)"""
+        found = set()
+        if address[:1] == '/':
+            _walk(self._root, address[1:].split('/'), 0, found)
+        return found
+
+    def _resolve(self, address):
+        self.misses += 1
+        if len(self._cache) >= self.cache_size:
+            # Cache piena: si riparte da zero (gli indirizzi OSC sono pochi)
+            self._cache.clear()
+            for addresses in self._matched.values():
+                addresses.clear()
+        entry = {}
+        for pattern in self.matching_patterns(address):
+            self._matched[pattern].add(address)
+            for target in self.patterns[pattern]:
+                entry[target] = entry.get(target, 0) + 1
+        self._cache[address] = entry
+        return entry
+
+    def _insert(self, pattern):
+        node = self._root
+        for part in split_pattern(pattern):
+            if part == _DESCENDANT:
+                if node.descendant is None:
+                    node.descendant = _Node()
+                node = node.descendant
+            elif _SPECIAL.isdisjoint(part):
+                node = node.literal.setdefault(part, _Node())
+            else:
+                child = node.wild.get(part)
+                if child is None:
+                    regex = re.compile(_part_regex(part, pattern))
+                    child = node.wild[part] = (regex.fullmatch, _Node())
+                node = child[1]
+        node.pattern = pattern
+
+    def _delete(self, pattern):
+        # Percorso dalla radice, poi potatura dei nodi rimasti vuoti
+        path = []
+        node = self._root
+        for part in split_pattern(pattern):
+            path.append((node, part))
+            if part == _DESCENDANT:
+                node = node.descendant
+            elif _SPECIAL.isdisjoint(part):
+                node = node.literal[part]
+            else:
+                node = node.wild[part][1]
+        node.pattern = None
+        for parent, part in reversed(path):
+            if not node.is_empty():
+                break
+            if part == _DESCENDANT:
+                parent.descendant = None
+            elif _SPECIAL.isdisjoint(part):
+                del parent.literal[part]
+            else:
+                del parent.wild[part]
+            node = parent
+
+    def get_stats(self):
+        """Pattern, destinatari, indirizzi in cache e risoluzioni"""
+        return {
+            'patterns': len(self.patterns),
+            'subscriptions': sum(len(targets) for targets in self.patterns.values()),
+            'cached_addresses': len(self._cache),
+            'misses': self.misses,
+        }
+
+
+class RouterDispatcherMixin:
+    """Smistamento con AddressRouter per dispatcher.Dispatcher di python-osc
+
+    Da mettere prima di Dispatcher tra le basi. Gli indirizzi passati a
+    map() sono pattern OSC ('//*' per tutti gli indirizzi); un indirizzo
+    in arrivo costa una ricerca in cache invece di una regex per mappatura.
+    Gli indirizzi in arrivo che sono a loro volta pattern usano il
+    confronto originale di python-osc.
+    """
+
+    def __init__(self, *args, cache_size=DEFAULT_CACHE_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = AddressRouter(cache_size)
+
+    def map(self, address, handler, *args, needs_reply_address=False):
+        self.router.add(address, address)
+        return super().map(address, handler, *args, needs_reply_address=needs_reply_address)
+
+    def unmap(self, address, handler, *args, needs_reply_address=False):
+        super().unmap(address, handler, *args, needs_reply_address=needs_reply_address)
+        if not self._map.get(address):
+            self.router.remove(address, address)
+
+    def handlers_for_address(self, address_pattern):
+        if has_wildcards(address_pattern):
+            return list(super().handlers_for_address(address_pattern))
+        handler_map = self._map
+        handlers = [handler for pattern in tuple(self.router.match(address_pattern))
+                    for handler in handler_map[pattern]]
+        if not handlers and self._default_handler is not None:
+            handlers.append(self._default_handler)
+        return handlers
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Scheduler dei bundle OSC per timetag
+I bundle con timetag futuro restano in un heap e partono all'ora NTP
+indicata: con un loop asyncio la scadenza più vicina è un timer del loop,
+senza loop si usa poll() o un thread (start()). L'orologio di un
+mittente può essere sfasato rispetto al nostro: ClockOffset stima lo
+sfasamento dalle differenze tra arrivo e timetag dei suoi bundle.
+"""
+
+import heapq
+import itertools
+import struct
+import threading
+import time
+from collections import deque
+
+from osc_decoder import (IMMEDIATELY, OSCDecodeError, decode_bundle, group_by_timetag,
+                         is_bundle, timetag_to_time)
+from udp_socket import request_time
+
+DEFAULT_TOLERANCE = 0.002    # secondi: scadenze più vicine partono subito
+DEFAULT_HORIZON = 60.0       # secondi: oltre, il timetag indica un orologio sfasato
+DEFAULT_OFFSET_WINDOW = 64   # bundle per mittente usati nella stima
+DEFAULT_MAX_PENDING = 10000  # bundle in attesa, poi i nuovi vengono scartati
+MAX_SOURCES = 1024           # mittenti con uno sfasamento stimato
+
+
+class ClockOffset:
+    """Sfasamento stimato tra l'orologio di un mittente e il nostro
+
+    Ogni bundle dà skew = arrivo - timetag. Se tutti i bundle della
+    finestra arrivano dopo il loro timetag (oltre la tolleranza) il
+    mittente è indietro; se tutti sono oltre l'orizzonte è avanti. In
+    questi casi lo sfasamento è lo skew massimo: il bundle programmato
+    con meno anticipo parte all'arrivo e gli altri mantengono la loro
+    distanza. Altrimenti vale zero, e i bundle programmati nel futuro da
+    un mittente sincronizzato restano intatti.
+    """
+
+    __slots__ = ('skews', 'tolerance', 'horizon', 'offset')
+
+    def __init__(self, window=DEFAULT_OFFSET_WINDOW, tolerance=DEFAULT_TOLERANCE,
+                 horizon=DEFAULT_HORIZON):
+        self.skews = deque(maxlen=window)
+        self.tolerance = tolerance
+        self.horizon = horizon
+        self.offset = 0.0
+
+    def update(self, timetag_time, arrival):
+        """Aggiunge un bundle alla finestra e restituisce lo sfasamento (secondi)"""
+        self.skews.append(arrival - timetag_time)
+        latest = max(self.skews)
+        if latest < -self.horizon or min(self.skews) > self.tolerance:
+            self.offset = latest
+        else:
+            self.offset = 0.0
+        return self.offset
+
+
+class BundleScheduler:
+    """Bundle in attesa del loro timetag, in un heap ordinato per scadenza
+
+    dispatch(item, delayed) riceve ogni item una volta sola: subito se il
+    timetag è "immediato" o già scaduto, altrimenti alla sua ora; delayed
+    è True per gli item usciti dall'heap. submit() può arrivare da più
+    thread, dispatch() non viene mai chiamata con il lock preso.
+    """
+
+    def __init__(self, dispatch, tolerance=DEFAULT_TOLERANCE, horizon=DEFAULT_HORIZON,
+                 max_pending=DEFAULT_MAX_PENDING, offset_window=DEFAULT_OFFSET_WINDOW):
+        self.dispatch = dispatch
+        self.tolerance = tolerance
+        self.horizon = horizon
+        self.max_pending = max_pending
+        self.offset_window = offset_window
+        # Elementi: (scadenza come time.time(), ordine di arrivo, item)
+        self.heap = []
+        self._order = itertools.count()
+        self._wakeup = threading.Condition()
+        self.offsets = {}
+
+        # Timer del loop asyncio (attach) oppure thread (start)
+        self._loop = None
+        self._timer = None
+        self._timer_due = None
+        self._thread = None
+        self._running = False
+
+        # Statistiche
+        self.immediate = 0
+        self.scheduled = 0
+        self.dispatched = 0
+        self.late = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def offset_for(self, source):
+        """Stima dello sfasamento del mittente (creata al primo bundle)"""
+        offset = self.offsets.get(source)
+        if offset is None:
+            if len(self.offsets) >= MAX_SOURCES:
+                self.offsets.clear()
+            offset = ClockOffset(self.offset_window, self.tolerance, self.horizon)
+            self.offsets[source] = offset
+        return offset
+
+    def submit(self, source, timetag, item, arrival=None):
+        """Invia subito o mette in attesa; True se l'item è già stato inviato
+
+        arrival è l'istante di ricezione (come time.time()), di default ora.
+        """
+        if timetag <= IMMEDIATELY:
+            self.immediate += 1
+            self.dispatch(item, False)
+            return True
+        if arrival is None:
+            arrival = time.time()
+        timetag_time = timetag_to_time(timetag)
+        with self._wakeup:
+            due = timetag_time + self.offset_for(source).update(timetag_time, arrival)
+            ready = due - arrival <= self.tolerance
+            if ready:
+                if arrival - due > self.tolerance:
+                    # Scaduto anche dopo la correzione dell'orologio
+                    self.late += 1
+                self.immediate += 1
+            elif len(self.heap) >= self.max_pending:
+                self.dropped += 1
+                return False
+            else:
+                heapq.heappush(self.heap, (due, next(self._order), item))
+                self.scheduled += 1
+                if self._loop is not None:
+                    self._arm()
+                elif self.heap[0][0] == due:
+                    # Nuova scadenza più vicina: il thread ricalcola l'attesa
+                    self._wakeup.notify()
+        if ready:
+            self.dispatch(item, False)
+        return ready
+
+    def poll(self, now=None):
+        """Invia gli item scaduti; secondi alla prossima scadenza (None se vuoto)"""
+        if now is None:
+            now = time.time()
+        ready = []
+        with self._wakeup:
+            heap = self.heap
+            while heap and heap[0][0] - now <= self.tolerance:
+                ready.append(heapq.heappop(heap)[2])
+            wait = heap[0][0] - now if heap else None
+        for item in ready:
+            self.dispatched += 1
+            self.dispatch(item, True)
+        return wait
+
+    def flush(self):
+        """Invia subito tutto ciò che è in attesa (in ordine di scadenza)"""
+        with self._wakeup:
+            ready = [heapq.heappop(self.heap)[2] for _ in range(len(self.heap))]
+        for item in ready:
+            self.dispatched += 1
+            self.dispatch(item, True)
+
+    def attach(self, loop):
+        """La scadenza più vicina diventa un timer del loop asyncio"""
+        self._loop = loop
+        with self._wakeup:
+            self._arm()
+
+    def detach(self):
+        """Annulla il timer e invia ciò che resta"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            self._timer_due = None
+        self._loop = None
+        self.flush()
+
+    def _arm(self):
+        # Con il lock preso: timer sulla scadenza più vicina, se è cambiata
+        if not self.heap:
+            return
+        due = self.heap[0][0]
+        if self._timer is not None:
+            if self._timer_due <= due:
+                return
+            self._timer.cancel()
+        # loop.time() è monotono: si converte il ritardo, non l'istante
+        delay = max(0.0, due - time.time())
+        self._timer = self._loop.call_at(self._loop.time() + delay, self._fire)
+        self._timer_due = due
+
+    def _fire(self):
+        self._timer = None
+        self._timer_due = None
+        self.poll()
+        if self._loop is not None:
+            with self._wakeup:
+                self._arm()
+
+    def start(self):
+        """Senza loop asyncio: un thread invia i bundle alla loro ora"""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='bundle-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ferma il thread e invia ciò che resta"""
+        if self._thread is None:
+            return
+        with self._wakeup:
+            self._running = False
+            self._wakeup.notify()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            self.poll()
+            with self._wakeup:
+                if not self._running:
+                    return
+                # Attesa calcolata con il lock: nessun submit può sfuggire
+                timeout = self.heap[0][0] - time.time() if self.heap else None
+                if timeout is None or timeout > self.tolerance:
+                    self._wakeup.wait(timeout)
+
+    def register_metrics(self, registry):
+        """Esporta bundle in attesa, programmati, in ritardo e scartati"""
+        registry.gauge('bundles_pending', 'Bundle OSC in attesa del loro timetag',
+                       lambda: len(self.heap))
+        registry.gauge('bundles_immediate_total', 'Bundle OSC inviati alla ricezione',
+                       lambda: self.immediate, kind='counter')
+        registry.gauge('bundles_scheduled_total', 'Bundle OSC messi in attesa del timetag',
+                       lambda: self.scheduled, kind='counter')
+        registry.gauge('bundles_late_total', 'Bundle OSC arrivati dopo il loro timetag',
+                       lambda: self.late, kind='counter')
+        registry.gauge('bundles_dropped_total', 'Bundle OSC scartati con l\'heap pieno',
+                       lambda: self.dropped, kind='counter')
+        registry.gauge('bundle_clock_offset_seconds', 'Sfasamento stimato dell\'orologio, per mittente',
+                       lambda: [({'source': _source_label(source)}, offset.offset)
+                                for source, offset in list(self.offsets.items())])
+
+    def get_stats(self):
+        """Contatori e sfasamenti diversi da zero"""
+        return {
+            'pending': len(self.heap),
+            'immediate': self.immediate,
+            'scheduled': self.scheduled,
+            'dispatched': self.dispatched,
+            'late': self.late,
+            'dropped': self.dropped,
+            'offsets': {_source_label(source): offset.offset
+                        for source, offset in list(self.offsets.items()) if offset.offset},
+        }
+
+    def format_stats(self):
+        """Riepilogo leggibile su una riga"""
+        stats = self.get_stats()
+        text = (f"subito {stats['immediate']}, programmati {stats['scheduled']}, "
+                f"in attesa {stats['pending']}, in ritardo {stats['late']}, "
+                f"scartati {stats['dropped']}")
+        if stats['offsets']:
+            text += ", sfasamenti " + ", ".join(
+                f"{source} {offset * 1000:+.0f} ms" for source, offset in stats['offsets'].items())
+        return text
+
+
+def _source_label(source):
+    if isinstance(source, tuple) and len(source) >= 2:
+        return f"{source[0]}:{source[1]}"
+    return str(source)
+
+
+class BundleMessage:
+    """Messaggio di un bundle nella forma usata da Handler.invoke di python-osc"""
+
+    __slots__ = ('address', 'params')
+
+    def __init__(self, address, params):
+        self.address = address
+        self.params = params
+
+    def __iter__(self):
+        return iter(self.params)
+
+
+class ScheduledDispatcherMixin:
+    """Bundle OSC con BundleScheduler per dispatcher.Dispatcher di python-osc
+
+    Da mettere prima di Dispatcher tra le basi. python-osc attende i
+    timetag futuri con time.sleep() nel thread della richiesta; qui i
+    bundle passano dallo scheduler (un thread dedicato) e ogni gruppo di
+    messaggi con lo stesso timetag arriva a dispatch_messages() in una
+    volta sola. I messaggi singoli seguono il percorso di python-osc. I
+    bundle malformati sono scartati e contati in `malformed`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = BundleScheduler(self._dispatch_scheduled)
+        self.scheduler.start()
+        self.malformed = 0
+
+    def call_handlers_for_packet(self, data, client_address):
+        if not is_bundle(data):
+            return super().call_handlers_for_packet(data, client_address)
+        try:
+            groups = group_by_timetag(decode_bundle(data))
+        except (OSCDecodeError, struct.error):
+            self.malformed += 1
+            return None
+        # Istante di ricezione del datagramma (del kernel con TunedServerMixin)
+        arrival = request_time()
+        for timetag, messages in groups:
+            self.scheduler.submit(client_address, timetag, (client_address, messages), arrival)
+        return None
+
+    def _dispatch_scheduled(self, item, delayed):
+        client_address, messages = item
+        # I blob sono memoryview sul datagramma: python-osc passa bytes
+        self.dispatch_messages(client_address, [
+            BundleMessage(message.address, [bytes(arg) if type(arg) is memoryview else arg
+                                            for arg in message.args])
+            for message in messages])
+
+    def dispatch_messages(self, client_address, messages):
+        """Chiama gli handler di tutti i messaggi di un gruppo (ridefinibile)"""
+        for message in messages:
+            for handler in self.handlers_for_address(message.address):
+                handler.invoke(client_address, message)
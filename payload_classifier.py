@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Classificazione dei payload UDP per mittente
+Il formato di un mittente (OSC, testo UTF-8, JSON, float32...) si
+riconosce al primo datagramma e resta valido per i successivi: il
+datagramma seguente va direttamente al suo decoder, senza tentativi
+guidati dalle eccezioni. Un mittente può avere un formato dichiarato
+(es. ":9001=16xfloat32le"). Il payload resta binario: il testo per i
+client JSON (contenuto esadecimale compreso) si costruisce solo quando
+qualcuno lo chiede.
+"""
+
+import json
+import re
+import struct
+
+from osc_decoder import OSCDecodeError, decode_bundle, decode_message, group_by_timetag, is_bundle
+from wire_format import MAX_VALUES, all_numeric, json_args, pack_numeric
+
+FORMAT_OSC = 'osc'        # messaggi OSC (i bundle diventano 'osc_bundle')
+FORMAT_TEXT = 'text'      # testo UTF-8, anche numeri separati da spazi o virgole
+FORMAT_JSON = 'json'      # testo UTF-8 che inizia con '{' o '['
+FORMAT_FLOAT = 'float'    # 4 byte: float32 big-endian (ordine di rete)
+FORMAT_DOUBLE = 'double'  # 8 byte: float64 big-endian
+FORMAT_BINARY = 'binary'  # tutto il resto, mostrato in esadecimale
+FORMATS = (FORMAT_OSC, FORMAT_TEXT, FORMAT_JSON, FORMAT_FLOAT, FORMAT_DOUBLE, FORMAT_BINARY)
+DATA_TYPE_BUNDLE = 'osc_bundle'
+
+# Tipi numerici dei formati dichiarati: nome -> codice struct
+NUMERIC_TYPES = {
+    'int8': 'b', 'uint8': 'B', 'int16': 'h', 'uint16': 'H',
+    'int32': 'i', 'uint32': 'I', 'float32': 'f', 'float64': 'd',
+}
+_SCHEMA_SPEC = re.compile(r'(?:(\d+)[x*])?([a-z]+\d+)(le|be)?')
+
+MAX_SOURCES = 4096   # mittenti con un formato memorizzato
+HEX_PREVIEW = 50     # byte mostrati in esadecimale nel testo per i client
+
+# Caratteri di un testo composto solo da numeri
+_NUMBER_CHARS = b'0123456789.+-eE, \t\r\n'
+_FLOAT = struct.Struct('>f')
+_DOUBLE = struct.Struct('>d')
+
+
+class Schema:
+    """Formato dichiarato per un mittente
+
+    Un formato classico (osc, text, json...) oppure valori numerici a
+    dimensione fissa: "16xfloat32le" è esattamente 16 float32
+    little-endian, "int16be" qualsiasi numero di int16 big-endian.
+    """
+
+    __slots__ = ('spec', 'data_type', 'fmt', 'count', 'item')
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.fmt = None
+        self.count = None
+        self.item = None
+        if spec in FORMATS:
+            self.data_type = spec
+            return
+        match = _SCHEMA_SPEC.fullmatch(spec)
+        if match is None or match.group(2) not in NUMERIC_TYPES:
+            raise ValueError(f"formato sconosciuto: {spec!r} (es. osc, text, 16xfloat32le)")
+        count, name, endian = match.groups()
+        self.data_type = name
+        self.count = int(count) if count else None
+        if self.count is not None and not 0 < self.count <= MAX_VALUES:
+            raise ValueError(f"numero di valori fuori intervallo (1-{MAX_VALUES}): {spec!r}")
+        order = '>' if endian == 'be' else '<'
+        self.item = struct.calcsize(NUMERIC_TYPES[name])
+        self.fmt = order + NUMERIC_TYPES[name]
+
+    def unpack(self, data):
+        """Valori del datagramma, o None se la dimensione non corrisponde"""
+        size = len(data)
+        if self.count is not None:
+            if size != self.count * self.item:
+                return None
+            count = self.count
+        else:
+            count, rest = divmod(size, self.item)
+            if rest or not count or count > MAX_VALUES:
+                return None
+        return struct.unpack(f'{self.fmt[0]}{count}{self.fmt[1]}', data)
+
+    def __repr__(self):
+        return f"Schema({self.spec!r})"
+
+
+def parse_schema(declaration):
+    """"[ip][:porta]=formato" -> (chiave del mittente, Schema)
+
+    La chiave è (ip, porta), (ip, None) o (None, porta); un numero da
+    solo è la porta di origine del mittente (non quella di ascolto).
+    """
+    source, sep, spec = declaration.partition('=')
+    if not sep or not source or not spec:
+        raise ValueError(f"dichiarazione non valida: {declaration!r} (es. :9001=16xfloat32le)")
+    ip, colon, port = source.rpartition(':')
+    if not colon:
+        ip, port = ('', source) if source.isdigit() else (source, '')
+    if port and not port.isdigit():
+        raise ValueError(f"porta non valida: {source!r}")
+    key = (ip or None, int(port) if port else None)
+    return key, Schema(spec.strip().lower())
+
+
+class Payload:
+    """Datagramma classificato: valori già estratti, testo costruito a richiesta"""
+
+    __slots__ = ('data_type', 'data', 'address', 'values', 'text')
+
+    def __init__(self, data_type, data, address=None, values=None, text=None):
+        self.data_type = data_type
+        self.data = data
+        # Indirizzo OSC, per il routing e l'id nei frame binari
+        self.address = address
+        # Argomenti OSC, valori numerici o gruppi (timetag, messaggi) di un bundle
+        self.values = values
+        self.text = text
+
+    def numeric(self):
+        """Dati extra per wire_format (b'' se non numerico e senza indirizzo)"""
+        values = self.values
+        if self.data_type == FORMAT_OSC:
+            return pack_numeric(len(self.data), self.address, values)
+        if values is None or self.data_type == DATA_TYPE_BUNDLE:
+            return b''
+        return pack_numeric(len(self.data), '', values)
+
+    def blob(self):
+        """Dati binari per wire_format (None se il payload non ne ha)
+
+        Il datagramma di un payload binario, il primo blob di un messaggio OSC.
+        """
+        data_type = self.data_type
+        if data_type == FORMAT_BINARY:
+            return self.data
+        if data_type == FORMAT_OSC and self.values:
+            for arg in self.values:
+                if type(arg) is memoryview or type(arg) is bytes:
+                    return arg
+        return None
+
+    def content(self):
+        """Rappresentazione testuale per i client JSON e il log"""
+        data_type = self.data_type
+        if self.text is not None:
+            return self.text
+        if data_type == FORMAT_OSC:
+            return f"{self.address} {json_args(self.values)}"
+        if data_type == DATA_TYPE_BUNDLE:
+            return '; '.join(f"{message.address} {json_args(message.args)}"
+                             for _, messages in self.values for message in messages)
+        values = self.values
+        if values is not None:
+            # I float32 hanno circa 7 cifre significative
+            return ' '.join(map(_format_float if type(values[0]) is float else str, values))
+        hex_data = self.data[:HEX_PREVIEW].hex()
+        return hex_data + '...' if len(self.data) > HEX_PREVIEW else hex_data
+
+
+_format_float = '{:.7g}'.format
+
+
+def udp_message(payload, addr, timestamp):
+    """Campi del messaggio UDP per i client JSON"""
+    return {
+        'timestamp': timestamp,
+        'source_ip': addr[0],
+        'source_port': addr[1],
+        'data_type': payload.data_type,
+        'content': payload.content(),
+        'size': len(payload.data),
+    }
+
+
+def _utf8(data):
+    """Testo del datagramma o None; l'eccezione solo per byte non ASCII
+
+    Un NUL non compare nel testo ma è frequente nei payload binari.
+    """
+    if b'\0' in data:
+        return None
+    if data.isascii():
+        return data.decode('ascii')
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+def _text_values(data):
+    """Numeri di un testo come "0.25, 0.5", o None"""
+    if not data or data.translate(None, _NUMBER_CHARS):
+        return None
+    try:
+        values = [float(v) for v in data.replace(b',', b' ').split()]
+    except ValueError:
+        return None
+    return values if 0 < len(values) <= MAX_VALUES else None
+
+
+def _maybe_osc(data):
+    # I pacchetti OSC sono sempre multipli di 4 byte: "/ciao" resta testo
+    return not len(data) & 3 and (data[:1] == b'/' or is_bundle(data))
+
+
+def detect_format(data):
+    """Formato di un datagramma senza storia del mittente"""
+    first = data[:1]
+    if _maybe_osc(data):
+        return FORMAT_OSC
+    text = _utf8(data)
+    if text is not None and (len(data) not in (4, 8) or text.strip().isprintable()):
+        return FORMAT_JSON if first in (b'{', b'[') else FORMAT_TEXT
+    if len(data) == 4:
+        return FORMAT_FLOAT
+    if len(data) == 8:
+        return FORMAT_DOUBLE
+    return FORMAT_BINARY
+
+
+class PayloadClassifier:
+    """Formato memorizzato per mittente, con formati dichiarati
+
+    Il formato riconosciuto al primo datagramma di un mittente viene
+    riusato: il decoder verifica solo le condizioni economiche (primo
+    byte, dimensione, UTF-8) e se non valgono il formato viene
+    riconosciuto di nuovo. Un formato dichiarato non cambia mai; i
+    datagrammi che non gli corrispondono finiscono come binari.
+    """
+
+    def __init__(self, schemas=(), max_sources=MAX_SOURCES):
+        # Chiave (ip, porta) / (ip, None) / (None, porta) -> Schema
+        self.schemas = dict(schemas)
+        self.max_sources = max_sources
+        self.formats = {}
+        # Contatori
+        self.payloads = dict.fromkeys(FORMATS + (DATA_TYPE_BUNDLE,), 0)
+        self.declared = 0
+        self.detections = 0
+        self.switches = 0
+        self.mismatches = 0
+        self.malformed = 0
+
+    def declare(self, key, schema):
+        """Aggiunge un formato dichiarato (vedi parse_schema)"""
+        self.schemas[key] = schema
+        self.formats.clear()
+
+    def schema_for(self, source):
+        """Formato dichiarato del mittente, o None"""
+        if not self.schemas:
+            return None
+        schemas = self.schemas
+        return (schemas.get((source[0], source[1])) or schemas.get((source[0], None))
+                or schemas.get((None, source[1])))
+
+    def format_for(self, data, source):
+        """Formato del datagramma: dichiarato, memorizzato o riconosciuto"""
+        fmt = self.formats.get(source)
+        if fmt is None:
+            schema = self.schema_for(source)
+            if schema is not None:
+                fmt = schema if schema.fmt is not None else schema.data_type
+                self.declared += 1
+            else:
+                fmt = detect_format(data)
+                self.detections += 1
+            if len(self.formats) >= self.max_sources:
+                self.formats.clear()
+            self.formats[source] = fmt
+        return fmt
+
+    def decode(self, data, source):
+        """Payload del datagramma (i dati vengono copiati se sono una memoryview)"""
+        if type(data) is not bytes:
+            data = bytes(data)
+        fmt = self.format_for(data, source)
+        if type(fmt) is Schema:
+            values = fmt.unpack(data)
+            if values is None:
+                self.mismatches += 1
+                return self._count(Payload(FORMAT_BINARY, data))
+            return self._count(Payload(fmt.data_type, data, values=values))
+        payload = self._decode_as(fmt, data)
+        if payload is None:
+            if self.schema_for(source) is not None:
+                # Formato dichiarato che non corrisponde: resta dichiarato
+                self.mismatches += 1
+                return self._count(Payload(FORMAT_BINARY, data))
+            detected = detect_format(data)
+            if detected != fmt:
+                # Il mittente ha cambiato formato
+                self.switches += 1
+                self.formats[source] = detected
+            payload = self._decode_as(detected, data) or Payload(FORMAT_BINARY, data)
+            fmt = detected
+        if fmt == FORMAT_OSC and payload.data_type == FORMAT_BINARY:
+            # OSC malformato (troncato, stringhe non UTF-8...): mostrato come binario
+            self.malformed += 1
+        return self._count(payload)
+
+    def peek(self, data, source):
+        """Payload di un datagramma già classificato (es. dalla cronologia)
+
+        Usa il formato memorizzato senza aggiornare contatori e formati.
+        """
+        fmt = self.formats.get(source) or self.schema_for(source) or detect_format(data)
+        if type(fmt) is Schema:
+            if fmt.fmt is None:
+                fmt = fmt.data_type
+            else:
+                values = fmt.unpack(data)
+                if values is None:
+                    return Payload(FORMAT_BINARY, data)
+                return Payload(fmt.data_type, data, values=values)
+        return (self._decode_as(fmt, data) or self._decode_as(detect_format(data), data)
+                or Payload(FORMAT_BINARY, data))
+
+    def _count(self, payload):
+        self.payloads[payload.data_type] = self.payloads.get(payload.data_type, 0) + 1
+        return payload
+
+    def _decode_as(self, fmt, data):
+        """Decodifica con un formato noto; None se il datagramma non lo rispetta"""
+        if fmt == FORMAT_OSC:
+            if len(data) & 3:
+                return None
+            try:
+                if data[:1] == b'/':
+                    message = decode_message(data)
+                    return Payload(FORMAT_OSC, data, message.address, message.args)
+                if is_bundle(data):
+                    return Payload(DATA_TYPE_BUNDLE, data,
+                                   values=group_by_timetag(decode_bundle(data)))
+            except (OSCDecodeError, struct.error):
+                # OSC malformato (anche con stringhe non UTF-8): il mittente resta OSC
+                return Payload(FORMAT_BINARY, data)
+            return None
+        if fmt == FORMAT_FLOAT:
+            return Payload(fmt, data, values=_FLOAT.unpack(data)) if len(data) == 4 else None
+        if fmt == FORMAT_DOUBLE:
+            return Payload(fmt, data, values=_DOUBLE.unpack(data)) if len(data) == 8 else None
+        if fmt == FORMAT_BINARY:
+            # Un mittente binario potrebbe passare a OSC o al testo
+            if _maybe_osc(data) or (b'\0' not in data and data.isascii()):
+                return None
+            return Payload(fmt, data)
+        text = _utf8(data)
+        if text is None:
+            return None
+        if fmt == FORMAT_JSON:
+            values = None
+            if data[:1] == b'[':
+                try:
+                    values = json.loads(text)
+                except ValueError:
+                    values = None
+                if not isinstance(values, list) or not all_numeric(values):
+                    values = None
+            return Payload(fmt, data, values=values, text=text)
+        return Payload(FORMAT_TEXT, data, values=_text_values(data), text=text)
+
+    def register_metrics(self, registry):
+        """Esporta datagrammi per formato, riconoscimenti e cambi di formato"""
+        registry.gauge('payloads_total', 'Datagrammi UDP per formato',
+                       lambda: [({'format': fmt}, count)
+                                for fmt, count in list(self.payloads.items())],
+                       kind='counter')
+        registry.gauge('payload_detections_total', 'Formati riconosciuti al primo datagramma',
+                       lambda: self.detections, kind='counter')
+        registry.gauge('payload_format_switches_total', 'Mittenti che hanno cambiato formato',
+                       lambda: self.switches, kind='counter')
+        registry.gauge('payload_schema_mismatches_total',
+                       'Datagrammi diversi dal formato dichiarato', lambda: self.mismatches,
+                       kind='counter')
+        registry.gauge('payload_osc_malformed_total', 'Datagrammi OSC malformati',
+                       lambda: self.malformed, kind='counter')
+
+    def get_stats(self):
+        """Datagrammi per formato e mittenti noti"""
+        return {
+            'payloads': {fmt: count for fmt, count in self.payloads.items() if count},
+            'sources': len(self.formats),
+            'schemas': len(self.schemas),
+            'detections': self.detections,
+            'switches': self.switches,
+            'mismatches': self.mismatches,
+            'malformed': self.malformed,
+        }
+
+    def format_stats(self):
+        """Riepilogo leggibile su una riga"""
+        stats = self.get_stats()
+        text = ", ".join(f"{fmt} {count}" for fmt, count in stats['payloads'].items())
+        return (f"{text or 'nessun datagramma'} ({stats['sources']} mittenti, "
+                f"{stats['switches']} cambi di formato, {stats['mismatches']} fuori schema, "
+                f"{stats['malformed']} OSC malformati)")
+
+
+def add_schema_arguments(parser):
+    """Opzione --schema comune ai bridge"""
+    parser.add_argument('--schema', action='append', default=[], metavar='MITTENTE=FORMATO',
+                        help='Formato dichiarato per un mittente (ip e/o porta di origine), es. :9001=16xfloat32le, '
+                             '192.168.1.50=osc (ripetibile)')
+
+
+def classifier_from_args(args, parser=None):
+    """PayloadClassifier con i formati di --schema (errore di argparse se non validi)"""
+    schemas = []
+    for declaration in args.schema:
+        try:
+            schemas.append(parse_schema(declaration))
+        except ValueError as e:
+            if parser is None:
+                raise
+            parser.error(str(e))
+    return PayloadClassifier(schemas)
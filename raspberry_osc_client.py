@@ -5,33 +5,65 @@ Si connette a un server OSC remoto e visualizza i dati ricevuti
 """
 
 import argparse
-import socket
 import struct
-from pythonosc.osc_message_builder import OscMessageBuilder
-from pythonosc.osc_message import OscMessage
 import time
 from datetime import datetime
 
+from osc_decoder import (IMMEDIATELY, OSCDecodeError, decode_bundle, decode_message,
+                         group_by_timetag, is_bundle)
+from osc_scheduler import BundleScheduler
+from udp_engine import BatchReceiver, wall_time
+from udp_socket import (RcvbufAutosizer, SocketOptions, add_socket_arguments,
+                        create_udp_socket, print_socket_report, socket_options_from_args)
+
+
+def osc_args(message):
+    """Argomenti di un messaggio decodificato, con i blob copiati in bytes"""
+    if 'b' not in message.typetags:
+        return message.args
+    return _copy_blobs(message.args)
+
+
+def _copy_blobs(args):
+    # Anche dentro gli array ('[b]')
+    return [bytes(arg) if type(arg) is memoryview else
+            _copy_blobs(arg) if type(arg) is list else arg
+            for arg in args]
+
+
 class OSCClient:
-    def __init__(self, server_ip, server_port=10000):
+    def __init__(self, server_ip, server_port=10000, socket_options=None):
         """Inizializza il client OSC"""
         self.server_ip = server_ip
         self.server_port = server_port
+        self.socket_options = socket_options or SocketOptions()
         self.socket = None
+        self.receiver = None
+        self.autosizer = None
+        # Bundle con timetag futuro: inviati a handle_message alla loro ora
+        self.scheduler = BundleScheduler(self.dispatch_group)
         
         # Dati ricevuti
         self.last_message = None
         self.last_address = None
         self.last_timestamp = None
         self.message_count = 0
+        self.decode_errors = 0
         
     def connect(self):
         """Stabilisce la connessione UDP al server"""
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            # Timeout per non bloccare il programma
-            self.socket.settimeout(1.0)
+            # Senza bind il socket UDP non riceverebbe nulla
+            self.socket, report = create_udp_socket(self.server_port, '0.0.0.0',
+                                                    self.socket_options)
+            self.receiver = BatchReceiver(self.socket,
+                                          buffer_size=self.socket_options.max_datagram,
+                                          timestamps=self.socket_options.timestamps,
+                                          pktinfo=self.socket_options.pktinfo)
+            self.autosizer = RcvbufAutosizer(self.socket, self.socket_options.rcvbuf_max)
+            self.autosizer.start()
             print(f"Connesso al server OSC: {self.server_ip}:{self.server_port}")
+            print_socket_report(report)
             return True
         except Exception as e:
             print(f"Errore nella connessione: {e}")
@@ -50,18 +82,32 @@ class OSCClient:
         try:
             while True:
                 try:
-                    # Ricevi dati
-                    data, addr = self.socket.recvfrom(4096)
+                    # Bundle scaduti; l'attesa non supera la prossima scadenza
+                    next_due = self.scheduler.poll()
+                    timeout = 1.0 if next_due is None else min(1.0, max(0.0, next_due))
+                    if not self.receiver.wait(timeout):
+                        continue
                     
-                    # Processa il messaggio OSC
-                    message = self.parse_osc_message(data)
-                    if message:
-                        self.handle_message(message)
+                    # Ricevi tutti i datagrammi pendenti in un colpo solo
+                    batch = self.receiver.drain()
+                    if not batch:
+                        continue
+                    # Istante di ricezione del lotto (del kernel, con SO_TIMESTAMPNS)
+                    arrival = wall_time(self.receiver.received_ns)
+                    received_at = datetime.fromtimestamp(arrival)
+                    for data, addr in batch:
+                        # Un datagramma malformato non deve far perdere il resto del lotto
+                        try:
+                            # Messaggio o bundle OSC: un gruppo per timetag
+                            groups = self.parse_osc_packet(data)
+                        except Exception as e:
+                            self.decode_errors += 1
+                            print(f"Errore nel parsing OSC: {e}")
+                            continue
+                        for timetag, messages in groups:
+                            self.scheduler.submit(addr, timetag, (messages, received_at),
+                                                  arrival)
                         
-                except socket.timeout:
-                    # Timeout normale, continua il loop
-                    continue
-                    
                 except KeyboardInterrupt:
                     print("\nInterruzione richiesta dall'utente")
                     break
@@ -73,73 +119,39 @@ class OSCClient:
         finally:
             self.cleanup()
     
-    def parse_osc_message(self, data):
-        """Parsa i dati OSC grezzi"""
+    def parse_osc_packet(self, data):
+        """Messaggi di un pacchetto raggruppati per timetag: [(timetag, [messaggi])]
+
+        Un messaggio singolo è un gruppo "immediato"; i bundle annidati
+        vengono appiattiti. I blob sono copiati: il datagramma sta nel buffer
+        del BatchReceiver, riusato prima che un bundle futuro parta.
+        """
         try:
-            # Estrai l'indirizzo OSC
-            address_end = data.find(b'\0')
-            if address_end == -1:
-                return None
-                
-            address = data[:address_end].decode('utf-8')
-            
-            # Estrai i tipi di argomento
-            type_tag_index = address_end + (4 - (address_end % 4))
-            if type_tag_index >= len(data):
-                return None
-                
-            type_tag = data[type_tag_index:type_tag_index+1].decode('utf-8')
-            if type_tag != ',':
-                return None
-                
-            # Estrai gli argomenti
-            args = []
-            arg_index = type_tag_index + 1
-            
-            for tag in data[type_tag_index+1:]:
-                tag_char = chr(tag)
-                
-                if tag_char == '\0':
-                    break
-                    
-                if tag_char == 'i':  # intero
-                    if arg_index + 4 > len(data):
-                        break
-                    value = struct.unpack('>i', data[arg_index:arg_index+4])[0]
-                    args.append(value)
-                    arg_index += 4
-                    
-                elif tag_char == 'f':  # float
-                    if arg_index + 4 > len(data):
-                        break
-                    value = struct.unpack('>f', data[arg_index:arg_index+4])[0]
-                    args.append(value)
-                    arg_index += 4
-                    
-                elif tag_char == 's':  # stringa
-                    string_end = data.find(b'\0', arg_index)
-                    if string_end == -1:
-                        break
-                    value = data[arg_index:string_end].decode('utf-8')
-                    args.append(value)
-                    arg_index = string_end + (4 - ((string_end - arg_index) % 4))
-                    
-                else:
-                    # Tipo non supportato, salta
-                    arg_index += 4
-            
-            return {'address': address, 'args': args}
-            
-        except Exception as e:
+            if not is_bundle(data):
+                message = decode_message(data)
+                return [(IMMEDIATELY, [{'address': message.address, 'args': osc_args(message)}])]
+            return [(timetag, [{'address': message.address, 'args': osc_args(message)}
+                               for message in messages])
+                    for timetag, messages in group_by_timetag(decode_bundle(data))]
+        except (OSCDecodeError, struct.error) as e:
+            self.decode_errors += 1
             print(f"Errore nel parsing OSC: {e}")
-            return None
+            return []
+    
+    def dispatch_group(self, item, delayed):
+        """Gestisce tutti i messaggi di un gruppo insieme (dallo scheduler)"""
+        messages, received_at = item
+        # Un bundle programmato viene mostrato all'ora in cui è eseguito
+        at = datetime.now() if delayed else received_at
+        for message in messages:
+            self.handle_message(message, at)
     
-    def handle_message(self, message):
+    def handle_message(self, message, received_at=None):
         """Gestisce un messaggio OSC ricevuto"""
         self.message_count += 1
         self.last_message = message['args']
         self.last_address = message['address']
-        self.last_timestamp = datetime.now()
+        self.last_timestamp = received_at or datetime.now()
         
         # Visualizza il messaggio
         timestamp_str = self.last_timestamp.strftime('%H:%M:%S.%f')[:-3]
@@ -161,6 +173,12 @@ class OSCClient:
     
     def cleanup(self):
         """Pulisce le risorse"""
+        if self.scheduler.scheduled:
+            print(f"Bundle: {self.scheduler.format_stats()}")
+        if self.decode_errors:
+            print(f"Pacchetti OSC malformati: {self.decode_errors}")
+        if self.autosizer:
+            self.autosizer.stop()
         if self.socket:
             self.socket.close()
             print("Connessione chiusa")
@@ -169,6 +187,7 @@ class OSCClient:
         """Restituisce le statistiche"""
         return {
             'message_count': self.message_count,
+            'decode_errors': self.decode_errors,
             'last_address': self.last_address,
             'last_message': self.last_message,
             'last_timestamp': self.last_timestamp
@@ -180,11 +199,12 @@ def main():
     parser.add_argument('server_ip', help='Indirizzo IP del server OSC')
     parser.add_argument('-p', '--port', type=int, default=10000, 
                        help='Porta del server OSC (default: 10000)')
+    add_socket_arguments(parser)
     
     args = parser.parse_args()
     
     # Crea e avvia il client
-    client = OSCClient(args.server_ip, args.port)
+    client = OSCClient(args.server_ip, args.port, socket_options_from_args(args))
     
     if client.connect():
         client.receive_messages()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Ritrasmissione dei datagrammi ricevuti verso altri host
+Un solo Raspberry Pi riceve lo stream di TouchDesigner e lo ripubblica a
+una lista di destinazioni unicast e/o a un gruppo multicast, così il
+mittente invia una volta sola. I datagrammi partono così come sono
+arrivati, dalle memoryview del ricevitore, senza copie; opzionalmente
+filtrati per indirizzo OSC o ridotti all'ultimo valore per indirizzo.
+Ogni destinazione ha un limite di datagrammi al secondo e i suoi
+contatori.
+
+    python relay.py -p 10000 --to 192.168.1.20:10000 --to 239.1.2.3:10000@500
+"""
+
+import argparse
+import ipaddress
+import socket
+import time
+from fnmatch import fnmatchcase
+
+from coalescer import DEFAULT_RATE_HZ, MODE_LATEST, MODE_OFF, Coalescer
+from osc_decoder import is_bundle, packet_address
+from udp_engine import BatchReceiver
+from udp_socket import (add_socket_arguments, create_udp_socket, print_socket_report,
+                        socket_options_from_args)
+
+# CPython non espone sendmmsg(): come per la ricezione, il lotto si invia
+# con un ciclo di sendto() non bloccanti nello stesso risveglio
+COALESCE_MODES = (MODE_OFF, MODE_LATEST)
+DEFAULT_TTL = 1             # il multicast non esce dalla rete locale
+DEFAULT_BURST_SECONDS = 0.1  # raffica ammessa sopra il limite, in secondi di limite
+DEFAULT_POLL_INTERVAL = 0.5  # come socketserver, senza coalescenza
+# Buffer di invio: il multicast resta in carico al socket finché la scheda
+# di rete non lo trasmette, e con il buffer pieno sendto() fallisce (EAGAIN)
+DEFAULT_SNDBUF = 1024 * 1024
+SO_SNDBUFFORCE = getattr(socket, 'SO_SNDBUFFORCE', 32)
+
+
+class RelayTarget:
+    """Destinazione della ritrasmissione con il suo limite (token bucket)
+
+    rate: datagrammi al secondo (0 = nessun limite).
+    """
+
+    def __init__(self, host, port, rate=0.0, burst=None):
+        # Risolto una volta: sendto() con un nome farebbe una query DNS per datagramma
+        self.address = (socket.gethostbyname(host), port)
+        self.label = f"{host}:{port}"
+        self.multicast = ipaddress.ip_address(self.address[0]).is_multicast
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate * DEFAULT_BURST_SECONDS)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+        # Statistiche
+        self.packets = 0
+        self.bytes = 0
+        self.limited = 0
+        self.errors = 0
+        self.last_error = None
+
+    def take(self, count, now):
+        """Quanti dei prossimi count datagrammi rientrano nel limite"""
+        if not self.rate:
+            return count
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        allowed = min(count, int(self.tokens))
+        self.tokens -= allowed
+        self.limited += count - allowed
+        return allowed
+
+    def get_stats(self):
+        return {
+            'target': self.label,
+            'multicast': self.multicast,
+            'rate': self.rate,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'rate_limited': self.limited,
+            'errors': self.errors,
+            'last_error': self.last_error,
+        }
+
+
+def parse_target(text):
+    """RelayTarget da "host:porta" o "host:porta@datagrammi_al_secondo" """
+    spec, _, rate = text.partition('@')
+    host, _, port = spec.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"destinazione non valida (host:porta[@rate]): {text}")
+    try:
+        rate = float(rate) if rate else 0.0
+    except ValueError:
+        raise ValueError(f"limite non valido in {text}") from None
+    if rate < 0:
+        raise ValueError(f"limite non valido in {text}")
+    try:
+        return RelayTarget(host, int(port), rate)
+    except OSError as e:
+        raise ValueError(f"host sconosciuto in {text}: {e}") from None
+
+
+class Relay:
+    """Inoltra i lotti del ricevitore a tutte le destinazioni
+
+    send_batch() accetta i lotti di BatchReceiver (lista di (dati, sorgente))
+    e va chiamata dal thread (o dal loop) di ricezione: i dati vengono
+    inviati prima di tornare al ricevitore, che poi riusa i buffer. Solo la
+    coalescenza copia i datagrammi, perché li tiene fino al tick.
+    """
+
+    def __init__(self, targets, patterns=(), coalesce=MODE_OFF, rate_hz=DEFAULT_RATE_HZ,
+                 passthrough=(), ttl=DEFAULT_TTL, interface=None, loopback=True,
+                 sndbuf=DEFAULT_SNDBUF):
+        if not targets:
+            raise ValueError("nessuna destinazione per la ritrasmissione")
+        if coalesce not in COALESCE_MODES:
+            raise ValueError(f"coalescenza non disponibile per la ritrasmissione: {coalesce}")
+        self.targets = list(targets)
+        self.patterns = tuple(patterns)
+        self._match_cache = {}
+        self.coalescer = (Coalescer(self._emit, coalesce, rate_hz, passthrough)
+                          if coalesce != MODE_OFF else None)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if sndbuf:
+            try:
+                # Come per la ricezione: oltre net.core.wmem_max solo con CAP_NET_ADMIN
+                self.sock.setsockopt(socket.SOL_SOCKET, SO_SNDBUFFORCE, sndbuf)
+            except OSError:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+        if any(target.multicast for target in self.targets):
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            # Con il loop attivo anche i ricevitori su questo host ricevono il gruppo
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(loopback))
+            if interface:
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                     socket.inet_aton(interface))
+
+        # Statistiche
+        self.received = 0
+        self.filtered = 0
+
+    @property
+    def poll_interval(self):
+        """Attesa massima tra due poll() per rispettare il tick di coalescenza"""
+        return self.coalescer.interval if self.coalescer else DEFAULT_POLL_INTERVAL
+
+    def matches(self, address):
+        """True se l'indirizzo passa il filtro (pattern in stile glob)"""
+        result = self._match_cache.get(address)
+        if result is None:
+            result = any(fnmatchcase(address, pattern) for pattern in self.patterns)
+            if len(self._match_cache) < 65536:
+                self._match_cache[address] = result
+        return result
+
+    def send_batch(self, batch):
+        """Inoltra un lotto di (dati, sorgente) ricevuto nello stesso risveglio"""
+        self.received += len(batch)
+        if self.patterns or self.coalescer:
+            batch = self._select(batch)
+        if batch:
+            self._fan_out(batch)
+
+    def send(self, data, source=None):
+        """Inoltra un solo datagramma (server a thread di python-osc)"""
+        self.send_batch([(data, source)])
+
+    def _select(self, batch):
+        # Filtro e coalescenza guardano l'indirizzo OSC (il primo, per un
+        # bundle); il resto (testo, binari) passa solo senza filtro. I bundle
+        # non vengono mai coalescati: i loro messaggi restano insieme
+        selected = []
+        for data, source in batch:
+            address = packet_address(data)
+            if self.patterns and (address is None or not self.matches(address)):
+                self.filtered += 1
+            elif self.coalescer is None or address is None or is_bundle(data):
+                selected.append((data, source))
+            else:
+                self.coalescer.offer(address, address, bytes(data))
+        return selected
+
+    def _emit(self, key, data, window):
+        # Uscita della coalescenza: un datagramma alla volta
+        self._fan_out([(data, None)])
+
+    def _fan_out(self, batch):
+        now = time.monotonic()
+        sendto = self.sock.sendto
+        dontwait = socket.MSG_DONTWAIT
+        for target in self.targets:
+            allowed = target.take(len(batch), now)
+            address = target.address
+            sent = nbytes = 0
+            for data, _ in (batch[:allowed] if allowed < len(batch) else batch):
+                try:
+                    nbytes += sendto(data, dontwait, address)
+                    sent += 1
+                except OSError as e:
+                    # Buffer di invio pieno (EAGAIN) o rete irraggiungibile:
+                    # il datagramma è perso solo per questa destinazione
+                    target.errors += 1
+                    target.last_error = e.strerror
+            target.packets += sent
+            target.bytes += nbytes
+
+    def poll(self):
+        """Senza loop asyncio: invia la coalescenza se il tick è scaduto"""
+        if self.coalescer is not None:
+            self.coalescer.poll()
+
+    def attach(self, loop):
+        """Il tick della coalescenza diventa un timer del loop"""
+        if self.coalescer is not None:
+            self.coalescer.attach(loop)
+
+    def register_metrics(self, registry):
+        """Esporta i contatori con l'etichetta target"""
+        def per_target(field):
+            return lambda: [({'target': target.label}, getattr(target, field))
+                            for target in self.targets]
+
+        registry.gauge('relay_packets_total', 'Datagrammi ritrasmessi per destinazione',
+                       per_target('packets'), kind='counter')
+        registry.gauge('relay_bytes_total', 'Byte ritrasmessi per destinazione',
+                       per_target('bytes'), kind='counter')
+        registry.gauge('relay_rate_limited_total',
+                       'Datagrammi non ritrasmessi per il limite della destinazione',
+                       per_target('limited'), kind='counter')
+        registry.gauge('relay_errors_total', 'Errori di invio per destinazione',
+                       per_target('errors'), kind='counter')
+        registry.gauge('relay_filtered_total', 'Datagrammi esclusi dal filtro della ritrasmissione',
+                       lambda: self.filtered, kind='counter')
+
+    def get_stats(self):
+        """Contatori globali e per destinazione"""
+        stats = {
+            'received': self.received,
+            'filtered': self.filtered,
+            'targets': [target.get_stats() for target in self.targets],
+        }
+        if self.coalescer is not None:
+            stats['coalesce'] = self.coalescer.get_stats()
+        return stats
+
+    def format_stats(self):
+        """Riepilogo leggibile: una parte per destinazione"""
+        parts = [f"{target.label} {target.packets}"
+                 + (f" (limite -{target.limited})" if target.limited else "")
+                 + (f" (errori {target.errors})" if target.errors else "")
+                 for target in self.targets]
+        summary = f"ricevuti {self.received}, " + ", ".join(parts)
+        if self.filtered:
+            summary += f", filtrati {self.filtered}"
+        return summary
+
+    def close(self):
+        """Invia ciò che resta della coalescenza e chiude il socket"""
+        if self.coalescer is not None:
+            self.coalescer.detach()
+        self.sock.close()
+
+
+class RelayServerMixin:
+    """Per i server UDP di socketserver (python-osc): ritrasmette ogni datagramma
+
+    Da mettere prima di PooledServerMixin tra le basi: l'inoltro avviene nel
+    thread di ricezione, prima che il datagramma passi agli handler.
+    serve_forever va chiamato con poll_interval=relay.poll_interval perché
+    la coalescenza rispetti il suo tick anche senza traffico.
+    """
+
+    def __init__(self, *args, relay=None, **kwargs):
+        self.relay = relay
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        if self.relay is not None:
+            self.relay.send(request[0], client_address)
+        super().process_request(request, client_address)
+
+    def service_actions(self):
+        super().service_actions()
+        if self.relay is not None:
+            self.relay.poll()
+
+    def server_close(self):
+        super().server_close()
+        if self.relay is not None:
+            self.relay.close()
+
+
+def add_relay_arguments(parser):
+    """Opzioni della riga di comando per la ritrasmissione"""
+    parser.add_argument('--relay', action='append', default=[], metavar='HOST:PORTA[@RATE]',
+                        help='Ritrasmetti i datagrammi a questa destinazione, unicast o gruppo '
+                             'multicast, con un limite opzionale in datagrammi/s (ripetibile)')
+    parser.add_argument('--relay-filter', action='append', default=[], metavar='PATTERN',
+                        help='Ritrasmetti solo questi indirizzi OSC, anche con * (ripetibile)')
+    parser.add_argument('--relay-coalesce', choices=COALESCE_MODES, default=MODE_OFF,
+                        help='Ritrasmetti solo l\'ultimo valore per indirizzo a ogni tick '
+                             '(default: off)')
+    parser.add_argument('--relay-hz', type=float, default=DEFAULT_RATE_HZ,
+                        help=f'Tick della coalescenza ritrasmessa (default: {DEFAULT_RATE_HZ:g})')
+    parser.add_argument('--relay-passthrough', action='append', default=[], metavar='PATTERN',
+                        help='Indirizzi ritrasmessi sempre subito con la coalescenza (ripetibile)')
+    parser.add_argument('--relay-ttl', type=int, default=DEFAULT_TTL,
+                        help=f'TTL multicast (default: {DEFAULT_TTL}, solo rete locale)')
+    parser.add_argument('--relay-interface', default=None, metavar='IP',
+                        help='Interfaccia di uscita del multicast (default: quella del kernel)')
+    parser.add_argument('--relay-no-loop', action='store_true',
+                        help='Non consegnare il multicast ai ricevitori su questo host')
+    parser.add_argument('--relay-sndbuf', type=int, default=DEFAULT_SNDBUF, metavar='BYTE',
+                        help=f'Buffer di invio della ritrasmissione (default: {DEFAULT_SNDBUF}, '
+                             f'0 = quello del kernel)')
+
+
+def relay_from_args(args, parser=None):
+    """Relay dalle opzioni aggiunte con add_relay_arguments() (None senza --relay)"""
+    if not args.relay:
+        return None
+    try:
+        return Relay([parse_target(text) for text in args.relay], args.relay_filter,
+                     args.relay_coalesce, args.relay_hz, args.relay_passthrough,
+                     args.relay_ttl, args.relay_interface, not args.relay_no_loop,
+                     args.relay_sndbuf)
+    except (ValueError, OSError) as e:
+        if parser is None:
+            raise
+        parser.error(str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ritrasmissione UDP/OSC verso più host')
+    parser.add_argument('-p', '--port', type=int, default=10000,
+                        help='Porta UDP in ascolto (default: 10000)')
+    parser.add_argument('-i', '--interface', default='0.0.0.0',
+                        help='Interfaccia di rete (default: 0.0.0.0 - tutte)')
+    parser.add_argument('--to', dest='relay', action='append', default=[],
+                        metavar='HOST:PORTA[@RATE]', help='Come --relay (ripetibile)')
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help='Secondi tra i riepiloghi (default: 10, 0 = mai)')
+    add_socket_arguments(parser)
+    add_relay_arguments(parser)
+    args = parser.parse_args()
+    if not args.relay:
+        parser.error('serve almeno una destinazione (--to o --relay)')
+    relay = relay_from_args(args, parser)
+
+    # Il relay non usa l'istante di ricezione: niente SO_TIMESTAMPNS
+    socket_options = socket_options_from_args(args)._replace(timestamps=False)
+    sock, report = create_udp_socket(args.port, args.interface, socket_options)
+    receiver = BatchReceiver(sock, buffer_size=socket_options.max_datagram)
+    print(f"Ritrasmissione da {args.interface}:{args.port} verso "
+          + ", ".join(target.label for target in relay.targets))
+    print_socket_report(report)
+
+    last_report = time.monotonic()
+    try:
+        # Senza traffico si torna comunque al tick della coalescenza
+        for batch in receiver.iter_batches(timeout=relay.poll_interval):
+            if batch:
+                relay.send_batch(batch)
+            relay.poll()
+            now = time.monotonic()
+            if args.stats_interval and now - last_report >= args.stats_interval:
+                last_report = now
+                print(f"Ritrasmissione: {relay.format_stats()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        relay.close()
+        receiver.close()
+        print(f"Ritrasmissione: {relay.format_stats()}")
+
+
+if __name__ == "__main__":
+    main()
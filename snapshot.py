@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Ultimo valore per indirizzo e frame di stato per i client appena collegati
+Ogni messaggio distribuito ai client aggiorna in O(1) la sua voce
+(mittente, indirizzo OSC): nessuna scansione della cronologia. Un client
+che si collega (o si ricollega dopo una caduta del Wi-Fi) riceve subito
+lo stato di tutti gli indirizzi in uno o pochi frame già pronti; i frame
+si ricostruiscono solo se la tabella è cambiata dall'ultima richiesta,
+quindi centinaia di client che si ricollegano insieme costano una sola
+costruzione.
+"""
+
+from wire_format import (FORMAT_BINARY, FORMAT_JSON, MAX_BATCH_FRAMES, batch_binary,
+                         snapshot_text)
+
+DEFAULT_MAX_ENTRIES = 4096
+
+
+class SnapshotTable:
+    """Ultimo PreparedMessage per (mittente, indirizzo), in ordine di aggiornamento
+
+    update() è chiamato da Broadcaster.publish; frames() restituisce i
+    frame di stato per un formato, ricostruiti solo se qualcosa è cambiato.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        if not 1 <= max_entries <= MAX_BATCH_FRAMES:
+            raise ValueError(f"max_entries deve essere tra 1 e {MAX_BATCH_FRAMES}")
+        self.max_entries = max_entries
+        self.entries = {}
+        self.version = 0
+        # Formato -> (versione, frame, id annunciati)
+        self._cache = {}
+
+        # Contatori
+        self.updates = 0
+        self.evicted = 0
+        self.builds = 0
+        self.joins = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, source, message):
+        """Nuovo ultimo valore per il mittente e l'indirizzo del messaggio"""
+        key = (source, message.address)
+        entries = self.entries
+        # Reinserita in fondo: l'ordine è quello dell'ultimo aggiornamento
+        if entries.pop(key, None) is None and len(entries) >= self.max_entries:
+            del entries[next(iter(entries))]
+            self.evicted += 1
+        entries[key] = message
+        self.updates += 1
+        self.version += 1
+
+    def frames(self, addresses, wire_format=FORMAT_JSON):
+        """(frame, id annunciati) per un client appena collegato
+
+        JSON: un frame {"type": "snapshot", "messages": [...]}. Binario:
+        la tabella degli indirizzi (l'AddressTable del Broadcaster), i
+        messaggi senza frame binario in un frame JSON e gli altri in un
+        unico lotto FRAME_BATCH. Gli stessi oggetti vanno a tutti i client
+        finché la tabella non cambia.
+        """
+        self.joins += 1
+        cached = self._cache.get(wire_format)
+        if cached is not None and cached[0] == self.version:
+            return cached[1], cached[2]
+        self.builds += 1
+        messages = list(self.entries.values())
+        announced = 0
+        if wire_format != FORMAT_BINARY:
+            frames = [snapshot_text([message.text for message in messages])] if messages else []
+        else:
+            binary = [message.binary() for message in messages if message.has_binary]
+            texts = [message.text for message in messages if not message.has_binary]
+            frames = []
+            if binary:
+                announced = len(addresses)
+                frames.append(addresses.announce(0))
+            if texts:
+                frames.append(snapshot_text(texts))
+            if binary:
+                frames.append(batch_binary(binary))
+        self._cache[wire_format] = (self.version, frames, announced)
+        return frames, announced
+
+    def format_stats(self):
+        """Riepilogo leggibile su una riga"""
+        return (f"{len(self.entries)} indirizzi, {self.updates} aggiornamenti, "
+                f"{self.joins} client serviti con {self.builds} costruzioni, "
+                f"{self.evicted} indirizzi scartati")
+
+    def register_metrics(self, registry):
+        """Esporta voci, costruzioni e client serviti"""
+        registry.gauge('snapshot_entries', 'Indirizzi nella tabella degli ultimi valori',
+                       lambda: len(self.entries))
+        registry.gauge('snapshot_builds_total', 'Costruzioni dei frame di stato',
+                       lambda: self.builds, kind='counter')
+        registry.gauge('snapshot_joins_total', 'Client che hanno ricevuto lo stato',
+                       lambda: self.joins, kind='counter')
+        registry.gauge('snapshot_evicted_total', 'Indirizzi scartati con la tabella piena',
+                       lambda: self.evicted, kind='counter')
+
+
+def add_snapshot_arguments(parser):
+    """Opzione --snapshot-size comune ai server WebSocket"""
+    parser.add_argument('--snapshot-size', type=int, default=DEFAULT_MAX_ENTRIES, metavar='N',
+                        help=f'Indirizzi di cui i nuovi client ricevono subito l\'ultimo valore '
+                             f'(default: {DEFAULT_MAX_ENTRIES}; 0 = nessuno stato, solo la '
+                             f'cronologia recente se il server la tiene)')
+
+
+def snapshot_from_args(args, parser):
+    """SnapshotTable da --snapshot-size, None se 0"""
+    if args.snapshot_size <= 0:
+        return None
+    try:
+        return SnapshotTable(args.snapshot_size)
+    except ValueError as e:
+        parser.error(str(e))
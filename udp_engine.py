@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Motore di ricezione UDP condiviso
+Svuota tutti i datagrammi pendenti ad ogni risveglio, in un buffer
+preallocato e riusato, dimensionato sul datagramma più grande accettato
+"""
+
+import select
+import socket
+import time
+
+from udp_socket import ANCILLARY_SIZE, MAX_UDP_PAYLOAD, kernel_timestamp, local_address
+
+# CPython non espone recvmmsg(): il lotto si ottiene con un ciclo
+# non bloccante di recvfrom_into() finché il kernel non risponde EAGAIN
+DEFAULT_BATCH_SIZE = 64
+# Di default nessun datagramma viene troncato
+DEFAULT_BUFFER_SIZE = MAX_UDP_PAYLOAD
+# Spazio medio per datagramma nell'arena, oltre al massimo per l'ultimo:
+# ogni lettura parte all'inizio di uno slot, uno o più per datagramma
+ARENA_SLOT = 2048
+
+
+def wall_time(received_ns):
+    """Ora del giorno (come time.time()) di un istante perf_counter_ns"""
+    return (received_ns + time.time_ns() - time.perf_counter_ns()) / 1e9
+
+
+class BatchReceiver:
+    """Riceve datagrammi in lotti riusando sempre gli stessi buffer
+
+    Le memoryview restituite da drain() puntano ai buffer interni e restano
+    valide solo fino alla chiamata successiva: chi le usa deve consumarle
+    (decodifica, copia, invio) prima di tornare al motore.
+
+    I datagrammi si ricevono uno dopo l'altro in un'unica arena, ognuno
+    all'inizio di uno slot di ARENA_SLOT byte: ogni lettura ha a
+    disposizione buffer_size byte (anche oltre il suo slot), e il lotto si
+    chiude quando gli slot sono finiti. Le viste di lettura degli slot sono
+    create una volta sola. Con buffer_size sotto MAX_UDP_PAYLOAD i
+    datagrammi che riempiono tutto il buffer sono contati come troncati.
+
+    Con timestamps=True (socket con SO_TIMESTAMPNS) received_ns è l'istante
+    in cui il kernel ha ricevuto il primo datagramma del lotto, riportato
+    sull'orologio di perf_counter_ns: la latenza misurata comprende
+    l'attesa nel buffer del socket e non il ritardo di Python nel
+    risvegliarsi. Con pktinfo=True local_addresses contiene l'indirizzo
+    locale di destinazione di ogni datagramma del lotto.
+    """
+
+    def __init__(self, sock, batch_size=DEFAULT_BATCH_SIZE,
+                 buffer_size=DEFAULT_BUFFER_SIZE, timestamps=False, pktinfo=False):
+        # Il socket resta bloccante: le letture non bloccanti usano
+        # MSG_DONTWAIT, così l'attesa senza timeout costa una sola syscall
+        self.sock = sock
+        self.sock.setblocking(True)
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self._stride = min(ARENA_SLOT, buffer_size)
+        self.arena = bytearray(batch_size * self._stride + buffer_size)
+        self.view = memoryview(self.arena)
+        # Vista di lettura (buffer_size byte) per l'inizio di ogni slot
+        self._slots = [self.view[i * self._stride:i * self._stride + buffer_size]
+                       for i in range(batch_size)]
+        self._check_truncated = buffer_size < MAX_UDP_PAYLOAD
+        self.received_ns = 0
+        # Dati ausiliari: recvmsg_into() al posto di recvfrom_into()
+        self.timestamps = timestamps
+        self.pktinfo = pktinfo
+        self.ancillary = timestamps or pktinfo
+        self.local_addresses = []
+        self._first_kernel_ns = None
+
+        # poll() evita di ricostruire le liste fd ad ogni attesa
+        if hasattr(select, 'poll'):
+            self._poller = select.poll()
+            self._poller.register(sock.fileno(), select.POLLIN)
+        else:
+            self._poller = None
+
+        # Statistiche
+        self.packets = 0
+        self.batches = 0
+        self.bytes = 0
+        self.truncated = 0
+
+    def drain(self):
+        """Legge i datagrammi pendenti senza bloccare: lista di (view, addr)"""
+        if not self.ancillary:
+            return self._drain_from(0, [])
+        view = self._slots[0]
+        self.local_addresses = []
+        try:
+            nbytes, addr = self._recvmsg(view, socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return []
+        return self._first(nbytes, addr)
+
+    def receive(self):
+        """Blocca fino al primo datagramma, poi svuota gli altri pendenti"""
+        view = self._slots[0]
+        if self.ancillary:
+            self.local_addresses = []
+            nbytes, addr = self._recvmsg(view, 0)
+        else:
+            nbytes, addr = self.sock.recvfrom_into(view)
+        return self._first(nbytes, addr)
+
+    def _first(self, nbytes, addr):
+        self.bytes += nbytes
+        if self._check_truncated and nbytes >= self.buffer_size:
+            self.truncated += 1
+        return self._drain_from(nbytes, [(self.view[:nbytes], addr)])
+
+    def _recvmsg(self, view, flags):
+        """Primo datagramma del lotto con i dati ausiliari"""
+        nbytes, ancdata, _, addr = self.sock.recvmsg_into([view], ANCILLARY_SIZE, flags)
+        if self.timestamps:
+            self._first_kernel_ns = kernel_timestamp(ancdata)
+        if self.pktinfo:
+            self.local_addresses.append(local_address(ancdata))
+        return nbytes, addr
+
+    def _recv_pktinfo(self, view, nbytes, flags):
+        # Stessa firma di recvfrom_into(), più l'indirizzo locale
+        nbytes, ancdata, _, addr = self.sock.recvmsg_into([view], ANCILLARY_SIZE, flags)
+        self.local_addresses.append(local_address(ancdata))
+        return nbytes, addr
+
+    def _drain_from(self, offset, batch):
+        # Il timestamp serve solo per il primo datagramma: gli altri passano
+        # da recvfrom_into(), che costa la metà di recvmsg_into()
+        recv_into = self._recv_pktinfo if self.pktinfo else self.sock.recvfrom_into
+        dontwait = socket.MSG_DONTWAIT
+        slots = self._slots
+        stride = self._stride
+        buffer_size = self.buffer_size
+        batch_size = self.batch_size
+        append = batch.append
+        # Primo slot libero dopo i byte già ricevuti (almeno uno per
+        # datagramma: al più batch_size datagrammi per lotto)
+        slot = -(-offset // stride) or len(batch)
+        nbytes_total = 0
+        while slot < batch_size:
+            view = slots[slot]
+            try:
+                nbytes, addr = recv_into(view, buffer_size, dontwait)
+            except (BlockingIOError, InterruptedError):
+                break
+            append((view[:nbytes], addr))
+            slot += 1 if nbytes <= stride else -(-nbytes // stride)
+            nbytes_total += nbytes
+            if nbytes >= buffer_size and self._check_truncated:
+                self.truncated += 1
+
+        if batch:
+            now = time.perf_counter_ns()
+            kernel_ns = self._first_kernel_ns
+            if kernel_ns:
+                # Istante del kernel (ora del giorno) riportato su perf_counter_ns
+                self._first_kernel_ns = None
+                self.received_ns = min(now, kernel_ns - time.time_ns() + now)
+            else:
+                self.received_ns = now
+            self.bytes += nbytes_total
+            self.packets += len(batch)
+            self.batches += 1
+        return batch
+
+    def wait(self, timeout=None):
+        """Attende che il socket sia leggibile; False se scade il timeout"""
+        if self._poller is not None:
+            return bool(self._poller.poll(None if timeout is None else timeout * 1000))
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        return bool(readable)
+
+    def iter_batches(self, timeout=None):
+        """Generatore bloccante di lotti (lista vuota allo scadere del timeout)
+
+        Si attende sul socket solo quando il lotto precedente lo ha svuotato.
+        """
+        if timeout is None:
+            while True:
+                yield self.receive()
+        while True:
+            batch = self.drain()
+            if batch:
+                yield batch
+            elif not self.wait(timeout):
+                yield []
+
+    def attach(self, loop, callback):
+        """Registra il socket sul loop asyncio: callback(batch) ad ogni risveglio"""
+        loop.add_reader(self.sock.fileno(), self._on_readable, callback)
+
+    def detach(self, loop):
+        """Rimuove il socket dal loop asyncio"""
+        loop.remove_reader(self.sock.fileno())
+
+    def _on_readable(self, callback):
+        batch = self.drain()
+        if batch:
+            callback(batch)
+
+    def get_stats(self):
+        """Restituisce le statistiche di ricezione"""
+        return {
+            'packets': self.packets,
+            'batches': self.batches,
+            'bytes': self.bytes,
+            'truncated': self.truncated,
+            'avg_batch': self.packets / self.batches if self.batches else 0.0,
+        }
+
+    def close(self):
+        """Chiude il socket"""
+        self.sock.close()
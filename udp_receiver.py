@@ -4,105 +4,261 @@ Simple UDP Receiver per Raspberry Pi
 Ascolta sulla porta specificata e mostra tutti i dati ricevuti
 """
 
-import socket
 import argparse
 import threading
-import queue
-from datetime import datetime
+import time
 
-def start_websocket_server(port=8765, udp_port=10000, interface='0.0.0.0'):
+from chunking import add_chunk_arguments, reassembler_from_args, register_chunk_metrics
+from coalescer import DEFAULT_RATE_HZ, MODE_AGGREGATE, MODE_OFF, MODES, Coalescer
+from broadcaster import POLICIES, POLICY_DROP_OLDEST, Broadcaster, policy_from_path
+from frame_batcher import add_batch_arguments, batcher_from_args
+from log_sink import DEFAULT_EVERY, DEFAULT_FIRST, LogSink, format_clock, level_from_args
+from metrics import (LatencyHistogram, MetricsRegistry, is_stats_request,
+                     register_udp_socket, stats_message)
+from osc_scheduler import BundleScheduler
+from payload_classifier import (DATA_TYPE_BUNDLE, PayloadClassifier, add_schema_arguments,
+                                classifier_from_args, udp_message)
+from snapshot import add_snapshot_arguments, snapshot_from_args
+from udp_engine import BatchReceiver, wall_time
+from udp_socket import (RcvbufAutosizer, SocketOptions, add_socket_arguments,
+                        create_udp_socket, print_socket_report, socket_options_from_args)
+from wire_format import (SUBPROTOCOLS, PreparedMessage, bundle_fields, bundle_info,
+                         batch_from_path, is_bundle_info, prepare_message, split_bundle_info,
+                         window_message, wire_format_from_request)
+from workers import WorkerPool
+
+# Log per pacchetto: accodato qui, scritto a lotti da un thread in background
+packet_log = LogSink()
+# Metriche del bridge: chiedile con {"type": "stats"} sul WebSocket
+registry = MetricsRegistry()
+decode_errors = registry.counter('decode_errors_total', 'Datagrammi scartati per errori di decodifica')
+# Formato per mittente (OSC, testo, float32...), con quelli dichiarati da --schema
+classifier = PayloadClassifier()
+# Riassemblaggio dei payload a frammenti (--chunks), uno per processo
+chunks = None
+
+def convert_udp_data(data, addr):
+    """Conversione avanzata del payload: (data_type, content)"""
+    payload = classifier.decode(data, addr)
+    return payload.data_type, payload.content()
+
+def encode_bundle(groups, addr, size, timestamp):
+    """Un frame per ogni timetag del bundle, con tutti i suoi messaggi OSC"""
+    import json
+    frames = []
+    for timetag, messages in groups:
+        bundle_message = {
+            'timestamp': timestamp,
+            'source_ip': addr[0],
+            'source_port': addr[1],
+            'size': size
+        }
+        bundle_message.update(bundle_fields(timetag, messages))
+        websocket_msg = {
+            'type': 'udp_message',
+            'message': bundle_message
+        }
+        frames.append((addr, json.dumps(websocket_msg), bundle_info(timetag, messages)))
+    return frames
+
+def decode_udp_batch(batch):
+    """Classifica un lotto di datagrammi: [(addr, Payload)]"""
+    decoded = []
+    if chunks is not None:
+        # Con i worker tutti i frammenti di un mittente arrivano allo stesso processo
+        batch = chunks.reassemble(batch)
+    for data, addr in batch:
+        try:
+            # Formato memorizzato per mittente: nessun tentativo a vuoto
+            payload = classifier.decode(data, addr)
+        except Exception:
+            # Un datagramma malformato non deve far perdere il resto del lotto
+            decode_errors.inc()
+            continue
+        decoded.append((addr, payload))
+        # Il testo del log si costruisce solo per i pacchetti mostrati
+        sample = packet_log.sample(addr)
+        if sample:
+            packet_log.write("Da %s:%d - %d bytes | %s: %s", addr[0], addr[1],
+                             len(payload.data), payload.data_type, payload.content()[:80],
+                             sample=sample)
+    return decoded
+
+def encode_udp_batch(batch, received_ns):
+    """Converte un lotto di datagrammi in (addr, frame JSON) (gira nei worker)"""
+    import json
+    timestamp = format_clock(wall_time(received_ns))
+    frames = []
+    for addr, payload in decode_udp_batch(batch):
+        if payload.data_type == DATA_TYPE_BUNDLE:
+            frames.extend(encode_bundle(payload.values, addr, len(payload.data), timestamp))
+            continue
+        websocket_msg = {
+            'type': 'udp_message',
+            'message': udp_message(payload, addr, timestamp)
+        }
+        frames.append((addr, json.dumps(websocket_msg), payload.numeric()))
+    return frames
+
+def start_websocket_server(port=8765, udp_port=10000, interface='0.0.0.0', workers=0,
+                           client_policy=POLICY_DROP_OLDEST, coalesce_mode=MODE_OFF,
+                           coalesce_hz=DEFAULT_RATE_HZ, passthrough=(), socket_options=None,
+                           batcher=None, snapshot=None):
     import asyncio
     import websockets
-    import json
-    from datetime import datetime
 
-    clients = set()
-    message_queue = queue.Queue()
+    socket_options = socket_options or SocketOptions()
+
+    latency_histogram = LatencyHistogram('ricezione->invio')
+    # Una coda di invio per ogni client: uno lento non blocca gli altri
+    # Chi si collega riceve subito l'ultimo valore di ogni indirizzo (snapshot)
+    clients = Broadcaster(client_policy, latency_histogram=latency_histogram,
+                          fanout_histogram=LatencyHistogram('fan-out'), batcher=batcher,
+                          snapshot=snapshot)
+    clients.register_metrics(registry)
+    register_udp_socket(registry, udp_port)
+
+    # I worker vanno creati con fork dal thread principale, prima del bridge
+    pool = None
+    if workers > 0:
+        pool = WorkerPool(workers, udp_port, interface, encode_udp_batch, socket_options)
+        pool.start()
 
     async def handle_websocket(websocket, path):
-        clients.add(websocket)
+        session = clients.add(websocket, policy_from_path(path),
+                              wire_format_from_request(path, websocket.subprotocol),
+                              batch_from_path(path))
         try:
             async for message in websocket:
-                pass
+                if is_stats_request(message):
+                    session.offer(stats_message(registry))
+                    continue
+                # subscribe/unsubscribe: solo gli indirizzi OSC richiesti
+                reply = clients.handle_subscription(session, message)
+                if reply is not None:
+                    session.offer(reply)
         finally:
-            clients.remove(websocket)
-
-    async def broadcast_message(message):
-        if clients:
-            message_json = json.dumps(message)
-            await asyncio.gather(*[
-                client.send(message_json) for client in clients
-            ])
-
-    def udp_receiver_thread():
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((interface, udp_port))
-        while True:
-            data, addr = sock.recvfrom(4096)
-            timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
-            # Conversione avanzata
-            try:
-                text_data = data.decode('utf-8')
-                data_type = 'text'
-                content = text_data
-            except UnicodeDecodeError:
-                # Prova conversione numerica
-                if len(data) == 4:
-                    try:
-                        import struct
-                        num = struct.unpack('!f', data)[0]
-                        data_type = 'float'
-                        content = str(num)
-                    except Exception:
-                        num = struct.unpack('!i', data)[0]
-                        data_type = 'int'
-                        content = str(num)
-                elif len(data) == 8:
-                    try:
-                        import struct
-                        num = struct.unpack('!d', data)[0]
-                        data_type = 'double'
-                        content = str(num)
-                    except Exception:
-                        content = data.hex()
-                        data_type = 'binary'
-                else:
-                    content = data.hex()
-                    data_type = 'binary'
-            udp_message = {
-                'timestamp': timestamp,
-                'source_ip': addr[0],
-                'source_port': addr[1],
-                'data_type': data_type,
-                'content': content,
-                'size': len(data)
-            }
-            websocket_msg = {
-                'type': 'udp_message',
-                'message': udp_message
-            }
-            message_queue.put(websocket_msg)
-            print(f"[{timestamp}] Da {addr[0]}:{addr[1]} - {len(data)} bytes | {data_type}: {content}")
-
-    async def process_message_queue():
+            await clients.remove(websocket)
+
+    def emit(key, item, window):
+        received_ns, addr, message = item
+        if window is not None:
+            message = window_message(message, window)
+        clients.publish(message, key=addr, received_ns=received_ns)
+
+    # Riduce gli indirizzi ad alta frequenza al ritmo del tick
+    coalescer = Coalescer(emit, coalesce_mode, coalesce_hz, passthrough)
+    registry.gauge('coalescer_pending', 'Indirizzi in attesa del tick di coalescenza',
+                   lambda: len(coalescer.pending))
+
+    def publish_bundle(item, delayed):
+        # Un frame per tutto il gruppo, mai coalescato
+        received_ns, frame, addresses = item
+        clients.publish(PreparedMessage(frame, addresses),
+                        received_ns=None if delayed else received_ns)
+
+    # Bundle OSC con timetag futuro: partono alla loro ora (timer del loop)
+    scheduler = BundleScheduler(publish_bundle)
+    scheduler.register_metrics(registry)
+
+    def publish(received_ns, addr, frame, numeric):
+        if is_bundle_info(numeric):
+            timetag, addresses = split_bundle_info(numeric)
+            scheduler.submit(addr, timetag, (received_ns, frame, addresses),
+                             wall_time(received_ns))
+            return
+        # Serializzato una sola volta per tutti i client
+        forward(received_ns, addr, prepare_message(frame, clients.addresses, addr, numeric,
+                                                   wall_time(received_ns)))
+
+    def forward(received_ns, addr, message):
+        if coalescer.enabled and message.is_numeric:
+            values = message.float_values() if coalescer.mode == MODE_AGGREGATE else None
+            coalescer.offer((addr, message.address), message.address,
+                            (received_ns, addr, message), values)
+        else:
+            coalescer.forward(addr, (received_ns, addr, message))
+
+    def publish_payload(received_ns, addr, payload, timestamp):
+        # Il JSON si costruisce solo se un client lo chiede
+        def render():
+            import json
+            return json.dumps({'type': 'udp_message',
+                               'message': udp_message(payload, addr, timestamp)})
+        message = prepare_message(None, clients.addresses, addr, payload.numeric(),
+                                  wall_time(received_ns), render, payload.blob())
+        forward(received_ns, addr, message)
+
+    def handle_udp_batch(batch, received_ns):
+        timestamp = format_clock(wall_time(received_ns))
+        for addr, payload in decode_udp_batch(batch):
+            if payload.data_type == DATA_TYPE_BUNDLE:
+                for addr, frame, info in encode_bundle(payload.values, addr,
+                                                       len(payload.data), timestamp):
+                    publish(received_ns, addr, frame, info)
+            else:
+                publish_payload(received_ns, addr, payload, timestamp)
+
+    def handle_worker_frames(frames):
+        for received_ns, addr, frame, numeric in frames:
+            publish(received_ns, addr, frame, numeric)
+
+    async def report_stats(interval=10.0):
+        # L'istogramma non si azzera: è anche esportato nelle metriche
+        reported = 0
         while True:
-            try:
-                message = message_queue.get_nowait()
-                await broadcast_message(message)
-                message_queue.task_done()
-            except queue.Empty:
-                await asyncio.sleep(0.1)
+            await asyncio.sleep(interval)
+            if latency_histogram.count != reported:
+                reported = latency_histogram.count
+                print(f"Latenza {latency_histogram.format_summary()}")
+                print(f"Client: {clients.format_stats()}")
+                if batcher is not None and batcher.messages_histogram.count:
+                    print(f"Lotti {batcher.format_stats()}")
+                if snapshot is not None and snapshot.joins:
+                    print(f"Stato per i nuovi client: {snapshot.format_stats()}")
+                if coalescer.enabled:
+                    print(f"Coalescenza {coalescer.format_stats()}")
+                if scheduler.immediate or scheduler.scheduled:
+                    print(f"Bundle: {scheduler.format_stats()}")
+                if any(classifier.payloads.values()):
+                    print(f"Payload: {classifier.format_stats()}")
+                if chunks is not None and chunks.fragments:
+                    print(f"Frammenti: {chunks.format_stats()}")
 
     async def main_async():
-        udp_thread = threading.Thread(target=udp_receiver_thread, daemon=True)
-        udp_thread.start()
-        server = await websockets.serve(handle_websocket, interface, port)
+        coalescer.attach(asyncio.get_running_loop())
+        scheduler.attach(asyncio.get_running_loop())
+        if pool is not None:
+            pool.attach(asyncio.get_running_loop(), handle_worker_frames)
+            registry.gauge('packets_received_total', 'Datagrammi ricevuti',
+                           lambda: pool.frames, kind='counter')
+        else:
+            sock, report = create_udp_socket(udp_port, interface, socket_options)
+            print_socket_report(report)
+            receiver = BatchReceiver(sock, buffer_size=socket_options.max_datagram,
+                                     timestamps=socket_options.timestamps,
+                                     pktinfo=socket_options.pktinfo)
+            receiver.attach(
+                asyncio.get_running_loop(),
+                lambda batch: handle_udp_batch(batch, receiver.received_ns)
+            )
+            RcvbufAutosizer(sock, socket_options.rcvbuf_max).attach(asyncio.get_running_loop())
+            registry.gauge('packets_received_total', 'Datagrammi ricevuti',
+                           lambda: receiver.packets, kind='counter')
+            registry.gauge('bytes_received_total', 'Byte ricevuti',
+                           lambda: receiver.bytes, kind='counter')
+            # Con i worker la classificazione avviene nei loro processi
+            classifier.register_metrics(registry)
+            if chunks is not None:
+                register_chunk_metrics(registry, {udp_port: chunks})
+        server = await websockets.serve(handle_websocket, interface, port,
+                                        subprotocols=SUBPROTOCOLS)
         print(f"Server WebSocket avviato su ws://{interface}:{port}")
         print("Interfaccia web disponibile su http://localhost:8000")
-        await asyncio.gather(server.wait_closed(), process_message_queue())
+        await asyncio.gather(server.wait_closed(), report_stats())
 
     threading.Thread(target=lambda: __import__('asyncio').run(__import__('asyncio').new_event_loop().run_until_complete(main_async())), daemon=True).start()
+    return pool
 
 def main():
     parser = argparse.ArgumentParser(description='UDP Receiver per Raspberry Pi')
@@ -110,55 +266,91 @@ def main():
                        help='Porta UDP in ascolto (default: 10000)')
     parser.add_argument('-i', '--interface', default='0.0.0.0',
                        help='Interfaccia di rete (default: 0.0.0.0 - tutte)')
+    parser.add_argument('--workers', type=int, default=0,
+                       help='Processi di ricezione con SO_REUSEPORT (default: 0 - nessuno)')
+    add_socket_arguments(parser)
+    parser.add_argument('--client-policy', choices=POLICIES, default=POLICY_DROP_OLDEST,
+                       help='Politica per i client WebSocket lenti (default: drop-oldest)')
+    parser.add_argument('--coalesce', choices=MODES, default=MODE_OFF,
+                       help='Coalescenza per indirizzo verso i client (default: off)')
+    parser.add_argument('--coalesce-hz', type=float, default=DEFAULT_RATE_HZ,
+                       help=f'Frequenza del tick di coalescenza (default: {DEFAULT_RATE_HZ:g})')
+    parser.add_argument('--passthrough', action='append', default=[], metavar='PATTERN',
+                       help='Indirizzi mai coalescati (ripetibile)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                       help='Nessun log per pacchetto')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                       help='Log di tutti i pacchetti, senza campionamento')
+    parser.add_argument('--log-first', type=int, default=DEFAULT_FIRST,
+                       help=f'Pacchetti mostrati per mittente prima del campionamento '
+                            f'(default: {DEFAULT_FIRST})')
+    parser.add_argument('--log-every', type=int, default=DEFAULT_EVERY,
+                       help=f'Poi uno ogni N pacchetti (default: {DEFAULT_EVERY})')
+    add_schema_arguments(parser)
+    add_batch_arguments(parser)
+    add_snapshot_arguments(parser)
+    add_chunk_arguments(parser)
     args = parser.parse_args()
+    packet_log.configure(level_from_args(args.quiet, args.verbose),
+                         args.log_first, args.log_every)
+    # Prima dei worker: li ereditano con il fork
+    global chunks, classifier
+    classifier = classifier_from_args(args, parser)
+    chunks = reassembler_from_args(args, parser)
     # Avvia anche il server WebSocket
-    start_websocket_server(port=8765, udp_port=args.port, interface=args.interface)
+    socket_options = socket_options_from_args(args)
+    pool = start_websocket_server(port=8765, udp_port=args.port, interface=args.interface,
+                                  workers=args.workers, client_policy=args.client_policy,
+                                  coalesce_mode=args.coalesce, coalesce_hz=args.coalesce_hz,
+                                  passthrough=args.passthrough, socket_options=socket_options,
+                                  batcher=batcher_from_args(args, parser),
+                                  snapshot=snapshot_from_args(args, parser))
+    if pool is not None:
+        # I worker ricevono, stampano e pubblicano sul bridge
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\nReceiver interrotto dall'utente")
+        finally:
+            pool.stop()
+            packet_log.close()
+        return
     # Crea socket UDP
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock = None
     try:
-        sock.bind((args.interface, args.port))
+        sock, report = create_udp_socket(args.port, args.interface, socket_options)
+        receiver = BatchReceiver(sock, buffer_size=socket_options.max_datagram,
+                                 timestamps=socket_options.timestamps,
+                                 pktinfo=socket_options.pktinfo)
+        RcvbufAutosizer(sock, socket_options.rcvbuf_max).start()
         print(f"UDP Receiver avviato su {args.interface}:{args.port}")
+        print_socket_report(report)
         print("In attesa di dati UDP...")
         print("Premi Ctrl+C per fermare")
         print("-" * 60)
-        while True:
-            data, addr = sock.recvfrom(4096)
-            timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
-            print(f"[{timestamp}] Da {addr[0]}:{addr[1]} - {len(data)} bytes")
-            try:
-                text_data = data.decode('utf-8')
-                print(f"   Testo: {text_data}")
-            except UnicodeDecodeError:
-                # Conversione numerica
-                if len(data) == 4:
-                    try:
-                        import struct
-                        num = struct.unpack('!f', data)[0]
-                        print(f"   Float: {num}")
-                    except Exception:
-                        num = struct.unpack('!i', data)[0]
-                        print(f"   Int: {num}")
-                elif len(data) == 8:
+        for batch in receiver.iter_batches():
+            for data, addr in batch:
+                # Conversione solo per i pacchetti che verranno mostrati
+                sample = packet_log.sample(addr)
+                if sample:
                     try:
-                        import struct
-                        num = struct.unpack('!d', data)[0]
-                        print(f"   Double: {num}")
+                        data_type, content = convert_udp_data(data, addr)
                     except Exception:
-                        hex_data = data.hex()
-                        print(f"   Dati: {hex_data}")
-                else:
-                    hex_data = data.hex()
-                    if len(hex_data) > 80:
-                        hex_data = hex_data[:80] + "..."
-                    print(f"   Dati: {hex_data}")
-            print("-" * 40)
+                        # Un datagramma malformato non deve fermare il receiver
+                        decode_errors.inc()
+                        continue
+                    packet_log.write("Da %s:%d - %d bytes\n   %s: %s\n%s",
+                                     addr[0], addr[1], len(data), data_type.capitalize(),
+                                     content[:80], "-" * 40, sample=sample)
     except KeyboardInterrupt:
         print("\nReceiver interrotto dall'utente")
     except Exception as e:
         print(f"Errore: {e}")
     finally:
-        sock.close()
+        if sock is not None:
+            sock.close()
+        packet_log.close()
         print("Socket chiuso")
 
 if __name__ == "__main__":
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Socket UDP di ricezione condivisi da tutti i punti di ingresso
+Buffer di ricezione (con ridimensionamento automatico sui drop del
+kernel), timestamp di ricezione del kernel, busy poll, IP_PKTINFO e
+adesione a un gruppo multicast. Il kernel raddoppia SO_RCVBUF e lo
+limita a net.core.rmem_max: all'avvio si stampano i valori richiesti
+accanto a quelli effettivi.
+"""
+
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from metrics import read_socket_drops
+
+# Costanti Linux non sempre esposte dal modulo socket
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33)
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46)
+IP_PKTINFO = getattr(socket, 'IP_PKTINFO', 8)
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+
+# struct timespec per dimensione: 16 byte con time_t a 64 bit, 8 byte sui
+# sistemi a 32 bit con time_t a 32 bit (Raspberry Pi OS armhf); e struct
+# in_pktinfo (ifindex, spec_dst, addr)
+_TIMESPECS = {8: struct.Struct('@ii'), 16: struct.Struct('@qq')}
+_PKTINFO = struct.Struct('@i4s4s')
+# Spazio per i messaggi ausiliari di recvmsg: timestamp e IP_PKTINFO
+ANCILLARY_SIZE = socket.CMSG_SPACE(16) + socket.CMSG_SPACE(_PKTINFO.size)
+
+DEFAULT_RCVBUF_MAX = 8 * 1024 * 1024
+# Payload UDP massimo su IPv4: il buffer di lettura di default
+MAX_UDP_PAYLOAD = 65507
+DEFAULT_AUTOSIZE_INTERVAL = 1.0
+
+# rcvbuf: byte richiesti (0 = default del kernel); rcvbuf_max: limite del
+# ridimensionamento automatico (0 = disattivato); busy_poll: µs (0 = no);
+# multicast: gruppo a cui unirsi dopo il bind ('' = nessuno); max_datagram:
+# byte letti per datagramma (i più lunghi vengono troncati dal kernel)
+SocketOptions = namedtuple('SocketOptions',
+                           'rcvbuf rcvbuf_max timestamps busy_poll pktinfo multicast max_datagram',
+                           defaults=(0, 0, False, 0, False, '', MAX_UDP_PAYLOAD))
+
+
+def _read_rmem_max():
+    try:
+        with open('/proc/sys/net/core/rmem_max') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def set_rcvbuf(sock, size):
+    """Imposta il buffer di ricezione: SO_RCVBUFFORCE se permesso, altrimenti SO_RCVBUF
+
+    Restituisce (opzione usata, valore effettivo letto dal kernel).
+    """
+    try:
+        # Ignora net.core.rmem_max, ma richiede CAP_NET_ADMIN
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+        option = 'SO_RCVBUFFORCE'
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        option = 'SO_RCVBUF'
+    return option, sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+
+def _apply(report, name, sock, level, option, value):
+    try:
+        sock.setsockopt(level, option, value)
+        report[name] = {'requested': value, 'effective': sock.getsockopt(level, option)}
+    except OSError as e:
+        report[name] = {'requested': value, 'effective': None, 'error': e.strerror}
+
+
+def apply_socket_options(sock, options):
+    """Applica le opzioni a un socket non ancora collegato: rapporto richiesti/effettivi"""
+    report = {}
+    if options.rcvbuf:
+        try:
+            option, effective = set_rcvbuf(sock, options.rcvbuf)
+            report['rcvbuf'] = {'requested': options.rcvbuf, 'effective': effective,
+                                'option': option}
+        except OSError as e:
+            report['rcvbuf'] = {'requested': options.rcvbuf, 'effective': None,
+                                'error': e.strerror}
+    else:
+        report['rcvbuf'] = {'requested': None,
+                            'effective': sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)}
+    if options.timestamps:
+        _apply(report, 'timestamps', sock, socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    if options.busy_poll:
+        _apply(report, 'busy_poll', sock, socket.SOL_SOCKET, SO_BUSY_POLL, options.busy_poll)
+    if options.pktinfo:
+        _apply(report, 'pktinfo', sock, socket.IPPROTO_IP, IP_PKTINFO, 1)
+    return report
+
+
+def join_multicast(report, sock, group, interface='0.0.0.0'):
+    """Si unisce al gruppo multicast (dopo il bind), sull'interfaccia indicata"""
+    membership = socket.inet_aton(group) + socket.inet_aton(interface or '0.0.0.0')
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        report['multicast'] = {'requested': group, 'effective': group}
+    except OSError as e:
+        report['multicast'] = {'requested': group, 'effective': None, 'error': e.strerror}
+
+
+def create_udp_socket(port, interface='0.0.0.0', options=None, reuseport=False):
+    """Socket UDP in ascolto con le opzioni richieste: (socket, rapporto)"""
+    options = options or SocketOptions()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuseport:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise OSError("SO_REUSEPORT non disponibile su questo sistema")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        report = apply_socket_options(sock, options)
+        sock.bind((interface, port))
+        if options.multicast:
+            join_multicast(report, sock, options.multicast, interface)
+    except OSError:
+        sock.close()
+        raise
+    return sock, report
+
+
+def format_socket_report(report):
+    """Righe leggibili: valori richiesti ed effettivi di ogni opzione"""
+    lines = []
+    rcvbuf = report.get('rcvbuf')
+    if rcvbuf is not None:
+        if rcvbuf['requested'] is None:
+            lines.append(f"SO_RCVBUF: default del kernel, effettivo {rcvbuf['effective']} byte")
+        elif rcvbuf['effective'] is None:
+            lines.append(f"SO_RCVBUF: richiesto {rcvbuf['requested']}, errore: {rcvbuf['error']}")
+        else:
+            line = (f"{rcvbuf['option']}: richiesto {rcvbuf['requested']} byte, "
+                    f"effettivo {rcvbuf['effective']} (il kernel raddoppia il valore)")
+            rmem_max = _read_rmem_max()
+            if rcvbuf['option'] == 'SO_RCVBUF' and rmem_max and rcvbuf['requested'] > rmem_max:
+                line += f", limitato da net.core.rmem_max={rmem_max}"
+            lines.append(line)
+    names = {'timestamps': 'SO_TIMESTAMPNS', 'busy_poll': 'SO_BUSY_POLL', 'pktinfo': 'IP_PKTINFO',
+             'multicast': 'IP_ADD_MEMBERSHIP'}
+    for key, name in names.items():
+        entry = report.get(key)
+        if entry is None:
+            continue
+        if entry['effective'] is None:
+            lines.append(f"{name}: non applicato ({entry['error']})")
+        else:
+            lines.append(f"{name}: richiesto {entry['requested']}, effettivo {entry['effective']}")
+    return lines
+
+
+def print_socket_report(report):
+    """Stampa il rapporto delle opzioni del socket"""
+    for line in format_socket_report(report):
+        print(f"  {line}")
+
+
+def kernel_timestamp(ancdata):
+    """Istante di ricezione del kernel (ns, come time.time_ns) dai dati ausiliari
+
+    None se manca o ha una dimensione sconosciuta: il chiamante usa
+    l'orologio in user space.
+    """
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SCM_TIMESTAMPNS:
+            timespec = _TIMESPECS.get(len(data))
+            if timespec is None:
+                return None
+            seconds, nanoseconds = timespec.unpack(data)
+            return seconds * 1000000000 + nanoseconds
+    return None
+
+
+def local_address(ancdata):
+    """Indirizzo locale di destinazione del datagramma (IP_PKTINFO), o None"""
+    for level, kind, data in ancdata:
+        if level == socket.IPPROTO_IP and kind == IP_PKTINFO:
+            return socket.inet_ntoa(_PKTINFO.unpack_from(data)[2])
+    return None
+
+
+def add_socket_arguments(parser):
+    """Opzioni della riga di comando comuni a tutti i ricevitori"""
+    parser.add_argument('--rcvbuf', type=int, default=0, metavar='BYTE',
+                        help='Buffer di ricezione del socket (default: quello del kernel)')
+    parser.add_argument('--rcvbuf-max', type=int, default=DEFAULT_RCVBUF_MAX, metavar='BYTE',
+                        help=f'Raddoppia il buffer quando il kernel scarta datagrammi, '
+                             f'fino a questo limite (default: {DEFAULT_RCVBUF_MAX}, 0 = mai)')
+    parser.add_argument('--no-kernel-timestamps', action='store_true',
+                        help='Non usare SO_TIMESTAMPNS: l\'istante di ricezione è quello di Python')
+    parser.add_argument('--busy-poll', type=int, default=0, metavar='US',
+                        help='SO_BUSY_POLL in µs: meno latenza, più CPU (default: 0)')
+    parser.add_argument('--pktinfo', action='store_true',
+                        help='IP_PKTINFO: indirizzo locale di destinazione di ogni datagramma')
+    parser.add_argument('--multicast', default='', metavar='GRUPPO',
+                        help='Ricevi anche dal gruppo multicast (es. 239.1.2.3, inviato da '
+                             'un altro ricevitore con --relay)')
+    parser.add_argument('--max-datagram', type=int, default=MAX_UDP_PAYLOAD, metavar='BYTE',
+                        help=f'Byte letti per datagramma, oltre il datagramma viene troncato '
+                             f'(default: {MAX_UDP_PAYLOAD}, il massimo UDP)')
+
+
+def socket_options_from_args(args):
+    """SocketOptions dalle opzioni aggiunte con add_socket_arguments()"""
+    return SocketOptions(rcvbuf=args.rcvbuf, rcvbuf_max=args.rcvbuf_max,
+                         timestamps=not args.no_kernel_timestamps,
+                         busy_poll=args.busy_poll, pktinfo=args.pktinfo,
+                         multicast=args.multicast,
+                         max_datagram=max(1, min(args.max_datagram, MAX_UDP_PAYLOAD)))
+
+
+class RcvbufAutosizer:
+    """Raddoppia il buffer di ricezione quando il kernel scarta datagrammi
+
+    Legge i drop del socket da /proc/net/udp ogni `interval` secondi; può
+    girare come timer del loop asyncio (attach) o in un thread (start).
+    """
+
+    def __init__(self, sock, max_size, interval=DEFAULT_AUTOSIZE_INTERVAL):
+        self.sock = sock
+        self.max_size = max_size
+        self.interval = interval
+        self.last_drops = read_socket_drops(sock)
+        self.grown = 0
+        self._timer = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self):
+        """False senza limite o dove i drop del kernel non sono leggibili"""
+        return self.max_size > 0 and self.last_drops is not None
+
+    def check(self):
+        """Confronta i drop con l'ultima lettura; True se il buffer è cresciuto"""
+        drops = read_socket_drops(self.sock)
+        if drops is None or drops <= self.last_drops:
+            return False
+        lost = drops - self.last_drops
+        self.last_drops = drops
+        # getsockopt restituisce il doppio del valore impostato
+        current = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 2
+        if current >= self.max_size:
+            return False
+        target = min(current * 2, self.max_size)
+        try:
+            option, effective = set_rcvbuf(self.sock, target)
+        except OSError as e:
+            print(f"Buffer di ricezione: impossibile portarlo a {target} byte ({e.strerror})")
+            self.max_size = 0
+            return False
+        self.grown += 1
+        print(f"Buffer di ricezione: {lost} datagrammi persi dal kernel, "
+              f"{option} {current} -> {target} byte (effettivo {effective})")
+        if effective // 2 < target:
+            # Il kernel non va oltre net.core.rmem_max: inutile insistere
+            print(f"Buffer di ricezione limitato a {effective} byte "
+                  f"(aumenta net.core.rmem_max o usa CAP_NET_ADMIN)")
+            self.max_size = 0
+        return True
+
+    def attach(self, loop):
+        """Controllo periodico come timer del loop asyncio"""
+        if not self.enabled:
+            return
+
+        def tick():
+            self.check()
+            if self.max_size:
+                self._timer = loop.call_later(self.interval, tick)
+
+        self._timer = loop.call_later(self.interval, tick)
+
+    def start(self):
+        """Controllo periodico in un thread in background (server a thread)"""
+        if not self.enabled:
+            return
+
+        def run():
+            while self.max_size and not self._stop.wait(self.interval):
+                self.check()
+
+        threading.Thread(target=run, name='rcvbuf-autosize', daemon=True).start()
+
+    def stop(self):
+        """Ferma il controllo periodico"""
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+# Istante di ricezione della richiesta servita dal thread corrente
+_request_time = threading.local()
+
+
+def request_time():
+    """Ora di ricezione (come time.time()) della richiesta in corso nei server a thread"""
+    ns = getattr(_request_time, 'ns', None)
+    return ns / 1e9 if ns else time.time()
+
+
+class TunedServerMixin:
+    """Per i server UDP di socketserver (python-osc)
+
+    Applica le opzioni prima del bind, aggiunge l'istante di ricezione
+    (del kernel, se disponibile) come terzo elemento della richiesta e lo
+    rende leggibile con request_time() dal thread che la gestisce.
+    """
+
+    def __init__(self, server_address, *args, socket_options=None, **kwargs):
+        self.socket_options = socket_options or SocketOptions()
+        self.socket_report = {}
+        # socketserver legge al massimo 8192 byte per datagramma, in un
+        # buffer nuovo ogni volta: qui un buffer unico della dimensione scelta
+        self.max_packet_size = self.socket_options.max_datagram
+        self._recv_view = memoryview(bytearray(self.max_packet_size))
+        self.truncated = 0
+        super().__init__(server_address, *args, **kwargs)
+
+    def server_bind(self):
+        self.socket_report = apply_socket_options(self.socket, self.socket_options)
+        super().server_bind()
+        if self.socket_options.multicast:
+            join_multicast(self.socket_report, self.socket, self.socket_options.multicast,
+                           self.server_address[0])
+
+    def get_request(self):
+        # Gira solo nel thread di serve_forever(): il buffer si può riusare,
+        # ai thread di gestione va una copia della dimensione giusta
+        view = self._recv_view
+        if self.socket_options.timestamps:
+            nbytes, ancdata, flags, client_address = self.socket.recvmsg_into(
+                [view], ANCILLARY_SIZE)
+            received = kernel_timestamp(ancdata) or time.time_ns()
+            if flags & socket.MSG_TRUNC:
+                self.truncated += 1
+        else:
+            nbytes, client_address = self.socket.recvfrom_into(view)
+            received = time.time_ns()
+            if nbytes >= self.max_packet_size and self.max_packet_size < MAX_UDP_PAYLOAD:
+                self.truncated += 1
+        return (bytes(view[:nbytes]), self.socket, received), client_address
+
+    def finish_request(self, request, client_address):
+        # Gira nel thread che gestisce la richiesta
+        _request_time.ns = request[2]
+        super().finish_request(request, client_address)
@@ -4,149 +4,477 @@ Server WebSocket + UDP Bridge
 Riceve dati UDP e li invia al browser via WebSocket
 """
 
+import argparse
 import asyncio
 import websockets
 import socket
 import json
-from datetime import datetime
-import threading
-import queue
+import signal
+import time
 
-# Dati condivisi
-udp_messages = []
-clients = set()
-message_queue = queue.Queue()
+from coalescer import DEFAULT_RATE_HZ, MODE_AGGREGATE, MODE_OFF, MODES, Coalescer
+from capture import CaptureWriter
+from chunking import add_chunk_arguments, reassembler_from_args, register_chunk_metrics
+from frame_batcher import add_batch_arguments, batcher_from_args
+from broadcaster import (DEFAULT_MAX_LAG_MS, DEFAULT_MAX_QUEUE, POLICIES,
+                         POLICY_DROP_OLDEST, Broadcaster, policy_from_path)
+from history_store import KIND_RAW, KIND_TEXT, HistoryStore
+from log_sink import DEFAULT_EVERY, DEFAULT_FIRST, LogSink, format_clock, level_from_args
+from metrics import (LatencyHistogram, MetricsRegistry, is_stats_request,
+                     register_udp_socket, stats_message)
+from osc_scheduler import BundleScheduler
+from relay import add_relay_arguments, relay_from_args
+from snapshot import add_snapshot_arguments, snapshot_from_args
+from payload_classifier import (DATA_TYPE_BUNDLE, PayloadClassifier, add_schema_arguments,
+                                classifier_from_args, udp_message)
+from udp_engine import BatchReceiver, wall_time
+from udp_socket import (RcvbufAutosizer, SocketOptions, add_socket_arguments,
+                        create_udp_socket, print_socket_report, socket_options_from_args)
+from wire_format import (SUBPROTOCOLS, PreparedMessage, batch_from_path, bundle_fields,
+                         bundle_info, is_bundle_info, prepare_message, split_bundle_info,
+                         window_message, wire_format_from_request)
+from workers import WorkerPool
+
+# Dati condivisi: la cronologia è un ring in memoria condivisa che contiene
+# i messaggi già serializzati in JSON (creata in main)
+udp_messages = None
+clients = None  # Broadcaster: una coda di invio per ogni client (creato in main)
+coalescer = None  # Coalescer tra ricezione e invio (creato in main)
+scheduler = None  # Bundle OSC in attesa del loro timetag (creato in main)
+capture_writer = None  # Registrazione su disco dei datagrammi (--capture)
+relay = None  # Ritrasmissione verso altri host (--relay)
+chunks = None  # Riassemblaggio dei payload a frammenti (--chunks)
+# Formato per mittente (OSC, testo, float32...), con quelli dichiarati da --schema
+classifier = PayloadClassifier()
+latency_histogram = LatencyHistogram('ricezione->invio')
+fanout_histogram = LatencyHistogram('fan-out')
+# Metriche del bridge: chiedile con {"type": "stats"} sul WebSocket
+registry = MetricsRegistry()
+decode_errors = registry.counter('decode_errors_total', 'Datagrammi scartati per errori di decodifica')
+# Log per pacchetto: accodato qui, scritto a lotti da un thread in background
+packet_log = LogSink()
 
 async def handle_websocket(websocket, path):
     """Gestisce le connessioni WebSocket"""
-    clients.add(websocket)
-    print(f"Client WebSocket connesso: {websocket.remote_address}")
+    session = clients.add(websocket, policy_from_path(path),
+                          wire_format_from_request(path, websocket.subprotocol),
+                          batch_from_path(path))
+    print(f"Client WebSocket connesso: {websocket.remote_address} "
+          f"({session.policy}, {session.wire_format})")
     
     try:
-        # Invia la cronologia iniziale
-        if udp_messages:
-            history_msg = {
-                'type': 'history',
-                'messages': udp_messages[-20:]  # Ultimi 20 messaggi
-            }
-            await websocket.send(json.dumps(history_msg))
+        # Senza la tabella degli ultimi valori: la cronologia recente
+        if clients.snapshot is None and udp_messages.last_seq:
+            # Ultimi 20 messaggi, senza riserializzarli
+            recent = [history_json(record) for record in udp_messages.last(20)
+                      if not record.truncated]
+            history_msg = '{"type": "history", "messages": [' + ', '.join(recent) + ']}'
+            session.offer(history_msg)
         
-        # Mantieni la connessione aperta
+        # Comandi: {"type": "stats"} -> metriche correnti;
+        # {"type": "subscribe" | "unsubscribe", "patterns": [...]} -> filtri OSC
         async for message in websocket:
-            # Il client può inviare comandi, ma per ora ignoriamo
-            pass
+            if is_stats_request(message):
+                session.offer(stats_message(registry))
+                continue
+            reply = clients.handle_subscription(session, message)
+            if reply is not None:
+                session.offer(reply)
             
     except websockets.exceptions.ConnectionClosed:
         print("Client WebSocket disconnesso")
     finally:
-        clients.remove(websocket)
-
-async def broadcast_message(message):
-    """Invia un messaggio a tutti i client WebSocket connessi"""
-    if clients:
-        message_json = json.dumps(message)
-        await asyncio.gather(*[
-            client.send(message_json) for client in clients
-        ])
-
-def udp_receiver_thread(udp_port=10000, interface='0.0.0.0'):
-    """Thread che riceve dati UDP e li invia via WebSocket"""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        await clients.remove(websocket)
+
+async def report_stats(interval=10.0):
+    """Stampa periodicamente la latenza ricezione->invio e lo stato dei client"""
+    # L'istogramma non si azzera: è anche esportato nelle metriche
+    reported = 0
+    while True:
+        await asyncio.sleep(interval)
+        if latency_histogram.count != reported:
+            reported = latency_histogram.count
+            print(f"Latenza {latency_histogram.format_summary()}")
+            print(f"Client: {clients.format_stats()}")
+            if clients.batcher is not None and clients.batcher.messages_histogram.count:
+                print(f"Lotti {clients.batcher.format_stats()}")
+            if clients.snapshot is not None and clients.snapshot.joins:
+                print(f"Stato per i nuovi client: {clients.snapshot.format_stats()}")
+            if coalescer.enabled:
+                print(f"Coalescenza {coalescer.format_stats()}")
+            if any(classifier.payloads.values()):
+                print(f"Payload: {classifier.format_stats()}")
+            if scheduler.immediate or scheduler.scheduled:
+                print(f"Bundle: {scheduler.format_stats()}")
+            if capture_writer is not None:
+                print(f"Cattura: {capture_writer.format_stats()}")
+            if relay is not None:
+                print(f"Ritrasmissione: {relay.format_stats()}")
+            if chunks is not None and chunks.fragments:
+                print(f"Frammenti: {chunks.format_stats()}")
+
+def build_udp_message(data, addr, timestamp):
+    """Costruisce il messaggio UDP da inviare ai client"""
+    return udp_message(classifier.decode(data, addr), addr, timestamp)
+
+def build_bundle_messages(groups, addr, size, timestamp):
+    """Un messaggio per ogni timetag del bundle, con tutti i suoi messaggi OSC"""
+    encoded = []
+    for timetag, messages in groups:
+        bundle_message = {
+            'timestamp': timestamp,
+            'source_ip': addr[0],
+            'source_port': addr[1],
+            'size': size
+        }
+        bundle_message.update(bundle_fields(timetag, messages))
+        # Timetag e indirizzi viaggiano come dati extra (anche dai worker)
+        encoded.append((addr, json.dumps(bundle_message), bundle_info(timetag, messages)))
+    return encoded
+
+def decode_udp_batch(batch):
+    """Classifica un lotto di datagrammi: [(addr, Payload)]"""
+    decoded = []
+    for data, addr in batch:
+        try:
+            # Formato memorizzato per mittente: nessun tentativo a vuoto
+            payload = classifier.decode(data, addr)
+        except Exception:
+            # Un datagramma malformato non deve far perdere il resto del lotto
+            decode_errors.inc()
+            continue
+        decoded.append((addr, payload))
+        # Log sulla console (campionato per mittente, non blocca)
+        packet_log.log(addr, "UDP da %s:%d - %d bytes (%s)",
+                       addr[0], addr[1], len(payload.data), payload.data_type)
+    return decoded
+
+def encode_udp_batch(batch, received_ns):
+    """Decodifica un lotto di datagrammi e lo serializza in JSON (gira nei worker)"""
+    # Istante di ricezione del lotto (del kernel, con SO_TIMESTAMPNS)
+    timestamp = format_clock(wall_time(received_ns))
+    encoded = []
+    if chunks is not None:
+        # SO_REUSEPORT manda tutti i frammenti di un mittente allo stesso worker
+        batch = chunks.reassemble(batch)
     
-    try:
-        sock.bind((interface, udp_port))
-        print(f"UDP Receiver avviato su {interface}:{udp_port}")
-        print("In attesa di dati UDP...")
-        
-        while True:
-            data, addr = sock.recvfrom(4096)
-            timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
-            
-            # Prova a decodificare come testo
-            try:
-                text_data = data.decode('utf-8')
-                data_type = 'text'
-                content = text_data
-            except UnicodeDecodeError:
-                # Se non è testo, mostra esadecimale
-                data_type = 'binary'
-                hex_data = data.hex()
-                if len(hex_data) > 100:
-                    content = hex_data[:100] + "..."
-                else:
-                    content = hex_data
-            
-            # Crea il messaggio
-            udp_message = {
-                'timestamp': timestamp,
-                'source_ip': addr[0],
-                'source_port': addr[1],
-                'data_type': data_type,
-                'content': content,
-                'size': len(data)
-            }
-            
-            # Aggiungi alla cronologia
-            udp_messages.append(udp_message)
-            if len(udp_messages) > 100:  # Limita a 100 messaggi
-                udp_messages.pop(0)
-            
-            # Invia via WebSocket
-            websocket_msg = {
-                'type': 'udp_message',
-                'message': udp_message
-            }
-            
-            # Usa una coda thread-safe per inviare al thread principale
-            message_queue.put(websocket_msg)
-            
-            # Log sulla console
-            print(f"[{timestamp}] UDP da {addr[0]}:{addr[1]} - {len(data)} bytes")
-            
-    except Exception as e:
-        print(f"Errore UDP receiver: {e}")
-    finally:
-        sock.close()
+    for addr, payload in decode_udp_batch(batch):
+        if payload.data_type == DATA_TYPE_BUNDLE:
+            encoded.extend(build_bundle_messages(payload.values, addr, len(payload.data),
+                                                 timestamp))
+            continue
+        # Valori numerici già impacchettati per i client in formato binario
+        encoded.append((addr, json.dumps(udp_message(payload, addr, timestamp)),
+                        payload.numeric()))
+    
+    return encoded
+
+def history_json(record):
+    """Messaggio JSON di un record della cronologia"""
+    if record.kind == KIND_TEXT:
+        return record.value
+    # Datagramma grezzo: reso in JSON solo ora, per il client che si collega
+    addr = (record.source_ip, record.source_port)
+    payload = classifier.peek(record.value, addr)
+    return json.dumps(udp_message(payload, addr, format_clock(record.timestamp)))
+
+def publish_message(received_ns, addr, message_json, numeric=b''):
+    """Aggiunge un messaggio serializzato alla cronologia e lo accoda per l'invio"""
+    if is_bundle_info(numeric):
+        # Bundle OSC: subito o al suo timetag, sempre in un unico frame
+        timetag, addresses = split_bundle_info(numeric)
+        scheduler.submit(addr, timetag, (received_ns, addr, message_json, addresses),
+                         wall_time(received_ns))
+        return
+    
+    # Aggiungi alla cronologia (O(1), capacità fissa)
+    now = wall_time(received_ns)
+    udp_messages.append(now, addr, None, KIND_TEXT, message_json.encode('utf-8'))
+    
+    # Serializzato una sola volta, lo stesso oggetto va a tutti i client
+    websocket_msg = '{"type": "udp_message", "message": ' + message_json + '}'
+    forward_message(received_ns, addr,
+                    prepare_message(websocket_msg, clients.addresses, addr, numeric, now))
 
-async def main():
+def publish_payload(received_ns, addr, payload, timestamp):
+    """Come publish_message, ma il JSON si costruisce solo se un client lo chiede"""
+    now = wall_time(received_ns)
+    # In cronologia il datagramma così com'è: nessuna serializzazione qui
+    udp_messages.append(now, addr, None, KIND_RAW, payload.data)
+    
+    def render():
+        return ('{"type": "udp_message", "message": '
+                + json.dumps(udp_message(payload, addr, timestamp)) + '}')
+    
+    forward_message(received_ns, addr,
+                    prepare_message(None, clients.addresses, addr, payload.numeric(), now,
+                                    render, payload.blob()))
+
+def forward_message(received_ns, addr, message):
+    """Accoda un PreparedMessage per l'invio, passando dalla coalescenza"""
+    if not coalescer.enabled:
+        clients.publish(message, key=addr, received_ns=received_ns)
+    elif message.is_numeric:
+        # Flussi di controllo: ridotti al ritmo del tick
+        values = message.float_values() if coalescer.mode == MODE_AGGREGATE else None
+        coalescer.offer((addr, message.address), message.address,
+                        (received_ns, addr, message), values)
+    else:
+        coalescer.forward(addr, (received_ns, addr, message))
+
+def publish_bundle(item, delayed):
+    """Invia un gruppo di un bundle (chiamata dallo scheduler dei timetag)"""
+    received_ns, addr, message_json, addresses = item
+    now = time.time() if delayed else wall_time(received_ns)
+    udp_messages.append(now, addr, None, KIND_TEXT, message_json.encode('utf-8'))
+    websocket_msg = '{"type": "udp_message", "message": ' + message_json + '}'
+    # Mai coalescato né conflato: i messaggi del bundle restano insieme;
+    # la latenza misura l'invio, non l'attesa del timetag
+    clients.publish(PreparedMessage(websocket_msg, addresses),
+                    received_ns=None if delayed else received_ns)
+
+def emit_coalesced(key, item, window):
+    """Invia ai client un messaggio uscito dalla coalescenza"""
+    received_ns, addr, message = item
+    if window is not None:
+        message = window_message(message, window)
+    clients.publish(message, key=addr, received_ns=received_ns)
+
+def handle_udp_batch(batch, received_ns):
+    """Elabora un lotto di datagrammi ricevuti nello stesso risveglio"""
+    if capture_writer is not None:
+        # Solo copia in coda: il disco lo tocca il thread di scrittura
+        capture_writer.record_batch(batch, received_ns)
+    if relay is not None:
+        # Inviati dai buffer del ricevitore, prima che vengano riusati
+        relay.send_batch(batch)
+    if chunks is not None:
+        # Cattura e ritrasmissione vedono i frammenti così come arrivano
+        batch = chunks.reassemble(batch)
+    timestamp = format_clock(wall_time(received_ns))
+    for addr, payload in decode_udp_batch(batch):
+        if payload.data_type == DATA_TYPE_BUNDLE:
+            for addr, message_json, info in build_bundle_messages(
+                    payload.values, addr, len(payload.data), timestamp):
+                publish_message(received_ns, addr, message_json, info)
+        else:
+            publish_payload(received_ns, addr, payload, timestamp)
+
+def register_metrics(receiver, udp_port, workers):
+    """Registra le metriche lette solo quando un client chiede le statistiche"""
+    if workers > 0:
+        # Nei worker il conteggio avviene sulle pipe verso questo processo
+        registry.gauge('packets_received_total', 'Datagrammi ricevuti',
+                       lambda: receiver.frames, kind='counter')
+    else:
+        registry.gauge('packets_received_total', 'Datagrammi ricevuti',
+                       lambda: receiver.packets, kind='counter')
+        registry.gauge('bytes_received_total', 'Byte ricevuti',
+                       lambda: receiver.bytes, kind='counter')
+        registry.gauge('receive_batches_total', 'Risvegli del ricevitore con almeno un datagramma',
+                       lambda: receiver.batches, kind='counter')
+        registry.gauge('socket_rcvbuf_bytes', 'Buffer di ricezione effettivo del socket',
+                       lambda: receiver.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
+        # Con i worker la classificazione avviene nei loro processi
+        classifier.register_metrics(registry)
+        if chunks is not None:
+            register_chunk_metrics(registry, {udp_port: chunks})
+    register_udp_socket(registry, udp_port)
+    clients.register_metrics(registry)
+    registry.gauge('coalescer_pending', 'Indirizzi in attesa del tick di coalescenza',
+                   lambda: len(coalescer.pending))
+    scheduler.register_metrics(registry)
+    registry.gauge('history_last_seq', 'Messaggi scritti nella cronologia',
+                   lambda: udp_messages.last_seq, kind='counter')
+    registry.gauge('log_pending', 'Righe di log in coda',
+                   lambda: packet_log.get_stats()['pending'])
+    registry.gauge('log_dropped_total', 'Righe di log perse',
+                   lambda: packet_log.dropped, kind='counter')
+    if capture_writer is not None:
+        registry.gauge('capture_pending_bytes', 'Byte in coda per la cattura su disco',
+                       lambda: capture_writer.get_stats()['pending_bytes'])
+        registry.gauge('capture_dropped_total', 'Datagrammi persi dalla cattura',
+                       lambda: capture_writer.dropped, kind='counter')
+    if relay is not None:
+        relay.register_metrics(registry)
+
+def start_udp_receiver(loop, udp_port=10000, interface='0.0.0.0', socket_options=None):
+    """Registra il ricevitore UDP a lotti direttamente sul loop asyncio"""
+    socket_options = socket_options or SocketOptions()
+    sock, report = create_udp_socket(udp_port, interface, socket_options)
+    
+    receiver = BatchReceiver(sock, buffer_size=socket_options.max_datagram,
+                             timestamps=socket_options.timestamps,
+                             pktinfo=socket_options.pktinfo)
+    receiver.attach(loop, lambda batch: handle_udp_batch(batch, receiver.received_ns))
+    # Il buffer cresce se il kernel scarta datagrammi (timer del loop)
+    RcvbufAutosizer(sock, socket_options.rcvbuf_max).attach(loop)
+    
+    print(f"UDP Receiver avviato su {interface}:{udp_port}")
+    print_socket_report(report)
+    print("In attesa di dati UDP...")
+    return receiver
+
+def start_udp_workers(loop, workers, udp_port=10000, interface='0.0.0.0', socket_options=None):
+    """Avvia N processi worker con SO_REUSEPORT che pubblicano sul loop"""
+    pool = WorkerPool(workers, udp_port, interface, encode_udp_batch, socket_options)
+    pool.start()
+    
+    def on_frames(frames):
+        for received_ns, addr, message_json, numeric in frames:
+            publish_message(received_ns, addr, message_json, numeric)
+    
+    pool.attach(loop, on_frames)
+    print("In attesa di dati UDP...")
+    return pool
+
+async def main(udp_port=10000, interface='0.0.0.0', workers=0,
+               history_name='streamtorasp_udp', history_size=1000, history_slab=512,
+               client_policy=POLICY_DROP_OLDEST, client_queue=DEFAULT_MAX_QUEUE,
+               client_max_lag_ms=DEFAULT_MAX_LAG_MS, coalesce_mode=MODE_OFF,
+               coalesce_hz=DEFAULT_RATE_HZ, passthrough=(), capture_dir=None,
+               capture_segment_mb=64, socket_options=None, relay_stage=None,
+               batcher=None, snapshot=None):
     """Avvia server WebSocket e UDP"""
-    # Avvia thread UDP
-    udp_thread = threading.Thread(
-        target=udp_receiver_thread, 
-        args=(10000, '0.0.0.0'),
-        daemon=True
-    )
-    udp_thread.start()
+    global capture_writer, clients, coalescer, relay, scheduler, udp_messages
+    clients = Broadcaster(client_policy, client_queue, client_max_lag_ms,
+                          latency_histogram, fanout_histogram, batcher, snapshot)
+    coalescer = Coalescer(emit_coalesced, coalesce_mode, coalesce_hz, passthrough)
+    scheduler = BundleScheduler(publish_bundle)
+    udp_messages = HistoryStore.create(history_name, history_size, history_slab)
+    print(f"Cronologia condivisa '{history_name}': {history_size} messaggi, "
+          f"{udp_messages.memory_size // 1024} KB")
+    if capture_dir:
+        capture_writer = CaptureWriter(capture_dir, capture_segment_mb * 1024 * 1024)
+        print(f"Registrazione dei datagrammi in '{capture_dir}'")
+    relay = relay_stage
+    
+    loop = asyncio.get_running_loop()
+    # Il tick della coalescenza e le scadenze dei bundle sono timer del loop
+    coalescer.attach(loop)
+    scheduler.attach(loop)
+    if relay is not None:
+        relay.attach(loop)
+        print("Ritrasmissione verso " + ", ".join(target.label for target in relay.targets))
+    if workers > 0:
+        # Decodifica distribuita su più processi
+        receiver = start_udp_workers(loop, workers, udp_port, interface, socket_options)
+    else:
+        # Avvia il ricevitore UDP sul loop (nessun thread dedicato)
+        receiver = start_udp_receiver(loop, udp_port, interface, socket_options)
+    register_metrics(receiver, udp_port, workers)
     
     # Avvia server WebSocket
     server = await websockets.serve(
         handle_websocket, 
         '0.0.0.0', 
-        8765
+        8765,
+        subprotocols=SUBPROTOCOLS
     )
     
     print("Server WebSocket avviato su ws://0.0.0.0:8765")
     print("Interfaccia web disponibile su http://localhost:8000")
     print("-" * 50)
     
-    # Task per gestire i messaggi dalla coda
-    async def process_message_queue():
-        while True:
-            try:
-                # Controlla la coda senza bloccare
-                message = message_queue.get_nowait()
-                await broadcast_message(message)
-                message_queue.task_done()
-            except queue.Empty:
-                # Nessun messaggio in coda, aspetta un po'
-                await asyncio.sleep(0.1)
-    
-    # Esegui sia il server che il processamento della coda
-    await asyncio.gather(
-        server.wait_closed(),
-        process_message_queue()
-    )
+    # Esegui il server e il report periodico, fino a SIGINT o SIGTERM:
+    # anche con kill la cronologia condivisa va chiusa e rimossa
+    stop = loop.create_future()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+    serving = asyncio.gather(server.wait_closed(), report_stats())
+    try:
+        await asyncio.wait((serving, stop), return_when=asyncio.FIRST_COMPLETED)
+        if serving.done():
+            serving.result()
+        print("\nArresto del server...")
+    finally:
+        serving.cancel()
+        server.close()
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+        if workers > 0:
+            receiver.stop()
+        else:
+            receiver.close()
+        udp_messages.close()
+        if capture_writer is not None:
+            capture_writer.close()
+        if relay is not None:
+            relay.close()
+        packet_log.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Bridge UDP -> WebSocket')
+    parser.add_argument('-p', '--port', type=int, default=10000,
+                        help='Porta UDP in ascolto (default: 10000)')
+    parser.add_argument('-i', '--interface', default='0.0.0.0',
+                        help='Interfaccia di rete (default: 0.0.0.0 - tutte)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Processi di ricezione con SO_REUSEPORT (default: 0 - nessuno)')
+    add_socket_arguments(parser)
+    parser.add_argument('--history-name', default='streamtorasp_udp',
+                        help='Nome della cronologia in memoria condivisa')
+    parser.add_argument('--history-size', type=int, default=1000,
+                        help='Messaggi conservati in cronologia (default: 1000)')
+    parser.add_argument('--history-slab', type=int, default=512,
+                        help='Byte riservati a ogni messaggio (default: 512)')
+    parser.add_argument('--client-policy', choices=POLICIES, default=POLICY_DROP_OLDEST,
+                        help='Politica per i client lenti (default: drop-oldest, '
+                             'sovrascrivibile con ?policy= nell\'URL WebSocket)')
+    parser.add_argument('--client-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help=f'Messaggi in coda per client (default: {DEFAULT_MAX_QUEUE})')
+    parser.add_argument('--client-max-lag', type=int, default=DEFAULT_MAX_LAG_MS,
+                        help=f'Ritardo massimo in ms con la politica disconnect '
+                             f'(default: {DEFAULT_MAX_LAG_MS})')
+    add_batch_arguments(parser)
+    add_snapshot_arguments(parser)
+    parser.add_argument('--coalesce', choices=MODES, default=MODE_OFF,
+                        help='Coalescenza per indirizzo: latest o aggregate (default: off)')
+    parser.add_argument('--coalesce-hz', type=float, default=DEFAULT_RATE_HZ,
+                        help=f'Frequenza del tick di coalescenza (default: {DEFAULT_RATE_HZ:g})')
+    parser.add_argument('--passthrough', action='append', default=[], metavar='PATTERN',
+                        help='Indirizzi mai coalescati, anche con * (ripetibile, es. /trigger/*)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Nessun log per pacchetto')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Log di tutti i pacchetti, senza campionamento')
+    parser.add_argument('--log-first', type=int, default=DEFAULT_FIRST,
+                        help=f'Pacchetti mostrati per mittente prima del campionamento '
+                             f'(default: {DEFAULT_FIRST})')
+    parser.add_argument('--log-every', type=int, default=DEFAULT_EVERY,
+                        help=f'Poi uno ogni N pacchetti (default: {DEFAULT_EVERY})')
+    add_schema_arguments(parser)
+    parser.add_argument('--capture', metavar='CARTELLA', default=None,
+                        help='Registra ogni datagramma su disco (rileggibile con capture.py)')
+    parser.add_argument('--capture-segment-mb', type=int, default=64,
+                        help='Dimensione dei segmenti di cattura in MB (default: 64)')
+    add_relay_arguments(parser)
+    add_chunk_arguments(parser)
+    args = parser.parse_args()
+    if args.capture and args.workers > 0:
+        # I worker inoltrano solo i messaggi già serializzati, non i payload grezzi
+        parser.error('--capture non è disponibile con --workers')
+    if args.relay and args.workers > 0:
+        parser.error('--relay non è disponibile con --workers')
+    packet_log.configure(level_from_args(args.quiet, args.verbose),
+                         args.log_first, args.log_every)
+    # Prima dei worker: li ereditano con il fork
+    classifier = classifier_from_args(args, parser)
+    chunks = reassembler_from_args(args, parser)
+    try:
+        asyncio.run(main(args.port, args.interface, args.workers,
+                         args.history_name, args.history_size, args.history_slab,
+                         args.client_policy, args.client_queue, args.client_max_lag,
+                         args.coalesce, args.coalesce_hz, args.passthrough,
+                         args.capture, args.capture_segment_mb,
+                         socket_options_from_args(args), relay_from_args(args, parser),
+                         batcher_from_args(args, parser), snapshot_from_args(args, parser)))
+    except KeyboardInterrupt:
+        print("\nServer interrotto dall'utente")
+    except FileExistsError as e:
+        # Cronologia di un altro server ancora attivo
+        raise SystemExit(f"Avvio non riuscito: {e}")
\ No newline at end of file
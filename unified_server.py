@@ -0,0 +1,731 @@
+#!/usr/bin/env python3
+"""
+Server unificato: HTTP, WebSocket, OSC e UDP grezzo in un solo processo
+Pagina web, API /api/..., /metrics e WebSocket condividono la stessa
+porta TCP; i datagrammi OSC e UDP arrivano a lotti sullo stesso loop
+asyncio. Cronologie, canali numerici, client e bundle in attesa sono un
+unico stato in memoria, toccato solo dal thread del loop: niente lock,
+nessun thread per datagramma. La configurazione è un file INI
+(streamtorasp.ini); app.py e udp_websocket_server.py restano come
+server separati.
+"""
+
+import argparse
+import asyncio
+import configparser
+import json
+import os
+import signal
+import time
+from http import HTTPStatus
+from threading import active_count
+from urllib.parse import unquote, urlsplit
+
+import websockets
+
+from broadcaster import (DEFAULT_MAX_LAG_MS, DEFAULT_MAX_QUEUE, POLICIES, POLICY_DROP_OLDEST,
+                         Broadcaster, policy_from_path)
+from capture import CaptureWriter
+from chunking import (DEFAULT_MAX_SIZE as DEFAULT_CHUNK_MAX_SIZE, DEFAULT_SLOTS as DEFAULT_CHUNK_SLOTS,
+                      DEFAULT_TIMEOUT as DEFAULT_CHUNK_TIMEOUT, Reassembler,
+                      register_chunk_metrics)
+from channel_store import ChannelStore, numeric_values
+from frame_batcher import (DEFAULT_MAX_BYTES, DEFAULT_MAX_MESSAGES, DEFAULT_MAX_WINDOW_MS,
+                           DEFAULT_MIN_WINDOW_MS, FrameBatcher)
+from coalescer import DEFAULT_RATE_HZ, MODE_AGGREGATE, MODE_OFF, MODES, Coalescer
+from history_store import KIND_RAW, HistoryStore
+from log_sink import (DEFAULT_EVERY, DEFAULT_FIRST, LEVEL_NORMAL, LEVEL_QUIET, LEVEL_VERBOSE,
+                      LogSink, format_clock, level_from_args)
+from metrics import (LatencyHistogram, MetricsRegistry, is_stats_request, register_udp_socket,
+                     stats_message)
+from osc_api import (LONG_POLL_MAX_TIMEOUT, QueryArgs, build_osc_response, etag_matches,
+                     get_channel, get_channel_stats, list_channels, long_poll_timeout)
+from osc_decoder import decode_bundle, decode_message, group_by_timetag, is_bundle
+from osc_scheduler import BundleScheduler
+from payload_classifier import (DATA_TYPE_BUNDLE, FORMAT_OSC, Payload, PayloadClassifier,
+                                parse_schema, udp_message)
+from relay import (COALESCE_MODES as RELAY_COALESCE_MODES, DEFAULT_SNDBUF, DEFAULT_TTL, Relay,
+                   parse_target)
+from snapshot import DEFAULT_MAX_ENTRIES as DEFAULT_SNAPSHOT_SIZE, SnapshotTable
+from udp_engine import BatchReceiver, wall_time
+from udp_socket import (DEFAULT_RCVBUF_MAX, MAX_UDP_PAYLOAD, RcvbufAutosizer, SocketOptions,
+                        create_udp_socket, print_socket_report)
+from wire_format import (SUBPROTOCOLS, PreparedMessage, batch_from_path, bundle_fields,
+                         prepare_message, window_message, wire_format_from_request)
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamtorasp.ini')
+PAGE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'index2.html')
+# Segnaposto della pagina: la porta WebSocket è quella del server HTTP
+PAGE_WS_PORT = b'<meta name="streamtorasp-ws-port" content="8765">'
+HISTORY_REPLAY = 20  # Messaggi inviati a un client WebSocket appena collegato
+
+LOG_LEVELS = {'quiet': LEVEL_QUIET, 'normal': LEVEL_NORMAL, 'verbose': LEVEL_VERBOSE}
+
+# Valori di default di ogni opzione del file INI: il tipo del default è
+# anche il tipo dell'opzione (le tuple sono liste, una voce per riga)
+DEFAULT_CONFIG = {
+    'http': {'host': '0.0.0.0', 'port': 8765},
+    'osc': {'interface': '0.0.0.0', 'port': 10000},
+    'udp': {'interface': '0.0.0.0', 'port': 10001, 'schema': ()},
+    'history': {'osc_name': 'streamtorasp_osc', 'osc_size': 10000, 'osc_slab': 128,
+                'udp_name': 'streamtorasp_udp', 'udp_size': 1000, 'udp_slab': 512},
+    'channels': {'capacity': 4096, 'max_channels': 256},
+    'clients': {'policy': POLICY_DROP_OLDEST, 'queue': DEFAULT_MAX_QUEUE,
+                'max_lag_ms': DEFAULT_MAX_LAG_MS, 'snapshot_size': DEFAULT_SNAPSHOT_SIZE},
+    'batch': {'min_ms': DEFAULT_MIN_WINDOW_MS, 'max_ms': DEFAULT_MAX_WINDOW_MS,
+              'messages': DEFAULT_MAX_MESSAGES, 'bytes': DEFAULT_MAX_BYTES},
+    'coalesce': {'mode': MODE_OFF, 'rate_hz': DEFAULT_RATE_HZ, 'passthrough': ('/trigger*',)},
+    'socket': {'rcvbuf': 0, 'rcvbuf_max': DEFAULT_RCVBUF_MAX, 'kernel_timestamps': True,
+               'busy_poll': 0, 'multicast': '', 'max_datagram': MAX_UDP_PAYLOAD},
+    'chunks': {'enabled': False, 'max_size': DEFAULT_CHUNK_MAX_SIZE,
+               'slots': DEFAULT_CHUNK_SLOTS, 'timeout': DEFAULT_CHUNK_TIMEOUT},
+    'log': {'level': 'normal', 'first': DEFAULT_FIRST, 'every': DEFAULT_EVERY,
+            'stats_interval': 10.0},
+    'capture': {'dir': '', 'segment_mb': 64},
+    'relay': {'targets': (), 'source': 'osc', 'filter': (), 'coalesce': MODE_OFF,
+              'rate_hz': DEFAULT_RATE_HZ, 'passthrough': ('/trigger*',), 'ttl': DEFAULT_TTL,
+              'interface': '', 'loop': True, 'sndbuf': DEFAULT_SNDBUF},
+}
+RELAY_SOURCES = ('osc', 'udp', 'all')
+CONFIG_CHOICES = {
+    ('clients', 'policy'): POLICIES,
+    ('coalesce', 'mode'): MODES,
+    ('log', 'level'): tuple(LOG_LEVELS),
+    ('relay', 'source'): RELAY_SOURCES,
+    ('relay', 'coalesce'): RELAY_COALESCE_MODES,
+}
+
+
+def load_config(path=None):
+    """Configurazione: DEFAULT_CONFIG aggiornato con il file INI, se indicato
+
+    Sezioni e opzioni sconosciute sono errori (ValueError), così un
+    refuso non passa inosservato.
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    if path is not None:
+        with open(path) as f:
+            parser.read_file(f)
+    config = {section: dict(defaults) for section, defaults in DEFAULT_CONFIG.items()}
+    for section in parser.sections():
+        defaults = DEFAULT_CONFIG.get(section)
+        if defaults is None:
+            raise ValueError(f"sezione sconosciuta: [{section}]")
+        for key, raw in parser.items(section):
+            if key not in defaults:
+                raise ValueError(f"opzione sconosciuta in [{section}]: {key}")
+            kind = type(defaults[key])
+            try:
+                if kind is bool:
+                    value = parser.getboolean(section, key)
+                elif kind is tuple:
+                    value = tuple(line.strip() for line in raw.splitlines() if line.strip())
+                else:
+                    value = kind(raw.strip())
+            except ValueError:
+                raise ValueError(f"valore non valido per [{section}] {key}: {raw!r}") from None
+            choices = CONFIG_CHOICES.get((section, key))
+            if choices is not None and value not in choices:
+                raise ValueError(f"[{section}] {key} deve essere uno tra: {', '.join(choices)}")
+            config[section][key] = value
+    return config
+
+
+def http_response(status, body, content_type, headers=()):
+    """Risposta per process_request di websockets: (stato, intestazioni, corpo)"""
+    return HTTPStatus(status), [('Content-Type', content_type), *headers], body
+
+
+def api_response(status, body, headers=()):
+    """Risposta per il risultato (stato, corpo) di osc_api"""
+    if isinstance(body, bytes):
+        return http_response(status, body, 'application/octet-stream', headers)
+    return http_response(status, json.dumps(body).encode('utf-8'), 'application/json', headers)
+
+
+def osc_args(message):
+    """Argomenti di un messaggio decodificato, con i blob copiati in bytes"""
+    if 'b' not in message.typetags:
+        return tuple(message.args)
+    return tuple(bytes(arg) if type(arg) is memoryview else arg for arg in message.args)
+
+
+class UnifiedServer:
+    """HTTP, WebSocket, OSC e UDP grezzo sullo stesso loop asyncio
+
+    I messaggi OSC vanno nella cronologia OSC (API HTTP), nei canali
+    numerici e ai client WebSocket; i datagrammi della porta UDP grezza
+    nella cronologia UDP e ai client. Entrambi passano dalla stessa
+    coalescenza, i bundle dallo stesso scheduler dei timetag.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.registry = MetricsRegistry()
+        registry = self.registry
+        self.decode_errors = registry.counter('decode_errors_total',
+                                              'Datagrammi scartati per errori di decodifica')
+        self.osc_messages = registry.counter('osc_messages_total', 'Messaggi OSC ricevuti')
+        self.http_requests = registry.counter('http_requests_total', 'Richieste HTTP servite')
+        self.latency_histogram = LatencyHistogram('ricezione->invio')
+
+        clients = config['clients']
+        batch = config['batch']
+        # Lotti per i client con ?batch=1 (max_ms = 0: disattivati)
+        batcher = None
+        if batch['max_ms'] > 0:
+            batcher = FrameBatcher(batch['min_ms'], batch['max_ms'], batch['messages'],
+                                   batch['bytes'])
+        # Ultimo valore per indirizzo per chi si collega (snapshot_size = 0: cronologia recente)
+        snapshot = None
+        if clients['snapshot_size'] > 0:
+            snapshot = SnapshotTable(clients['snapshot_size'])
+        self.clients = Broadcaster(clients['policy'], clients['queue'], clients['max_lag_ms'],
+                                   self.latency_histogram, LatencyHistogram('fan-out'), batcher,
+                                   snapshot)
+        coalesce = config['coalesce']
+        self.coalescer = Coalescer(self.emit, coalesce['mode'], coalesce['rate_hz'],
+                                   coalesce['passthrough'])
+        self.scheduler = BundleScheduler(self.dispatch_bundle)
+        channels = config['channels']
+        self.channels = ChannelStore(channels['capacity'], channels['max_channels'])
+        self.classifier = PayloadClassifier(
+            [parse_schema(declaration) for declaration in config['udp']['schema']])
+        log = config['log']
+        self.log = LogSink(level=LOG_LEVELS[log['level']], first=log['first'],
+                           every=log['every'])
+
+        # Stesso formato di app.py, per l'API /api/osc-data
+        self.osc_data = {
+            'last_message': None,
+            'last_address': None,
+            'last_timestamp': None,
+            'message_history': None
+        }
+        self.udp_history = None
+        self.capture = None
+        # Ritrasmissione dei datagrammi grezzi, prima della decodifica
+        relay = config['relay']
+        self.relay = None
+        if relay['targets']:
+            self.relay = Relay([parse_target(text) for text in relay['targets']],
+                               relay['filter'], relay['coalesce'], relay['rate_hz'],
+                               relay['passthrough'], relay['ttl'], relay['interface'] or None,
+                               relay['loop'], relay['sndbuf'])
+        # Porta -> Reassembler dei payload a frammenti (buffer allocati al primo uso)
+        self.chunks = {}
+        chunks = config['chunks']
+        if chunks['enabled']:
+            for port in (config['osc']['port'], config['udp']['port']):
+                if port:
+                    self.chunks[port] = Reassembler(chunks['max_size'], chunks['slots'],
+                                                    chunks['timeout'])
+        self.page = None
+        # Porta -> (BatchReceiver, RcvbufAutosizer)
+        self.receivers = {}
+        self.server = None
+        self.closing = False
+        # Risveglia i long-poll: creato dal primo che attende
+        self._new_data = None
+        self._loop = None
+
+    # --- Avvio e arresto ---
+
+    async def start(self):
+        """Apre cronologie, socket UDP e server HTTP/WebSocket"""
+        config = self.config
+        self._loop = loop = asyncio.get_running_loop()
+        history = config['history']
+        self.osc_data['message_history'] = HistoryStore.create(
+            history['osc_name'], history['osc_size'], history['osc_slab'])
+        if config['udp']['port']:
+            self.udp_history = HistoryStore.create(
+                history['udp_name'], history['udp_size'], history['udp_slab'])
+        if config['capture']['dir']:
+            self.capture = CaptureWriter(config['capture']['dir'],
+                                         config['capture']['segment_mb'] * 1024 * 1024)
+            print(f"Registrazione dei datagrammi in '{config['capture']['dir']}'")
+        try:
+            with open(PAGE_FILE, 'rb') as f:
+                self.page = f.read().replace(
+                    PAGE_WS_PORT,
+                    f'<meta name="streamtorasp-ws-port" content="{config["http"]["port"]}">'
+                    .encode('utf-8'))
+        except OSError:
+            print(f"Pagina web non trovata: {PAGE_FILE}")
+
+        # Il tick della coalescenza e le scadenze dei bundle sono timer del loop
+        self.coalescer.attach(loop)
+        self.scheduler.attach(loop)
+        if self.relay is not None:
+            self.relay.attach(loop)
+
+        socket_config = config['socket']
+        options = SocketOptions(rcvbuf=socket_config['rcvbuf'],
+                                rcvbuf_max=socket_config['rcvbuf_max'],
+                                timestamps=socket_config['kernel_timestamps'],
+                                busy_poll=socket_config['busy_poll'],
+                                multicast=socket_config['multicast'],
+                                max_datagram=max(1, min(socket_config['max_datagram'],
+                                                        MAX_UDP_PAYLOAD)))
+        relay_source = config['relay']['source']
+        self.open_receiver(config['osc']['interface'], config['osc']['port'], options,
+                           self.handle_osc_batch, 'OSC', relay_source in ('osc', 'all'))
+        if config['udp']['port']:
+            self.open_receiver(config['udp']['interface'], config['udp']['port'], options,
+                               self.handle_udp_batch, 'UDP', relay_source in ('udp', 'all'))
+        self.register_metrics()
+
+        http = config['http']
+        # Il long-poll gira dentro process_request, nel timeout dell'handshake
+        self.server = await websockets.serve(
+            self.handle_websocket, http['host'], http['port'],
+            process_request=self.process_request,
+            subprotocols=SUBPROTOCOLS,
+            open_timeout=LONG_POLL_MAX_TIMEOUT + 10
+        )
+        print(f"Interfaccia web e API su http://{http['host']}:{http['port']}")
+        print(f"Server WebSocket su ws://{http['host']}:{http['port']}")
+
+    def open_receiver(self, interface, port, options, handler, name, relayed=False):
+        """Ricevitore a lotti sul loop per una porta UDP"""
+        sock, report = create_udp_socket(port, interface, options)
+        receiver = BatchReceiver(sock, buffer_size=options.max_datagram,
+                                 timestamps=options.timestamps)
+        relay = self.relay if relayed else None
+        reassembler = self.chunks.get(port)
+
+        def on_batch(batch):
+            received_ns = receiver.received_ns
+            if relay is not None:
+                # Dai buffer del ricevitore, prima che vengano riusati
+                relay.send_batch(batch)
+            if self.capture is not None:
+                self.capture.record_batch(batch, received_ns)
+            if reassembler is not None:
+                # Ritrasmissione e cattura vedono i frammenti così come arrivano
+                batch = reassembler.reassemble(batch)
+            handler(batch, received_ns)
+
+        receiver.attach(self._loop, on_batch)
+        # Il buffer cresce se il kernel scarta datagrammi (timer del loop)
+        autosizer = RcvbufAutosizer(sock, options.rcvbuf_max)
+        autosizer.attach(self._loop)
+        self.receivers[port] = (receiver, autosizer)
+        print(f"Ricevitore {name} avviato su {interface}:{port}")
+        print_socket_report(report)
+        if relay is not None:
+            print("  Ritrasmissione verso " + ", ".join(target.label for target in relay.targets))
+
+    async def close(self):
+        """Arresto ordinato: prima le connessioni, poi ricezione, code e cronologie"""
+        # I long-poll in corso rispondono subito: server.close() li attende
+        self.closing = True
+        self._notify()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for receiver, autosizer in self.receivers.values():
+            autosizer.stop()
+            receiver.detach(self._loop)
+            receiver.close()
+        self.receivers.clear()
+        # Bundle in attesa e valori coalescati finiscono in cronologia
+        self.scheduler.detach()
+        self.coalescer.detach()
+        if self.relay is not None:
+            self.relay.close()
+        if self.capture is not None:
+            self.capture.close()
+        for history in (self.osc_data['message_history'], self.udp_history):
+            if history is not None:
+                history.close()
+        self.osc_data['message_history'] = self.udp_history = None
+        self.log.close()
+
+    async def run(self):
+        """Serve fino a SIGINT o SIGTERM, poi chiude tutto"""
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+        reporter = None
+        try:
+            await self.start()
+            print("-" * 50)
+            reporter = asyncio.create_task(self.report_stats())
+            await stop
+            print("\nArresto del server...")
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+            await self.close()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+
+    # --- Ricezione ---
+
+    def handle_osc_batch(self, batch, received_ns):
+        """Decodifica un lotto della porta OSC (messaggi e bundle)"""
+        timestamp = format_clock(wall_time(received_ns))
+        for data, addr in batch:
+            # Le memoryview del lotto vengono riusate: il messaggio tiene una copia
+            data = bytes(data)
+            try:
+                if is_bundle(data):
+                    self.submit_bundle(data, addr, received_ns)
+                    continue
+                message = decode_message(data)
+            except Exception:
+                # Un datagramma malformato non deve far perdere il resto del lotto
+                self.decode_errors.inc()
+                continue
+            self.osc_messages.inc()
+            self.publish_osc(received_ns, addr, data, message, timestamp)
+
+    def handle_udp_batch(self, batch, received_ns):
+        """Classifica un lotto della porta UDP grezza, come udp_websocket_server.py"""
+        now = wall_time(received_ns)
+        timestamp = format_clock(now)
+        for data, addr in batch:
+            try:
+                payload = self.classifier.decode(data, addr)
+            except Exception:
+                # Un datagramma malformato non deve far perdere il resto del lotto
+                self.decode_errors.inc()
+                continue
+            self.log.log(addr, "UDP da %s:%d - %d bytes (%s)",
+                         addr[0], addr[1], len(payload.data), payload.data_type)
+            if payload.data_type == DATA_TYPE_BUNDLE:
+                self.submit_bundle(payload.data, addr, received_ns, payload.values)
+                continue
+            # In cronologia il datagramma così com'è: il JSON solo se serve
+            self.udp_history.append(now, addr, None, KIND_RAW, payload.data)
+            self.forward(received_ns, addr, self.prepare(received_ns, addr, payload, timestamp))
+
+    def submit_bundle(self, data, addr, received_ns, groups=None):
+        """Bundle OSC: ogni gruppo di messaggi parte al suo timetag"""
+        if groups is None:
+            groups = group_by_timetag(decode_bundle(data))
+        arrival = wall_time(received_ns)
+        for timetag, messages in groups:
+            self.osc_messages.inc(len(messages))
+            self.scheduler.submit(addr, timetag,
+                                  (received_ns, addr, len(data), timetag, messages), arrival)
+
+    def prepare(self, received_ns, addr, payload, timestamp):
+        """PreparedMessage con il testo JSON costruito solo se un client lo chiede"""
+        def render():
+            return ('{"type": "udp_message", "message": '
+                    + json.dumps(udp_message(payload, addr, timestamp)) + '}')
+
+        return prepare_message(None, self.clients.addresses, addr, payload.numeric(),
+                               wall_time(received_ns), render, payload.blob())
+
+    def publish_osc(self, received_ns, addr, data, message, timestamp):
+        """Messaggio OSC singolo: coalescenza, poi cronologia, canali e client"""
+        payload = Payload(FORMAT_OSC, data, message.address, message.args)
+        self.forward(received_ns, addr, self.prepare(received_ns, addr, payload, timestamp),
+                     osc_args(message))
+
+    def forward(self, received_ns, addr, message, args=None):
+        """Passa un messaggio dalla coalescenza (args: argomenti OSC da registrare)"""
+        item = (received_ns, addr, message, args)
+        coalescer = self.coalescer
+        if not coalescer.enabled:
+            self.emit(None, item, None)
+        elif message.address is not None:
+            values = None
+            if coalescer.mode == MODE_AGGREGATE:
+                if args is not None:
+                    values = numeric_values(args)
+                elif message.is_numeric:
+                    values = message.float_values()
+            coalescer.offer((addr, message.address), message.address, item, values)
+        else:
+            coalescer.forward(addr, item)
+
+    def emit(self, key, item, window):
+        """Registra e invia un messaggio uscito dalla coalescenza"""
+        received_ns, addr, message, args = item
+        if window is not None:
+            message = window_message(message, window)
+        if args is not None:
+            if window is not None:
+                # Finestra aggregata: in cronologia va la media
+                args = tuple(window.mean)
+            self.record_osc(wall_time(received_ns), addr, message.address, args, window)
+        self.clients.publish(message, key=addr, received_ns=received_ns)
+
+    def dispatch_bundle(self, item, delayed):
+        """Un gruppo di un bundle (dallo scheduler): cronologia e un unico frame"""
+        received_ns, addr, size, timetag, messages = item
+        now = time.time() if delayed else wall_time(received_ns)
+        for message in messages:
+            self.record_osc(now, addr, message.address, osc_args(message))
+        bundle_message = {
+            'timestamp': format_clock(wall_time(received_ns)),
+            'source_ip': addr[0],
+            'source_port': addr[1],
+            'size': size
+        }
+        bundle_message.update(bundle_fields(timetag, messages))
+        text = '{"type": "udp_message", "message": ' + json.dumps(bundle_message) + '}'
+        # Mai coalescato: i messaggi del bundle restano insieme; la latenza
+        # misura l'invio, non l'attesa del timetag
+        self.clients.publish(PreparedMessage(text, tuple(m.address for m in messages)),
+                             received_ns=None if delayed else received_ns)
+
+    def record_osc(self, timestamp, addr, address, args, window=None):
+        """Aggiorna ultimo messaggio, cronologia OSC e canali; risveglia i long-poll"""
+        osc_data = self.osc_data
+        osc_data['last_message'] = args
+        osc_data['last_address'] = address
+        osc_data['last_timestamp'] = timestamp
+        osc_data['message_history'].append_values(timestamp, addr, address, args)
+        values = numeric_values(args)
+        if values is not None:
+            self.channels.append(address, timestamp, values)
+        self._notify()
+        if window is not None:
+            self.log.log(address, "OSC Message received: %s -> %r (%d campioni, min %r, max %r)",
+                         address, args, window.count, window.min, window.max)
+        else:
+            self.log.log(address, "OSC Message received: %s -> %r", address, args)
+
+    def _notify(self):
+        if self._new_data is not None:
+            self._new_data.set()
+            self._new_data = None
+
+    # --- WebSocket ---
+
+    async def handle_websocket(self, websocket, path):
+        """Client WebSocket: stato degli indirizzi, poi comandi stats e subscribe"""
+        session = self.clients.add(websocket, policy_from_path(path),
+                                   wire_format_from_request(path, websocket.subprotocol),
+                                   batch_from_path(path))
+        print(f"Client WebSocket connesso: {websocket.remote_address} "
+              f"({session.policy}, {session.wire_format})")
+        try:
+            # Lo stato degli indirizzi lo accoda clients.add(); senza, la cronologia
+            recent = ([] if self.clients.snapshot is not None
+                      else self.recent_messages(HISTORY_REPLAY))
+            if recent:
+                session.offer('{"type": "history", "messages": [' + ', '.join(recent) + ']}')
+            async for message in websocket:
+                if is_stats_request(message):
+                    session.offer(stats_message(self.registry))
+                    continue
+                reply = self.clients.handle_subscription(session, message)
+                if reply is not None:
+                    session.offer(reply)
+        except websockets.exceptions.ConnectionClosed:
+            print("Client WebSocket disconnesso")
+        finally:
+            await self.clients.remove(websocket)
+
+    def recent_messages(self, count):
+        """Ultimi messaggi delle due cronologie, in ordine di arrivo, come JSON"""
+        records = [(record.timestamp, True, record)
+                   for record in self.osc_data['message_history'].last(count)
+                   if not record.truncated]
+        if self.udp_history is not None:
+            records.extend((record.timestamp, False, record)
+                           for record in self.udp_history.last(count) if not record.truncated)
+        records.sort(key=lambda entry: entry[0])
+        return [self.history_json(record, is_osc) for _, is_osc, record in records[-count:]]
+
+    def history_json(self, record, is_osc):
+        """Messaggio JSON di un record, nello stesso formato dei messaggi dal vivo"""
+        addr = (record.source_ip, record.source_port)
+        if is_osc:
+            payload = Payload(FORMAT_OSC, b'', record.address, list(record.value))
+        else:
+            payload = self.classifier.peek(record.value, addr)
+        message = udp_message(payload, addr, format_clock(record.timestamp))
+        message['size'] = record.size
+        return json.dumps(message)
+
+    # --- HTTP ---
+
+    async def process_request(self, path, request_headers):
+        """Richieste HTTP sulla porta del WebSocket (None = handshake WebSocket)"""
+        if 'upgrade' in request_headers.get('Connection', '').lower():
+            return None
+        self.http_requests.inc()
+        url = urlsplit(path)
+        try:
+            return await self.route(unquote(url.path), QueryArgs(url.query), request_headers)
+        except Exception as e:
+            print(f"Errore HTTP su {path}: {e!r}")
+            return api_response(500, {'error': 'errore interno del server'})
+
+    async def route(self, path, args, headers):
+        """Stesse route di app.py, più la pagina del bridge"""
+        if path in ('/', '/index.html'):
+            if self.page is None:
+                return api_response(404, {'error': 'pagina non disponibile'})
+            return http_response(200, self.page, 'text/html; charset=utf-8')
+        if path == '/api/osc-data':
+            return self.osc_data_response(args.get('since', type=int), headers)
+        if path == '/api/osc-data/wait':
+            return await self.wait_osc_data(args, headers)
+        if path == '/api/channels':
+            return api_response(*list_channels(self.channels))
+        if path.startswith('/api/channels/'):
+            address = path[len('/api/channels'):]
+            return api_response(*get_channel(self.channels, address, args))
+        if path.startswith('/api/channel-stats/'):
+            address = path[len('/api/channel-stats'):]
+            return api_response(*get_channel_stats(self.channels, address, args))
+        if path == '/metrics':
+            return http_response(200, self.registry.render_prometheus().encode('utf-8'),
+                                 'text/plain; version=0.0.4')
+        return api_response(404, {'error': f'percorso sconosciuto: {path}'})
+
+    def osc_data_response(self, since, headers):
+        """Risponde 304 se il client ha già l'ultima sequenza (ETag)."""
+        # L'ETag è l'ultima sequenza: chi l'ha già vista non ha nulla di nuovo
+        etag = str(self.osc_data['message_history'].last_seq)
+        if etag_matches(headers.get('If-None-Match'), etag):
+            return HTTPStatus.NOT_MODIFIED, [('ETag', f'"{etag}"')], b''
+        data = build_osc_response(self.osc_data, self.coalescer, since)
+        return api_response(200, data, [('ETag', f'"{data["last_seq"]}"')])
+
+    async def wait_osc_data(self, args, headers):
+        """Long-poll: attende messaggi successivi a ?since=<seq> fino a ?timeout=<s>."""
+        since = args.get('since', default=0, type=int)
+        history_store = self.osc_data['message_history']
+        loop = self._loop
+        deadline = loop.time() + long_poll_timeout(args)
+        # I valori in attesa di coalescenza arrivano al tick (timer del loop)
+        while history_store.last_seq <= since and not self.closing:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if self._new_data is None:
+                self._new_data = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._new_data.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.osc_data_response(since, headers)
+
+    # --- Metriche e statistiche ---
+
+    def register_metrics(self):
+        """Registra le metriche lette solo all'esportazione"""
+        registry = self.registry
+        receivers = self.receivers
+        registry.gauge('packets_received_total', 'Datagrammi ricevuti, per porta',
+                       lambda: [({'port': port}, receiver.packets)
+                                for port, (receiver, _) in receivers.items()], kind='counter')
+        registry.gauge('bytes_received_total', 'Byte ricevuti, per porta',
+                       lambda: [({'port': port}, receiver.bytes)
+                                for port, (receiver, _) in receivers.items()], kind='counter')
+        registry.gauge('receive_batches_total',
+                       'Risvegli del ricevitore con almeno un datagramma, per porta',
+                       lambda: [({'port': port}, receiver.batches)
+                                for port, (receiver, _) in receivers.items()], kind='counter')
+        register_udp_socket(registry, *receivers)
+        registry.gauge('threads', 'Thread attivi del processo', active_count)
+        self.clients.register_metrics(registry)
+        self.scheduler.register_metrics(registry)
+        self.classifier.register_metrics(registry)
+        registry.gauge('coalescer_pending', 'Indirizzi in attesa del tick di coalescenza',
+                       lambda: len(self.coalescer.pending))
+        registry.gauge('history_last_seq', 'Messaggi scritti nella cronologia',
+                       lambda: [({'history': name}, history.last_seq) for name, history in
+                                (('osc', self.osc_data['message_history']),
+                                 ('udp', self.udp_history)) if history is not None],
+                       kind='counter')
+        registry.gauge('channels', 'Canali numerici in memoria',
+                       lambda: len(self.channels.channels))
+        registry.gauge('channels_memory_bytes', 'Memoria dei canali numerici',
+                       lambda: self.channels.memory_size)
+        registry.gauge('channels_rejected_total', 'Campioni scartati per limite di canali',
+                       lambda: self.channels.rejected, kind='counter')
+        registry.gauge('log_pending', 'Righe di log in coda',
+                       lambda: self.log.get_stats()['pending'])
+        registry.gauge('log_dropped_total', 'Righe di log perse',
+                       lambda: self.log.dropped, kind='counter')
+        if self.capture is not None:
+            registry.gauge('capture_pending_bytes', 'Byte in coda per la cattura su disco',
+                           lambda: self.capture.get_stats()['pending_bytes'])
+            registry.gauge('capture_dropped_total', 'Datagrammi persi dalla cattura',
+                           lambda: self.capture.dropped, kind='counter')
+        if self.relay is not None:
+            self.relay.register_metrics(registry)
+        if self.chunks:
+            register_chunk_metrics(registry, self.chunks)
+
+    async def report_stats(self):
+        """Stampa periodicamente latenza, client e contatori se è arrivato qualcosa"""
+        interval = self.config['log']['stats_interval']
+        if interval <= 0:
+            return
+        reported = None
+        while True:
+            await asyncio.sleep(interval)
+            received = sum(receiver.packets for receiver, _ in self.receivers.values())
+            if received == reported:
+                continue
+            reported = received
+            print(f"Datagrammi: {received}, messaggi OSC: {self.osc_messages.value}, "
+                  f"richieste HTTP: {self.http_requests.value}")
+            print(f"Latenza {self.latency_histogram.format_summary()}")
+            print(f"Client: {self.clients.format_stats()}")
+            batcher = self.clients.batcher
+            if batcher is not None and batcher.messages_histogram.count:
+                print(f"Lotti {batcher.format_stats()}")
+            snapshot = self.clients.snapshot
+            if snapshot is not None and snapshot.joins:
+                print(f"Stato per i nuovi client: {snapshot.format_stats()}")
+            if self.coalescer.enabled:
+                print(f"Coalescenza {self.coalescer.format_stats()}")
+            if any(self.classifier.payloads.values()):
+                print(f"Payload: {self.classifier.format_stats()}")
+            if self.scheduler.immediate or self.scheduler.scheduled:
+                print(f"Bundle: {self.scheduler.format_stats()}")
+            if self.capture is not None:
+                print(f"Cattura: {self.capture.format_stats()}")
+            if self.relay is not None:
+                print(f"Ritrasmissione: {self.relay.format_stats()}")
+            for port, reassembler in self.chunks.items():
+                if reassembler.fragments:
+                    print(f"Frammenti ({port}): {reassembler.format_stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Server unificato: interfaccia web, API, WebSocket, OSC e UDP')
+    parser.add_argument('-c', '--config', default=None, metavar='FILE',
+                        help=f'File di configurazione INI (default: {CONFIG_FILE} se esiste)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Nessun log per messaggio (sostituisce [log] level)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Log di tutti i messaggi, senza campionamento')
+    args = parser.parse_args()
+
+    path = args.config
+    if path is None and os.path.exists(CONFIG_FILE):
+        path = CONFIG_FILE
+    try:
+        config = load_config(path)
+        server = UnifiedServer(config)
+    except (OSError, ValueError, configparser.Error) as e:
+        parser.error(str(e))
+    if path is not None:
+        print(f"Configurazione da '{path}'")
+    if args.quiet or args.verbose:
+        server.log.configure(level=level_from_args(args.quiet, args.verbose))
+    try:
+        asyncio.run(server.run())
+    except OSError as e:
+        # Tipicamente una porta già in uso
+        raise SystemExit(f"Avvio non riuscito: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Formato dei frame WebSocket verso il browser
+Ogni messaggio viene serializzato una sola volta (testo JSON e, se serve,
+frame binario) e lo stesso oggetto viene inviato a tutti i client.
+In modalità binaria i payload numerici viaggiano come float32 little-endian
+preceduti da un id di indirizzo, i dati binari (blob OSC, payload
+ricomposti dai frammenti) così come sono; la tabella degli id viene inviata una
+volta per connessione, solo per gli indirizzi nuovi. I client che lo
+chiedono (?batch=1) ricevono i messaggi vicini nel tempo raggruppati in un
+solo frame, testo o binario.
+"""
+
+import json
+import struct
+from urllib.parse import parse_qs, urlsplit
+
+from osc_decoder import IMMEDIATELY, OSCDecodeError, decode_message, timetag_to_time
+
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+
+# Sottoprotocolli WebSocket (in alternativa a ?format=binary nell'URL)
+SUBPROTOCOL_JSON = 'streamtorasp.json'
+SUBPROTOCOL_BINARY = 'streamtorasp.bin'
+SUBPROTOCOLS = [SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON]
+
+# Frame binario: tipo (uint8), riservato, id indirizzo (uint16), numero di
+# valori (uint16), dimensione del datagramma (uint16), timestamp Unix
+# (float64); seguono i valori float32, allineati a 4 byte per Float32Array.
+# FRAME_WINDOW (coalescenza aggregate) ha la stessa intestazione, con il
+# numero di campioni della finestra al posto della dimensione, e i valori
+# min, max e media uno dopo l'altro
+FRAME_FLOATS = 1
+FRAME_WINDOW = 2
+FLOATS_HEADER = struct.Struct('<BxHHHd')
+# Lotto binario: tipo (uint8), riservato, numero di frame (uint16), poi i
+# frame FRAME_FLOATS/FRAME_WINDOW uno dopo l'altro, ognuno lungo
+# intestazione + valori (lunghezze multiple di 4: Float32Array resta allineato)
+FRAME_BATCH = 3
+BATCH_HEADER = struct.Struct('<BxH')
+# Blob: tipo (uint8), riservato, id indirizzo (uint16), byte di dati
+# (uint32), timestamp Unix (float64); seguono i dati, con zeri fino a un
+# multiplo di 4 byte
+FRAME_BLOB = 4
+BLOB_HEADER = struct.Struct('<BxHId')
+MAX_BATCH_FRAMES = 0xFFFF
+MAX_VALUES = 1024
+MAX_ADDRESSES = 0xFFFF
+
+# Payload numerico estratto (anche sulla pipe dei worker): dimensione del
+# datagramma (uint16), indirizzo UTF-8 + NUL, valori float32 LE (nessun
+# valore per i messaggi OSC non numerici: serve l'indirizzo per il routing)
+_NUMERIC_SIZE = struct.Struct('<H')
+# Un gruppo di un bundle OSC usa lo stesso canale: dimensione 0xFFFF come
+# marcatore, timetag NTP (uint64), poi gli indirizzi separati da NUL
+_BUNDLE_INFO = struct.Struct('<HQ')
+_BUNDLE_MARK = 0xFFFF
+_MAX_SIZE = 0xFFFE
+
+
+def wire_format_from_request(path, subprotocol=None, default=FORMAT_JSON):
+    """Formato scelto dal client: sottoprotocollo o ?format=... nell'URL"""
+    if subprotocol == SUBPROTOCOL_BINARY:
+        return FORMAT_BINARY
+    if subprotocol == SUBPROTOCOL_JSON:
+        return FORMAT_JSON
+    query = parse_qs(urlsplit(path or '').query)
+    wire_format = query.get('format', [default])[0]
+    return wire_format if wire_format in FORMATS else default
+
+
+def batch_from_path(path):
+    """True se il client chiede i lotti con ?batch=1 nell'URL"""
+    query = parse_qs(urlsplit(path or '').query)
+    return query.get('batch', ['0'])[0] in ('1', 'true', 'yes')
+
+
+def batch_text(texts):
+    """Frame JSON con più frame testuali: {"type": "batch", "messages": [...]}
+
+    I frame sono già oggetti JSON: si concatenano senza riserializzarli.
+    """
+    return '{"type": "batch", "messages": [' + ', '.join(texts) + ']}'
+
+
+def snapshot_text(texts):
+    """Frame JSON con l'ultimo frame di ogni indirizzo: {"type": "snapshot", "messages": [...]}"""
+    return '{"type": "snapshot", "messages": [' + ', '.join(texts) + ']}'
+
+
+def batch_binary(frames):
+    """Frame FRAME_BATCH con più frame binari (al massimo MAX_BATCH_FRAMES)"""
+    return BATCH_HEADER.pack(FRAME_BATCH, len(frames)) + b''.join(frames)
+
+
+def extract_numeric(data):
+    """Payload numerico già impacchettato: dimensione, indirizzo + NUL, float32 LE
+
+    Riconosce messaggi OSC con soli argomenti int/float e testo con numeri
+    separati da spazi o virgole; per gli altri messaggi OSC solo dimensione
+    e indirizzo, b'' se il payload non è né OSC né numerico.
+    """
+    if data[:1] == b'/':
+        try:
+            message = decode_message(data)
+        except (OSCDecodeError, struct.error):
+            return b''
+        return pack_numeric(len(data), message.address, message.args)
+    try:
+        values = [float(v) for v in str(data, 'ascii').replace(',', ' ').split()]
+    except (UnicodeDecodeError, ValueError):
+        return b''
+    return pack_numeric(len(data), '', values)
+
+
+def pack_numeric(size, address, values):
+    """Dimensione, indirizzo + NUL e valori float32 LE
+
+    Se i valori non sono tutti numerici restano dimensione e indirizzo
+    (b'' senza indirizzo).
+    """
+    head = _NUMERIC_SIZE.pack(min(size, _MAX_SIZE)) + address.encode('utf-8') + b'\0'
+    if not all_numeric(values):
+        return head if address else b''
+    try:
+        return head + struct.pack(f'<{len(values)}f', *values)
+    except (OverflowError, struct.error):
+        return head if address else b''
+
+
+def all_numeric(values):
+    """True se values è una sequenza non vuota (al massimo MAX_VALUES) di int/float"""
+    if not values or len(values) > MAX_VALUES:
+        return False
+    for value in values:
+        if type(value) is not float and type(value) is not int:
+            return False
+    return True
+
+
+def split_numeric(numeric):
+    """Separa un payload di extract_numeric in (dimensione, indirizzo, float32)"""
+    nul = numeric.index(b'\0', 2)
+    return (_NUMERIC_SIZE.unpack_from(numeric)[0],
+            str(numeric[2:nul], 'utf-8'), numeric[nul + 1:])
+
+
+def json_args(args):
+    """Argomenti OSC serializzabili in JSON (blob in esadecimale)"""
+    result = []
+    for arg in args:
+        if type(arg) is memoryview or type(arg) is bytes:
+            arg = arg.hex()
+        elif type(arg) is list:
+            arg = json_args(arg)
+        result.append(arg)
+    return result
+
+
+def bundle_fields(timetag, messages):
+    """Campi del messaggio UDP per un gruppo di un bundle OSC
+
+    "messages" contiene tutti i messaggi con lo stesso timetag, così il
+    gruppo arriva ai client in un unico frame; "timetag" è in secondi
+    Unix, None per "subito".
+    """
+    return {
+        'data_type': 'osc_bundle',
+        'timetag': None if timetag <= IMMEDIATELY else timetag_to_time(timetag),
+        'content': ' '.join(message.address for message in messages),
+        'messages': [{'address': message.address, 'args': json_args(message.args)}
+                     for message in messages],
+    }
+
+
+def bundle_info(timetag, messages):
+    """Timetag e indirizzi di un gruppo, sullo stesso canale di extract_numeric"""
+    return (_BUNDLE_INFO.pack(_BUNDLE_MARK, timetag)
+            + '\0'.join(message.address for message in messages).encode('utf-8'))
+
+
+def is_bundle_info(extra):
+    """True se i dati extra descrivono un gruppo di un bundle"""
+    return len(extra) >= _BUNDLE_INFO.size and _NUMERIC_SIZE.unpack_from(extra)[0] == _BUNDLE_MARK
+
+
+def split_bundle_info(extra):
+    """(timetag, indirizzi) da bundle_info"""
+    timetag = _BUNDLE_INFO.unpack_from(extra)[1]
+    return timetag, tuple(str(extra[_BUNDLE_INFO.size:], 'utf-8').split('\0'))
+
+
+class AddressTable:
+    """Id compatti per (mittente, indirizzo OSC), condivisi da tutti i client"""
+
+    def __init__(self, max_addresses=MAX_ADDRESSES):
+        self.max_addresses = max_addresses
+        self.ids = {}
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def id_for(self, source, address):
+        """Id dell'indirizzo (assegnato alla prima occorrenza), None se piena"""
+        key = (source, address)
+        address_id = self.ids.get(key)
+        if address_id is None:
+            if len(self.entries) >= self.max_addresses:
+                return None
+            address_id = len(self.entries)
+            self.ids[key] = address_id
+            self.entries.append(key)
+        return address_id
+
+    def announce(self, first):
+        """Frame JSON con gli indirizzi da `first` in poi"""
+        return json.dumps({
+            'type': 'addresses',
+            'first': first,
+            'addresses': [
+                {'source_ip': source[0], 'source_port': source[1], 'address': address}
+                for source, address in self.entries[first:]
+            ]
+        })
+
+
+class PreparedMessage:
+    """Messaggio serializzato una volta sola e condiviso tra i client
+
+    Il testo JSON può essere passato già pronto oppure come funzione
+    render(): viene costruito al primo client JSON che lo chiede, e mai
+    se tutti i client ricevono il frame binario.
+    """
+
+    __slots__ = ('_text', '_render', 'address', 'address_id', 'values', 'size', 'timestamp',
+                 'frame_type', 'count', '_binary')
+
+    def __init__(self, text, address=None, address_id=None, values=b'', size=0,
+                 timestamp=0.0, frame_type=FRAME_FLOATS, count=None, render=None):
+        self._text = text
+        self._render = render
+        # Indirizzo OSC per il routing (tupla di indirizzi per un bundle)
+        self.address = address
+        self.address_id = address_id
+        self.values = values
+        self.size = size
+        self.timestamp = timestamp
+        self.frame_type = frame_type
+        # Numero di valori (in FRAME_WINDOW i byte contengono tre serie)
+        self.count = len(values) // 4 if count is None else count
+        self._binary = None
+
+    @property
+    def text(self):
+        """Testo JSON, costruito alla prima richiesta se serve"""
+        if self._text is None:
+            self._text = self._render()
+            self._render = None
+        return self._text
+
+    @property
+    def is_numeric(self):
+        return self.address_id is not None and self.frame_type != FRAME_BLOB
+
+    @property
+    def has_binary(self):
+        """True se i client in formato binario ricevono binary()"""
+        return self.address_id is not None
+
+    def float_values(self):
+        """Valori come tupla di float (solo per i messaggi numerici)"""
+        return struct.unpack(f'<{self.count}f', self.values[:self.count * 4])
+
+    def binary(self):
+        """Frame binario, costruito al primo client che lo chiede"""
+        if self._binary is None and self.frame_type == FRAME_BLOB:
+            size = len(self.values)
+            self._binary = (BLOB_HEADER.pack(FRAME_BLOB, self.address_id, size, self.timestamp)
+                            + self.values + bytes(-size % 4))
+        elif self._binary is None:
+            self._binary = FLOATS_HEADER.pack(
+                self.frame_type, self.address_id, self.count,
+                self.size, self.timestamp) + self.values
+        return self._binary
+
+
+def prepare_message(text, addresses, source, numeric=b'', timestamp=0.0, render=None,
+                    blob=None):
+    """Crea il PreparedMessage; i payload numerici ricevono un id di indirizzo
+
+    Con text=None il testo JSON lo costruisce render() quando serve. Con
+    blob (bytes) i client in formato binario ricevono i dati in un frame
+    FRAME_BLOB invece che in esadecimale.
+    """
+    if blob:
+        return blob_message(text, addresses, source, numeric, timestamp, render, blob)
+    if not numeric:
+        return PreparedMessage(text, render=render)
+    size, address, values = split_numeric(numeric)
+    if not values:
+        # Messaggio OSC non numerico: solo l'indirizzo, per il routing
+        return PreparedMessage(text, address, render=render)
+    address_id = addresses.id_for(source, address)
+    if address_id is None:
+        return PreparedMessage(text, address, render=render)
+    return PreparedMessage(text, address, address_id, values, size, timestamp, render=render)
+
+
+def blob_message(text, addresses, source, numeric, timestamp, render, blob):
+    """PreparedMessage FRAME_BLOB (indirizzo OSC se c'è, altrimenti '')"""
+    address = split_numeric(numeric)[1] if numeric else None
+    address_id = addresses.id_for(source, address or '')
+    if address_id is None:
+        return PreparedMessage(text, address, render=render)
+    return PreparedMessage(text, address, address_id, blob, len(blob), timestamp,
+                           FRAME_BLOB, 0, render=render)
+
+
+def window_message(message, window):
+    """Messaggio con le statistiche di una finestra di coalescenza
+
+    Il testo JSON riceve il campo "window" dentro "message"; il frame
+    binario diventa FRAME_WINDOW con min, max e media.
+    """
+    def render():
+        window_json = json.dumps({'count': window.count, 'min': window.min,
+                                  'max': window.max, 'mean': window.mean})
+        # Il testo termina con la chiusura di "message" e del frame: '}}'
+        return message.text[:-2] + ', "window": ' + window_json + '}}'
+
+    if not message.is_numeric:
+        return PreparedMessage(None, message.address, render=render)
+    count = len(window.mean)
+    values = struct.pack(f'<{count * 3}f', *window.min, *window.max, *window.mean)
+    return PreparedMessage(None, message.address, message.address_id, values,
+                           min(window.count, 0xFFFF), message.timestamp,
+                           FRAME_WINDOW, count, render=render)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Ricezione UDP multi-processo con SO_REUSEPORT
+N processi legano la stessa porta, il kernel distribuisce i mittenti tra
+loro e ogni worker pubblica i messaggi già serializzati su una pipe
+verso l'unico broadcaster WebSocket
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import time
+
+from udp_engine import BatchReceiver
+from udp_socket import (RcvbufAutosizer, SocketOptions, create_udp_socket,
+                        print_socket_report)
+
+# Ogni frame sulla pipe: lunghezza del testo e dei dati extra (uint32),
+# istante di ricezione (perf_counter_ns, monotono e comune a tutti i
+# processi), ip e porta del mittente, poi il testo UTF-8 e i dati extra
+_FRAME_HEADER = struct.Struct('<IIQ4sH2x')
+_READ_SIZE = 1 << 16
+
+
+def bind_reuseport(port, interface='0.0.0.0', options=None):
+    """Crea un socket UDP condivisibile tra processi con SO_REUSEPORT: (socket, rapporto)"""
+    return create_udp_socket(port, interface, options, reuseport=True)
+
+
+def _worker_main(index, write_fd, udp_port, interface, handle_batch, options):
+    """Corpo del processo worker: riceve, decodifica, scrive frame sulla pipe"""
+    # Il Ctrl+C lo gestisce il processo principale
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sock, report = bind_reuseport(udp_port, interface, options)
+    if index == 0:
+        # Stesse opzioni per tutti: basta il rapporto del primo
+        print_socket_report(report)
+    receiver = BatchReceiver(sock, buffer_size=options.max_datagram,
+                             timestamps=options.timestamps, pktinfo=options.pktinfo)
+    # Ogni worker ha il suo socket e il suo buffer: controllo tra un lotto e l'altro
+    autosizer = RcvbufAutosizer(sock, options.rcvbuf_max)
+    timeout = autosizer.interval if autosizer.enabled else None
+    next_check = time.monotonic() + autosizer.interval
+    pack_header = _FRAME_HEADER.pack
+    try:
+        for batch in receiver.iter_batches(timeout):
+            if timeout is not None:
+                now = time.monotonic()
+                if now >= next_check:
+                    autosizer.check()
+                    next_check = now + autosizer.interval
+            if not batch:
+                continue
+            received_ns = receiver.received_ns
+            frames = handle_batch(batch, received_ns)
+            if not frames:
+                continue
+            # Un'unica write per lotto
+            chunks = []
+            for addr, frame, extra in frames:
+                payload = frame.encode('utf-8')
+                chunks.append(pack_header(len(payload), len(extra), received_ns,
+                                          socket.inet_aton(addr[0]), addr[1]))
+                chunks.append(payload)
+                if extra:
+                    chunks.append(extra)
+            os.write(write_fd, b''.join(chunks))
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        receiver.close()
+        os.close(write_fd)
+
+
+class WorkerPool:
+    """Gruppo di processi worker che condividono la porta UDP
+
+    handle_batch(batch, received_ns) gira nei worker e restituisce la lista
+    di (addr, frame, extra) da pubblicare, con extra bytes anche vuoti; nel
+    processo principale on_frames riceve la lista di
+    (received_ns, addr, frame, extra) letti dalle pipe.
+    """
+
+    def __init__(self, count, udp_port, interface, handle_batch, socket_options=None):
+        self.count = count
+        self.udp_port = udp_port
+        self.interface = interface
+        self.handle_batch = handle_batch
+        self.socket_options = socket_options or SocketOptions()
+        self.processes = []
+        self.read_fds = []
+        self._pending = {}
+        self.frames = 0
+
+    def start(self):
+        """Avvia i processi worker (fork: handle_batch può essere una closure)"""
+        context = multiprocessing.get_context('fork')
+        for index in range(self.count):
+            read_fd, write_fd = os.pipe()
+            process = context.Process(
+                target=_worker_main,
+                args=(index, write_fd, self.udp_port, self.interface, self.handle_batch,
+                      self.socket_options),
+                daemon=True
+            )
+            process.start()
+            os.close(write_fd)
+            self.processes.append(process)
+            self.read_fds.append(read_fd)
+            self._pending[read_fd] = b''
+        print(f"{self.count} worker UDP avviati su {self.interface}:{self.udp_port} (SO_REUSEPORT)")
+
+    def read_frames(self, read_fd):
+        """Legge i frame completi disponibili su una pipe: [(received_ns, addr, testo, extra)]"""
+        chunk = os.read(read_fd, _READ_SIZE)
+        if not chunk:
+            return None
+        data = self._pending[read_fd] + chunk if self._pending[read_fd] else chunk
+        frames = []
+        pos = 0
+        header_size = _FRAME_HEADER.size
+        while pos + header_size <= len(data):
+            size, extra_size, received_ns, ip, port = _FRAME_HEADER.unpack_from(data, pos)
+            start = pos + header_size
+            extra_start = start + size
+            if extra_start + extra_size > len(data):
+                break
+            frames.append((received_ns, (socket.inet_ntoa(ip), port),
+                           str(data[start:extra_start], 'utf-8'),
+                           data[extra_start:extra_start + extra_size]))
+            pos = extra_start + extra_size
+        self._pending[read_fd] = data[pos:]
+        self.frames += len(frames)
+        return frames
+
+    def attach(self, loop, on_frames):
+        """Registra le pipe sul loop asyncio: on_frames(frames) per ogni lettura"""
+        for read_fd in self.read_fds:
+            loop.add_reader(read_fd, self._on_readable, loop, read_fd, on_frames)
+
+    def _on_readable(self, loop, read_fd, on_frames):
+        frames = self.read_frames(read_fd)
+        if frames is None:
+            # Worker terminato
+            loop.remove_reader(read_fd)
+            return
+        if frames:
+            on_frames(frames)
+
+    def stop(self):
+        """Termina i worker e chiude le pipe"""
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join(timeout=1.0)
+        for read_fd in self.read_fds:
+            try:
+                os.close(read_fd)
+            except OSError:
+                pass
+        self.processes = []
+        self.read_fds = []